@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Analytics Export
+Writes messages, replies, opt-outs and per-campaign counters to a Hive-partitioned Parquet
+dataset under ANALYTICS_EXPORT_DIR, so analysts can read it with pyarrow/pandas/DuckDB instead of
+querying the live SQLite file:
+
+    messages/campaign_id=<id>/date=<YYYY-MM-DD>/part-<run>.parquet
+    replies/campaign_id=<id>/date=<YYYY-MM-DD>/part-<run>.parquet
+    opt_outs/date=<YYYY-MM-DD>/part-<run>.parquet
+    campaigns/snapshot_date=<YYYY-MM-DD>/part-<run>.parquet
+
+Exports are incremental. Each dataset keeps a watermark in export_watermarks and a run only
+reads rows past it: new replies and opt-outs by id, and messages by change_seq, which a trigger
+moves past every other message's whenever a message with a send outcome is written, so a
+message shows up again when it is delivered or read. It counts writes rather than using the
+event timestamps: a delivery callback applied minutes late still carries the time it arrived,
+which an export in between has already passed. Readers should keep the row with the latest
+exported_at per id. Campaign counters are a full snapshot every run.
+
+Rows come out of SQLite ordered by partition and are converted to Arrow record batches of
+ANALYTICS_EXPORT_BATCH_SIZE, so memory stays bounded by one batch however big the tables are.
+A dataset's files are written under a temporary name and its watermark only moves once all of
+them are in place; a crash leaves the watermark behind, so the next run covers the same rows.
+
+Usage: python analytics_export.py [--dataset NAME ...] [--full] [--output DIR]
+"""
+
+import argparse
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from db import connect
+
+ANALYTICS_EXPORT_DIR = os.getenv('ANALYTICS_EXPORT_DIR', 'analytics')
+ANALYTICS_EXPORT_BATCH_SIZE = int(os.getenv('ANALYTICS_EXPORT_BATCH_SIZE', '50000'))
+# Hive's name for a null partition value, so readers map it back to null
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+DATASETS = {
+    'messages': {
+        # Numbers live on contacts; messages.phone_number is only set on rows from before them
+        'query': '''
+            SELECT m.campaign_id, COALESCE(date(m.sent_at), date(m.failed_at)) AS date,
+                   m.id, m.contact_id, COALESCE(c.phone_canonical, m.phone_number), m.status,
+                   m.error_code, m.retry_count, m.sent_at, m.delivered_at, m.read_at, m.failed_at,
+                   m.change_seq
+            FROM messages m
+            LEFT JOIN contacts c ON c.id = m.contact_id
+            WHERE m.change_seq > ?
+            ORDER BY m.campaign_id, date, m.id
+        ''',
+        'partitions': ['campaign_id', 'date'],
+        'schema': pa.schema([
+            ('id', pa.int64()), ('contact_id', pa.int64()), ('phone_number', pa.string()),
+            ('status', pa.string()), ('error_code', pa.string()), ('retry_count', pa.int32()),
+            ('sent_at', pa.timestamp('us')), ('delivered_at', pa.timestamp('us')),
+            ('read_at', pa.timestamp('us')), ('failed_at', pa.timestamp('us')),
+        ]),
+        'watermark': 'change_seq',
+        'initial_watermark': 0,
+    },
+    'replies': {
+        'query': '''
+            SELECT r.campaign_id, date(r.received_at) AS date,
+                   r.id, r.phone_number, r.sender_name, r.message_content, r.received_at,
+                   r.sentiment, r.confidence_score, r.reply_type, r.is_opt_out, r.requires_attention
+            FROM replies r
+            WHERE r.id > ?
+            ORDER BY r.campaign_id, date, r.id
+        ''',
+        'partitions': ['campaign_id', 'date'],
+        'schema': pa.schema([
+            ('id', pa.int64()), ('phone_number', pa.string()), ('sender_name', pa.string()),
+            ('message_content', pa.string()), ('received_at', pa.timestamp('us')),
+            ('sentiment', pa.string()), ('confidence_score', pa.float64()), ('reply_type', pa.string()),
+            ('is_opt_out', pa.bool_()), ('requires_attention', pa.bool_()),
+        ]),
+        'watermark': 'id',
+        'initial_watermark': 0,
+    },
+    'opt_outs': {
+        'query': '''
+            SELECT date(o.opted_out_at) AS date,
+                   o.id, o.phone_number, o.phone_canonical, o.sender_name, o.opted_out_at, o.reason, o.source
+            FROM opt_out_list o
+            WHERE o.id > ?
+            ORDER BY date, o.id
+        ''',
+        'partitions': ['date'],
+        'schema': pa.schema([
+            ('id', pa.int64()), ('phone_number', pa.string()), ('phone_canonical', pa.string()),
+            ('sender_name', pa.string()), ('opted_out_at', pa.timestamp('us')), ('reason', pa.string()),
+            ('source', pa.string()),
+        ]),
+        'watermark': 'id',
+        'initial_watermark': 0,
+    },
+    'campaigns': {
+        # Counters change all the time and there are few campaigns, so every run is a full snapshot
+        'query': '''
+            SELECT date('now', 'localtime') AS snapshot_date,
+                   c.id, c.name, c.status, c.total_contacts, c.rate_limit,
+                   c.created_at, c.started_at, c.completed_at,
+                   COALESCE(m.sent, 0), COALESCE(m.delivered, 0), COALESCE(m.read, 0),
+                   COALESCE(m.failed, 0), COALESCE(m.pending, 0),
+                   COALESCE(r.replies, 0), COALESCE(r.responders, 0), COALESCE(r.opt_outs, 0)
+            FROM campaigns c
+            LEFT JOIN (
+                SELECT campaign_id,
+                       SUM(status IN ('sent', 'delivered', 'read')) AS sent,
+                       SUM(status IN ('delivered', 'read')) AS delivered,
+                       SUM(status = 'read') AS read,
+                       SUM(status IN ('failed', 'undelivered')) AS failed,
+                       SUM(status IN ('pending', 'deferred', 'retry_scheduled', 'sending')) AS pending
+                FROM messages GROUP BY campaign_id
+            ) m ON m.campaign_id = c.id
+            LEFT JOIN (
+                SELECT campaign_id, COUNT(*) AS replies, COUNT(DISTINCT phone_number) AS responders,
+                       SUM(is_opt_out = 1) AS opt_outs
+                FROM replies GROUP BY campaign_id
+            ) r ON r.campaign_id = c.id
+            ORDER BY c.id
+        ''',
+        'partitions': ['snapshot_date'],
+        'schema': pa.schema([
+            ('id', pa.string()), ('name', pa.string()), ('status', pa.string()),
+            ('total_contacts', pa.int64()), ('rate_limit', pa.int64()),
+            ('created_at', pa.timestamp('us')), ('started_at', pa.timestamp('us')),
+            ('completed_at', pa.timestamp('us')),
+            ('sent', pa.int64()), ('delivered', pa.int64()), ('read', pa.int64()), ('failed', pa.int64()),
+            ('pending', pa.int64()), ('replies', pa.int64()), ('responders', pa.int64()),
+            ('opt_outs', pa.int64()),
+        ]),
+        'watermark': None,
+        'initial_watermark': None,
+    },
+}
+
+
+def setup_export_watermarks(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_watermarks (
+            dataset TEXT PRIMARY KEY,
+            watermark,
+            rows_exported INTEGER,
+            exported_at TIMESTAMP
+        )
+    ''')
+
+
+def setup_message_changes(cursor):
+    """change_seq on messages: the incremental messages export's watermark (see the module docstring)"""
+    cursor.execute("PRAGMA table_info(messages)")
+    if 'change_seq' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE messages ADD COLUMN change_seq INTEGER")
+        # Messages that already have an outcome get a place in the order, oldest first
+        cursor.execute('''
+            UPDATE messages SET change_seq = id
+            WHERE COALESCE(sent_at, delivered_at, read_at, failed_at) IS NOT NULL
+        ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_change_seq ON messages(change_seq)')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_messages_change_seq
+        AFTER UPDATE OF status, error_code, retry_count, sent_at, delivered_at, read_at, failed_at ON messages
+        WHEN COALESCE(NEW.sent_at, NEW.delivered_at, NEW.read_at, NEW.failed_at) IS NOT NULL
+        BEGIN
+            UPDATE messages SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM messages)
+            WHERE id = NEW.id;
+        END
+    ''')
+
+
+def get_watermark(conn, dataset: str):
+    row = conn.execute("SELECT watermark FROM export_watermarks WHERE dataset = ?", (dataset,)).fetchone()
+    initial = DATASETS[dataset]['initial_watermark']
+    if row is None or type(row[0]) is not type(initial):
+        # None yet, or a messages timestamp watermark from before change_seq: start over
+        return initial
+    return row[0]
+
+
+def _column(values: list, field: pa.Field) -> pa.Array:
+    if pa.types.is_timestamp(field.type):
+        strings = pa.array([str(value) if value is not None else None for value in values], pa.string())
+        try:
+            return pc.cast(strings, field.type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # A malformed value shouldn't sink the export; it comes out as null
+            return pa.array([_parse_timestamp(value) for value in values], field.type)
+    if pa.types.is_boolean(field.type):
+        return pa.array([bool(value) if value is not None else None for value in values], field.type)
+    if pa.types.is_string(field.type):
+        return pa.array([str(value) if value is not None else None for value in values], field.type)
+    return pa.array(values, field.type)
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+def to_record_batch(rows: List[tuple], schema: pa.Schema, exported_at: datetime) -> pa.RecordBatch:
+    """Rows as an Arrow record batch of schema, whose last column (exported_at) is filled in here"""
+    columns = list(zip(*rows))
+    arrays = [_column(list(columns[i]), field) for i, field in enumerate(schema) if field.name != 'exported_at']
+    arrays.append(pa.array([exported_at] * len(rows), pa.timestamp('us')))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _partition_dir(root: str, dataset: str, names: List[str], values: tuple) -> str:
+    parts = [f"{name}={str(value).replace('/', '_') if value not in (None, '') else NULL_PARTITION}"
+             for name, value in zip(names, values)]
+    return os.path.join(root, dataset, *parts)
+
+
+def export_dataset(conn, dataset: str, output_dir: str = None, full: bool = False,
+                   batch_size: int = None, run_id: str = None) -> Dict:
+    """
+    Export one dataset's rows past its watermark (all rows with full=True) and advance the
+    watermark. Returns {'dataset', 'rows', 'files', 'watermark'}.
+    """
+    spec = DATASETS[dataset]
+    output_dir = output_dir or ANALYTICS_EXPORT_DIR
+    batch_size = batch_size or ANALYTICS_EXPORT_BATCH_SIZE
+    run_id = run_id or datetime.now().strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:8]
+    exported_at = datetime.now()
+    schema = spec['schema'].append(pa.field('exported_at', pa.timestamp('us')))
+    partition_count = len(spec['partitions'])
+    has_watermark_column = spec['watermark'] == 'change_seq'
+
+    since = spec['initial_watermark'] if full else get_watermark(conn, dataset)
+    watermark = since
+    cursor = conn.cursor()
+    cursor.execute(spec['query'], (since,) if spec['watermark'] else ())
+
+    written, files = 0, []
+    writer, current, buffer = None, None, []
+
+    def flush():
+        nonlocal writer
+        if not buffer:
+            return
+        if writer is None:
+            directory = _partition_dir(output_dir, dataset, spec['partitions'], current)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'part-{run_id}.parquet')
+            writer = pq.ParquetWriter(path + '.tmp', schema)
+            files.append(path)
+        writer.write_batch(to_record_batch(buffer, schema, exported_at))
+        buffer.clear()
+
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                key = row[:partition_count]
+                if key != current:
+                    flush()
+                    if writer is not None:
+                        writer.close()
+                        writer = None
+                    current = key
+                values = row[partition_count:]
+                if has_watermark_column:
+                    watermark = max(watermark, values[-1])
+                    values = values[:-1]
+                elif spec['watermark'] == 'id':
+                    watermark = max(watermark, values[0])
+                buffer.append(values)
+                written += 1
+                if len(buffer) >= batch_size:
+                    flush()
+        flush()
+        if writer is not None:
+            writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        for path in files:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+        raise
+
+    # Every file of the run is complete before any of it becomes visible or the watermark moves
+    for path in files:
+        os.replace(path + '.tmp', path)
+    if spec['watermark'] is not None:
+        conn.execute('''
+            INSERT INTO export_watermarks (dataset, watermark, rows_exported, exported_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(dataset) DO UPDATE SET
+                watermark = excluded.watermark, rows_exported = excluded.rows_exported,
+                exported_at = excluded.exported_at
+        ''', (dataset, watermark, written, exported_at))
+        conn.commit()
+
+    return {'dataset': dataset, 'rows': written, 'files': len(files), 'watermark': watermark}
+
+
+def run_analytics_export(datasets: List[str] = None, output_dir: str = None, full: bool = False) -> List[Dict]:
+    """Export each dataset (all of them by default) into output_dir under one run id"""
+    datasets = datasets or list(DATASETS)
+    unknown = [name for name in datasets if name not in DATASETS]
+    if unknown:
+        raise ValueError(f"Unknown dataset(s): {', '.join(unknown)}")
+
+    run_id = datetime.now().strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:8]
+    conn = connect()
+    try:
+        setup_export_watermarks(conn.cursor())
+        setup_message_changes(conn.cursor())
+        conn.commit()
+        results = [export_dataset(conn, name, output_dir, full=full, run_id=run_id) for name in datasets]
+    finally:
+        conn.close()
+
+    for result in results:
+        print(f"📦 {result['dataset']}: {result['rows']:,} rows in {result['files']} file(s)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export campaign analytics to partitioned Parquet')
+    parser.add_argument('--dataset', action='append', choices=list(DATASETS),
+                        help='Dataset to export (repeatable, default: all)')
+    parser.add_argument('--full', action='store_true', help='Ignore watermarks and export every row')
+    parser.add_argument('--output', default=ANALYTICS_EXPORT_DIR, help='Dataset root directory')
+    args = parser.parse_args()
+
+    print("📊 WhatsApp Analytics Export\n")
+    run_analytics_export(args.dataset, args.output, full=args.full)
@@ -1,22 +1,46 @@
 # app.py - Main Flask Application
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import pandas as pd
-import sqlite3
 import uuid
 import os
-from datetime import datetime
-import re
+from datetime import datetime, timedelta, timezone
 from celery import Celery
 import json
+import logging
+from io import BytesIO
 from dotenv import load_dotenv
 from twilio.twiml.messaging_response import MessagingResponse
 
+from phone_numbers import validate_phone_number, validate_phone_series
+from contacts import setup_contacts_table, upsert_contacts, migrate_messages_to_contacts
+from message_templates import compile_template, encode_variables
+from campaign_control import set_campaign_control, apply_campaign_control, has_dispatch_work
+from send_ledger import setup_send_ledger
+from retry_scheduler import setup_retry_columns
+from scheduler import setup_scheduler, parse_schedule_time
+from reply_rollups import rollup_where, replies_since
+from responder_sketches import HLL_STANDARD_ERROR, SKETCH_KINDS, count_responders
+from analytics_export import setup_message_changes
+from reply_export import (EXPORT_ASYNC_THRESHOLD, EXPORT_FORMATS, setup_export_jobs, export_filters,
+                          count_export_rows, export_filename, iter_export_rows, stream_csv, write_xlsx,
+                          create_export_job, get_export_job)
+from delivery_status import (setup_delivery_status, parse_status_callback, enqueue_status_events,
+                             apply_status_batch, delivery_latency_histogram)
+from metrics import CONTENT_TYPE, ENDPOINT_QUERIES, WEBHOOK_LATENCY, render
+from structured_logging import setup_logging, log_event, log_message_event
+from db import QueryCount, connect
+from profiling import ProfilingMiddleware
+
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
+# Profiles requests switched on by PROFILE_REQUESTS or an X-Profile header (see profiling.py)
+app.wsgi_app = ProfilingMiddleware(app.wsgi_app)
 
 # Configure Celery
 app.config['CELERY_BROKER_URL'] = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6380/0')
@@ -26,10 +50,30 @@ app.config['CELERY_RESULT_BACKEND'] = os.getenv('CELERY_RESULT_BACKEND', 'redis:
 celery = Celery(app.name, broker=app.config['CELERY_BROKER_URL'])
 celery.conf.update(app.config)
 
+@app.before_request
+def start_query_count():
+    """Count the SQL statements each request runs, per endpoint (whatsapp_endpoint_queries)"""
+    g.query_count = QueryCount().start()
+
+@app.teardown_request
+def record_query_count(error):
+    query_count = g.pop('query_count', None)
+    if query_count is not None:
+        query_count.stop()
+        ENDPOINT_QUERIES.labels(request.endpoint or 'unmatched').observe(query_count.count)
+
 # Database setup
+def add_missing_columns(cursor, table, columns):
+    """Add columns introduced after a database was created ({name: definition})"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = [column[1] for column in cursor.fetchall()]
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
 def init_db():
     """Initialize SQLite database"""
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn = connect()
     cursor = conn.cursor()
     
     # Campaigns table
@@ -43,10 +87,15 @@ def init_db():
             status TEXT DEFAULT 'pending',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             started_at TIMESTAMP,
-            completed_at TIMESTAMP
+            completed_at TIMESTAMP,
+            last_message_id INTEGER DEFAULT 0,
+            control TEXT
         )
     ''')
     
+    # Dispatcher checkpoint and pause/cancel state
+    add_missing_columns(cursor, 'campaigns', {'last_message_id': 'INTEGER DEFAULT 0', 'control': 'TEXT'})
+    
     # Messages table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS messages (
@@ -61,28 +110,49 @@ def init_db():
             failed_at TIMESTAMP,
             error_message TEXT,
             retry_count INTEGER DEFAULT 0,
-            FOREIGN KEY (campaign_id) REFERENCES campaigns (id)
+            contact_id INTEGER,
+            variables TEXT,
+            FOREIGN KEY (campaign_id) REFERENCES campaigns (id),
+            FOREIGN KEY (contact_id) REFERENCES contacts (id)
         )
     ''')
     
-    conn.commit()
-    conn.close()
-
-def validate_phone_number(phone):
-    """Validate and format phone number"""
-    # Remove all non-digit characters
-    phone = re.sub(r'\D', '', str(phone))
+    # Template variables per message (older rows only have the rendered message_content)
+    add_missing_columns(cursor, 'messages', {'variables': 'TEXT'})
+    
+    # Contacts are shared across campaigns; messages only reference them
+    setup_contacts_table(cursor)
+    migrate_messages_to_contacts(cursor)
+    cursor.execute('DROP INDEX IF EXISTS idx_messages_phone_canonical')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_contact
+        ON messages(contact_id, sent_at DESC)
+    ''')
     
-    # Add country code if missing (assuming Kenya +254)
-    if len(phone) == 9 and phone.startswith('7'):
-        phone = '254' + phone
-    elif len(phone) == 10 and phone.startswith('07'):
-        phone = '254' + phone[1:]
+    # Claim columns for the send ledger, provider SIDs for delivery status callbacks
+    setup_send_ledger(cursor)
+    setup_delivery_status(cursor)
     
-    # Validate final format
-    if len(phone) >= 10 and phone.isdigit():
-        return phone
-    return None
+    # Error classes and due times for the failed-message retry scheduler
+    setup_retry_columns(cursor)
+    
+    # Scheduled campaigns and messages held back by quiet hours
+    setup_scheduler(cursor)
+    
+    # Background reply exports
+    setup_export_jobs(cursor)
+    
+    # Write order of messages with an outcome, for the incremental analytics export
+    setup_message_changes(cursor)
+    
+    # Lets the campaign dispatcher page straight to a campaign's pending messages
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_campaign_status
+        ON messages(campaign_id, status)
+    ''')
+    
+    conn.commit()
+    conn.close()
 
 def parse_excel_file(file_path):
     """Parse Excel file and extract contact information"""
@@ -100,21 +170,23 @@ def parse_excel_file(file_path):
         if missing_cols:
             return None, f"Missing required columns: {missing_cols}"
         
+        # Validate the whole phone column at once and drop invalid numbers
+        df['phone'] = validate_phone_series(df['phone'])
+        df = df[df['phone'].notna()]
+        custom_cols = [col for col in df.columns if col not in ['phone', 'name']]
+        
         contacts = []
-        for _, row in df.iterrows():
-            phone = validate_phone_number(row['phone'])
-            if phone:
-                contact = {
-                    'phone': phone,
-                    'name': str(row['name']).strip(),
-                }
-                
-                # Add any additional columns as custom fields
-                for col in df.columns:
-                    if col not in ['phone', 'name']:
-                        contact[col] = str(row[col]) if pd.notna(row[col]) else ''
-                
-                contacts.append(contact)
+        for row in df.to_dict('records'):
+            contact = {
+                'phone': row['phone'],
+                'name': str(row['name']).strip(),
+            }
+            
+            # Add any additional columns as custom fields
+            for col in custom_cols:
+                contact[col] = str(row[col]) if pd.notna(row[col]) else ''
+            
+            contacts.append(contact)
         
         return contacts, None
     
@@ -123,14 +195,32 @@ def parse_excel_file(file_path):
 
 def personalize_message(template, contact):
     """Replace placeholders in message template with contact data"""
-    message = template
+    compiled = compile_template(template)
+    return compiled.render(compiled.variables_for(contact))
+
+def create_campaign_records(cursor, campaign_id, campaign_name, message_template, rate_limit, contacts):
+    """Upsert the contacts and insert the campaign with one message per contact; returns the contact count"""
+    contact_ids = upsert_contacts(cursor, contacts)
+    
+    # The template is stored once on the campaign; each message only keeps the values it uses.
+    # A number listed twice in the sheet is still only messaged once.
+    compiled = compile_template(message_template)
+    messages = {}
+    for contact_id, contact in zip(contact_ids, contacts):
+        messages[contact_id] = encode_variables(compiled.variables_for(contact))
     
-    # Replace all placeholders with contact data
-    for key, value in contact.items():
-        placeholder = '{' + key + '}'
-        message = message.replace(placeholder, str(value))
+    cursor.execute('''
+        INSERT INTO campaigns (id, name, message_template, total_contacts, rate_limit, status)
+        VALUES (?, ?, ?, ?, ?, 'pending')
+    ''', (campaign_id, campaign_name, message_template, len(messages), rate_limit))
+    
+    # Inserting in contact_id order keeps the (contact_id, sent_at) index writes sequential
+    cursor.executemany('''
+        INSERT INTO messages (campaign_id, contact_id, variables)
+        VALUES (?, ?, ?)
+    ''', [(campaign_id, contact_id, variables) for contact_id, variables in sorted(messages.items())])
     
-    return message
+    return len(messages)
 
 @app.route('/api/start-campaign', methods=['POST'])
 def start_campaign():
@@ -146,6 +236,14 @@ def start_campaign():
         if not all([campaign_name, message_template, api_key]):
             return jsonify({'error': 'Missing required fields'}), 400
         
+        # Optional ISO 8601 start time; the scheduler starts the campaign when it comes due
+        try:
+            scheduled_at = parse_schedule_time(request.form.get('scheduled_at'))
+        except ValueError:
+            return jsonify({'error': 'Invalid scheduled_at, expected ISO 8601'}), 400
+        if scheduled_at is not None and scheduled_at <= datetime.now():
+            scheduled_at = None
+        
         # Handle file upload
         if 'file' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
@@ -173,22 +271,15 @@ def start_campaign():
         # Create campaign
         campaign_id = str(uuid.uuid4())
         
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
-        # Insert campaign
-        cursor.execute('''
-            INSERT INTO campaigns (id, name, message_template, total_contacts, rate_limit, status)
-            VALUES (?, ?, ?, ?, ?, 'pending')
-        ''', (campaign_id, campaign_name, message_template, len(contacts), rate_limit))
-        
-        # Insert messages
-        for contact in contacts:
-            personalized_message = personalize_message(message_template, contact)
+        total_contacts = create_campaign_records(cursor, campaign_id, campaign_name, message_template,
+                                                 rate_limit, contacts)
+        if scheduled_at is not None:
             cursor.execute('''
-                INSERT INTO messages (campaign_id, phone_number, name, message_content)
-                VALUES (?, ?, ?, ?)
-            ''', (campaign_id, contact['phone'], contact['name'], personalized_message))
+                UPDATE campaigns SET status = 'scheduled', scheduled_at = ? WHERE id = ?
+            ''', (scheduled_at, campaign_id))
         
         conn.commit()
         conn.close()
@@ -196,14 +287,16 @@ def start_campaign():
         # Clean up uploaded file
         os.remove(file_path)
         
-        # Start Celery task to process messages
-        from celery_worker import process_campaign_task
-        process_campaign_task.delay(campaign_id, api_key, rate_limit)
+        # Start Celery task to process messages (scheduled campaigns wait for the scheduler tick)
+        if scheduled_at is None:
+            from celery_worker import process_campaign_task
+            process_campaign_task.delay(campaign_id, api_key, rate_limit)
         
         return jsonify({
             'success': True,
             'campaign_id': campaign_id,
-            'total_contacts': len(contacts)
+            'total_contacts': total_contacts,
+            'scheduled_at': scheduled_at.isoformat() if scheduled_at else None
         })
     
     except Exception as e:
@@ -213,7 +306,7 @@ def start_campaign():
 def get_campaign_status(campaign_id):
     """Get campaign status and statistics"""
     try:
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         # Get campaign info
@@ -257,7 +350,7 @@ def get_campaign_status(campaign_id):
 def get_campaigns():
     """Get all campaigns"""
     try:
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         # First, check if tables exist
@@ -268,12 +361,14 @@ def get_campaigns():
             conn.close()
             return jsonify({'campaigns': []})
         
+        # Delivery receipts move messages on from 'sent' to 'delivered' / 'read'; those still count
+        # as sent, so progress never goes backwards, and delivered is the subset that arrived
         cursor.execute('''
             SELECT c.id, c.name, c.message_template, c.total_contacts, c.rate_limit, c.status, c.created_at,
                    COUNT(m.id) as total_messages,
-                   SUM(CASE WHEN m.status = 'sent' THEN 1 ELSE 0 END) as sent_messages,
-                   SUM(CASE WHEN m.status = 'delivered' THEN 1 ELSE 0 END) as delivered_messages,
-                   SUM(CASE WHEN m.status = 'failed' THEN 1 ELSE 0 END) as failed_messages
+                   SUM(CASE WHEN m.status IN ('sent', 'delivered', 'read') THEN 1 ELSE 0 END) as sent_messages,
+                   SUM(CASE WHEN m.status IN ('delivered', 'read') THEN 1 ELSE 0 END) as delivered_messages,
+                   SUM(CASE WHEN m.status IN ('failed', 'undelivered') THEN 1 ELSE 0 END) as failed_messages
             FROM campaigns c
             LEFT JOIN messages m ON c.id = m.campaign_id
             GROUP BY c.id, c.name, c.message_template, c.total_contacts, c.rate_limit, c.status, c.created_at
@@ -301,13 +396,47 @@ def get_campaigns():
         print(f"Error in get_campaigns: {str(e)}")
         return jsonify({'campaigns': [], 'error': str(e)}), 200  # Return 200 with empty array instead of 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint for this process (the worker serves its own on WORKER_METRICS_PORT)"""
+    return Response(render(), content_type=CONTENT_TYPE)
+
+@app.route('/webhook/status', methods=['POST'])
+@WEBHOOK_LATENCY.labels('status').time()
+def twilio_status_callback():
+    """Twilio delivery status callback: queued here, applied in batches by the worker"""
+    event = parse_status_callback(request.values)
+    if not enqueue_status_events([event]):
+        # No queue to buffer into, so apply this one callback straight away
+        conn = connect()
+        try:
+            apply_status_batch(conn, [event])
+        finally:
+            conn.close()
+    return '', 204
+
+@app.route('/api/campaigns/<campaign_id>/delivery-latency', methods=['GET'])
+def get_delivery_latency(campaign_id):
+    """Histogram of sent-to-delivered latency for a campaign"""
+    try:
+        conn = connect()
+        histogram = delivery_latency_histogram(conn.cursor(), campaign_id)
+        conn.close()
+        return jsonify(histogram)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # WhatsApp Reply Collection Routes
 @app.route('/webhook/whatsapp', methods=['POST'])
+@WEBHOOK_LATENCY.labels('reply').time()
 def whatsapp_webhook():
     """Handle incoming WhatsApp messages (replies to our campaigns) with full compliance"""
     try:
         # Import reply handling functions
-        from reply_handler import store_reply, detect_reply_sentiment, is_opt_out_message, generate_auto_response
+        from reply_handler import (
+            store_reply, detect_reply_sentiment, is_opt_out_message,
+            generate_auto_response, find_sender_name
+        )
         
         # Get incoming message details
         from_number = request.values.get('From', '')
@@ -317,22 +446,19 @@ def whatsapp_webhook():
         # Remove 'whatsapp:' prefix to get clean phone number
         clean_phone = from_number.replace('whatsapp:', '')
         
-        print(f"📱 Incoming WhatsApp reply from {clean_phone}: {message_body}")
-        
         # Handle media if present
         media_url = None
         media_type = None
         if num_media > 0:
             media_url = request.values.get('MediaUrl0')
             media_type = request.values.get('MediaContentType0')
-            print(f"📷 Media received: {media_type} - {media_url}")
         
-        # Store the reply (this handles opt-out detection and database updates)
-        reply_id = store_reply(clean_phone, message_body, media_url, media_type)
-        
-        # Generate response using the enhanced format with compliance
+        # Classify once and share the result between storage and the auto-response
         sentiment_result = detect_reply_sentiment(message_body, clean_phone)
         
+        # Store the reply (this handles opt-out detection and database updates)
+        reply_id = store_reply(clean_phone, message_body, media_url, media_type, sentiment_result)
+        
         # Enhanced opt-out detection
         opt_out = (
             is_opt_out_message(message_body) or 
@@ -340,22 +466,21 @@ def whatsapp_webhook():
             sentiment_result.get('sentiment') == 'desired_opt_out'
         )
         
-        auto_response = generate_auto_response(message_body, sentiment_result, opt_out)
+        auto_response = generate_auto_response(
+            message_body, sentiment_result, opt_out, find_sender_name(clean_phone)
+        )
         
         # Create TwiML response
         response = MessagingResponse()
         response.message(auto_response)
         
-        print(f"🤖 Auto-response sent: {auto_response}")
-        
-        # Log compliance actions
-        if opt_out:
-            print(f"🚫 OPT-OUT PROCESSED: {clean_phone} has been unsubscribed")
+        log_message_event(logger, 'auto_response_sent', key=reply_id, reply_id=reply_id,
+                          media=bool(media_url), opt_out=opt_out)
         
         return str(response)
         
     except Exception as e:
-        print(f"❌ Webhook error: {str(e)}")
+        log_event(logger, 'reply_webhook_failed', logging.ERROR, exc_info=e)
         # Return empty response to avoid Twilio retries
         response = MessagingResponse()
         return str(response)
@@ -374,7 +499,7 @@ def get_replies():
         
         offset = (page - 1) * per_page
         
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         # Build query with filters
@@ -406,7 +531,10 @@ def get_replies():
         
         # Get replies with pagination
         query = f"""
-            SELECT r.*, c.name as campaign_name
+            SELECT r.id, r.phone_number, r.sender_name, r.message_content, r.received_at,
+                   r.campaign_id, r.original_message_id, r.reply_type, r.media_url, r.media_type,
+                   r.sentiment, r.confidence_score, r.is_opt_out, r.requires_attention,
+                   c.name as campaign_name
             FROM replies r
             LEFT JOIN campaigns c ON r.campaign_id = c.id
             {where_clause}
@@ -430,10 +558,10 @@ def get_replies():
                 'media_url': row[8],
                 'media_type': row[9],
                 'sentiment': row[10],
-                'confidence_score': row[11] if len(row) > 11 else 0.8,
-                'is_opt_out': bool(row[12]) if len(row) > 12 else False,
-                'requires_attention': bool(row[13]) if len(row) > 13 else False,
-                'campaign_name': row[15] if len(row) > 15 else 'Unknown'
+                'confidence_score': row[11],
+                'is_opt_out': bool(row[12]),
+                'requires_attention': bool(row[13]),
+                'campaign_name': row[14]
             })
         
         conn.close()
@@ -454,17 +582,18 @@ def get_reply_analytics():
     """Get analytics about WhatsApp replies"""
     try:
         campaign_id = request.args.get('campaign_id')
+        exact = request.args.get('exact') == 'true'
         
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
-        where_clause = "WHERE campaign_id = ?" if campaign_id else ""
-        params = [campaign_id] if campaign_id else []
+        # Counts come from the hourly rollups the replies triggers keep current
+        where_clause, params = rollup_where(campaign_id)
         
         # Get sentiment breakdown
         cursor.execute(f"""
-            SELECT sentiment, COUNT(*) as count
-            FROM replies {where_clause}
+            SELECT NULLIF(sentiment, ''), SUM(reply_count) as count
+            FROM reply_rollups {where_clause}
             GROUP BY sentiment
         """, params)
         
@@ -475,47 +604,38 @@ def get_reply_analytics():
         if positive_count > 0:
             sentiment_data['positive'] = positive_count
         
-        # Get reply rate
+        # Get reply rate (unique responders from the HyperLogLog sketches unless exact=true)
         if campaign_id:
             cursor.execute("SELECT total_contacts FROM campaigns WHERE id = ?", (campaign_id,))
             total_sent = cursor.fetchone()
             total_sent = total_sent[0] if total_sent else 0
-            
-            cursor.execute("SELECT COUNT(DISTINCT phone_number) FROM replies WHERE campaign_id = ?", (campaign_id,))
-            total_replies = cursor.fetchone()[0]
-            
-            reply_rate = (total_replies / total_sent * 100) if total_sent > 0 else 0
         else:
             # Calculate overall reply rate across all campaigns
             cursor.execute("SELECT SUM(total_contacts) FROM campaigns")
             total_sent = cursor.fetchone()[0] or 0
-            
-            cursor.execute("SELECT COUNT(DISTINCT phone_number) FROM replies")
-            total_replies = cursor.fetchone()[0]
-            
-            reply_rate = (total_replies / total_sent * 100) if total_sent > 0 else 0
+        
+        total_replies = count_responders(cursor, campaign_id, exact=exact)
+        reply_rate = (total_replies / total_sent * 100) if total_sent > 0 else 0
         
         # Get opt-out count
-        if campaign_id:
-            cursor.execute("SELECT COUNT(*) FROM replies WHERE campaign_id = ? AND is_opt_out = 1", (campaign_id,))
-        else:
-            cursor.execute("SELECT COUNT(*) FROM replies WHERE is_opt_out = 1")
+        cursor.execute(f"""
+            SELECT COALESCE(SUM(reply_count), 0) FROM reply_rollups
+            WHERE is_opt_out = 1 {'AND campaign_id = ?' if campaign_id else ''}
+        """, params)
         
         opt_outs = cursor.fetchone()[0]
         
-        # Get recent replies
-        if campaign_id:
-            cursor.execute("SELECT COUNT(*) FROM replies WHERE campaign_id = ? AND received_at >= datetime('now', '-24 hours')", (campaign_id,))
-        else:
-            cursor.execute("SELECT COUNT(*) FROM replies WHERE received_at >= datetime('now', '-24 hours')")
-        
-        recent_replies = cursor.fetchone()[0]
+        # Get recent replies (received_at is UTC)
+        since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=24)
+        recent_replies = replies_since(cursor, since, campaign_id)
         
         conn.close()
         
         return jsonify({
             'sentiment_breakdown': sentiment_data,
             'reply_rate': round(reply_rate, 2),
+            'unique_responders': total_replies,
+            'unique_responders_approximate': not exact,
             'total_opt_outs': opt_outs,
             'recent_replies_24h': recent_replies
         })
@@ -523,140 +643,118 @@ def get_reply_analytics():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/replies/download', methods=['GET'])
-def download_replies():
-    """Download filtered replies as Excel file"""
+@app.route('/api/replies/unique-responders', methods=['GET'])
+def get_unique_responders():
+    """Distinct responders for a campaign (or all) over a UTC date range; exact=true for COUNT(DISTINCT)"""
     try:
-        import pandas as pd
-        from io import BytesIO
-        from datetime import datetime
-        
-        # Get query parameters for filtering
-        campaign_id = request.args.get('campaign_id')
-        sentiment = request.args.get('sentiment')
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
-        conn = sqlite3.connect('whatsapp_campaigns.db')
-        cursor = conn.cursor()
-        
-        # Build query with filters
-        where_conditions = []
-        params = []
-        
-        if campaign_id:
-            where_conditions.append("r.campaign_id = ?")
-            params.append(campaign_id)
-        
-        if sentiment:
-            where_conditions.append("r.sentiment = ?")
-            params.append(sentiment)
-        
-        if start_date:
-            where_conditions.append("r.received_at >= ?")
-            params.append(start_date)
-        
-        if end_date:
-            where_conditions.append("r.received_at <= ?")
-            params.append(end_date + ' 23:59:59')  # Include end of day
-        
-        where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-        
-        # Get filtered replies
-        query = f"""
-            SELECT 
-                r.sender_name as "Contact Name",
-                r.phone_number as "Phone Number",
-                r.message_content as "Reply Message",
-                r.received_at as "Reply Date & Time",
-                c.name as "Campaign Name",
-                r.sentiment as "Sentiment",
-                r.reply_type as "Reply Type",
-                CASE WHEN r.is_opt_out = 1 THEN 'Yes' ELSE 'No' END as "Opted Out"
-            FROM replies r
-            LEFT JOIN campaigns c ON r.campaign_id = c.id
-            {where_clause}
-            ORDER BY r.received_at DESC
-        """
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        if not rows:
-            conn.close()
-            return jsonify({'error': 'No replies found for the specified filters'}), 404
-        
-        # Get column names
-        columns = [description[0] for description in cursor.description]
-        
-        # Create DataFrame
-        df = pd.DataFrame(rows, columns=columns)
+        exact = request.args.get('exact') == 'true'
+        kind = request.args.get('kind', 'reply')
+        if kind not in SKETCH_KINDS:
+            return jsonify({'error': f"kind must be one of: {', '.join(SKETCH_KINDS)}"}), 400
+        
+        conn = connect()
+        count = count_responders(conn.cursor(), request.args.get('campaign_id'), request.args.get('start_date'),
+                                 request.args.get('end_date'), kind=kind, exact=exact)
+        conn.close()
         
-        # Format the date column
-        df['Reply Date & Time'] = pd.to_datetime(df['Reply Date & Time']).dt.strftime('%Y-%m-%d %H:%M:%S')
+        return jsonify({
+            'unique_responders': count,
+            'approximate': not exact,
+            'standard_error': 0 if exact else round(HLL_STANDARD_ERROR, 4)
+        })
         
-        # Create Excel file in memory
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='WhatsApp Replies', index=False)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/replies/download', methods=['GET'])
+def download_replies():
+    """Download filtered replies as Excel (default) or CSV; large exports become a background job"""
+    try:
+        fmt = request.args.get('format', 'xlsx')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f"Unsupported format '{fmt}', use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+        filters = export_filters(request.args)
+        
+        conn = connect()
+        try:
+            total = count_export_rows(conn, filters, limit=EXPORT_ASYNC_THRESHOLD + 1)
+            if not total:
+                return jsonify({'error': 'No replies found for the specified filters'}), 404
             
-            # Get the workbook and worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['WhatsApp Replies']
+            filename = export_filename(conn, filters, fmt)
+            if total > EXPORT_ASYNC_THRESHOLD or request.args.get('async') == 'true':
+                job_id = create_export_job(conn, filters, fmt, filename)
+                from celery_worker import export_replies_task
+                export_replies_task.delay(job_id)
+                return jsonify({
+                    'job_id': job_id,
+                    'status': 'queued',
+                    'status_url': f'/api/replies/exports/{job_id}',
+                    'download_url': f'/api/replies/exports/{job_id}/download'
+                }), 202
             
-            # Auto-adjust column widths
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)  # Cap at 50 characters
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-        
-        output.seek(0)
-        conn.close()
-        
-        # Generate filename with timestamp and filters
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename_parts = ['whatsapp_replies', timestamp]
-        
-        if campaign_id:
-            # Get campaign name for filename
-            conn_temp = sqlite3.connect('whatsapp_campaigns.db')
-            cursor_temp = conn_temp.cursor()
-            cursor_temp.execute("SELECT name FROM campaigns WHERE id = ?", (campaign_id,))
-            campaign_result = cursor_temp.fetchone()
-            if campaign_result:
-                campaign_name = campaign_result[0].replace(' ', '_').replace('/', '_')
-                filename_parts.append(f'campaign_{campaign_name}')
-            conn_temp.close()
-        
-        if sentiment:
-            filename_parts.append(f'sentiment_{sentiment}')
-        
-        filename = '_'.join(filename_parts) + '.xlsx'
+            if fmt == 'csv':
+                return Response(
+                    stream_with_context(stream_csv(filters)),
+                    mimetype=EXPORT_FORMATS['csv'],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'}
+                )
+            
+            # Below the threshold the finished workbook is small enough to hold while it is sent
+            output = BytesIO()
+            write_xlsx(iter_export_rows(conn, filters), output)
+            output.seek(0)
+        finally:
+            conn.close()
         
         return send_file(
             output,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype=EXPORT_FORMATS['xlsx']
         )
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/replies/exports/<job_id>', methods=['GET'])
+def get_export_status(job_id):
+    """Status of a background reply export"""
+    job = get_export_job(job_id)
+    if not job:
+        return jsonify({'error': 'Export not found'}), 404
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'],
+        'format': job['format'],
+        'filename': job['filename'],
+        'row_count': job['row_count'],
+        'error': job['error'],
+        'download_url': f'/api/replies/exports/{job_id}/download' if job['status'] == 'completed' else None
+    })
+
+@app.route('/api/replies/exports/<job_id>/download', methods=['GET'])
+def download_export(job_id):
+    """Download the file written by a completed background export"""
+    job = get_export_job(job_id)
+    if not job or job['status'] != 'completed' or not os.path.exists(job['file_path']):
+        return jsonify({'error': 'Export not ready or expired'}), 404
+    
+    return send_file(
+        os.path.abspath(job['file_path']),
+        as_attachment=True,
+        download_name=job['filename'],
+        mimetype=EXPORT_FORMATS[job['format']]
+    )
+
 # Opt-out Management API Endpoints
 @app.route('/api/opt-out/analytics', methods=['GET'])
 def get_opt_out_analytics():
     """Get opt-out analytics and compliance metrics"""
     try:
         from opt_out_manager import get_opt_out_analytics
-        analytics = get_opt_out_analytics()
+        analytics = get_opt_out_analytics(exact=request.args.get('exact') == 'true')
         return jsonify(analytics)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -700,48 +798,37 @@ def schedule_opt_out_confirmation():
 
 @app.route('/api/opt-out/send-pending', methods=['POST'])
 def send_pending_opt_out_confirmations():
-    """Send all pending opt-out confirmations"""
+    """Send one batch of due opt-out confirmations now (the scheduler tick sends the rest)"""
     try:
-        from opt_out_manager import get_pending_opt_out_confirmations, mark_opt_out_confirmation_sent
-        from celery_worker import send_whatsapp_message
-        
-        confirmations = get_pending_opt_out_confirmations()
-        sent_count = 0
-        errors = []
-        
-        for confirmation in confirmations:
-            try:
-                # Send the opt-out confirmation message
-                task_result = send_whatsapp_message.delay(
-                    confirmation['phone_number'],
-                    confirmation['message'],
-                    None  # No campaign_id for opt-out confirmations
-                )
-                
-                # Mark as sent
-                mark_opt_out_confirmation_sent(confirmation['id'])
-                sent_count += 1
-                
-                print(f"✅ Opt-out confirmation sent to {confirmation['phone_number']}")
-                
-            except Exception as e:
-                error_msg = f"Failed to send to {confirmation['phone_number']}: {str(e)}"
-                errors.append(error_msg)
-                print(f"❌ {error_msg}")
+        from opt_out_manager import dispatch_opt_out_confirmations
+        from celery_worker import send_rate_limited
+        
+        # Rows are only marked sent once the provider has accepted them
+        summary = dispatch_opt_out_confirmations(send_rate_limited, max_batches=1)
         
         response_data = {
-            'sent_count': sent_count,
-            'total_confirmations': len(confirmations)
+            'sent_count': summary['sent'],
+            'total_confirmations': summary['claimed']
         }
         
-        if errors:
-            response_data['errors'] = errors
+        if summary['errors']:
+            response_data['errors'] = summary['errors']
             
         return jsonify(response_data)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/opt-out/metrics', methods=['GET'])
+def get_opt_out_metrics():
+    """Opt-out confirmation backlog and scheduled-to-sent latency"""
+    try:
+        from opt_out_manager import get_opt_out_confirmation_metrics
+        window_hours = request.args.get('hours', 24, type=int)
+        return jsonify(get_opt_out_confirmation_metrics(window_hours))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/opt-out/check/<phone_number>', methods=['GET'])
 def check_opt_out_status(phone_number):
     """Check if a phone number has opted out"""
@@ -752,6 +839,93 @@ def check_opt_out_status(phone_number):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/campaigns/<campaign_id>/pause', methods=['POST'])
+def pause_campaign(campaign_id):
+    """Ask the dispatcher to stop after its current batch; pending messages are kept"""
+    return control_campaign(campaign_id, 'pause', allowed_statuses=('scheduled', 'pending', 'running'))
+
+@app.route('/api/campaigns/<campaign_id>/cancel', methods=['POST'])
+def cancel_campaign(campaign_id):
+    """Stop a campaign for good; its pending messages are marked cancelled"""
+    return control_campaign(campaign_id, 'cancel',
+                            allowed_statuses=('scheduled', 'pending', 'running', 'paused', 'failed'))
+
+def control_campaign(campaign_id, action, allowed_statuses):
+    try:
+        conn = connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT status FROM campaigns WHERE id = ?', (campaign_id,))
+        campaign = cursor.fetchone()
+        if not campaign:
+            conn.close()
+            return jsonify({'error': 'Campaign not found'}), 404
+        
+        status = campaign[0]
+        if status not in allowed_statuses:
+            conn.close()
+            return jsonify({'error': f'Cannot {action} a campaign that is {status}'}), 409
+        
+        set_campaign_control(cursor, campaign_id, action)
+        # A running campaign with nothing pending is only waiting on quiet hours or retries
+        applied = status != 'running' or not has_dispatch_work(cursor, campaign_id)
+        if applied:
+            # No dispatcher is working on it, so apply the action now
+            apply_campaign_control(cursor, campaign_id, action)
+        
+        conn.commit()
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'campaign_id': campaign_id,
+            'action': action,
+            'applied': applied
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/campaigns/<campaign_id>/resume', methods=['POST'])
+def resume_campaign(campaign_id):
+    """Re-queue a paused campaign from its checkpoint, optionally with a new rate limit"""
+    try:
+        data = request.get_json(silent=True) or request.form
+        api_key = data.get('api_key')
+        if not api_key:
+            return jsonify({'error': 'Missing required fields'}), 400
+        
+        conn = connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT status, rate_limit FROM campaigns WHERE id = ?', (campaign_id,))
+        campaign = cursor.fetchone()
+        if not campaign:
+            conn.close()
+            return jsonify({'error': 'Campaign not found'}), 404
+        
+        status, rate_limit = campaign
+        if status not in ('paused', 'failed'):
+            conn.close()
+            return jsonify({'error': f'Cannot resume a campaign that is {status}'}), 409
+        
+        rate_limit = int(data.get('rate_limit', rate_limit))
+        set_campaign_control(cursor, campaign_id, None)
+        cursor.execute('''
+            UPDATE campaigns SET status = 'pending', rate_limit = ?
+            WHERE id = ?
+        ''', (rate_limit, campaign_id))
+        conn.commit()
+        conn.close()
+        
+        from celery_worker import process_campaign_task
+        process_campaign_task.delay(campaign_id, api_key, rate_limit)
+        
+        return jsonify({'success': True, 'campaign_id': campaign_id, 'rate_limit': rate_limit})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/campaigns/<campaign_id>/clean-opt-outs', methods=['POST'])
 def clean_opt_outs_from_campaign(campaign_id):
     """Remove opted-out contacts from a specific campaign"""
@@ -789,6 +963,7 @@ def get_compliant_templates():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    setup_logging()
     init_db()
     # Initialize reply database
     from reply_handler import setup_replies_database
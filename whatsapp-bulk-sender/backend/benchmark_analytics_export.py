@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Analytics export benchmark
+Fills a replies table with N rows and exports all of them through the /api/replies/download
+path (write-only XLSX, and the streamed CSV) and through the Parquet analytics export. Then adds
+1% more replies and times an incremental Parquet run, which only reads past the watermark.
+Reports wall time, peak Python memory (tracemalloc) and output size for each.
+
+Usage: python benchmark_analytics_export.py [replies]
+"""
+
+import sys
+import os
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_reply_export import build_replies, xlsx_export, csv_export
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def parquet_export(conn):
+    from analytics_export import export_dataset
+    export_dataset(conn, 'replies', 'analytics')
+    return directory_size('analytics')
+
+
+def measure(export, conn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = export(conn)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, size
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from app import init_db
+        from analytics_export import setup_export_watermarks
+        from reply_handler import setup_replies_database
+        init_db()
+        setup_replies_database()
+
+        print(f"⚙️ Creating {count:,} replies...")
+        conn = build_replies(count)
+        setup_export_watermarks(conn.cursor())
+        results = [(name, measure(export, conn)) for name, export in
+                   (('download (XLSX)', xlsx_export), ('download (CSV)', csv_export),
+                    ('Parquet, full', parquet_export))]
+
+        extra = count // 100
+        conn.execute('''
+            INSERT INTO replies (phone_number, sender_name, message_content, received_at, campaign_id, sentiment)
+            SELECT phone_number, sender_name, message_content, received_at, campaign_id, sentiment
+            FROM replies ORDER BY id LIMIT ?
+        ''', (extra,))
+        conn.commit()
+        size_before = directory_size('analytics')
+        seconds, peak, size = measure(parquet_export, conn)
+        results.append((f'Parquet, +{extra:,} rows', (seconds, peak, size - size_before)))
+        conn.close()
+        os.chdir('/')
+
+    print(f"\n📊 Exporting {count:,} replies (times include tracemalloc overhead)")
+    for name, (seconds, peak, size) in results:
+        print(f"   {name:<22} {seconds:7.2f}s   peak {peak / 2**20:8.1f} MiB   output {size / 2**20:6.1f} MiB")
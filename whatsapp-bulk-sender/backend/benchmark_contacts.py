@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Contact store benchmark
+Creates the same series of campaigns over a shared customer base twice: the old way (a full
+contact copy per message row, inserted one at a time) and with the contacts table (bulk upsert,
+messages referencing contact_id). Reports database size and campaign creation time.
+
+Usage: python benchmark_contacts.py [customers] [campaigns] [contacts_per_campaign]
+"""
+
+import sys
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATE = "Hi {name}! New arrivals have landed in {city}. Your last order was {last_order}, " \
+           "reply YES for your size {size} picks. Reply STOP to opt out | Mwihaki Intimates"
+CITIES = ["Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret", "Thika"]
+SIZES = ["32A", "34B", "36C", "38D"]
+
+
+def generate_customers(count, seed=5):
+    rng = random.Random(seed)
+    return [{
+        'phone': f"2547{rng.randint(10000000, 99999999)}",
+        'name': f"Customer {i}",
+        'city': rng.choice(CITIES),
+        'size': rng.choice(SIZES),
+        'last_order': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+    } for i in range(count)]
+
+
+def database_size(conn):
+    conn.execute("VACUUM")
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def legacy_create_campaign(cursor, campaign_id, contacts):
+    """start_campaign before the contacts table: one full row per contact, inserted one at a time"""
+    from app import personalize_message
+    from phone_numbers import canonical_phone_number
+
+    cursor.execute('''
+        INSERT INTO campaigns (id, name, message_template, total_contacts, rate_limit, status)
+        VALUES (?, ?, ?, ?, ?, 'pending')
+    ''', (campaign_id, campaign_id, TEMPLATE, len(contacts), 2))
+    for contact in contacts:
+        cursor.execute('''
+            INSERT INTO messages (campaign_id, phone_number, name, message_content, phone_canonical)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (campaign_id, contact['phone'], contact['name'], personalize_message(TEMPLATE, contact),
+              canonical_phone_number(contact['phone'])))
+
+
+def run(directory, campaigns, use_contacts):
+    os.chdir(directory)
+    from app import init_db, create_campaign_records
+
+    if use_contacts:
+        init_db()
+    else:
+        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn.execute('''
+            CREATE TABLE campaigns (
+                id TEXT PRIMARY KEY, name TEXT NOT NULL, message_template TEXT NOT NULL,
+                total_contacts INTEGER, rate_limit INTEGER, status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, started_at TIMESTAMP, completed_at TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, campaign_id TEXT, phone_number TEXT, name TEXT,
+                message_content TEXT, status TEXT DEFAULT 'pending', sent_at TIMESTAMP,
+                delivered_at TIMESTAMP, failed_at TIMESTAMP, error_message TEXT, retry_count INTEGER DEFAULT 0,
+                phone_canonical TEXT
+            )
+        ''')
+        conn.execute("CREATE INDEX idx_messages_phone_canonical ON messages(phone_canonical, sent_at DESC)")
+        conn.commit()
+        conn.close()
+
+    timings = []
+    for number, contacts in enumerate(campaigns):
+        campaign_id = f"campaign-{number}"
+        conn = sqlite3.connect('whatsapp_campaigns.db')
+        start = time.perf_counter()
+        if use_contacts:
+            create_campaign_records(conn.cursor(), campaign_id, campaign_id, TEMPLATE, 2, contacts)
+        else:
+            legacy_create_campaign(conn.cursor(), campaign_id, contacts)
+        conn.commit()
+        timings.append(time.perf_counter() - start)
+        conn.close()
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    size = database_size(conn)
+    content = conn.execute("SELECT SUM(LENGTH(message_content)) FROM messages").fetchone()[0]
+    conn.close()
+    os.chdir('/')
+    return size, content, timings
+
+
+if __name__ == "__main__":
+    customer_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    campaign_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    per_campaign = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+
+    customers = generate_customers(customer_count)
+    rng = random.Random(9)
+    campaigns = [rng.sample(customers, per_campaign) for _ in range(campaign_count)]
+    total = campaign_count * per_campaign
+
+    results = {}
+    for label, use_contacts in [("per-message copies", False), ("contacts table", True)]:
+        with tempfile.TemporaryDirectory() as directory:
+            results[label] = run(directory, campaigns, use_contacts)
+
+    print(f"\n📊 {campaign_count} campaigns x {per_campaign:,} contacts from {customer_count:,} customers")
+    for label, (size, content, timings) in results.items():
+        print(f"   {label:<20} {size / 1e6:8.1f} MB, {(size - content) / total:4.0f} B/message besides the text   "
+              f"create {sum(timings) / len(timings) * 1000:5.0f} ms/campaign "
+              f"({per_campaign / (sum(timings) / len(timings)):,.0f} contacts/s)")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Delivery status ingestion benchmark
+Builds a sent campaign of N messages, then applies a delivered + read callback for each one,
+first with an UPDATE and commit per callback (what a synchronous webhook would do), then with
+apply_status_batch over queue-sized batches. Reports callbacks per second for both.
+
+Usage: python benchmark_delivery_status.py [messages] [batch_size]
+"""
+
+import sys
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_sent_campaign(campaign_id, count):
+    from app import create_campaign_records
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    contacts = [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(count)]
+    create_campaign_records(conn.cursor(), campaign_id, 'Launch', 'Hi {name}', 0, contacts)
+    conn.execute('''
+        UPDATE messages SET status = 'sent', sent_at = ?, provider_sid = 'SM' || campaign_id || id
+        WHERE campaign_id = ?
+    ''', (datetime.now(), campaign_id))
+    conn.commit()
+    return conn
+
+
+def callbacks_for(conn, campaign_id):
+    sids = [row[0] for row in conn.execute('SELECT provider_sid FROM messages WHERE campaign_id = ?', (campaign_id,))]
+    now = time.time()
+    events = [{'sid': sid, 'status': status, 'error_code': None, 'received_at': now}
+              for status in ('delivered', 'read') for sid in sids]
+    random.Random(3).shuffle(events)
+    return events
+
+
+def apply_one_at_a_time(conn, events):
+    for event in events:
+        conn.execute('''
+            UPDATE messages SET status = ?, delivered_at = COALESCE(delivered_at, ?)
+            WHERE provider_sid = ?
+        ''', (event['status'], datetime.fromtimestamp(event['received_at']), event['sid']))
+        conn.commit()
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from app import init_db
+        from delivery_status import apply_status_batch
+        init_db()
+
+        print(f"⚙️ Creating two sent campaigns with {count:,} messages each...")
+        single = build_sent_campaign('single', count)
+        batched = build_sent_campaign('batched', count)
+
+        events = callbacks_for(single, 'single')
+        start = time.perf_counter()
+        apply_one_at_a_time(single, events)
+        single_seconds = time.perf_counter() - start
+
+        events = callbacks_for(batched, 'batched')
+        start = time.perf_counter()
+        for offset in range(0, len(events), batch_size):
+            apply_status_batch(batched, events[offset:offset + batch_size])
+        batched_seconds = time.perf_counter() - start
+
+        single.close()
+        batched.close()
+        os.chdir('/')
+
+    print(f"\n📊 Applying {len(events):,} status callbacks")
+    print(f"   commit per callback   {single_seconds:7.2f}s   {len(events) / single_seconds:10,.0f} callbacks/s")
+    print(f"   batches of {batch_size:<6}     {batched_seconds:7.2f}s   {len(events) / batched_seconds:10,.0f} callbacks/s")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the compiled keyword matcher
+Compares the single-pass regex against the old per-list substring scans on a synthetic reply corpus
+"""
+
+import random
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from keyword_matcher import (
+    find_keyword_hits, contains_opt_out_keyword,
+    OPT_OUT_KEYWORDS, POSITIVE_KEYWORDS, NEGATIVE_KEYWORDS,
+    QUESTION_KEYWORDS, URGENT_KEYWORDS
+)
+
+FILLER_WORDS = [
+    'habari', 'leo', 'the', 'shop', 'size', 'colour', 'nyekundu', 'kesho',
+    'delivery', 'nairobi', 'mombasa', 'ok', 'sasa', 'please', 'tafadhali',
+    'know', 'nachagua', 'nothing', 'another', 'blocks', 'stopover', 'ber',
+]
+
+
+def _plain(keywords):
+    return [keyword.rstrip('*') for keyword in keywords]
+
+
+def substring_scan(message_content):
+    """The previous implementation: one substring scan per keyword list"""
+    message_lower = message_content.lower()
+    opt_out = any(word in message_lower for word in _plain(OPT_OUT_KEYWORDS))
+    positive = sum(1 for word in _plain(POSITIVE_KEYWORDS) if word in message_lower)
+    negative = sum(1 for word in _plain(NEGATIVE_KEYWORDS) if word in message_lower)
+    question = sum(1 for word in _plain(QUESTION_KEYWORDS) if word in message_lower)
+    urgent = sum(1 for word in _plain(URGENT_KEYWORDS) if word in message_lower)
+    # is_opt_out_message() ran the opt-out list a second time
+    opt_out_again = any(word in message_lower for word in _plain(OPT_OUT_KEYWORDS))
+    return opt_out, positive, negative, question, urgent, opt_out_again
+
+
+def compiled_scan(message_content):
+    """The compiled matcher: one full scan plus an early-exit opt-out search"""
+    return find_keyword_hits(message_content), contains_opt_out_keyword(message_content)
+
+
+def generate_corpus(size, seed=42):
+    """Generate synthetic replies of 3-30 words with a sprinkling of keywords"""
+    rng = random.Random(seed)
+    keywords = _plain(
+        OPT_OUT_KEYWORDS + POSITIVE_KEYWORDS + NEGATIVE_KEYWORDS + QUESTION_KEYWORDS + URGENT_KEYWORDS
+    )
+    corpus = []
+    for _ in range(size):
+        words = [rng.choice(FILLER_WORDS) for _ in range(rng.randint(3, 30))]
+        for _ in range(rng.randint(0, 2)):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def run_benchmark(func, corpus):
+    start = time.perf_counter()
+    for message in corpus:
+        func(message)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    print(f"🧪 Generating {size:,} synthetic replies...")
+    corpus = generate_corpus(size)
+
+    print("⏱️ Running benchmarks...\n")
+    for label, func in [('Substring scans (old)', substring_scan), ('Compiled matcher', compiled_scan)]:
+        elapsed = run_benchmark(func, corpus)
+        print(f"{label:24s} {elapsed:8.3f}s  {size / elapsed:12,.0f} msgs/sec  {elapsed / size * 1e6:6.2f} µs/msg")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Per-message logging benchmark
+Times what the send loop pays per message to log it: the two print() lines it used to write
+synchronously, against log_message_event through the queued JSON handler at the default 1%
+sample and with every message logged. Output goes to a file, or to a pipe read slowly (about
+1 MB/s, like a busy container log driver) to show a print() blocking on its reader.
+
+Usage: python benchmark_logging.py [messages]
+"""
+
+import sys
+import os
+import logging
+import subprocess
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import structured_logging
+from structured_logging import log_context, log_message_event, setup_logging, stop_logging
+
+SLOW_READER = "import sys, time\nwhile sys.stdin.buffer.read(4096): time.sleep(0.004)"
+
+
+def print_lines(stream, count):
+    for i in range(count):
+        print(f"✓ Message sent to 2547{i:08d} (Customer {i})", file=stream, flush=True)
+        print(f"✅ Twilio message sent successfully. SID: SM{i:032d}", file=stream, flush=True)
+
+
+def log_lines(count):
+    logger = logging.getLogger('celery_worker')
+    for i in range(count):
+        with log_context(campaign_id='c1', message_id=i):
+            log_message_event(logger, 'message_sent', provider_sid=f'SM{i:032d}')
+
+
+def per_message_us(function, count):
+    start = time.perf_counter()
+    function(count)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as directory:
+        rows = []
+        for target in ('file', 'slow pipe'):
+            if target == 'file':
+                stream = open(os.path.join(directory, 'out.log'), 'w')
+                reader = None
+            else:
+                reader = subprocess.Popen([sys.executable, '-c', SLOW_READER], stdin=subprocess.PIPE)
+                stream = open(reader.stdin.fileno(), 'w', closefd=False)
+
+            printed = per_message_us(lambda n: print_lines(stream, n), count)
+            structured_logging._handler = None
+            setup_logging(stream)
+            logging.getLogger().handlers = [structured_logging._handler]
+            sampled = per_message_us(log_lines, count)
+            structured_logging.LOG_MESSAGE_SAMPLE_RATE = 1.0
+            everything = per_message_us(log_lines, count)
+            structured_logging.LOG_MESSAGE_SAMPLE_RATE = 0.01
+            stop_logging()
+            rows.append((target, printed, sampled, everything))
+
+            stream.close()
+            if reader:
+                reader.stdin.close()
+                reader.kill()
+
+    print(f"\n📊 {count:,} messages, per-message cost in the send loop")
+    print(f"   {'output':<10} {'print() x2':>12} {'log 1%':>10} {'log 100%':>10}")
+    for target, printed, sampled, everything in rows:
+        print(f"   {target:<10} {printed:9.1f} µs {sampled:7.1f} µs {everything:7.1f} µs")
+    print(f"   log records dropped (queue full): {structured_logging.DROPPED.labels().get():,.0f}")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Message storage benchmark
+One campaign with a ~600 character template, stored the old way (fully rendered message_content
+per row) and as template-on-campaign plus per-message variables. Reports database size, the memory
+the campaign worker holds after loading its pending messages, and render throughput.
+
+Usage: python benchmark_message_templates.py [contacts]
+"""
+
+import sys
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_contacts import generate_customers, database_size
+from message_templates import compile_template, render_message
+
+TEMPLATE = (
+    "Hi {name}! 🌸 Mwihaki Intimates here. Our new season collection has just landed at the {city} "
+    "store and we've set aside a few pieces in your size ({size}) because we know you loved your "
+    "last order on {last_order}. This week only, every lace set, bralette and shapewear piece is "
+    "20% off, and delivery within {city} is free on orders above KES 3,000. Reply YES and we'll "
+    "send you photos of what's in stock in {size}, or reply SIZE if you'd like help with fitting. "
+    "You can also visit us Monday to Saturday, 9am to 7pm. Thank you for being part of the family! "
+    "Reply STOP to opt out | Mwihaki Intimates"
+)
+
+
+def legacy_personalize_message(template, contact):
+    message = template
+    for key, value in contact.items():
+        message = message.replace('{' + key + '}', str(value))
+    return message
+
+
+def build(directory, contacts, store_variables):
+    os.chdir(directory)
+    from app import init_db, create_campaign_records
+    from contacts import upsert_contacts
+
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    cursor = conn.cursor()
+    if store_variables:
+        create_campaign_records(cursor, 'c1', 'Season launch', TEMPLATE, 2, contacts)
+    else:
+        contact_ids = upsert_contacts(cursor, contacts)
+        cursor.execute('''
+            INSERT INTO campaigns (id, name, message_template, total_contacts, rate_limit, status)
+            VALUES ('c1', 'Season launch', ?, ?, 2, 'pending')
+        ''', (TEMPLATE, len(contacts)))
+        cursor.executemany("INSERT INTO messages (campaign_id, contact_id, message_content) VALUES ('c1', ?, ?)",
+                           [(contact_id, legacy_personalize_message(TEMPLATE, contact))
+                            for contact_id, contact in zip(contact_ids, contacts)])
+    conn.commit()
+    size = database_size(conn)
+
+    # What process_campaign_task holds after loading the pending messages
+    tracemalloc.start()
+    cursor.execute('''
+        SELECT m.id, c.phone_canonical, m.variables, m.message_content, c.name
+        FROM messages m JOIN contacts c ON c.id = m.contact_id
+        WHERE m.campaign_id = 'c1' AND m.status = 'pending' ORDER BY m.id
+    ''')
+    rows = cursor.fetchall()
+    loaded, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    conn.close()
+    os.chdir('/')
+    return size, loaded, rows
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    contacts = generate_customers(count)
+    random.Random(1).shuffle(contacts)
+
+    results = {}
+    for label, store_variables in [("rendered rows", False), ("template + variables", True)]:
+        with tempfile.TemporaryDirectory() as directory:
+            results[label] = build(directory, contacts, store_variables)
+
+    sample = contacts[:20000]
+    start = time.perf_counter()
+    for contact in sample:
+        legacy_personalize_message(TEMPLATE, contact)
+    legacy_rate = len(sample) / (time.perf_counter() - start)
+
+    compiled = compile_template(TEMPLATE)
+    stored = [row[2] for row in results["template + variables"][2][:len(sample)]]
+    start = time.perf_counter()
+    for variables in stored:
+        render_message(compiled, variables)
+    compiled_rate = len(sample) / (time.perf_counter() - start)
+
+    print(f"\n📊 {count:,} messages, {len(TEMPLATE)} character template")
+    for label, (size, loaded, _) in results.items():
+        print(f"   {label:<22} database {size / 1e6:7.1f} MB   worker rows in memory {loaded / 1e6:7.1f} MB")
+    print(f"   render: str.replace loop {legacy_rate:,.0f}/s, compiled template from stored variables "
+          f"{compiled_rate:,.0f}/s")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Metrics overhead benchmark
+Times what a hot path pays to record one event: a labelled counter increment (label lookup
+included), an increment on a series kept from labels(), a histogram observation and a timed
+block with prometheus_client. Also times rendering /metrics with one series per outcome for C
+campaigns.
+
+Usage: python benchmark_metrics.py [events] [campaigns]
+"""
+
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+from metrics import render
+
+
+def per_event_ns(function, events):
+    start = time.perf_counter()
+    function(events)
+    return (time.perf_counter() - start) / events * 1e9
+
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    campaigns = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    registry = CollectorRegistry()
+    messages = Counter('bench_messages_total', 'Messages', ['campaign_id', 'outcome', 'error_class'],
+                       registry=registry)
+    latency = Histogram('bench_seconds', 'Latency', ['outcome'], registry=registry)
+    series = messages.labels('c1', 'sent', '')
+    observed = latency.labels('ok')
+
+    def labelled_inc(n):
+        for _ in range(n):
+            messages.labels('c1', 'sent', '').inc()
+
+    def series_inc(n):
+        for _ in range(n):
+            series.inc()
+
+    def observe(n):
+        for i in range(n):
+            observed.observe(i * 1e-6)
+
+    def timed_block(n):
+        for _ in range(n):
+            with observed.time():
+                pass
+
+    def empty_loop(n):
+        for _ in range(n):
+            pass
+
+    loop_ns = per_event_ns(empty_loop, events)
+    rows = [(label, per_event_ns(function, events) - loop_ns) for label, function in (
+        ('labels(...).inc()', labelled_inc),
+        ('series.inc()', series_inc),
+        ('histogram.observe()', observe),
+        ('with histogram.time()', timed_block),
+    )]
+
+    for i in range(campaigns):
+        for outcome in ('sent', 'failed', 'deferred', 'retried'):
+            messages.labels(f'c{i}', outcome, '').inc()
+    start = time.perf_counter()
+    body = render(registry)
+    render_ms = (time.perf_counter() - start) * 1000
+
+    print(f"\n📊 {events:,} events each (loop overhead of {loop_ns:.0f} ns subtracted)")
+    for label, ns in rows:
+        print(f"   {label:<24} {ns:8.0f} ns/event")
+    print(f"   render {campaigns * 4:,} series       {render_ms:8.1f} ms ({len(body) / 1024:,.0f} KiB)")
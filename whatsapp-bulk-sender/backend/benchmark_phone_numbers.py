@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Phone number normalisation benchmark
+Numbers normalised per second for the old normalisers (regex validate_phone_number,
+filter-based normalize_phone_number + get_phone_number_variations) against the
+phone_numbers module: scalar cold, scalar with a warm LRU memo, and the vectorised
+pandas entry point used at ingestion.
+
+Usage: python benchmark_phone_numbers.py [count]
+"""
+
+import sys
+import os
+import random
+import re
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+import phone_numbers
+from phone_numbers import canonical_phone_number, validate_phone_number, validate_phone_series
+
+FORMATS = ["0{}", "{}", "254{}", "+254{}", "whatsapp:+254{}", "+254 {} ", "+256{}", "0{}.0"]
+
+
+def legacy_validate_phone_number(phone):
+    phone = re.sub(r'\D', '', str(phone))
+    if len(phone) == 9 and phone.startswith('7'):
+        phone = '254' + phone
+    elif len(phone) == 10 and phone.startswith('07'):
+        phone = '254' + phone[1:]
+    if len(phone) >= 10 and phone.isdigit():
+        return phone
+    return None
+
+
+def legacy_normalize_phone_number(phone_number):
+    digits_only = ''.join(filter(str.isdigit, phone_number))
+    if digits_only.startswith('254'):
+        return '+' + digits_only
+    elif digits_only.startswith('0') and len(digits_only) == 10:
+        return '+254' + digits_only[1:]
+    elif len(digits_only) == 9:
+        return '+254' + digits_only
+    return '+' + digits_only
+
+
+def legacy_variations(phone_number):
+    normalized = legacy_normalize_phone_number(phone_number)
+    digits_only = ''.join(filter(str.isdigit, normalized))
+    return list(set([
+        normalized, digits_only,
+        '0' + digits_only[3:] if digits_only.startswith('254') else normalized,
+        digits_only[3:] if digits_only.startswith('254') else normalized,
+        'whatsapp:' + normalized,
+    ]))
+
+
+def generate_numbers(count, distinct, seed=11):
+    rng = random.Random(seed)
+    pool = [rng.choice(FORMATS).format(f"7{rng.randint(10000000, 99999999)}") for _ in range(distinct)]
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def rate(function, numbers):
+    start = time.perf_counter()
+    for number in numbers:
+        function(number)
+    return len(numbers) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    # Replies repeat a small set of senders; a contact sheet is mostly distinct numbers
+    replies = generate_numbers(count, distinct=2000)
+    sheet = generate_numbers(count, distinct=count)
+
+    print(f"\n📊 Numbers normalised per second ({count:,} numbers)")
+    print(f"   legacy validate_phone_number (regex):       {rate(legacy_validate_phone_number, sheet):>12,.0f}")
+    print(f"   legacy normalize_phone_number (filter):     {rate(legacy_normalize_phone_number, sheet):>12,.0f}")
+    print(f"   legacy get_phone_number_variations:         {rate(legacy_variations, replies):>12,.0f}")
+
+    phone_numbers._parse_cached.cache_clear()
+    print(f"   validate_phone_number, distinct numbers:    {rate(validate_phone_number, sheet):>12,.0f}")
+    phone_numbers._parse_cached.cache_clear()
+    print(f"   canonical_phone_number, repeated senders:   {rate(canonical_phone_number, replies):>12,.0f}")
+
+    series = pd.Series(sheet)
+    start = time.perf_counter()
+    validate_phone_series(series)
+    print(f"   validate_phone_series (pandas, ingestion):  {count / (time.perf_counter() - start):>12,.0f}")
+
+    # Contact sheet parsing as parse_excel_file did it (iterrows) and does it now
+    df = pd.DataFrame({'phone': sheet, 'name': 'Jane', 'city': 'Nairobi'})
+    start = time.perf_counter()
+    for _, row in df.iterrows():
+        legacy_validate_phone_number(row['phone'])
+    legacy_rows = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    valid = df.assign(phone=validate_phone_series(df['phone']))
+    valid[valid['phone'].notna()].to_dict('records')
+    print(f"\n   contact sheet rows/s, iterrows + regex:      {legacy_rows:>12,.0f}")
+    print(f"   contact sheet rows/s, series + to_dict:     {count / (time.perf_counter() - start):>12,.0f}")
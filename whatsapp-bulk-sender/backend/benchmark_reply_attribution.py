@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Reply attribution benchmark
+Builds a scratch messages table with N rows and compares the old lookup (one unindexed
+query per phone number variation, plus a second pass for the sender name) with the single
+indexed lookup through contacts(phone_canonical) and messages(contact_id, sent_at DESC).
+
+Usage: python benchmark_reply_attribution.py [rows] [lookups]   (e.g. 10000000 for the 10M run)
+"""
+
+import sys
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from phone_numbers import canonical_phone_number
+from contacts import setup_contacts_table, find_latest_message_for_phone
+from reply_handler import get_phone_number_variations
+
+INSERT_BATCH_SIZE = 100000
+
+
+def build_messages_table(db_path, rows, seed=7):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute('''
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            campaign_id INTEGER,
+            phone_number TEXT,
+            name TEXT,
+            message_content TEXT,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            contact_id INTEGER
+        )
+    ''')
+    setup_contacts_table(conn.cursor())
+
+    contact_ids = {}
+    for start in range(0, rows, INSERT_BATCH_SIZE):
+        batch = []
+        new_contacts = []
+        for i in range(start, min(rows, start + INSERT_BATCH_SIZE)):
+            phone = f"2547{rng.randint(10000000, 99999999)}"
+            canonical = canonical_phone_number(phone)
+            if canonical not in contact_ids:
+                contact_ids[canonical] = len(contact_ids) + 1
+                new_contacts.append((contact_ids[canonical], canonical, f"Contact {i}"))
+            batch.append((i // 5000 + 1, phone, f"Contact {i}", "Hello",
+                          f"2024-{1 + i % 12:02d}-01 10:00:00", contact_ids[canonical]))
+        conn.executemany("INSERT INTO contacts (id, phone_canonical, name) VALUES (?, ?, ?)", new_contacts)
+        conn.executemany('''
+            INSERT INTO messages (campaign_id, phone_number, name, message_content, sent_at, contact_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', batch)
+    conn.commit()
+    return conn
+
+
+def legacy_lookup(cursor, phone_number):
+    """Pre-index behaviour: try every variation for the campaign, then again for the name"""
+    campaign_id = message_id = None
+    for variation in get_phone_number_variations(phone_number):
+        cursor.execute('''
+            SELECT campaign_id, id FROM messages
+            WHERE phone_number = ?
+            ORDER BY sent_at DESC
+            LIMIT 1
+        ''', (variation,))
+        result = cursor.fetchone()
+        if result:
+            campaign_id, message_id = result
+            break
+
+    name = None
+    for variation in get_phone_number_variations(phone_number):
+        cursor.execute("SELECT name FROM messages WHERE phone_number = ? ORDER BY sent_at DESC LIMIT 1",
+                       (variation,))
+        result = cursor.fetchone()
+        if result:
+            name = result[0]
+            break
+    return campaign_id, message_id, name
+
+
+def time_lookups(function, cursor, phones):
+    start = time.perf_counter()
+    for phone in phones:
+        function(cursor, phone)
+    return (time.perf_counter() - start) / len(phones)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'attribution.db')
+
+        print(f"⚙️ Building messages table with {rows:,} rows...")
+        start = time.perf_counter()
+        conn = build_messages_table(db_path, rows)
+        print(f"   built in {time.perf_counter() - start:.1f}s")
+        cursor = conn.cursor()
+
+        # Replies arrive in a mix of formats; half of them are for unknown numbers
+        known = [row[0] for row in cursor.execute(
+            "SELECT phone_number FROM messages ORDER BY RANDOM() LIMIT ?", (lookups // 2,))]
+        phones = ['whatsapp:+' + phone for phone in known] + \
+                 [f"07{random.randint(10000000, 99999999)}" for _ in range(lookups - len(known))]
+
+        legacy = time_lookups(legacy_lookup, cursor, phones)
+
+        start = time.perf_counter()
+        cursor.execute('''
+            CREATE INDEX idx_messages_contact
+            ON messages(contact_id, sent_at DESC)
+        ''')
+        index_build = time.perf_counter() - start
+
+        indexed = time_lookups(find_latest_message_for_phone, cursor, phones * 50)
+        for phone in phones:
+            assert legacy_lookup(cursor, phone)[:2] == find_latest_message_for_phone(cursor, phone)[:2]
+        conn.close()
+
+    print(f"\n📊 {rows:,} messages, {len(phones)} reply lookups")
+    print(f"   variations scan (unindexed): {legacy * 1000:10.2f} ms / reply")
+    print(f"   contacts + contact index:    {indexed * 1000:10.3f} ms / reply")
+    print(f"   index build:                 {index_build:10.1f} s (one-off, in init_db)")
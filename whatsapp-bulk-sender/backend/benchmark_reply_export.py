@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Reply export benchmark
+Fills a replies table with N rows, then exports all of them three ways: the previous download
+(DataFrame, openpyxl workbook in memory, a pass over every cell to size columns), the write-only
+XLSX export, and the streamed CSV. Reports wall time and peak Python memory (tracemalloc) for each.
+
+Usage: python benchmark_reply_export.py [replies]
+"""
+
+import sys
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from io import BytesIO
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = 'yes no thanks when where price stop interested call me later please more info asante sawa'.split()
+
+
+def build_replies(count):
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn.execute("INSERT INTO campaigns (id, name, message_template) VALUES ('c1', 'Launch', 'Hi {name}')")
+    rng = random.Random(5)
+    start = datetime(2026, 1, 1)
+    conn.executemany('''
+        INSERT INTO replies (phone_number, sender_name, message_content, received_at, campaign_id,
+                             sentiment, reply_type, is_opt_out)
+        VALUES (?, ?, ?, ?, 'c1', ?, 'text', ?)
+    ''', ((f'2547{i:08d}', f'Customer {i}', ' '.join(rng.choices(WORDS, k=rng.randint(1, 25))),
+           (start + timedelta(seconds=i * 7)).strftime('%Y-%m-%d %H:%M:%S'),
+           rng.choice(['positive', 'negative', 'neutral', 'question']), int(rng.random() < 0.02))
+          for i in range(count)))
+    conn.commit()
+    return conn
+
+
+def previous_export(conn):
+    """The download as it was: whole result set into a DataFrame, then every cell visited for widths"""
+    import pandas as pd
+
+    cursor = conn.execute('''
+        SELECT r.sender_name as "Contact Name", r.phone_number as "Phone Number",
+               r.message_content as "Reply Message", r.received_at as "Reply Date & Time",
+               c.name as "Campaign Name", r.sentiment as "Sentiment", r.reply_type as "Reply Type",
+               CASE WHEN r.is_opt_out = 1 THEN 'Yes' ELSE 'No' END as "Opted Out"
+        FROM replies r LEFT JOIN campaigns c ON r.campaign_id = c.id
+        ORDER BY r.received_at DESC
+    ''')
+    rows = cursor.fetchall()
+    df = pd.DataFrame(rows, columns=[description[0] for description in cursor.description])
+    df['Reply Date & Time'] = pd.to_datetime(df['Reply Date & Time']).dt.strftime('%Y-%m-%d %H:%M:%S')
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='WhatsApp Replies', index=False)
+        worksheet = writer.sheets['WhatsApp Replies']
+        for column in worksheet.columns:
+            max_length = max(len(str(cell.value)) for cell in column)
+            worksheet.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
+    return output.tell()
+
+
+def xlsx_export(conn):
+    from reply_export import iter_export_rows, write_xlsx
+    with open('replies.xlsx', 'wb') as f:
+        write_xlsx(iter_export_rows(conn, {}), f)
+    return os.path.getsize('replies.xlsx')
+
+
+def csv_export(conn):
+    from reply_export import stream_csv
+    return sum(len(chunk) for chunk in stream_csv({}))
+
+
+def measure(export, conn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = export(conn)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, size
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from app import init_db
+        from reply_handler import setup_replies_database
+        init_db()
+        setup_replies_database()
+
+        print(f"⚙️ Creating {count:,} replies...")
+        conn = build_replies(count)
+        results = [(name, measure(export, conn)) for name, export in
+                   (('previous (DataFrame)', previous_export), ('write-only XLSX', xlsx_export),
+                    ('streamed CSV', csv_export))]
+        conn.close()
+        os.chdir('/')
+
+    print(f"\n📊 Exporting {count:,} replies (times include tracemalloc overhead)")
+    for name, (seconds, peak, size) in results:
+        print(f"   {name:<22} {seconds:7.2f}s   peak {peak / 2**20:8.1f} MiB   output {size / 2**20:6.1f} MiB")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Reply rollup benchmark
+Inserts N replies to 50 campaigns sent over 90 days (timing the insert cost the rollup
+triggers add), then compares the reply analytics counts (sentiment breakdown, opt-outs, last
+24 hours) computed from raw replies against the same counts from the hourly rollups. The gain
+depends on replies per rollup key, which the rollup row count shows.
+
+Usage: python benchmark_reply_rollups.py [replies] [repeats]
+"""
+
+import sys
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+SENTIMENTS = ['positive', 'positive_feedback', 'negative', 'neutral', 'question', 'desired_opt_out']
+
+
+def reply_rows(count):
+    """Replies arrive in the hours after their campaign goes out (mean 6h), like real traffic"""
+    rng = random.Random(11)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    sent_at = [now - timedelta(days=rng.uniform(0, 90)) for _ in range(50)]
+    for i in range(count):
+        campaign = rng.randint(0, 49)
+        received_at = min(now, sent_at[campaign] + timedelta(hours=rng.expovariate(1 / 6)))
+        sentiment = rng.choice(SENTIMENTS)
+        yield (f'2547{rng.randint(0, count):08d}', 'reply text', received_at.strftime('%Y-%m-%d %H:%M:%S'),
+               f'c{campaign}', sentiment, sentiment == 'desired_opt_out')
+
+
+def insert(conn, count):
+    start = time.perf_counter()
+    conn.executemany('''
+        INSERT INTO replies (phone_number, message_content, received_at, campaign_id, sentiment, is_opt_out)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', reply_rows(count))
+    conn.commit()
+    return time.perf_counter() - start
+
+
+def raw_counts(cursor, campaign_id):
+    where, params = ("WHERE campaign_id = ?", [campaign_id]) if campaign_id else ("", [])
+    cursor.execute(f"SELECT sentiment, COUNT(*) FROM replies {where} GROUP BY sentiment", params)
+    sentiments = dict(cursor.fetchall())
+    cursor.execute(f"SELECT COUNT(*) FROM replies {where + ' AND' if where else 'WHERE'} is_opt_out = 1", params)
+    opt_outs = cursor.fetchone()[0]
+    cursor.execute(f"SELECT COUNT(*) FROM replies {where + ' AND' if where else 'WHERE'} "
+                   "received_at >= datetime('now', '-24 hours')", params)
+    return sentiments, opt_outs, cursor.fetchone()[0]
+
+
+def rollup_counts(cursor, campaign_id):
+    from reply_rollups import rollup_where, replies_since
+    where, params = rollup_where(campaign_id)
+    cursor.execute(f"SELECT NULLIF(sentiment, ''), SUM(reply_count) FROM reply_rollups {where} GROUP BY sentiment",
+                   params)
+    sentiments = dict(cursor.fetchall())
+    cursor.execute(f"SELECT COALESCE(SUM(reply_count), 0) FROM reply_rollups "
+                   f"WHERE is_opt_out = 1 {'AND campaign_id = ?' if campaign_id else ''}", params)
+    opt_outs = cursor.fetchone()[0]
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=24)
+    return sentiments, opt_outs, replies_since(cursor, since, campaign_id)
+
+
+def timed(counts, cursor, repeats):
+    start = time.perf_counter()
+    for i in range(repeats):
+        result = counts(cursor, None if i % 2 == 0 else 'c7')
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from reply_handler import setup_replies_database
+        setup_replies_database()
+        conn = sqlite3.connect('whatsapp_campaigns.db')
+
+        print(f"⚙️ Inserting {count:,} replies...")
+        with_triggers = insert(conn, count)
+        conn.execute("DROP TRIGGER trg_reply_rollups_insert")
+        conn.execute("DROP TRIGGER trg_reply_rollups_delete")
+        without_triggers = insert(conn, count)
+        conn.execute("DELETE FROM replies WHERE id > ?", (count,))
+        conn.commit()
+
+        cursor = conn.cursor()
+        raw_ms, raw = timed(raw_counts, cursor, repeats)
+        rollup_ms, rolled = timed(rollup_counts, cursor, repeats)
+        rollup_rows = cursor.execute("SELECT COUNT(*) FROM reply_rollups").fetchone()[0]
+        conn.close()
+        os.chdir('/')
+
+    print(f"\n📊 {count:,} replies, {rollup_rows:,} rollup rows")
+    print(f"   insert without triggers   {count / without_triggers:10,.0f} replies/s")
+    print(f"   insert with triggers      {count / with_triggers:10,.0f} replies/s")
+    print(f"   analytics from replies    {raw_ms:8.2f} ms/request")
+    print(f"   analytics from rollups    {rollup_ms:8.2f} ms/request")
+    print(f"   same answer: {raw == rolled}")
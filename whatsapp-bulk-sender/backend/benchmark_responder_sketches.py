@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Unique responder benchmark
+Builds N replies from a pool of N/3 numbers across 50 campaigns and 90 days, then times unique
+responders overall and for one campaign with COUNT(DISTINCT phone_number) and with the merged
+HyperLogLog sketches, and reports the estimate's error. Also times add_responder, the per-reply
+cost store_reply now pays.
+
+Usage: python benchmark_responder_sketches.py [replies] [repeats]
+"""
+
+import sys
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from reply_handler import setup_replies_database
+        from responder_sketches import add_responder, count_responders, rebuild_responder_sketches
+        setup_replies_database()
+        conn = sqlite3.connect('whatsapp_campaigns.db')
+        cursor = conn.cursor()
+
+        print(f"⚙️ Creating {count:,} replies...")
+        rng = random.Random(2)
+        conn.executemany('''
+            INSERT INTO replies (phone_number, message_content, campaign_id, received_at)
+            VALUES (?, 'text', ?, date('2026-01-01', ?))
+        ''', ((f'2547{rng.randint(0, count // 3):08d}', f'c{rng.randint(0, 49)}', f'+{rng.randint(0, 89)} days')
+              for _ in range(count)))
+        start = time.perf_counter()
+        sketches = rebuild_responder_sketches(cursor)
+        rebuild_seconds = time.perf_counter() - start
+        conn.commit()
+
+        rows = []
+        for label, campaign_id in (('all campaigns', None), ('one campaign', 'c7')):
+            exact_ms, exact = timed(lambda: count_responders(cursor, campaign_id, exact=True), repeats)
+            sketch_ms, estimate = timed(lambda: count_responders(cursor, campaign_id), repeats)
+            rows.append((label, exact_ms, sketch_ms, exact, estimate))
+
+        start = time.perf_counter()
+        for i in range(5000):
+            add_responder(cursor, 'c7', '2026-02-01', f'2548{i:08d}')
+        add_us = (time.perf_counter() - start) / 5000 * 1e6
+        conn.rollback()
+        conn.close()
+        os.chdir('/')
+
+    print(f"\n📊 {count:,} replies, {sketches:,} sketches (rebuilt in {rebuild_seconds:.1f}s)")
+    for label, exact_ms, sketch_ms, exact, estimate in rows:
+        print(f"   {label:<14} COUNT(DISTINCT) {exact_ms:8.2f} ms   sketches {sketch_ms:8.2f} ms   "
+              f"exact {exact:,}  estimate {estimate:,} ({(estimate - exact) / exact:+.2%})")
+    print(f"   add_responder per reply   {add_us:8.1f} µs")
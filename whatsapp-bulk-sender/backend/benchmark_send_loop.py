@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Campaign send loop memory benchmark
+Builds one campaign with N pending messages and walks it the way process_campaign_task does,
+first with the old fetchall() of every pending row, then with the keyset-paged iterator.
+Reports time to the first message and the traced memory profile while walking the campaign.
+
+Usage: python benchmark_send_loop.py [messages] [page_size]
+"""
+
+import sys
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLES = 10
+
+
+def build_campaign(count):
+    from app import init_db, create_campaign_records
+
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    contacts = [{'phone': f'07{i:08d}', 'name': f'Customer {i}', 'city': 'Nairobi'} for i in range(count)]
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}, new arrivals in {city}!', 2, contacts)
+    conn.commit()
+    return conn
+
+
+def fetchall_messages(conn, campaign_id):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT m.id, c.phone_canonical, m.variables, m.message_content, c.name
+        FROM messages m
+        JOIN contacts c ON c.id = m.contact_id
+        WHERE m.campaign_id = ? AND m.status = 'pending'
+        ORDER BY m.id
+    ''', (campaign_id,))
+    return iter(cursor.fetchall())
+
+
+def profile(open_messages, count):
+    """Walk the messages; returns (seconds to first message, [(done, traced MB)], peak MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    messages = open_messages()
+    first = None
+    samples = []
+    for done, _ in enumerate(messages, 1):
+        if first is None:
+            first = time.perf_counter() - start
+        if done % max(1, count // SAMPLES) == 0:
+            samples.append((done, tracemalloc.get_traced_memory()[0] / 1e6))
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return first, samples, peak
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from celery_worker import iter_pending_messages
+
+        print(f"⚙️ Creating a campaign with {count:,} messages...")
+        conn = build_campaign(count)
+
+        runs = {
+            "fetchall": profile(lambda: fetchall_messages(conn, 'c1'), count),
+            f"pages of {page_size}": profile(lambda: iter_pending_messages(conn, 'c1', page_size), count),
+        }
+        conn.close()
+        os.chdir('/')
+
+    print(f"\n📊 Walking {count:,} pending messages")
+    for label, (first, samples, peak) in runs.items():
+        print(f"   {label:<14} first message after {first * 1000:8.1f} ms   peak {peak:7.1f} MB")
+        print("      traced MB: " + "  ".join(f"{done // 1000}k:{mb:.1f}" for done, mb in samples))
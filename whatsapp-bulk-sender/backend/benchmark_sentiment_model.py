@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for the local sentiment model
+Trains on the seed set and times single-message predictions on CPU
+"""
+
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sentiment_model import LocalSentimentModel, load_training_data, extract_features
+from benchmark_keyword_matcher import generate_corpus
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    messages, labels, weights = load_training_data('whatsapp_campaigns.db')
+    print(f"🧠 Training on {len(messages)} messages...")
+    start = time.perf_counter()
+    model = LocalSentimentModel().fit(messages, labels, weights)
+    print(f"   Trained in {time.perf_counter() - start:.2f}s\n")
+
+    corpus = generate_corpus(size)
+
+    for label, func in [('Feature extraction', extract_features), ('Full prediction', model.predict)]:
+        timings = []
+        for message in corpus:
+            start = time.perf_counter()
+            func(message)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"{label:20s} p50 {percentile(timings, 0.5) * 1e6:7.1f} µs   "
+              f"p99 {percentile(timings, 0.99) * 1e6:7.1f} µs   "
+              f"{size / sum(timings):10,.0f} msgs/sec")
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite
+Times the hot paths of ingestion, sending and reply handling on generated datasets of
+increasing size, asv-style: each case is timed --repeat times per size and the best and median
+runs are kept, with the best run per item so sizes can be compared with each other.
+
+  parse_excel_file              contact sheet (.xlsx) of N rows
+  validate_phone_number         N distinct numbers in mixed formats
+  personalize_message           N contacts through a three-placeholder template
+  normalize_phone_number        N reply senders (repeats, as inbound traffic has)
+  get_phone_number_variations   N reply senders
+  detect_reply_sentiment_basic  N reply texts
+  is_opt_out_message            N reply texts
+  create_campaign_records       a campaign of N contacts inserted into a fresh database
+  api_campaigns                 GET /api/campaigns over N messages in 20 campaigns
+  api_replies_paging            GET /api/replies, first, middle and last page of N replies
+
+Results are written to benchmark-results/<commit>-<time>.json. --compare prints the change
+between two result files (the two newest when none are given) and exits with 1 when a case got
+slower by more than --threshold, so a commit can be checked against the one before it.
+
+Usage: python benchmark_suite.py [--quick] [--repeat 5] [--only validate_phone_number,api_campaigns]
+       python benchmark_suite.py --compare [benchmark-results/<before>.json benchmark-results/<after>.json]
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, Tuple
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from load_test import REPLY_BODIES, git_commit
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark-results')
+FORMATS = ["0{}", "{}", "254{}", "+254{}", "whatsapp:+254{}", "+254 {} ", "0{}.0"]
+TEMPLATE = 'Hi {name}, the {product} you liked is back in {city}. Reply STOP to opt out.'
+
+# name -> (sizes, quick sizes, prepare); prepare(size) returns (run, reset), reset running untimed before each run
+CASES: Dict[str, Tuple[Tuple[int, ...], Tuple[int, ...], Callable]] = {}
+
+
+def case(sizes, quick):
+    def register(prepare):
+        CASES[prepare.__name__.replace('bench_', '')] = (sizes, quick, prepare)
+        return prepare
+    return register
+
+
+def generate_numbers(count, distinct, seed=11):
+    rng = random.Random(seed)
+    pool = [rng.choice(FORMATS).format(f"7{rng.randint(10000000, 99999999)}") for _ in range(distinct)]
+    return pool if distinct == count else [rng.choice(pool) for _ in range(count)]
+
+
+def contacts(count, seed=12):
+    rng = random.Random(seed)
+    return [{'phone': f'07{i:08d}', 'name': f'Customer {i}', 'city': rng.choice(['Nairobi', 'Mombasa', 'Kisumu']),
+             'product': rng.choice(['lace set', 'silk robe', 'cotton bra'])} for i in range(count)]
+
+
+def reply_texts(count, seed=13):
+    rng = random.Random(seed)
+    return [rng.choice(REPLY_BODIES) for _ in range(count)]
+
+
+def fresh_database():
+    from app import init_db
+    from reply_handler import setup_replies_database
+    if os.path.exists('whatsapp_campaigns.db'):
+        os.remove('whatsapp_campaigns.db')
+    init_db()
+    setup_replies_database()
+
+
+def each(function, items):
+    def run():
+        for item in items:
+            function(item)
+    return run
+
+
+@case(sizes=(1000, 10000, 50000), quick=(100, 1000))
+def bench_parse_excel_file(size):
+    from app import parse_excel_file
+    path = f'contacts-{size}.xlsx'
+    pd.DataFrame(contacts(size)).to_excel(path, index=False)
+    return (lambda: parse_excel_file(path)), None
+
+
+@case(sizes=(1000, 10000, 100000), quick=(1000, 10000))
+def bench_validate_phone_number(size):
+    import phone_numbers as module
+    run = each(module.validate_phone_number, generate_numbers(size, size))
+    return run, module._parse_cached.cache_clear
+
+
+@case(sizes=(1000, 10000, 100000), quick=(1000, 10000))
+def bench_personalize_message(size):
+    from app import personalize_message
+    rows = contacts(size)
+    return (lambda: [personalize_message(TEMPLATE, contact) for contact in rows]), None
+
+
+@case(sizes=(1000, 10000, 100000), quick=(1000, 10000))
+def bench_normalize_phone_number(size):
+    import phone_numbers as module
+    from reply_handler import normalize_phone_number
+    return each(normalize_phone_number, generate_numbers(size, max(1, size // 50))), module._parse_cached.cache_clear
+
+
+@case(sizes=(1000, 10000, 100000), quick=(1000, 10000))
+def bench_get_phone_number_variations(size):
+    import phone_numbers as module
+    from reply_handler import get_phone_number_variations
+    return each(get_phone_number_variations, generate_numbers(size, max(1, size // 50))), module._parse_cached.cache_clear
+
+
+@case(sizes=(1000, 10000, 100000), quick=(1000, 10000))
+def bench_detect_reply_sentiment_basic(size):
+    from reply_handler import detect_reply_sentiment_basic
+    return each(detect_reply_sentiment_basic, reply_texts(size)), None
+
+
+@case(sizes=(1000, 10000, 100000), quick=(1000, 10000))
+def bench_is_opt_out_message(size):
+    from reply_handler import is_opt_out_message
+    return each(is_opt_out_message, reply_texts(size)), None
+
+
+@case(sizes=(1000, 10000, 100000), quick=(1000, 10000))
+def bench_create_campaign_records(size):
+    from app import create_campaign_records
+    rows = contacts(size)
+
+    def run():
+        conn = sqlite3.connect('whatsapp_campaigns.db')
+        create_campaign_records(conn.cursor(), 'bench', 'Benchmark', TEMPLATE, 0, rows)
+        conn.commit()
+        conn.close()
+    return run, fresh_database
+
+
+@case(sizes=(10000, 100000, 500000), quick=(1000, 10000))
+def bench_api_campaigns(size):
+    from app import app, create_campaign_records
+    fresh_database()
+    rng = random.Random(14)
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    rows = contacts(size)
+    per_campaign = max(1, size // 20)
+    for i in range(0, size, per_campaign):
+        create_campaign_records(conn.cursor(), f'bench-{i}', f'Campaign {i}', TEMPLATE, 0, rows[i:i + per_campaign])
+    statuses = ['sent', 'delivered', 'read', 'failed', 'pending']
+    conn.executemany("UPDATE messages SET status = ? WHERE id = ?",
+                     [(rng.choice(statuses), message_id) for message_id in range(1, size + 1)])
+    conn.commit()
+    conn.close()
+    client = app.test_client()
+    return (lambda: client.get('/api/campaigns').get_json()), None
+
+
+@case(sizes=(10000, 100000, 500000), quick=(1000, 10000))
+def bench_api_replies_paging(size):
+    from app import app
+    fresh_database()
+    rng = random.Random(15)
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn.execute("INSERT INTO campaigns (id, name, message_template, total_contacts, rate_limit, status) "
+                 "VALUES ('bench', 'Benchmark', 'Hi', 0, 0, 'completed')")
+    senders = generate_numbers(size, max(1, size // 10))
+    conn.executemany('''
+        INSERT INTO replies (phone_number, message_content, received_at, campaign_id, sentiment, confidence_score)
+        VALUES (?, ?, datetime('2026-01-01', '+' || ? || ' seconds'), 'bench', ?, 0.6)
+    ''', [(senders[i], rng.choice(REPLY_BODIES), i, rng.choice(['interested', 'question', 'neutral']))
+          for i in range(size)])
+    conn.commit()
+    conn.close()
+    client = app.test_client()
+    pages = (1, size // 100 or 1, (size + 49) // 50)
+    return (lambda: [client.get(f'/api/replies?page={page}&per_page=50').get_json() for page in pages]), None
+
+
+def time_case(prepare, size, repeat) -> Dict:
+    run, reset = prepare(size)
+    timings = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {'size': size, 'best_s': round(best, 6), 'median_s': round(statistics.median(timings), 6),
+            'per_item_us': round(best / size * 1e6, 4), 'repeat': repeat}
+
+
+def run_suite(names, quick, repeat) -> Dict:
+    results = {'created_at': datetime.now().isoformat(timespec='seconds'), **git_commit(),
+               'python': sys.version.split()[0], 'quick': quick, 'cases': {}}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for name in names:
+                sizes, quick_sizes, prepare = CASES[name]
+                results['cases'][name] = []
+                for size in (quick_sizes if quick else sizes):
+                    result = time_case(prepare, size, repeat)
+                    results['cases'][name].append(result)
+                    print(f"   {name:<30} {size:>8,}  best {result['best_s'] * 1000:10.2f} ms  "
+                          f"median {result['median_s'] * 1000:10.2f} ms  {result['per_item_us']:9.3f} µs/item")
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def compare(before: Dict, after: Dict, threshold: float) -> int:
+    """Prints the change per case and size; returns how many got slower than threshold allows"""
+    print(f"\n📊 {before['commit']} → {after['commit']}{' (uncommitted changes)' if after['dirty'] else ''}")
+    regressions = 0
+    for name, rows in after['cases'].items():
+        old = {row['size']: row for row in before['cases'].get(name, [])}
+        for row in rows:
+            if row['size'] not in old:
+                continue
+            change = row['best_s'] / old[row['size']]['best_s'] - 1
+            flag = ''
+            if change > threshold:
+                regressions += 1
+                flag = '  ⚠️ slower'
+            elif change < -threshold:
+                flag = '  ✅ faster'
+            print(f"   {name:<30} {row['size']:>8,}  {old[row['size']]['best_s'] * 1000:10.2f} → "
+                  f"{row['best_s'] * 1000:10.2f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+
+def latest_results(count: int = 2):
+    return sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')), key=os.path.getmtime)[-count:]
+
+
+def load(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths on growing datasets')
+    parser.add_argument('--quick', action='store_true', help='small sizes only, for a fast check')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case and size (the best is kept)')
+    parser.add_argument('--only', help='comma-separated case names')
+    parser.add_argument('--compare', nargs='*', metavar='RESULTS', help='two result files (default: the two newest)')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        paths = args.compare or latest_results()
+        if len(paths) != 2:
+            sys.exit("❌ Need two result files to compare")
+        sys.exit(1 if compare(load(paths[0]), load(paths[1]), args.threshold) else 0)
+
+    names = args.only.split(',') if args.only else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        sys.exit(f"❌ Unknown cases: {', '.join(unknown)} (have {', '.join(CASES)})")
+
+    print(f"⚙️ Benchmarking {len(names)} cases, best of {args.repeat}")
+    results = run_suite(names, args.quick, args.repeat)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{results['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 {path}")
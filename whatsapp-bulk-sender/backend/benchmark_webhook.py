@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Webhook latency benchmark
+Posts synthetic replies to /webhook/whatsapp through the Flask test client against a scratch
+database and reports p50/p99 handling time. Run without GEMINI_API_KEY to measure the
+offline path (local model + response catalogue).
+"""
+
+import sys
+import os
+import random
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_REPLIES = [
+    "How much is the lace set?", "Bei gani ya bra?", "Asante sana!", "I love it, thank you",
+    "What sizes do you have", "Nataka kununua hii", "ok", "Sawa", "The size was wrong",
+    "Nĩ wega mũno", "Erokamano ahinya", "Do you deliver to Kisumu?", "STOP",
+]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rng = random.Random(7)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+
+        from app import app, init_db
+        from reply_handler import setup_replies_database
+        from opt_out_manager import setup_opt_out_tables
+        init_db()
+        setup_replies_database()
+        setup_opt_out_tables()
+
+        client = app.test_client()
+        timings = []
+        for i in range(count):
+            payload = {
+                'From': f'whatsapp:+2547{rng.randint(10000000, 99999999)}',
+                'Body': rng.choice(SAMPLE_REPLIES),
+                'NumMedia': '0',
+            }
+            start = time.perf_counter()
+            client.post('/webhook/whatsapp', data=payload)
+            timings.append(time.perf_counter() - start)
+
+        os.chdir('/')
+
+    timings.sort()
+    print(f"\n📊 {count} webhook calls: "
+          f"p50 {percentile(timings, 0.5) * 1000:.1f} ms   "
+          f"p99 {percentile(timings, 0.99) * 1000:.1f} ms   "
+          f"max {timings[-1] * 1000:.1f} ms")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Campaign Control
+Pause / resume / cancel for campaigns that are already dispatching. Redis holds a cheap flag the
+dispatcher checks between batches; the campaigns table keeps the same state as the fallback.
+A campaign stays 'running' while it still has messages to send later (held by quiet hours,
+waiting for a retry, or failed and not yet classified), so it can still be paused or cancelled;
+it is completed once nothing is left.
+"""
+
+import logging
+import os
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+import redis
+
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+CONTROL_REDIS_URL = os.getenv('CONTROL_REDIS_URL', os.getenv('CELERY_BROKER_URL', 'redis://localhost:6380/0'))
+CONTROL_ACTIONS = ('pause', 'cancel')
+
+# Messages a campaign may still send
+OUTSTANDING_MESSAGES = '''
+    m.status IN ('pending', 'sending', 'deferred', 'retry_scheduled')
+    OR (m.status = 'failed' AND m.retry_class IS NULL)
+'''
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(CONTROL_REDIS_URL, decode_responses=True,
+                                             socket_connect_timeout=0.5, socket_timeout=0.5)
+    return _redis_client
+
+
+def control_key(campaign_id: str) -> str:
+    return f"campaign:{campaign_id}:control"
+
+
+def set_campaign_control(cursor, campaign_id: str, action: Optional[str]):
+    """Record a control action for the dispatcher ('pause', 'cancel'), or clear it with None"""
+    cursor.execute("UPDATE campaigns SET control = ? WHERE id = ?", (action, campaign_id))
+    try:
+        if action:
+            get_redis().set(control_key(campaign_id), action)
+        else:
+            get_redis().delete(control_key(campaign_id))
+    except redis.RedisError as e:
+        log_event(logger, 'campaign_control_redis_unavailable', logging.WARNING, campaign_id=campaign_id,
+                  action=action, error=str(e))
+
+
+def get_campaign_control(cursor, campaign_id: str) -> Optional[str]:
+    """The pending control action for a campaign: one Redis GET, or a primary-key read without Redis"""
+    try:
+        return get_redis().get(control_key(campaign_id))
+    except redis.RedisError:
+        cursor.execute("SELECT control FROM campaigns WHERE id = ?", (campaign_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def apply_campaign_control(cursor, campaign_id: str, action: str):
+    """Stop a campaign: paused campaigns keep their pending messages, cancelled ones drop them"""
+    if action == 'pause':
+        cursor.execute("UPDATE campaigns SET status = 'paused' WHERE id = ?", (campaign_id,))
+        log_event(logger, 'campaign_paused', campaign_id=campaign_id)
+    elif action == 'cancel':
+        cursor.execute('''
+            UPDATE messages SET status = 'cancelled'
+            WHERE campaign_id = ? AND status IN ('pending', 'deferred', 'retry_scheduled')
+        ''', (campaign_id,))
+        cursor.execute('''
+            UPDATE campaigns SET status = 'cancelled', completed_at = ?
+            WHERE id = ?
+        ''', (datetime.now(), campaign_id))
+        log_event(logger, 'campaign_cancelled', campaign_id=campaign_id)
+
+
+def has_dispatch_work(cursor, campaign_id: str, ignore_ids: Iterable[int] = ()) -> bool:
+    """
+    Whether a dispatcher may be working on the campaign: it has messages pending or mid-send,
+    other than ignore_ids
+    """
+    ignore_ids = list(ignore_ids)
+    cursor.execute(f'''
+        SELECT 1 FROM messages
+        WHERE campaign_id = ? AND status IN ('pending', 'sending') AND id NOT IN ({','.join('?' * len(ignore_ids))})
+        LIMIT 1
+    ''', [campaign_id] + ignore_ids)
+    return cursor.fetchone() is not None
+
+
+def complete_finished_campaigns(cursor, campaign_id: Optional[str] = None) -> List[str]:
+    """Mark running campaigns (or just campaign_id) with no outstanding messages completed"""
+    query = f'''
+        SELECT cp.id FROM campaigns cp
+        WHERE cp.status = 'running'
+          AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.campaign_id = cp.id AND ({OUTSTANDING_MESSAGES}))
+    '''
+    params = []
+    if campaign_id is not None:
+        query += ' AND cp.id = ?'
+        params.append(campaign_id)
+    cursor.execute(query, params)
+    finished = [row[0] for row in cursor.fetchall()]
+
+    cursor.executemany('''
+        UPDATE campaigns SET status = 'completed', completed_at = ?
+        WHERE id = ? AND status = 'running'
+    ''', [(datetime.now(), finished_id) for finished_id in finished])
+    return finished
@@ -3,14 +3,34 @@ from celery import Celery
 import sqlite3
 import time
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
+import logging
+from celery.signals import setup_logging as celery_setup_logging, worker_init, worker_ready
 from dotenv import load_dotenv
+from twilio.base.exceptions import TwilioRestException
 from twilio.rest import Client
 
+from message_templates import PERSIST_RENDERED_MESSAGES, compile_template, render_message
+from campaign_control import (CONTROL_ACTIONS, get_campaign_control, apply_campaign_control,
+                              complete_finished_campaigns, has_dispatch_work)
+from delivery_status import drain_status_queue
+from retry_scheduler import classify_error, schedule_failed_messages, pop_due_retries, release_due_retries
+from scheduler import quiet_hours_end, defer_message, start_due_campaigns, release_deferred_messages
+from rate_limiter import provider_limiter
+from opt_out_manager import dispatch_opt_out_confirmations
+from metrics import WORKER_METRICS_PORT, MULTIPROC_DIR, MESSAGES, PROVIDER_LATENCY, clear_process_files, start_http_server
+from send_ledger import (SEND_CLAIM_TIMEOUT, idempotency_key, tag_status_callback, claim_message,
+                         record_send_result, release_message, reconcile_stuck_messages)
+from structured_logging import setup_logging, log_context, log_event, log_message_event
+from db import connect
+from profiling import profile_task
+
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Create Celery instance
 celery_app = Celery('whatsapp_sender')
 celery_app.config_from_object({
@@ -29,87 +49,263 @@ celery_app.config_from_object({
     'broker_connection_retry_on_startup': True,
 })
 
+# Pending messages read per page by the campaign dispatcher
+CAMPAIGN_PAGE_SIZE = int(os.getenv('CAMPAIGN_PAGE_SIZE', '500'))
+# Messages sent between checkpoints / pause-cancel checks
+CAMPAIGN_CONTROL_BATCH = int(os.getenv('CAMPAIGN_CONTROL_BATCH', '20'))
+# Seconds between drains of the delivery status callback queue
+STATUS_DRAIN_INTERVAL = float(os.getenv('STATUS_DRAIN_INTERVAL', '5'))
+# Seconds between passes of the failed-message retry scheduler
+RETRY_POLL_INTERVAL = float(os.getenv('RETRY_POLL_INTERVAL', '30'))
+# Seconds between scheduler ticks (scheduled campaigns, quiet hours, opt-out confirmations)
+SCHEDULER_TICK_INTERVAL = float(os.getenv('SCHEDULER_TICK_INTERVAL', '15'))
+# Seconds between checks of the reply rollups against raw replies
+ROLLUP_VERIFY_INTERVAL = float(os.getenv('ROLLUP_VERIFY_INTERVAL', '86400'))
+# Seconds between incremental Parquet analytics exports; 0 leaves them to the CLI
+ANALYTICS_EXPORT_INTERVAL = float(os.getenv('ANALYTICS_EXPORT_INTERVAL', '0'))
+# Seconds between campaign progress lines in the log
+LOG_PROGRESS_INTERVAL = float(os.getenv('LOG_PROGRESS_INTERVAL', '30'))
+# Queue of the periodic tasks below. Its own worker serves it (docker-compose.yml: celery-periodic),
+# so status drains, retries and scheduler ticks never wait behind a campaign run on the solo pool
+PERIODIC_QUEUE = os.getenv('PERIODIC_QUEUE', 'periodic')
+# Queue of the background jobs someone is waiting on (reply exports, sentiment backfills). Its own
+# worker serves it (docker-compose.yml: celery-jobs), so a job asked for from the dashboard doesn't
+# sit behind a campaign run, and an hours-long backfill doesn't hold up the periodic tasks
+JOBS_QUEUE = os.getenv('JOBS_QUEUE', 'jobs')
+
+celery_app.conf.beat_schedule = {
+    'drain-delivery-status': {
+        'task': 'celery_worker.drain_delivery_status_task',
+        'schedule': STATUS_DRAIN_INTERVAL,
+    },
+    'retry-failed-messages': {
+        'task': 'celery_worker.retry_failed_messages_task',
+        'schedule': RETRY_POLL_INTERVAL,
+    },
+    'scheduler-tick': {
+        'task': 'celery_worker.scheduler_tick_task',
+        'schedule': SCHEDULER_TICK_INTERVAL,
+    },
+    'verify-reply-rollups': {
+        'task': 'celery_worker.verify_reply_rollups_task',
+        'schedule': ROLLUP_VERIFY_INTERVAL,
+    },
+}
+if ANALYTICS_EXPORT_INTERVAL > 0:
+    celery_app.conf.beat_schedule['analytics-export'] = {
+        'task': 'celery_worker.analytics_export_task',
+        'schedule': ANALYTICS_EXPORT_INTERVAL,
+    }
+# Only a running beat process (celery -A celery_worker beat) sends these
+celery_app.conf.task_routes = {
+    entry['task']: {'queue': PERIODIC_QUEUE} for entry in celery_app.conf.beat_schedule.values()
+}
+celery_app.conf.task_routes.update({
+    'celery_worker.export_replies_task': {'queue': JOBS_QUEUE},
+    'celery_worker.backfill_sentiment_task': {'queue': JOBS_QUEUE},
+})
+
+def iter_pending_messages(conn, campaign_id, page_size=None, after_id=0):
+    """
+    Yield a campaign's pending messages in keyset pages over messages.id, so memory stays flat
+    however big the campaign is. Pages are found through idx_messages_campaign_status, and
+    after_id (the dispatcher checkpoint) skips everything already worked through.
+    """
+    page_size = page_size or CAMPAIGN_PAGE_SIZE
+    cursor = conn.cursor()
+    last_id = after_id
+    
+    while True:
+        cursor.execute('''
+            SELECT m.id, c.phone_canonical, m.variables, m.message_content, c.name
+            FROM messages m
+            JOIN contacts c ON c.id = m.contact_id
+            WHERE m.campaign_id = ? AND m.status = 'pending' AND m.id > ?
+            ORDER BY m.id
+            LIMIT ?
+        ''', (campaign_id, last_id, page_size))
+        page = cursor.fetchall()
+        if not page:
+            return
+        
+        yield from page
+        last_id = page[-1][0]
+
+def iter_campaign_backlog(conn, campaign_id, after_id=0):
+    """
+    Pending messages from the checkpoint on, then more passes from the start for messages released
+    back to pending behind the walk (quiet hours over, retries due) until a pass finds nothing
+    """
+    while True:
+        found = False
+        for row in iter_pending_messages(conn, campaign_id, after_id=after_id):
+            found = True
+            yield row
+        if not found and after_id == 0:
+            return
+        after_id = 0
+
+def dispatch_message(conn, campaign_id, message_id, phone, name, content, rendered, api_key):
+    """
+    Claim, send and record one message. Returns whether it was sent, or None when it wasn't
+    attempted: the recipient is in quiet hours (the message is deferred), or it was no longer
+    pending (another worker claimed it first).
+    """
+    cursor = conn.cursor()
+    
+    with log_context(campaign_id=campaign_id, message_id=message_id):
+        send_after = quiet_hours_end(phone)
+        if send_after is not None:
+            defer_message(cursor, message_id, send_after)
+            conn.commit()
+            MESSAGES.labels(campaign_id, 'deferred', '').inc()
+            log_message_event(logger, 'message_deferred', send_after=send_after)
+            return None
+        
+        # Claimed and committed before the provider call, so a crash can't lead to a re-send
+        token = claim_message(conn, message_id)
+        if token is None:
+            return None
+        
+        try:
+            success, result = send_rate_limited(
+                phone, content, api_key, idempotency_key=idempotency_key(campaign_id, message_id)
+            )
+        except Exception as e:
+            success, result = False, str(e)
+        
+        try:
+            # The provider SID is kept so status callbacks can find the message
+            if success:
+                record_send_result(cursor, message_id, token, True,
+                                   message_content=content if PERSIST_RENDERED_MESSAGES else rendered,
+                                   provider_sid=result)
+                MESSAGES.labels(campaign_id, 'sent', '').inc()
+                log_message_event(logger, 'message_sent', provider_sid=result)
+            else:
+                record_send_result(cursor, message_id, token, False, result)
+                error_class = classify_error(result)[1]
+                MESSAGES.labels(campaign_id, 'failed', error_class).inc()
+                log_message_event(logger, 'message_failed', logging.WARNING, error=result, error_class=error_class)
+            conn.commit()
+        except Exception as e:
+            # The claim is settled now rather than left in 'sending' until a worker restart: a
+            # failure goes to the retry scheduler like any other; if this raises too, the
+            # message stays claimed for reconciliation
+            conn.rollback()
+            if success:
+                record_send_result(cursor, message_id, token, True,
+                                   message_content=content if PERSIST_RENDERED_MESSAGES else rendered,
+                                   provider_sid=result)
+            else:
+                record_send_result(cursor, message_id, token, False, result or f"Dispatch error: {e}")
+            conn.commit()
+            raise
+        return success
+
+def checkpoint_campaign(conn, campaign_id, last_message_id):
+    """Save dispatcher progress and return any pending control action"""
+    cursor = conn.cursor()
+    cursor.execute('UPDATE campaigns SET last_message_id = ? WHERE id = ?', (last_message_id, campaign_id))
+    conn.commit()
+    return get_campaign_control(cursor, campaign_id)
+
 @celery_app.task(bind=True, max_retries=3)
+@profile_task
 def process_campaign_task(self, campaign_id, api_key, rate_limit):
     """Process campaign messages with rate limiting and retry logic"""
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn = connect()
     cursor = conn.cursor()
     
     try:
+        cursor.execute('''
+            SELECT message_template, last_message_id, control FROM campaigns WHERE id = ?
+        ''', (campaign_id,))
+        message_template, checkpoint, control = cursor.fetchone()
+        
+        # Paused or cancelled before this task got to run
+        if control in CONTROL_ACTIONS:
+            apply_campaign_control(cursor, campaign_id, control)
+            conn.commit()
+            return
+        
+        # Messages a crashed run left mid-send are settled before anything is sent again
+        reconcile_stuck_messages(conn, find_sent_message, campaign_id=campaign_id)
+        
         # Update campaign status to running
         cursor.execute('''
             UPDATE campaigns 
-            SET status = 'running', started_at = ?
+            SET status = 'running', started_at = COALESCE(started_at, ?)
             WHERE id = ?
         ''', (datetime.now(), campaign_id))
         conn.commit()
         
-        # Get pending messages
+        # Template is compiled once; each message is rendered from its variables when sent
+        template = compile_template(message_template)
+        
         cursor.execute('''
-            SELECT id, phone_number, message_content, name
-            FROM messages 
+            SELECT COUNT(*) FROM messages
             WHERE campaign_id = ? AND status = 'pending'
-            ORDER BY id
         ''', (campaign_id,))
-        
-        messages = cursor.fetchall()
-        total_messages = len(messages)
+        total_messages = cursor.fetchone()[0]
         processed = 0
+        # Every row worked through counts towards the next control check, sent or not
+        seen = 0
         
-        print(f"Processing {total_messages} messages for campaign {campaign_id}")
+        log_event(logger, 'campaign_started', campaign_id=campaign_id, pending=total_messages)
+        progress_logged_at = time.monotonic()
         
-        for message_id, phone, content, name in messages:
+        # Pending messages are streamed a page at a time, not loaded up front
+        pending = iter_campaign_backlog(conn, campaign_id, after_id=checkpoint or 0)
+        for message_id, phone, variables, rendered, name in pending:
+            seen += 1
             try:
-                # Send WhatsApp message
-                success, error_msg = send_whatsapp_message(phone, content, api_key)
-                
-                if success:
-                    cursor.execute('''
-                        UPDATE messages 
-                        SET status = 'sent', sent_at = ?
-                        WHERE id = ?
-                    ''', (datetime.now(), message_id))
-                    print(f"✓ Message sent to {phone} ({name})")
-                else:
-                    cursor.execute('''
-                        UPDATE messages 
-                        SET status = 'failed', failed_at = ?, error_message = ?
-                        WHERE id = ?
-                    ''', (datetime.now(), error_msg, message_id))
-                    print(f"✗ Failed to send to {phone} ({name}): {error_msg}")
-                
-                conn.commit()
-                processed += 1
+                # Rows created before templates were stored once already hold their text
+                content = rendered if rendered is not None else render_message(template, variables)
                 
-                # Update progress
-                if processed % 10 == 0:  # Update every 10 messages
-                    print(f"Progress: {processed}/{total_messages} messages processed")
-                
-                # Rate limiting - wait between messages
-                time.sleep(rate_limit)
+                # Send WhatsApp message; deferred or already-claimed messages aren't waited on
+                if dispatch_message(conn, campaign_id, message_id, phone, name, content, rendered, api_key) is not None:
+                    processed += 1
+                    
+                    # Progress goes to the log on a timer, not per message
+                    if time.monotonic() - progress_logged_at >= LOG_PROGRESS_INTERVAL:
+                        progress_logged_at = time.monotonic()
+                        log_event(logger, 'campaign_progress', campaign_id=campaign_id,
+                                  processed=processed, pending=total_messages)
+                    
+                    # Rate limiting - wait between messages
+                    time.sleep(rate_limit)
                 
             except Exception as e:
+                # A message that was never claimed fails here for the retry scheduler; a claimed
+                # one was already settled by dispatch_message
                 error_msg = str(e)
-                cursor.execute('''
-                    UPDATE messages 
-                    SET status = 'failed', failed_at = ?, error_message = ?
-                    WHERE id = ?
-                ''', (datetime.now(), error_msg, message_id))
+                conn.rollback()
+                record_send_result(cursor, message_id, None, False, error_msg)
                 conn.commit()
-                print(f"✗ Exception sending to {phone}: {error_msg}")
+                log_message_event(logger, 'message_failed', logging.WARNING, key=message_id,
+                                  campaign_id=campaign_id, message_id=message_id, error=error_msg)
+            
+            # Between batches: checkpoint progress, then obey pause/cancel
+            if seen % CAMPAIGN_CONTROL_BATCH == 0:
+                control = checkpoint_campaign(conn, campaign_id, message_id)
+                if control in CONTROL_ACTIONS:
+                    apply_campaign_control(cursor, campaign_id, control)
+                    conn.commit()
+                    log_event(logger, 'campaign_stopped', campaign_id=campaign_id, control=control,
+                              processed=processed, pending=total_messages)
+                    return
         
-        # Update campaign to completed
-        cursor.execute('''
-            UPDATE campaigns 
-            SET status = 'completed', completed_at = ?
-            WHERE id = ?
-        ''', (datetime.now(), campaign_id))
+        # Completed only once nothing is left to send later (quiet hours, retries); until then it
+        # stays running, so it can still be paused or cancelled
+        completed = complete_finished_campaigns(cursor, campaign_id)
         conn.commit()
         
-        print(f"Campaign {campaign_id} completed. Processed {processed}/{total_messages} messages")
+        log_event(logger, 'campaign_completed' if completed else 'campaign_dispatched', campaign_id=campaign_id,
+                  processed=processed, pending=total_messages)
         
     except Exception as e:
-        print(f"Campaign {campaign_id} failed: {str(e)}")
+        log_event(logger, 'campaign_failed', logging.ERROR, exc_info=e, campaign_id=campaign_id)
         cursor.execute('''
             UPDATE campaigns 
             SET status = 'failed'
@@ -119,30 +315,35 @@ def process_campaign_task(self, campaign_id, api_key, rate_limit):
         
         # Retry the task if retries are available
         if self.request.retries < self.max_retries:
-            print(f"Retrying campaign {campaign_id} in 60 seconds...")
+            log_event(logger, 'campaign_retry_scheduled', logging.WARNING, campaign_id=campaign_id, countdown=60)
             raise self.retry(countdown=60, exc=e)
         
     finally:
         conn.close()
 
 @celery_app.task(bind=True, max_retries=5)
+@profile_task
 def send_single_message_task(self, message_id, phone, content, api_key):
     """Send a single WhatsApp message with retry logic"""
     try:
-        success, error_msg = send_whatsapp_message(phone, content, api_key)
-        
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
+        token = claim_message(conn, message_id)
+        if token is None:
+            conn.close()
+            return False
+        
+        cursor.execute('SELECT campaign_id FROM messages WHERE id = ?', (message_id,))
+        success, result = send_whatsapp_message(
+            phone, content, api_key, idempotency_key=idempotency_key(cursor.fetchone()[0], message_id)
+        )
+        
         if success:
-            cursor.execute('''
-                UPDATE messages 
-                SET status = 'sent', sent_at = ?
-                WHERE id = ?
-            ''', (datetime.now(), message_id))
+            record_send_result(cursor, message_id, token, True, message_content=content, provider_sid=result)
         else:
             # If API rate limited, retry with exponential backoff
-            if "rate limit" in error_msg.lower() or "too many requests" in error_msg.lower():
+            if "rate limit" in result.lower() or "too many requests" in result.lower():
                 cursor.execute('''
                     UPDATE messages 
                     SET retry_count = retry_count + 1
@@ -150,16 +351,18 @@ def send_single_message_task(self, message_id, phone, content, api_key):
                 ''', (message_id,))
                 
                 if self.request.retries < self.max_retries:
+                    # Rejected by the provider, so the claim goes back for the retry
+                    release_message(cursor, message_id, token)
+                    conn.commit()
+                    conn.close()
+                    
                     # Exponential backoff: 2^retry_count * 60 seconds
                     countdown = (2 ** self.request.retries) * 60
-                    print(f"Rate limited. Retrying message {message_id} in {countdown} seconds")
+                    log_event(logger, 'message_rate_limited', logging.WARNING, message_id=message_id,
+                              countdown=countdown)
                     raise self.retry(countdown=countdown)
             
-            cursor.execute('''
-                UPDATE messages 
-                SET status = 'failed', failed_at = ?, error_message = ?
-                WHERE id = ?
-            ''', (datetime.now(), error_msg, message_id))
+            record_send_result(cursor, message_id, token, False, result)
         
         conn.commit()
         conn.close()
@@ -168,11 +371,11 @@ def send_single_message_task(self, message_id, phone, content, api_key):
         
     except Exception as e:
         if self.request.retries < self.max_retries:
-            print(f"Exception in send_single_message_task: {str(e)}. Retrying...")
+            log_event(logger, 'message_retry_scheduled', logging.WARNING, message_id=message_id, error=str(e))
             raise self.retry(countdown=60, exc=e)
         else:
             # Final failure
-            conn = sqlite3.connect('whatsapp_campaigns.db')
+            conn = connect()
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE messages 
@@ -183,8 +386,64 @@ def send_single_message_task(self, message_id, phone, content, api_key):
             conn.close()
             return False
 
-def send_whatsapp_message(phone, message, api_key):
-    """Send WhatsApp message via Twilio (temporary) or Business API (future)"""
+@celery_app.task(bind=True, max_retries=3)
+@profile_task
+def backfill_sentiment_task(self, batch_size=200, workers=4, restart=False):
+    """Re-classify existing replies; a retry resumes from the last committed checkpoint"""
+    from update_sentiment import update_all_sentiments
+    
+    try:
+        return update_all_sentiments(batch_size=batch_size, workers=workers, restart=restart)
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            log_event(logger, 'sentiment_backfill_failed', logging.WARNING, error=str(e), countdown=60)
+            raise self.retry(countdown=60, exc=e,
+                             kwargs={'batch_size': batch_size, 'workers': workers, 'restart': False})
+        raise
+
+@celery_app.task
+@profile_task
+def verify_reply_rollups_task():
+    """Recompute the reply analytics rollups and responder sketches from raw replies"""
+    from reply_rollups import run_rollup_verification
+    from responder_sketches import run_sketch_rebuild
+    return {'rollups': run_rollup_verification(), 'sketches': run_sketch_rebuild()}
+
+@celery_app.task
+@profile_task
+def analytics_export_task(datasets=None, full=False):
+    """Incremental Parquet export of messages, replies, opt-outs and campaign counters"""
+    from analytics_export import run_analytics_export
+    return run_analytics_export(datasets, full=full)
+
+@celery_app.task
+@profile_task
+def export_replies_task(job_id):
+    """Write a large reply export to EXPORT_DIR for /api/replies/exports/<job_id>/download"""
+    from reply_export import run_export_job
+    return run_export_job(job_id)
+
+def twilio_client(account_sid, auth_token):
+    """Twilio REST client; TWILIO_API_BASE_URL sends its requests elsewhere (fake_provider.py in load tests)"""
+    client = Client(account_sid, auth_token)
+    base_url = os.getenv('TWILIO_API_BASE_URL')
+    if base_url:
+        client.api.base_url = base_url.rstrip('/')
+    return client
+
+def send_rate_limited(phone, message, api_key, idempotency_key=None):
+    """send_whatsapp_message paced by the provider budget shared by every sender in this worker"""
+    provider_limiter.wait()
+    return send_whatsapp_message(phone, message, api_key, idempotency_key=idempotency_key)
+
+def send_whatsapp_message(phone, message, api_key, idempotency_key=None):
+    """
+    Send WhatsApp message via Twilio (temporary) or Business API (future).
+    Returns (True, provider message SID) or (False, error message).
+    idempotency_key is stable per message for providers that de-duplicate on it; Twilio's
+    Messages API has no such parameter, so it goes on the status callback URL instead, which
+    lets a callback record the SID of a message whose worker died before it could.
+    """
     
     # OPTION 1: TWILIO WhatsApp API (ACTIVE - for testing without WABA approval)
     try:
@@ -196,7 +455,7 @@ def send_whatsapp_message(phone, message, api_key):
         if not account_sid or not auth_token:
             return False, "Twilio credentials not configured in .env file"
         
-        client = Client(account_sid, auth_token)
+        client = twilio_client(account_sid, auth_token)
         
         # Format phone number for WhatsApp
         if not phone.startswith('whatsapp:'):
@@ -206,19 +465,37 @@ def send_whatsapp_message(phone, message, api_key):
         else:
             to_number = phone
         
-        # Send message via Twilio
-        twilio_message = client.messages.create(
-            body=message,
-            from_=twilio_from,
-            to=to_number
-        )
+        # Delivery / read receipts are posted back to /webhook/status when a public URL is set
+        status_callback = os.getenv('TWILIO_STATUS_CALLBACK_URL')
+        if status_callback and idempotency_key:
+            status_callback = tag_status_callback(status_callback, idempotency_key)
+        extra = {'status_callback': status_callback} if status_callback else {}
         
-        print(f"✅ Twilio message sent successfully. SID: {twilio_message.sid}")
-        return True, f"Success - Twilio SID: {twilio_message.sid}"
+        # Send message via Twilio, timing only the provider call
+        started = time.perf_counter()
+        try:
+            twilio_message = client.messages.create(
+                body=message,
+                from_=twilio_from,
+                to=to_number,
+                **extra
+            )
+        except Exception:
+            PROVIDER_LATENCY.labels('error').observe(time.perf_counter() - started)
+            raise
+        PROVIDER_LATENCY.labels('ok').observe(time.perf_counter() - started)
         
+        log_message_event(logger, 'provider_accepted', logging.DEBUG, provider_sid=twilio_message.sid)
+        return True, twilio_message.sid
+        
+    except TwilioRestException as e:
+        # Keep Twilio's error code (or the HTTP status) so the retry scheduler can classify it
+        error_msg = f"Twilio error {e.code or e.status}: {e.msg}"
+        log_message_event(logger, 'provider_error', logging.WARNING, error=error_msg, status=e.status)
+        return False, error_msg
     except Exception as e:
         error_msg = f"Twilio error: {str(e)}"
-        print(f"❌ {error_msg}")
+        log_message_event(logger, 'provider_error', logging.WARNING, error=error_msg)
         return False, error_msg
     
     # OPTION 2: WhatsApp Business API (COMMENTED OUT - activate when WABA is approved)
@@ -268,6 +545,148 @@ def send_whatsapp_message(phone, message, api_key):
         return False, f"Unexpected error: {str(e)}"
     """
 
+@celery_app.task
+@profile_task
+def drain_delivery_status_task():
+    """Apply queued delivery status callbacks in batched transactions (run by celery beat)"""
+    conn = connect()
+    try:
+        applied = drain_status_queue(conn)
+        if applied:
+            log_event(logger, 'status_callbacks_applied', applied=applied)
+        return applied
+    finally:
+        conn.close()
+
+@celery_app.task
+@profile_task
+def retry_failed_messages_task():
+    """
+    Schedule new retryable failures, then hand every retry that has come due back to its campaign's
+    dispatcher (run by celery beat). Returns how many were released.
+    """
+    conn = connect()
+    try:
+        scheduled = schedule_failed_messages(conn)
+        if any(scheduled.values()):
+            log_event(logger, 'failed_messages_classified', **scheduled)
+        
+        due = release_due_retries(conn, pop_due_retries(conn))
+        for row in due:
+            MESSAGES.labels(row[1], 'retried', '').inc()
+        if due:
+            queued = hand_back_to_dispatchers(conn, due)
+            log_event(logger, 'retries_released', retried=len(due), campaigns_queued=len(queued))
+        
+        # Campaigns whose last outstanding messages were classified as permanent
+        for campaign_id in complete_finished_campaigns(conn.cursor()):
+            log_event(logger, 'campaign_completed', campaign_id=campaign_id)
+        conn.commit()
+        return len(due)
+    finally:
+        conn.close()
+
+def hand_back_to_dispatchers(conn, rows):
+    """
+    Send messages released back to 'pending' (rows from load_send_rows) through their campaign's
+    dispatcher on the campaign queue, never from the periodic worker that released them. A
+    campaign whose dispatcher is still going picks them up on its next pass; for the rest a
+    process_campaign_task is queued. Returns the campaigns queued.
+    """
+    cursor = conn.cursor()
+    released, rate_limits = {}, {}
+    for message_id, campaign_id, *_, rate_limit in rows:
+        released.setdefault(campaign_id, []).append(message_id)
+        rate_limits[campaign_id] = rate_limit
+    
+    queued = [campaign_id for campaign_id, message_ids in released.items()
+              if not has_dispatch_work(cursor, campaign_id, ignore_ids=message_ids)]
+    for campaign_id in queued:
+        process_campaign_task.delay(campaign_id, os.getenv('WHATSAPP_API_KEY'), rate_limits[campaign_id] or 0)
+    return queued
+
+@celery_app.task
+@profile_task
+def scheduler_tick_task():
+    """Start scheduled campaigns, release messages past quiet hours, send due opt-out confirmations"""
+    conn = connect()
+    try:
+        for campaign_id, rate_limit in start_due_campaigns(conn):
+            log_event(logger, 'scheduled_campaign_started', campaign_id=campaign_id)
+            process_campaign_task.delay(campaign_id, os.getenv('WHATSAPP_API_KEY'), rate_limit)
+        
+        released = release_deferred_messages(conn)
+        if released:
+            queued = hand_back_to_dispatchers(conn, released)
+            log_event(logger, 'deferred_messages_released', released=len(released), campaigns_queued=len(queued))
+    finally:
+        conn.close()
+    
+    # Claimed in batches, sent through the shared limiter, marked once the provider answered
+    dispatch_opt_out_confirmations(send_rate_limited)
+
+def find_sent_message(phone, message, since):
+    """
+    SIDs of outbound Twilio messages to the same number with the same body since a crashed
+    worker's claim; send_ledger.reconcile_stuck_messages decides which, if any, is the claimed
+    message. Raises when Twilio can't be asked, so the message stays claimed rather than risk
+    a duplicate.
+    """
+    account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+    auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+    twilio_from = os.getenv('TWILIO_WHATSAPP_FROM', 'whatsapp:+14155238886')
+    
+    if not account_sid or not auth_token:
+        raise RuntimeError("Twilio credentials not configured in .env file")
+    
+    if not phone.startswith('+'):
+        phone = '+' + phone
+    if isinstance(since, str):
+        since = datetime.fromisoformat(since)
+    # Claims are stored in local time; Twilio's dates are UTC. A minute of slack covers clock skew
+    since = since.astimezone(timezone.utc) - timedelta(minutes=1)
+    
+    # DateSent filters are whole days, so the exact cut is made on each message's creation time
+    client = twilio_client(account_sid, auth_token)
+    candidates = client.messages.list(to=f'whatsapp:{phone}', from_=twilio_from,
+                                      date_sent_after=since - timedelta(days=1), limit=50)
+    return [candidate.sid for candidate in candidates
+            if candidate.body == message and (candidate.date_created is None or candidate.date_created >= since)]
+
+@worker_ready.connect
+def reconcile_on_startup(**kwargs):
+    """Settle messages whose worker died mid-send before this worker takes new tasks"""
+    conn = connect()
+    try:
+        reconcile_stuck_messages(conn, find_sent_message, older_than=SEND_CLAIM_TIMEOUT)
+    except sqlite3.Error as e:
+        log_event(logger, 'startup_reconciliation_skipped', logging.WARNING, error=str(e))
+    finally:
+        conn.close()
+
+@celery_setup_logging.connect
+def configure_logging(**kwargs):
+    """Structured JSON logs instead of Celery's own logging setup (see structured_logging.py)"""
+    setup_logging()
+
+@worker_init.connect
+def reset_metrics(**kwargs):
+    """Counters restart with the worker, so files its previous run's processes recorded are dropped"""
+    if MULTIPROC_DIR:
+        clear_process_files()
+
+@worker_ready.connect
+def start_metrics_exporter(**kwargs):
+    """Serve /metrics for Prometheus from the worker's main process"""
+    if WORKER_METRICS_PORT:
+        try:
+            start_http_server(WORKER_METRICS_PORT)
+            log_event(logger, 'metrics_exporter_started', port=WORKER_METRICS_PORT)
+        except OSError as e:
+            log_event(logger, 'metrics_exporter_failed', logging.WARNING, error=str(e))
+
 if __name__ == '__main__':
-    # Run worker with: celery -A celery_worker worker --loglevel=info
+    # Run the campaign worker with: celery -A celery_worker worker -Q celery --loglevel=info
+    # the periodic tasks' worker with: celery -A celery_worker worker -Q periodic --loglevel=info
+    # and their scheduler with: celery -A celery_worker beat --loglevel=info
     celery_app.start()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Contact Store
+One row per customer keyed by canonical phone, shared by every campaign.
+Custom Excel columns are kept as compact JSON attributes instead of being thrown away.
+"""
+
+import json
+from typing import Dict, List
+
+from phone_numbers import MIGRATION_BATCH_SIZE, canonical_phone_number
+
+# SQLite allows 999 bound parameters per statement
+LOOKUP_CHUNK_SIZE = 500
+
+CONTACT_FIELDS = ('phone', 'name')
+
+_attribute_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, sort_keys=True)
+
+
+def setup_contacts_table(cursor):
+    """Create the contacts table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_canonical TEXT UNIQUE NOT NULL,
+            name TEXT,
+            attributes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def encode_attributes(contact: Dict) -> str:
+    """Custom fields of a parsed contact (everything except phone and name) as compact JSON"""
+    attributes = {key: value for key, value in contact.items()
+                  if key not in CONTACT_FIELDS and value not in ('', None)}
+    return _attribute_encoder.encode(attributes)
+
+
+def upsert_contacts(cursor, contacts: List[Dict]) -> List[int]:
+    """
+    Insert or update contacts in bulk. The latest name wins and new custom fields are merged
+    into the stored ones; repeat customers whose details haven't changed are not rewritten.
+    Returns the contact_id for each input contact, in order.
+    """
+    phones = [canonical_phone_number(contact['phone']) for contact in contacts]
+    rows = {}
+    for phone, contact in zip(phones, contacts):
+        rows[phone] = (contact.get('name'), encode_attributes(contact))
+
+    contact_ids = {}
+    inserts = []
+    updates = []
+    stored = fetch_contacts(cursor, list(rows))
+    for phone, (name, attributes) in rows.items():
+        current = stored.get(phone)
+        if current is None:
+            inserts.append((phone, name, attributes))
+            continue
+        contact_id, current_name, current_attributes = current
+        contact_ids[phone] = contact_id
+        if (name is not None and name != current_name) or \
+                (attributes != '{}' and attributes != current_attributes):
+            updates.append((name, attributes, contact_id))
+
+    cursor.executemany('''
+        INSERT INTO contacts (phone_canonical, name, attributes)
+        VALUES (?, ?, ?)
+    ''', inserts)
+    cursor.executemany('''
+        UPDATE contacts SET
+            name = COALESCE(?, name),
+            attributes = json_patch(COALESCE(attributes, '{}'), ?),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', updates)
+
+    if inserts:
+        new_contacts = fetch_contacts(cursor, [phone for phone, _, _ in inserts])
+        contact_ids.update((phone, row[0]) for phone, row in new_contacts.items())
+    return [contact_ids[phone] for phone in phones]
+
+
+def fetch_contacts(cursor, canonical_phones: List[str]) -> Dict[str, tuple]:
+    """{canonical phone: (id, name, attributes)} for the stored contacts among these numbers"""
+    contacts = {}
+    for start in range(0, len(canonical_phones), LOOKUP_CHUNK_SIZE):
+        chunk = canonical_phones[start:start + LOOKUP_CHUNK_SIZE]
+        cursor.execute(f'''
+            SELECT phone_canonical, id, name, attributes FROM contacts
+            WHERE phone_canonical IN ({','.join('?' * len(chunk))})
+        ''', chunk)
+        contacts.update((row[0], row[1:]) for row in cursor.fetchall())
+    return contacts
+
+
+def migrate_messages_to_contacts(cursor) -> int:
+    """
+    Add messages.contact_id to an older database and fill it from the phone numbers and names
+    each message row carried. Runs once; returns the number of messages linked.
+    """
+    cursor.execute("PRAGMA table_info(messages)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'contact_id' in columns:
+        return 0
+
+    print("⚙️ Moving message recipients into the contacts table...")
+    cursor.execute("ALTER TABLE messages ADD COLUMN contact_id INTEGER REFERENCES contacts(id)")
+
+    linked = 0
+    last_id = 0
+    while True:
+        cursor.execute('''
+            SELECT id, phone_number, name FROM messages
+            WHERE id > ? AND phone_number IS NOT NULL
+            ORDER BY id LIMIT ?
+        ''', (last_id, MIGRATION_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        # Rows are in id order, so the most recent name for a number wins
+        contact_ids = upsert_contacts(cursor, [{'phone': phone, 'name': name} for _, phone, name in rows])
+        cursor.executemany(
+            "UPDATE messages SET contact_id = ? WHERE id = ?",
+            [(contact_id, row[0]) for contact_id, row in zip(contact_ids, rows)]
+        )
+        linked += len(rows)
+        last_id = rows[-1][0]
+
+    print(f"✅ Linked {linked} messages to contacts")
+    return linked
+
+
+def find_latest_message_for_phone(cursor, phone_number):
+    """
+    Most recent campaign message sent to this number: one lookup on the contacts phone key,
+    then messages(contact_id, sent_at DESC).
+    Returns (campaign_id, message_id, name) or (None, None, None).
+    """
+    cursor.execute('''
+        SELECT m.campaign_id, m.id, c.name
+        FROM contacts c
+        JOIN messages m ON m.contact_id = c.id
+        WHERE c.phone_canonical = ?
+        ORDER BY m.sent_at DESC
+        LIMIT 1
+    ''', (canonical_phone_number(phone_number),))
+
+    result = cursor.fetchone()
+    return tuple(result) if result else (None, None, None)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Database
+Opens the campaigns database through connect(), whose connections time every statement with
+the fetches that finish it, count the rows, and note the code that ran it.
+
+Statements taking SLOW_QUERY_MS or longer are logged as slow_query events with their call site
+and EXPLAIN QUERY PLAN, and counted in whatsapp_slow_queries_total. Parameters are never logged.
+
+Code that wants to see each query registers a recorder for the current thread (or task) with
+`with QueryLog() as log:`; the API uses one per request to export statements per endpoint
+(whatsapp_endpoint_queries), the profiler (profiling.py) is another, and tests use QueryLog to
+hold an endpoint to a query budget. Without a recorder a statement costs a timer read and a
+small object more than sqlite3 alone. Rows read by iterating a cursor directly, rather than
+with fetchone/fetchmany/fetchall, are not counted.
+"""
+
+import contextvars
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter as Tally
+from typing import Dict, List, Optional
+
+from metrics import SLOW_QUERIES
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+DATABASE = 'whatsapp_campaigns.db'
+# Statements at least this slow are logged with their query plan
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_recorders: contextvars.ContextVar = contextvars.ContextVar('query_recorders', default=())
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_THIS_FILE = os.path.normcase(__file__.rsplit('.', 1)[0])
+
+
+def normalize_statement(sql: str) -> str:
+    """One line, with IN lists of any length folded together"""
+    return _PLACEHOLDER_LIST.sub('(?, ...)', ' '.join(sql.split()))
+
+
+def call_site() -> str:
+    """'file.py:line function' of the first caller outside this module"""
+    frame = sys._getframe(1)
+    while frame is not None and os.path.normcase(frame.f_code.co_filename.rsplit('.', 1)[0]) == _THIS_FILE:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+
+
+class Query:
+    """One statement run: its text, time and rows so far (fetches add to both), and call site"""
+    __slots__ = ('sql', 'parameters', 'seconds', 'rows', 'site', 'logged')
+
+    def __init__(self, sql: str, parameters, seconds: float, rows: int, site: Optional[str]):
+        self.sql = sql
+        self.parameters = parameters
+        self.seconds = seconds
+        self.rows = rows
+        self.site = site
+        self.logged = False
+
+    def __repr__(self):
+        return f'<Query {self.seconds * 1000:.3f} ms, {self.rows} rows, {self.site}: {normalize_statement(self.sql)[:80]}>'
+
+
+class QueryRecorder:
+    """Sees every statement run inside `with recorder:` (or between start and stop) in this context"""
+    # Whether queries need their call site, which costs a stack walk each
+    wants_site = True
+
+    def start(self):
+        self._token = _recorders.set(_recorders.get() + (self,))
+        return self
+
+    def stop(self):
+        _recorders.reset(self._token)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record(self, query: Query):
+        """A statement was executed"""
+
+    def fetched(self, query: Query, seconds: float, rows: int):
+        """More rows of query were fetched (already added to query)"""
+
+
+class QueryCount(QueryRecorder):
+    """Counts the statements run inside it"""
+    wants_site = False
+
+    def __init__(self):
+        self.count = 0
+
+    def record(self, query: Query):
+        self.count += 1
+
+
+class QueryLog(QueryRecorder):
+    """Keeps every statement run inside `with QueryLog() as log:`"""
+
+    def __init__(self):
+        self.queries: List[Query] = []
+
+    def record(self, query: Query):
+        self.queries.append(query)
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def seconds(self) -> float:
+        return sum(query.seconds for query in self.queries)
+
+    def statements(self) -> Dict[str, int]:
+        """{normalized statement: times run}"""
+        return dict(Tally(normalize_statement(query.sql) for query in self.queries))
+
+    def repeated(self, threshold: int = 2) -> Dict[str, int]:
+        """Statements run threshold or more times: a query per item in a loop looks like this"""
+        return {sql: calls for sql, calls in self.statements().items() if calls >= threshold}
+
+    def report(self) -> str:
+        return '\n'.join(f'  {query!r}' for query in self.queries)
+
+
+def explain(connection: sqlite3.Connection, sql: str, parameters) -> List[str]:
+    """EXPLAIN QUERY PLAN details for sql, or [] for statements that have none"""
+    if parameters is None or not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    try:
+        rows = sqlite3.Connection.execute(connection, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    except (sqlite3.Error, ValueError):
+        return []
+    return [row[3] for row in rows]
+
+
+def log_slow_query(connection: sqlite3.Connection, query: Query):
+    query.logged = True
+    if query.site is None:
+        query.site = call_site()
+    SLOW_QUERIES.labels(query.site).inc()
+    log_event(logger, 'slow_query', logging.WARNING, sql=normalize_statement(query.sql),
+              duration_ms=round(query.seconds * 1000, 3), rows=query.rows, site=query.site,
+              plan=explain(connection, query.sql, query.parameters))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _query: Optional[Query] = None
+
+    def _finish(self, sql, parameters, start):
+        seconds = time.perf_counter() - start
+        recorders = _recorders.get()
+        site = call_site() if recorders and any(recorder.wants_site for recorder in recorders) else None
+        query = self._query = Query(sql, parameters, seconds, max(self.rowcount, 0), site)
+        for recorder in recorders:
+            recorder.record(query)
+        # A statement returning rows is judged as they are fetched, with them counted
+        if self.description is None and seconds * 1000 >= SLOW_QUERY_MS:
+            log_slow_query(self.connection, query)
+
+    def _fetched(self, start, rows):
+        query = self._query
+        if query is None:
+            return
+        seconds = time.perf_counter() - start
+        query.seconds += seconds
+        query.rows += rows
+        for recorder in _recorders.get():
+            recorder.fetched(query, seconds, rows)
+        if not query.logged and query.seconds * 1000 >= SLOW_QUERY_MS:
+            log_slow_query(self.connection, query)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._finish(sql, parameters, start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._finish(sql, None, start)
+
+    def executescript(self, script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            self._finish(script, None, start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+def connect(database: str = DATABASE, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect with every statement timed and recorded"""
+    return sqlite3.connect(database, factory=InstrumentedConnection, **kwargs)
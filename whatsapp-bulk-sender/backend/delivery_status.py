@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Delivery Status
+Twilio status callbacks (delivered / read / undelivered / failed) for messages we sent. The webhook
+only stamps each callback with its arrival time and pushes it onto a Redis list; a worker drains
+the list and applies callbacks in batched transactions, since callbacks arrive in bursts several
+times larger than outbound volume. Delivery-latency histograms are read from the same columns.
+Each message's callback URL carries its idempotency key, so a callback can record the SID of a
+message whose worker died before it could (see send_ledger.py).
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import redis
+
+from campaign_control import get_redis
+from send_ledger import message_id_from_key
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUE_KEY = 'delivery_status:queue'
+STATUS_BATCH_SIZE = int(os.getenv('STATUS_BATCH_SIZE', '1000'))
+# Callbacks that beat the worker's own "sent" commit are retried for this many seconds
+STATUS_UNMATCHED_TTL = int(os.getenv('STATUS_UNMATCHED_TTL', '600'))
+
+# Callback statuses that change a message, and the statuses each may replace. Callbacks can
+# arrive out of order, so a late "delivered" never overwrites "read".
+STATUS_TRANSITIONS = {
+    'delivered': ('sending', 'sent'),
+    'read': ('sending', 'sent', 'delivered'),
+    'undelivered': ('sending', 'sent'),
+    'failed': ('sending', 'sent'),
+}
+
+# Upper bounds (seconds) of the delivery-latency histogram buckets
+LATENCY_BUCKETS = (1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def setup_delivery_status(cursor):
+    """Provider SID and read time on messages, with a unique index for callback lookups"""
+    cursor.execute("PRAGMA table_info(messages)")
+    existing = [column[1] for column in cursor.fetchall()]
+    for name, definition in (('provider_sid', 'TEXT'), ('read_at', 'TIMESTAMP')):
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE messages ADD COLUMN {name} {definition}")
+
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_provider_sid
+        ON messages(provider_sid) WHERE provider_sid IS NOT NULL
+    ''')
+
+
+def parse_status_callback(values) -> Dict:
+    """The fields we keep from a Twilio status callback, stamped with when it arrived"""
+    return {
+        'sid': values.get('MessageSid', ''),
+        'status': values.get('MessageStatus', '').lower(),
+        'error_code': values.get('ErrorCode'),
+        'key': values.get('key'),
+        'received_at': time.time(),
+    }
+
+
+def enqueue_status_events(events: List[Dict]) -> bool:
+    """Push callbacks onto the status queue; False if Redis is unavailable"""
+    try:
+        get_redis().rpush(STATUS_QUEUE_KEY, *[json.dumps(event) for event in events])
+        return True
+    except redis.RedisError as e:
+        log_event(logger, 'status_queue_redis_unavailable', logging.WARNING, callbacks=len(events),
+                  error=str(e))
+        return False
+
+
+def pop_status_events(count: int) -> List[Dict]:
+    """Take up to count callbacks off the front of the queue in one round trip"""
+    pipe = get_redis().pipeline()
+    pipe.lrange(STATUS_QUEUE_KEY, 0, count - 1)
+    pipe.ltrim(STATUS_QUEUE_KEY, count, -1)
+    raw, _ = pipe.execute()
+    return [json.loads(item) for item in raw]
+
+
+def apply_status_batch(conn, events: List[Dict]) -> Tuple[int, List[Dict]]:
+    """
+    Apply a batch of callbacks in one transaction: one SID lookup, then one executemany per
+    status. Returns (callbacks applied, callbacks for SIDs not recorded yet).
+    """
+    # Any status of a keyed callback ('queued', 'sent', ...) can record the SID
+    events = [event for event in events
+              if event['sid'] and (event['status'] in STATUS_TRANSITIONS or event.get('key'))]
+    if not events:
+        return 0, []
+
+    cursor = conn.cursor()
+    sids = list({event['sid'] for event in events})
+    known = set()
+    for start in range(0, len(sids), 500):
+        chunk = sids[start:start + 500]
+        cursor.execute(f'''
+            SELECT provider_sid FROM messages
+            WHERE provider_sid IN ({','.join('?' * len(chunk))})
+        ''', chunk)
+        known.update(row[0] for row in cursor.fetchall())
+
+    # SIDs of messages still claimed without one: sent, but not (or not yet) recorded by the worker
+    adopt = {event['sid']: message_id_from_key(event.get('key')) for event in events
+             if event['sid'] not in known and message_id_from_key(event.get('key')) is not None}
+    for sid, message_id in adopt.items():
+        cursor.execute('''
+            UPDATE messages SET provider_sid = ?
+            WHERE id = ? AND status = 'sending' AND provider_sid IS NULL
+        ''', (sid, message_id))
+        if cursor.rowcount == 1:
+            known.add(sid)
+
+    events = [event for event in events if event['status'] in STATUS_TRANSITIONS]
+    by_status = {}
+    unmatched = []
+    for event in events:
+        if event['sid'] in known:
+            by_status.setdefault(event['status'], []).append(event)
+        else:
+            unmatched.append(event)
+
+    for status, batch in by_status.items():
+        allowed = ','.join(f"'{previous}'" for previous in STATUS_TRANSITIONS[status])
+        if status == 'delivered':
+            cursor.executemany(f'''
+                UPDATE messages SET status = 'delivered', delivered_at = COALESCE(delivered_at, ?)
+                WHERE provider_sid = ? AND status IN ({allowed})
+            ''', [(datetime.fromtimestamp(event['received_at']), event['sid']) for event in batch])
+        elif status == 'read':
+            # A read receipt implies delivery, even if the delivered callback never came
+            cursor.executemany(f'''
+                UPDATE messages SET status = 'read', read_at = COALESCE(read_at, ?),
+                                    delivered_at = COALESCE(delivered_at, ?)
+                WHERE provider_sid = ? AND status IN ({allowed})
+            ''', [(datetime.fromtimestamp(event['received_at']),) * 2 + (event['sid'],) for event in batch])
+        else:
+            cursor.executemany(f'''
+                UPDATE messages SET status = ?, failed_at = ?, error_message = ?
+                WHERE provider_sid = ? AND status IN ({allowed})
+            ''', [(status, datetime.fromtimestamp(event['received_at']),
+                   f"Twilio error {event['error_code']}" if event['error_code'] else None,
+                   event['sid']) for event in batch])
+    conn.commit()
+
+    applied = len(events) - len(unmatched)
+    return applied, unmatched
+
+
+def drain_status_queue(conn, batch_size: int = None) -> int:
+    """Apply the callbacks queued when the drain starts; returns how many were applied"""
+    batch_size = batch_size or STATUS_BATCH_SIZE
+    remaining = get_redis().llen(STATUS_QUEUE_KEY)
+    total = 0
+    while remaining > 0:
+        events = pop_status_events(min(batch_size, remaining))
+        if not events:
+            break
+        remaining -= len(events)
+
+        try:
+            applied, unmatched = apply_status_batch(conn, events)
+        except Exception:
+            # Already trimmed off the queue, so put them back (out-of-order is safe, see
+            # STATUS_TRANSITIONS) for the next drain rather than lose them
+            conn.rollback()
+            enqueue_status_events(events)
+            raise
+        total += applied
+
+        # Back of the queue for SIDs the worker hasn't committed yet; dropped once stale
+        cutoff = time.time() - STATUS_UNMATCHED_TTL
+        retry = [event for event in unmatched if event['received_at'] > cutoff]
+        if retry:
+            enqueue_status_events(retry)
+    return total
+
+
+def delivery_latency_histogram(cursor, campaign_id: str) -> Dict:
+    """Sent-to-delivered latency for a campaign, bucketed by LATENCY_BUCKETS (seconds)"""
+    bucket_sql = ' '.join(f"WHEN latency <= {bound} THEN {index}" for index, bound in enumerate(LATENCY_BUCKETS))
+    cursor.execute(f'''
+        SELECT CASE {bucket_sql} ELSE {len(LATENCY_BUCKETS)} END AS bucket,
+               COUNT(*), SUM(latency)
+        FROM (
+            SELECT (julianday(delivered_at) - julianday(sent_at)) * 86400.0 AS latency
+            FROM messages
+            WHERE campaign_id = ? AND delivered_at IS NOT NULL AND sent_at IS NOT NULL
+        )
+        GROUP BY bucket
+    ''', (campaign_id,))
+    counts = dict.fromkeys(range(len(LATENCY_BUCKETS) + 1), 0)
+    total_latency = 0.0
+    for bucket, count, latency_sum in cursor.fetchall():
+        counts[bucket] = count
+        total_latency += latency_sum or 0.0
+
+    delivered = sum(counts.values())
+    labels = [f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+    return {
+        'campaign_id': campaign_id,
+        'delivered': delivered,
+        'mean_seconds': round(total_latency / delivered, 3) if delivered else None,
+        'buckets': [{'bucket': label, 'count': counts[index]} for index, label in enumerate(labels)],
+    }
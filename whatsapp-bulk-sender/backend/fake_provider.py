@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Fake Provider
+A local stand-in for the Twilio Messages API and the Gemini generateContent endpoint, so the
+send and reply pipelines can be load tested without credentials or cost. Point the app at it
+with TWILIO_API_BASE_URL and GEMINI_API_ENDPOINT (load_test.py does this itself).
+
+Twilio side: POST /2010-04-01/Accounts/<sid>/Messages.json accepts a message after
+--latency-ms (+- jitter), or fails it: --error-rate as a retryable 20500, --invalid-rate as a
+permanent 21211, and 429 / 20429 whenever requests exceed --throttle-rps. Accepted messages get
+a 'delivered' status callback (then 'read' for --read-rate of them) posted to their
+StatusCallback URL after --callback-delay-ms. GET .../Messages.json lists sent messages for
+the worker's crash reconciliation.
+
+Gemini side: POST /v1beta/models/<model>:generateContent answers after --gemini-latency-ms with a
+keyword-based classification (or a short reply for response prompts), and 429
+RESOURCE_EXHAUSTED for --gemini-error-rate of requests.
+
+GET /stats returns the request counts and the status callback latencies seen.
+
+Usage: python fake_provider.py [--port 8099] [--latency-ms 80] [--error-rate 0.01] [--throttle-rps 80] ...
+"""
+
+import argparse
+import heapq
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/(?P<account>[^/]+)/Messages\.json$')
+GEMINI_PATH = re.compile(r'^/v1beta/models/(?P<model>[^/:]+):generateContent$')
+PROMPT_MESSAGE = re.compile(r'Message: "(?P<message>.*?)"', re.DOTALL)
+
+
+@dataclass
+class ProviderConfig:
+    latency_ms: float = 80
+    jitter_ms: float = 20
+    error_rate: float = 0.0
+    invalid_rate: float = 0.0
+    throttle_rps: float = 0  # 0 never throttles
+    callback_delay_ms: float = 500
+    read_rate: float = 0.3
+    gemini_latency_ms: float = 300
+    gemini_error_rate: float = 0.0
+    seed: Optional[int] = None
+
+
+def classify(message: str) -> Dict:
+    """Roughly what Gemini would say, from keywords"""
+    text = message.lower()
+    if any(word in text for word in ('stop', 'unsubscribe', 'sitaki', 'acha')):
+        category = 'DESIRED_OPT_OUT'
+    elif '?' in text or any(word in text for word in ('how much', 'bei gani', 'price')):
+        category = 'QUESTION'
+    elif any(word in text for word in ('bad', 'late', 'broken', 'refund')):
+        category = 'COMPLAINT'
+    elif any(word in text for word in ('thanks', 'love', 'great', 'asante')):
+        category = 'POSITIVE_FEEDBACK'
+    else:
+        category = 'NEUTRAL'
+    return {'category': category, 'confidence': 0.85, 'reasoning': 'fake provider keyword match',
+            'requires_human_attention': category == 'COMPLAINT', 'suggested_priority': 'medium'}
+
+
+class FakeProvider:
+    def __init__(self, config: ProviderConfig = None):
+        self.config = config or ProviderConfig()
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        self.sent: List[Dict] = []
+        self.callback_latencies: List[float] = []
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.callbacks: List[tuple] = []
+        self.callback_ready = threading.Condition(self.lock)
+        self.callback_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='fake-callbacks')
+        self.session = requests.Session()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    # Bookkeeping
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'counts': dict(self.counts), 'callback_latencies': list(self.callback_latencies),
+                    'pending_callbacks': len(self.callbacks)}
+
+    def throttled(self) -> bool:
+        """Fixed one-second windows of throttle_rps requests"""
+        if not self.config.throttle_rps:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            return self.window_count > self.config.throttle_rps
+
+    def delay(self, latency_ms: float):
+        jitter = self.rng.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+        time.sleep(max(0.0, latency_ms + jitter) / 1000)
+
+    # Twilio
+
+    def create_message(self, account: str, form: Dict[str, str]):
+        if self.throttled():
+            self.count('messages_throttled')
+            return 429, {'code': 20429, 'message': 'Too Many Requests', 'status': 429}
+        self.delay(self.config.latency_ms)
+
+        roll = self.rng.random()
+        if roll < self.config.error_rate:
+            self.count('messages_errored')
+            return 500, {'code': 20500, 'message': 'Internal Server Error', 'status': 500}
+        if roll < self.config.error_rate + self.config.invalid_rate:
+            self.count('messages_invalid')
+            return 400, {'code': 21211, 'message': "The 'To' number is not a valid phone number.", 'status': 400}
+
+        sid = 'SM' + uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
+        message = {
+            'sid': sid, 'account_sid': account, 'to': form.get('To', ''), 'from': form.get('From', ''),
+            'body': form.get('Body', ''), 'status': 'queued', 'direction': 'outbound-api',
+            'date_created': now.strftime('%a, %d %b %Y %H:%M:%S +0000'),
+            'date_sent': now.strftime('%a, %d %b %Y %H:%M:%S +0000'),
+            'num_segments': '1', 'price': None, 'error_code': None, 'error_message': None,
+            'uri': f'/2010-04-01/Accounts/{account}/Messages/{sid}.json',
+        }
+        with self.lock:
+            self.counts['messages_accepted'] = self.counts.get('messages_accepted', 0) + 1
+            self.sent.append(message)
+        if form.get('StatusCallback'):
+            self.schedule_callbacks(sid, form['StatusCallback'])
+        return 201, message
+
+    def list_messages(self, account: str, query: Dict[str, str]):
+        to = query.get('To')
+        with self.lock:
+            matching = [message for message in self.sent if not to or message['to'] == to]
+        page_size = int(query.get('PageSize', 50))
+        return 200, {'messages': matching[-page_size:][::-1], 'next_page_uri': None, 'page': 0,
+                     'page_size': page_size, 'uri': f'/2010-04-01/Accounts/{account}/Messages.json'}
+
+    def schedule_callbacks(self, sid: str, url: str):
+        due = time.monotonic() + self.config.callback_delay_ms / 1000
+        statuses = ['delivered'] + (['read'] if self.rng.random() < self.config.read_rate else [])
+        with self.callback_ready:
+            for offset, status in enumerate(statuses):
+                heapq.heappush(self.callbacks, (due + offset * 0.2, sid, status, url))
+            self.callback_ready.notify()
+
+    def run_callbacks(self):
+        while True:
+            with self.callback_ready:
+                while not self.callbacks or self.callbacks[0][0] > time.monotonic():
+                    timeout = self.callbacks[0][0] - time.monotonic() if self.callbacks else None
+                    self.callback_ready.wait(timeout)
+                _, sid, status, url = heapq.heappop(self.callbacks)
+            self.callback_pool.submit(self.post_callback, sid, status, url)
+
+    def post_callback(self, sid: str, status: str, url: str):
+        start = time.perf_counter()
+        try:
+            response = self.session.post(url, data={'MessageSid': sid, 'MessageStatus': status}, timeout=30)
+            ok = response.status_code < 300
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            name = 'callbacks_delivered' if ok else 'callbacks_failed'
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.callback_latencies.append(elapsed)
+
+    # Gemini
+
+    def generate_content(self, model: str, body: Dict):
+        if self.rng.random() < self.config.gemini_error_rate:
+            self.count('gemini_throttled')
+            return 429, {'error': {'code': 429, 'message': 'Resource has been exhausted (e.g. check quota).',
+                                   'status': 'RESOURCE_EXHAUSTED'}}
+        self.delay(self.config.gemini_latency_ms)
+        prompt = ' '.join(part.get('text', '') for content in body.get('contents', [])
+                          for part in content.get('parts', []))
+        match = PROMPT_MESSAGE.search(prompt)
+        if 'JSON' in prompt and match:
+            text = json.dumps(classify(match.group('message')))
+        else:
+            text = 'Thank you for your message! Our team will get back to you shortly.'
+        self.count('gemini_requests')
+        return 200, {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'},
+                                     'finishReason': 'STOP', 'index': 0}]}
+
+    # Server
+
+    def start(self, port: int = 0, address: str = '127.0.0.1') -> str:
+        """Serve from background threads; returns the base URL"""
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def reply(self, status: int, payload: Dict):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                match = MESSAGES_PATH.match(url.path)
+                if match:
+                    self.reply(*provider.list_messages(match.group('account'), query))
+                elif url.path == '/stats':
+                    self.reply(200, provider.stats())
+                else:
+                    self.reply(404, {'code': 20404, 'message': 'Not Found', 'status': 404})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                raw = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+                match = MESSAGES_PATH.match(url.path)
+                if match:
+                    form = {key: values[0] for key, values in parse_qs(raw).items()}
+                    self.reply(*provider.create_message(match.group('account'), form))
+                    return
+                match = GEMINI_PATH.match(url.path)
+                if match:
+                    self.reply(*provider.generate_content(match.group('model'), json.loads(raw or '{}')))
+                    return
+                self.reply(404, {'code': 20404, 'message': 'Not Found', 'status': 404})
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-provider', daemon=True).start()
+        threading.Thread(target=self.run_callbacks, name='fake-callback-scheduler', daemon=True).start()
+        return f'http://{address}:{self.server.server_address[1]}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+        self.callback_pool.shutdown(wait=False)
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = ProviderConfig()
+    parser.add_argument('--latency-ms', type=float, default=defaults.latency_ms)
+    parser.add_argument('--jitter-ms', type=float, default=defaults.jitter_ms)
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help='retryable 20500 errors')
+    parser.add_argument('--invalid-rate', type=float, default=defaults.invalid_rate, help='permanent 21211 errors')
+    parser.add_argument('--throttle-rps', type=float, default=defaults.throttle_rps, help='429 above this rate')
+    parser.add_argument('--callback-delay-ms', type=float, default=defaults.callback_delay_ms)
+    parser.add_argument('--read-rate', type=float, default=defaults.read_rate)
+    parser.add_argument('--gemini-latency-ms', type=float, default=defaults.gemini_latency_ms)
+    parser.add_argument('--gemini-error-rate', type=float, default=defaults.gemini_error_rate)
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def config_from_arguments(args) -> ProviderConfig:
+    return ProviderConfig(**{name: getattr(args, name) for name in ProviderConfig.__dataclass_fields__})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake Twilio / Gemini provider for load tests')
+    parser.add_argument('--port', type=int, default=8099)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    provider = FakeProvider(config_from_arguments(args))
+    url = provider.start(args.port, '0.0.0.0')
+    print(f"🧪 Fake provider on {url}")
+    print(f"   TWILIO_API_BASE_URL={url}  GEMINI_API_ENDPOINT={url}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        provider.stop()
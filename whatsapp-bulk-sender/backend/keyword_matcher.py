@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Compiled Keyword Matcher for reply classification
+Builds one trie-shaped regex at import time and returns every category hit in a single pass
+"""
+
+import re
+from typing import Dict, List
+
+# Keywords ending in '*' are stems and also match longer words ("thank*" -> "thanks").
+# Every other keyword must match whole words, so "no" no longer fires inside "know"
+# and "acha" no longer fires inside "nachagua". Apostrophes are ignored, so
+# "don't message" also covers "dont message", and "opt-out" matches "opt out".
+OPT_OUT_KEYWORDS = (
+    # English
+    'stop', 'unsubscribe*', 'remove', 'opt out', 'optout', 'quit', 'delete',
+    "don't message", 'not interested', 'no more', 'enough',
+    'block', 'remove me', 'delete me', 'take me off', 'annoying',
+    # Swahili
+    'hatutaki', 'sitaki', 'acha', 'wacha', 'hapana', 'usinitumie',
+    'sijadhani', 'sitaki ujumbe', 'ondoa', 'sikitaki',
+)
+
+POSITIVE_KEYWORDS = (
+    'yes', 'interested', 'buy', 'purchase', 'want', 'like', 'love',
+    'thank*', 'good', 'great', 'excellent', 'amazing', 'perfect',
+    'asante', 'nataka', 'poa', 'sawa', 'vizuri',
+)
+
+NEGATIVE_KEYWORDS = (
+    'no', 'hate', 'bad', 'terrible', 'angry', 'complain*', 'problem*',
+    'issue*', 'wrong', 'awful', 'horrible', 'disappointed', 'refund*',
+    'mbaya', 'haina', 'tatizo',
+)
+
+QUESTION_KEYWORDS = (
+    'how', 'what', 'when', 'where', 'why', 'which', 'price*',
+    'cost*', 'available', 'je', 'vipi', 'bei', 'rahisi',
+)
+
+URGENT_KEYWORDS = (
+    'urgent*', 'emergency', 'immediately', 'asap', 'help', 'haraka',
+)
+
+# Order matters: a keyword listed in two categories keeps the first one. Longer
+# keywords always win, so "no more" is an opt-out rather than a negative "no".
+KEYWORD_CATEGORIES = {
+    'opt_out': OPT_OUT_KEYWORDS,
+    'urgent': URGENT_KEYWORDS,
+    'negative': NEGATIVE_KEYWORDS,
+    'positive': POSITIVE_KEYWORDS,
+    'question': QUESTION_KEYWORDS,
+}
+
+
+_SEPARATOR_PATTERN = re.compile(r"[\s\-]+")
+
+
+def normalize_keyword(text: str) -> str:
+    """Canonical form used to map a matched span back to its keyword"""
+    text = text.lower().replace("'", '').replace('’', '')
+    return ' '.join(_SEPARATOR_PATTERN.split(text.strip()))
+
+
+def _trie_regex(keywords) -> str:
+    """
+    Build a prefix-factored alternation ("stop|stay" -> "st(?:ay|op)").
+    The regex engine rejects most positions on the first character instead of
+    trying every keyword, and greedy optional tails keep the longest match.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def emit(node):
+        branches = []
+        for char in sorted(key for key in node if key):
+            if char == ' ':
+                fragment = r"[\s\-]+"
+            elif char == "'":
+                fragment = "['’]?"
+            else:
+                fragment = re.escape(char)
+            branches.append(fragment + emit(node[char]))
+
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + body + ')?' if '' in node else body
+
+    return emit(trie)
+
+
+def build_keyword_matcher(categories: Dict[str, tuple]):
+    """
+    Compile keyword lists into one regex plus a lookup table.
+    Whole-word keywords match in group 1 and stems (plus any suffix) in group 2;
+    the table maps each normalised keyword to its category.
+    """
+    lookup = {}
+    words, stems = set(), set()
+
+    for category, keywords in categories.items():
+        for keyword in keywords:
+            stem = keyword.endswith('*')
+            keyword = keyword.rstrip('*').lower()
+            lookup.setdefault(normalize_keyword(keyword), category)
+            (stems if stem else words).add(keyword)
+
+    alternatives = []
+    if words:
+        alternatives.append(r'(' + _trie_regex(words) + r')(?!\w)')
+    if stems:
+        alternatives.append(r'(' + _trie_regex(stems) + r')\w*')
+
+    return re.compile(r'\b(?:' + '|'.join(alternatives) + ')'), lookup
+
+
+KEYWORD_PATTERN, KEYWORD_LOOKUP = build_keyword_matcher(KEYWORD_CATEGORIES)
+OPT_OUT_PATTERN, _ = build_keyword_matcher({'opt_out': OPT_OUT_KEYWORDS})
+
+
+def find_keyword_hits(message_content: str) -> Dict[str, List[str]]:
+    """Return the matched keywords for every category in a single scan of the message"""
+    hits = {category: [] for category in KEYWORD_CATEGORIES}
+
+    for match in KEYWORD_PATTERN.finditer(message_content.lower()):
+        keyword = normalize_keyword(match.group(match.lastindex))
+        hits[KEYWORD_LOOKUP[keyword]].append(normalize_keyword(match.group()))
+
+    return hits
+
+
+def contains_opt_out_keyword(message_content: str) -> bool:
+    """Check for an opt-out keyword, stopping at the first hit"""
+    return OPT_OUT_PATTERN.search(message_content.lower()) is not None
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Load test
+Runs app.py over HTTP (threaded werkzeug server) against fake_provider.py in a scratch
+directory, with campaign tasks run by one worker thread the way the solo Celery pool runs them,
+and drives four phases:
+
+  create   POST /api/start-campaign with generated contact sheets
+  send     every campaign through process_campaign_task (claim, provider call, record)
+  status   the provider's delivered / read callbacks into /webhook/status, queued in Redis and
+           applied by drain_delivery_status_task every STATUS_DRAIN_INTERVAL, as beat runs it
+  replies  a storm of inbound replies into /webhook/whatsapp from --concurrency senders
+
+The report (throughput, latency percentiles, outcomes, the commit it ran on) is printed and
+written to loadtest-results/<commit>-<time>.json; --compare prints the change between two
+reports, so a commit can be checked against the one before it. Keep the options the same
+between runs you compare. Redis is used when it is reachable and noted in the report; the run
+uses --redis-url (a scratch database, not the one real workers use) and clears its status and
+retry queues there first, so nothing is left for a real worker to apply.
+
+Usage: python load_test.py [--contacts 2000] [--campaigns 2] [--replies 2000] [--concurrency 16]
+                           [--redis-url redis://localhost:6380/15]
+                           [fake provider options, see python fake_provider.py --help]
+       python load_test.py --compare loadtest-results/<before>.json loadtest-results/<after>.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import requests
+
+from fake_provider import FakeProvider, add_config_arguments, config_from_arguments
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadtest-results')
+
+REPLY_BODIES = [
+    'Thanks, I love the new collection!', 'How much is the red lace set?', 'STOP', 'Bei gani?',
+    'ok', 'My order was late and the strap is broken', 'Do you deliver to Kisumu', 'hmm',
+    'Asante sana', 'Please unsubscribe me', 'Which sizes do you have in black', 'Nice',
+]
+
+
+def latency_summary(samples: List[float]) -> Dict:
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {'count': len(ordered), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+            'p50_ms': percentile(0.5), 'p90_ms': percentile(0.9), 'p99_ms': percentile(0.99),
+            'max_ms': round(ordered[-1] * 1000, 2)}
+
+
+def phase_report(seconds: float, samples: List[float], **outcomes) -> Dict:
+    return {'seconds': round(seconds, 3),
+            'throughput_per_s': round(len(samples) / seconds, 1) if seconds else None,
+            'latency': latency_summary(samples), **outcomes}
+
+
+def contact_sheet(count: int, offset: int) -> bytes:
+    frame = pd.DataFrame({'phone': [f'2547{offset + i:08d}' for i in range(count)],
+                          'name': [f'Customer {offset + i}' for i in range(count)],
+                          'city': [random.choice(['Nairobi', 'Mombasa', 'Kisumu']) for _ in range(count)]})
+    buffer = BytesIO()
+    frame.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def git_commit() -> Dict:
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], capture_output=True, text=True, timeout=10,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+    return {'commit': git('rev-parse', '--short', 'HEAD') or 'unknown',
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+class SoloWorker:
+    """Runs .delay()ed tasks one at a time on a background thread, like `celery worker --pool=solo`"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='solo-worker')
+        self.futures = []
+
+    def delay(self, task):
+        def submit(*args, **kwargs):
+            self.futures.append(self.executor.submit(task, *args, **kwargs))
+        return submit
+
+    def wait(self):
+        for future in list(self.futures):
+            future.result()
+
+
+class PeriodicDrain:
+    """Runs the status drain task every interval on a background thread, like beat and the periodic worker"""
+
+    def __init__(self, task, interval: float):
+        self.task = task
+        self.interval = interval
+        self.applied = 0
+        self.errors = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True, name='periodic-worker')
+
+    def drain(self):
+        try:
+            self.applied += self.task() or 0
+        except Exception:
+            # The batch went back on the queue; the next drain retries it, as under beat
+            self.errors += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.drain()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Stop the schedule and drain whatever is still queued"""
+        self.stopped.set()
+        self.thread.join()
+        self.drain()
+
+
+def run(args) -> Dict:
+    provider = FakeProvider(config_from_arguments(args))
+    provider_url = provider.start()
+    os.environ.update({
+        'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32, 'TWILIO_AUTH_TOKEN': 'load-test',
+        'TWILIO_API_BASE_URL': provider_url, 'GEMINI_API_KEY': 'load-test', 'GEMINI_API_ENDPOINT': provider_url,
+        # Status and retry queues, control flags: kept out of the Redis database real workers drain
+        'CONTROL_REDIS_URL': args.redis_url,
+    })
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        out = open(os.path.join(directory, 'app.log'), 'w')
+        with contextlib.redirect_stdout(out):
+            import app as app_module
+            import celery_worker
+            from reply_handler import setup_replies_database
+            from opt_out_manager import setup_opt_out_tables
+            from campaign_control import get_redis
+            from delivery_status import STATUS_QUEUE_KEY
+            from retry_scheduler import RETRY_QUEUE_KEY
+            from structured_logging import setup_logging
+            from werkzeug.serving import make_server
+
+            setup_logging(out)
+            app_module.init_db()
+            setup_replies_database()
+            setup_opt_out_tables()
+            try:
+                redis_available = bool(get_redis().ping())
+                get_redis().delete(STATUS_QUEUE_KEY, RETRY_QUEUE_KEY)
+            except Exception:
+                redis_available = False
+
+            server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            app_url = f'http://127.0.0.1:{server.server_port}'
+            os.environ['TWILIO_STATUS_CALLBACK_URL'] = f'{app_url}/webhook/status'
+
+            worker = SoloWorker()
+            celery_worker.process_campaign_task.delay = worker.delay(celery_worker.process_campaign_task)
+            dispatch_times: List[float] = []
+            dispatch_message = celery_worker.dispatch_message
+
+            def timed_dispatch(*dispatch_args):
+                start = time.perf_counter()
+                try:
+                    return dispatch_message(*dispatch_args)
+                finally:
+                    dispatch_times.append(time.perf_counter() - start)
+            celery_worker.dispatch_message = timed_dispatch
+
+            # Without Redis the webhook applies callbacks itself and there is nothing to drain
+            drain = PeriodicDrain(celery_worker.drain_delivery_status_task, celery_worker.STATUS_DRAIN_INTERVAL)
+            if redis_available:
+                drain.start()
+
+            report = {'created_at': datetime.now().isoformat(timespec='seconds'), **git_commit(),
+                      'python': sys.version.split()[0], 'redis': redis_available,
+                      'config': {key: value for key, value in vars(args).items() if key != 'compare'},
+                      'phases': {}}
+            session = requests.Session()
+
+            # create
+            sheets = [contact_sheet(args.contacts, i * args.contacts) for i in range(args.campaigns)]
+            create_times, statuses = [], []
+            send_start = time.perf_counter()
+            for i, sheet in enumerate(sheets):
+                start = time.perf_counter()
+                response = session.post(f'{app_url}/api/start-campaign', data={
+                    'campaign_name': f'Load test {i}', 'message_template': 'Hi {name}, new arrivals in {city}!',
+                    'rate_limit': '0', 'api_key': 'load-test',
+                }, files={'file': (f'contacts-{i}.xlsx', sheet)})
+                create_times.append(time.perf_counter() - start)
+                statuses.append(response.status_code)
+            report['phases']['create'] = phase_report(time.perf_counter() - send_start, create_times,
+                                                      contacts_per_campaign=args.contacts,
+                                                      errors=sum(status != 200 for status in statuses))
+            print(f"   create   {args.campaigns} campaigns", file=sys.__stdout__)
+
+            # send
+            worker.wait()
+            send_seconds = time.perf_counter() - send_start
+            conn = sqlite3.connect('whatsapp_campaigns.db')
+            outcomes = dict(conn.execute("SELECT status, COUNT(*) FROM messages GROUP BY status").fetchall())
+            report['phases']['send'] = phase_report(send_seconds, dispatch_times, outcomes=outcomes)
+            print(f"   send     {len(dispatch_times):,} messages", file=sys.__stdout__)
+
+            # status callbacks, which have been arriving since the first message went out
+            drain_start = time.perf_counter()
+            deadline = drain_start + args.drain_timeout
+            while time.perf_counter() < deadline:
+                stats = provider.stats()
+                done = stats['counts'].get('callbacks_delivered', 0) + stats['counts'].get('callbacks_failed', 0)
+                if not stats['pending_callbacks'] and done >= len(stats['callback_latencies']):
+                    break
+                time.sleep(0.2)
+            time.sleep(0.5)
+            if redis_available:
+                drain.stop()
+            stats = provider.stats()
+            statuses = dict(conn.execute('''
+                SELECT status, COUNT(*) FROM messages WHERE status IN ('delivered', 'read') GROUP BY status
+            ''').fetchall())
+            report['phases']['status'] = phase_report(
+                send_seconds + time.perf_counter() - drain_start, stats['callback_latencies'],
+                drain_after_send_s=round(time.perf_counter() - drain_start, 3),
+                failed=stats['counts'].get('callbacks_failed', 0), applied=statuses,
+                drained=drain.applied, drain_errors=drain.errors,
+                left_queued=get_redis().llen(STATUS_QUEUE_KEY) if redis_available else 0)
+            print(f"   status   {len(stats['callback_latencies']):,} callbacks", file=sys.__stdout__)
+
+            # replies
+            phones = [row[0] for row in conn.execute("SELECT phone_canonical FROM contacts").fetchall()]
+            local = threading.local()
+            rng = random.Random(7)
+            storm = [(rng.choice(phones), rng.choice(REPLY_BODIES)) for _ in range(args.replies)]
+
+            def post_reply(reply):
+                if not hasattr(local, 'session'):
+                    local.session = requests.Session()
+                start = time.perf_counter()
+                response = local.session.post(f'{app_url}/webhook/whatsapp',
+                                              data={'From': f'whatsapp:{reply[0]}', 'Body': reply[1], 'NumMedia': '0'})
+                return time.perf_counter() - start, response.status_code
+
+            reply_start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(post_reply, storm))
+            reply_seconds = time.perf_counter() - reply_start
+            stored = conn.execute("SELECT COUNT(*) FROM replies").fetchone()[0]
+            report['phases']['replies'] = phase_report(
+                reply_seconds, [elapsed for elapsed, _ in results], concurrency=args.concurrency,
+                errors=sum(status != 200 for _, status in results), stored=stored,
+                gemini_requests=provider.stats()['counts'].get('gemini_requests', 0))
+            print(f"   replies  {len(results):,} webhooks", file=sys.__stdout__)
+
+            conn.close()
+            server.shutdown()
+            provider.stop()
+        out.close()
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    return report
+
+
+def print_report(report: Dict):
+    print(f"\n📊 Load test on {report['commit']}{' (uncommitted changes)' if report['dirty'] else ''}, "
+          f"Redis {'on' if report['redis'] else 'off'}")
+    for name, phase in report['phases'].items():
+        latency = phase['latency']
+        extra = {key: value for key, value in phase.items() if key not in ('seconds', 'throughput_per_s', 'latency')}
+        print(f"   {name:<8} {phase['throughput_per_s'] or 0:9,.1f}/s  p50 {latency.get('p50_ms', 0):8.1f} ms  "
+              f"p99 {latency.get('p99_ms', 0):8.1f} ms  {json.dumps(extra)}")
+
+
+def compare(before: Dict, after: Dict):
+    print(f"\n📊 {before['commit']} → {after['commit']}")
+    if before['config'] != after['config']:
+        print("   ⚠️ The runs used different options; differences may not be the code's")
+    for name in after['phases']:
+        if name not in before['phases']:
+            continue
+        old, new = before['phases'][name], after['phases'][name]
+        rows = [('throughput/s', old['throughput_per_s'], new['throughput_per_s'])]
+        rows += [(key, old['latency'].get(key), new['latency'].get(key)) for key in ('p50_ms', 'p90_ms', 'p99_ms')]
+        for label, a, b in rows:
+            change = f"{(b - a) / a:+.1%}" if a and b is not None else 'n/a'
+            print(f"   {name:<8} {label:<13} {a or 0:10,.1f} → {b or 0:10,.1f}   {change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test app.py against the fake provider')
+    parser.add_argument('--contacts', type=int, default=2000, help='contacts per campaign')
+    parser.add_argument('--campaigns', type=int, default=2)
+    parser.add_argument('--replies', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent reply senders')
+    parser.add_argument('--drain-timeout', type=float, default=120, help='seconds to wait for status callbacks')
+    parser.add_argument('--redis-url', default='redis://localhost:6380/15',
+                        help='scratch Redis database for the status and retry queues (its queues are cleared)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        sys.exit(0)
+
+    if args.seed is None:
+        args.seed = 1
+    random.seed(args.seed)
+    print(f"⚙️ Load testing: {args.campaigns} x {args.contacts:,} contacts, {args.replies:,} replies")
+    report = run(args)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{report['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\n💾 {path}")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Message Templates
+Campaign templates are parsed once into literal text and {field} slots. Message rows only keep
+the variables their template uses, and the text is rendered when the message is sent.
+"""
+
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+# Keep the rendered text of sent messages on their rows (for audits); off by default
+PERSIST_RENDERED_MESSAGES = os.getenv('PERSIST_RENDERED_MESSAGES', 'false').lower() == 'true'
+
+_FIELD_PATTERN = re.compile(r'\{([^{}]+)\}')
+_variables_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+class CompiledTemplate:
+    """A message template split into alternating literal text and field names"""
+
+    def __init__(self, template: str):
+        self.template = template
+        # re.split with one group alternates literal, field, literal, ... ending on a literal
+        self.parts = _FIELD_PATTERN.split(template)
+        self.fields: Tuple[str, ...] = tuple(dict.fromkeys(self.parts[1::2]))
+
+    def variables_for(self, contact: Dict) -> Dict[str, str]:
+        """The contact values this template uses"""
+        return {field: str(contact[field]) for field in self.fields if field in contact}
+
+    def render(self, variables: Dict) -> str:
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            field = parts[i]
+            # Placeholders without a value stay in the text, as they always have
+            parts[i] = variables[field] if field in variables else '{' + field + '}'
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_template(template: str) -> CompiledTemplate:
+    return CompiledTemplate(template)
+
+
+def encode_variables(variables: Dict[str, str]) -> Optional[str]:
+    return _variables_encoder.encode(variables) if variables else None
+
+
+def render_message(template: CompiledTemplate, variables_json: Optional[str]) -> str:
+    """Message text from a stored variables row"""
+    return template.render(json.loads(variables_json) if variables_json else {})
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Metrics
+Prometheus counters and histograms (prometheus_client) for the send pipeline, webhooks and reply
+classification, served by the Flask app at /metrics and by the Celery worker on
+WORKER_METRICS_PORT.
+
+Queue depths and rate limiter tokens are gauges read when the endpoint is scraped. A prefork
+worker pool runs tasks in child processes: with PROMETHEUS_MULTIPROC_DIR set in the worker's
+environment every process records into files there and the exporter adds them up. The default
+solo pool runs tasks in the main process and needs neither.
+"""
+
+import glob
+import os
+import sqlite3
+from typing import Dict
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               disable_created_metrics, generate_latest, multiprocess)
+from prometheus_client import start_http_server as start_exporter
+from prometheus_client.core import GaugeMetricFamily
+
+from rate_limiter import provider_limiter
+
+# Port of the worker's /metrics exporter; 0 turns it off
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', '9808'))
+# Directory prefork worker processes record into; prometheus_client reads it on import, so it
+# has to be in the worker's environment rather than .env. Unset for the solo pool
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Upper bounds (seconds) for request-style latencies: provider calls, webhooks, classification
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+if MULTIPROC_DIR:
+    # Unlabelled counters open their file as soon as they are defined, some of them on import
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# A _created series per campaign and outcome would double /metrics for a timestamp nobody graphs
+disable_created_metrics()
+
+# The pipeline's metrics
+PROVIDER_LATENCY = Histogram('whatsapp_provider_request_seconds',
+                             'Time taken by the provider (Twilio) send call', ['outcome'], buckets=LATENCY_BUCKETS)
+WEBHOOK_LATENCY = Histogram('whatsapp_webhook_seconds', 'Time to handle a provider webhook', ['webhook'],
+                            buckets=LATENCY_BUCKETS)
+CLASSIFICATION_LATENCY = Histogram('whatsapp_reply_classification_seconds',
+                                   'Time to classify a reply, by classifier', ['method'], buckets=LATENCY_BUCKETS)
+MESSAGES = Counter('whatsapp_messages_total',
+                   'Outbound messages by outcome (sent, failed, deferred, retried, suppressed)',
+                   ['campaign_id', 'outcome', 'error_class'])
+ENDPOINT_QUERIES = Histogram('whatsapp_endpoint_queries', 'SQL statements run per API request', ['endpoint'],
+                             buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+SLOW_QUERIES = Counter('whatsapp_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS, by call site', ['site'])
+
+
+def queue_depths() -> Dict[str, float]:
+    """Status callbacks waiting in Redis, and messages and confirmations waiting in the database"""
+    import redis
+    from campaign_control import get_redis
+    from delivery_status import STATUS_QUEUE_KEY
+
+    depths = {}
+    try:
+        depths['status_callbacks'] = get_redis().llen(STATUS_QUEUE_KEY)
+    except redis.RedisError:
+        pass
+
+    # Each count is served by a partial index on the status it counts
+    from db import connect
+    conn = connect()
+    try:
+        for queue, query in (
+            ('retry_scheduled', "SELECT COUNT(*) FROM messages WHERE status = 'retry_scheduled'"),
+            ('deferred', "SELECT COUNT(*) FROM messages WHERE status = 'deferred'"),
+            ('opt_out_confirmations', "SELECT COUNT(*) FROM opt_out_queue WHERE sent = FALSE"),
+        ):
+            try:
+                depths[queue] = conn.execute(query).fetchone()[0]
+            except sqlite3.Error:
+                pass
+    finally:
+        conn.close()
+    return depths
+
+
+class ScrapeTimeGauges:
+    """Gauges read when /metrics is scraped rather than recorded, so they are never stale"""
+
+    def describe(self):
+        """The gauges without values, so registering them doesn't touch Redis or the database"""
+        return [
+            GaugeMetricFamily('whatsapp_queue_depth', 'Work waiting in each queue', labels=['queue']),
+            GaugeMetricFamily('whatsapp_rate_limiter_tokens',
+                              'Sends the provider rate limiter would allow now; negative while senders queue',
+                              labels=[]),
+        ]
+
+    def collect(self):
+        depth, tokens = self.describe()
+        for queue, value in queue_depths().items():
+            depth.add_metric([queue], value)
+        tokens.add_metric([], provider_limiter.tokens())
+        return [depth, tokens]
+
+
+SCRAPE_TIME_GAUGES = ScrapeTimeGauges()
+REGISTRY.register(SCRAPE_TIME_GAUGES)
+
+
+def scrape_registry(directory: str = None) -> CollectorRegistry:
+    """What /metrics serves: this process's registry, or every process's files in a multiprocess directory"""
+    directory = directory if directory is not None else MULTIPROC_DIR
+    if not directory:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=directory)
+    registry.register(SCRAPE_TIME_GAUGES)
+    return registry
+
+
+def render(registry: CollectorRegistry = None) -> bytes:
+    """Prometheus text exposition format"""
+    return generate_latest(registry or scrape_registry())
+
+
+def clear_process_files(directory: str = None):
+    """Drop files left by a previous worker run (each is named after its pid) but not this process's own"""
+    own = f'_{os.getpid()}.db'
+    for path in glob.glob(os.path.join(directory or MULTIPROC_DIR, '*.db')):
+        if not path.endswith(own):
+            os.remove(path)
+
+
+def start_http_server(port: int, address: str = ''):
+    """Serve /metrics from a daemon thread (the worker's exporter); returns the server and its thread"""
+    return start_exporter(port, address, registry=scrape_registry())
@@ -4,15 +4,32 @@ Opt-out Management System for WhatsApp Business Compliance
 Handles opt-out confirmations, scheduling, and contact list management
 """
 
-import sqlite3
+import logging
+import os
+import uuid
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 import json
 
+from phone_numbers import canonical_phone_number, ensure_phone_canonical_column
+from responder_sketches import count_responders_by_campaign
+from metrics import MESSAGES
+from db import connect
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+# Confirmations claimed and sent per batch by the dispatcher
+CONFIRMATION_BATCH_SIZE = int(os.getenv('CONFIRMATION_BATCH_SIZE', '100'))
+# Provider attempts per confirmation before it is left for someone to look at
+CONFIRMATION_MAX_ATTEMPTS = int(os.getenv('CONFIRMATION_MAX_ATTEMPTS', '5'))
+# Seconds after which a claimed but unfinished batch may be claimed again
+CONFIRMATION_CLAIM_TIMEOUT = int(os.getenv('CONFIRMATION_CLAIM_TIMEOUT', '300'))
+
 
 def setup_opt_out_tables():
     """Create database tables for opt-out management"""
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn = connect()
     cursor = conn.cursor()
     
     # Opt-out queue for scheduled confirmations
@@ -37,13 +54,25 @@ def setup_opt_out_tables():
             sender_name TEXT,
             opted_out_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             reason TEXT,
-            source TEXT DEFAULT 'reply'
+            source TEXT DEFAULT 'reply',
+            phone_canonical TEXT
         )
     ''')
+    ensure_phone_canonical_column(cursor, 'opt_out_list')
+    
+    # The queue may have been created by reply_handler without the message columns
+    cursor.execute("PRAGMA table_info(opt_out_queue)")
+    queue_columns = [column[1] for column in cursor.fetchall()]
+    for name, definition in (('message', 'TEXT'), ('sent_at', 'TIMESTAMP'), ('claim_token', 'TEXT'),
+                             ('claimed_at', 'TIMESTAMP'), ('attempts', 'INTEGER DEFAULT 0'), ('last_error', 'TEXT')):
+        if name not in queue_columns:
+            cursor.execute(f"ALTER TABLE opt_out_queue ADD COLUMN {name} {definition}")
     
     # Create indexes
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_optout_queue_scheduled ON opt_out_queue(scheduled_time, sent)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_optout_queue_due ON opt_out_queue(scheduled_time) WHERE sent = FALSE')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_optout_list_phone ON opt_out_list(phone_number)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_optout_list_canonical ON opt_out_list(phone_canonical)')
     
     conn.commit()
     conn.close()
@@ -51,7 +80,7 @@ def setup_opt_out_tables():
 
 def get_pending_opt_out_confirmations() -> List[Dict]:
     """Get all pending opt-out confirmations ready to be sent"""
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn = connect()
     cursor = conn.cursor()
     
     # Get confirmations that are scheduled and not yet sent
@@ -80,7 +109,7 @@ def get_pending_opt_out_confirmations() -> List[Dict]:
 def mark_opt_out_confirmation_sent(confirmation_id: int) -> bool:
     """Mark an opt-out confirmation as sent"""
     try:
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -93,13 +122,163 @@ def mark_opt_out_confirmation_sent(confirmation_id: int) -> bool:
         conn.close()
         return True
     except Exception as e:
-        print(f"Error marking confirmation as sent: {e}")
+        log_event(logger, 'opt_out_confirmation_mark_failed', logging.ERROR, exc_info=e,
+                  confirmation_id=confirmation_id)
         return False
 
 
-def get_opt_out_analytics() -> Dict:
-    """Get analytics about opt-outs"""
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+def claim_due_confirmations(conn, limit: int = None, now: datetime = None) -> Tuple[str, List[tuple]]:
+    """
+    Claim up to limit due confirmations for one dispatcher and return (claim token, rows of
+    (id, phone_number, sender_name, message, scheduled_time)). Rows held by a dispatcher that
+    died, or whose send failed, are claimable again after CONFIRMATION_CLAIM_TIMEOUT.
+    """
+    limit = limit or CONFIRMATION_BATCH_SIZE
+    now = now or datetime.now()
+    stale = (now - timedelta(seconds=CONFIRMATION_CLAIM_TIMEOUT)).isoformat()
+    token = uuid.uuid4().hex
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT id FROM opt_out_queue
+        WHERE sent = FALSE AND scheduled_time <= ? AND attempts < ?
+          AND (claim_token IS NULL OR claimed_at < ?)
+        ORDER BY scheduled_time
+        LIMIT ?
+    ''', (now.isoformat(), CONFIRMATION_MAX_ATTEMPTS, stale, limit))
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        return token, []
+    
+    placeholders = ','.join('?' * len(ids))
+    cursor.execute(f'''
+        UPDATE opt_out_queue SET claim_token = ?, claimed_at = ?
+        WHERE id IN ({placeholders}) AND sent = FALSE AND (claim_token IS NULL OR claimed_at < ?)
+    ''', [token, now.isoformat()] + ids + [stale])
+    cursor.execute(f'''
+        SELECT id, phone_number, sender_name, message, scheduled_time FROM opt_out_queue
+        WHERE id IN ({placeholders}) AND claim_token = ?
+        ORDER BY scheduled_time
+    ''', ids + [token])
+    rows = cursor.fetchall()
+    conn.commit()
+    return token, rows
+
+
+def record_confirmation_results(conn, token: str, sent: List[Tuple[int, str]], failed: List[Tuple[int, str]]):
+    """Mark a claimed batch once the provider has answered: sent [(id, sent_at)], failed [(id, error)]"""
+    cursor = conn.cursor()
+    cursor.executemany('''
+        UPDATE opt_out_queue
+        SET sent = TRUE, sent_at = ?, claim_token = NULL, attempts = attempts + 1
+        WHERE id = ? AND claim_token = ?
+    ''', [(sent_at, confirmation_id, token) for confirmation_id, sent_at in sent])
+    # Failures keep their claim, so the claim timeout doubles as the retry backoff
+    cursor.executemany('''
+        UPDATE opt_out_queue SET attempts = attempts + 1, last_error = ?
+        WHERE id = ? AND claim_token = ?
+    ''', [(error, confirmation_id, token) for confirmation_id, error in failed])
+    conn.commit()
+
+
+def dispatch_opt_out_confirmations(send: Callable, max_batches: int = None) -> Dict:
+    """
+    Send due confirmations a claimed batch at a time through send(phone, message, api_key),
+    the shared rate-limited sender. Results are written per batch after the provider answers.
+    """
+    from reply_handler import get_compliant_opt_out_message
+    
+    api_key = os.getenv('WHATSAPP_API_KEY')
+    conn = connect()
+    summary = {'claimed': 0, 'sent': 0, 'failed': 0, 'errors': [], 'latencies': []}
+    batches = 0
+    
+    try:
+        while max_batches is None or batches < max_batches:
+            token, rows = claim_due_confirmations(conn)
+            if not rows:
+                break
+            batches += 1
+            summary['claimed'] += len(rows)
+            
+            sent, failed = [], []
+            for confirmation_id, phone_number, sender_name, message, scheduled_time in rows:
+                try:
+                    success, result = send(phone_number, message or get_compliant_opt_out_message(sender_name), api_key)
+                except Exception as e:
+                    success, result = False, str(e)
+                
+                if success:
+                    sent_at = datetime.now()
+                    sent.append((confirmation_id, sent_at.isoformat()))
+                    summary['latencies'].append((sent_at - datetime.fromisoformat(scheduled_time)).total_seconds())
+                else:
+                    failed.append((confirmation_id, result))
+                    summary['errors'].append(f"Failed to send to {phone_number}: {result}")
+            
+            record_confirmation_results(conn, token, sent, failed)
+            summary['sent'] += len(sent)
+            summary['failed'] += len(failed)
+    finally:
+        conn.close()
+    
+    if summary['claimed']:
+        latencies = summary['latencies']
+        log_event(logger, 'opt_out_confirmations_sent', sent=summary['sent'], failed=summary['failed'],
+                  latency_mean=round(sum(latencies) / max(len(latencies), 1), 1),
+                  latency_max=round(max(latencies, default=0), 1))
+    return summary
+
+
+def get_opt_out_confirmation_metrics(window_hours: int = 24) -> Dict:
+    """Backlog size and scheduled-to-sent latency of opt-out confirmations"""
+    conn = connect()
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    
+    cursor.execute('''
+        SELECT COUNT(*), MIN(scheduled_time) FROM opt_out_queue
+        WHERE sent = FALSE AND scheduled_time <= ? AND attempts < ?
+    ''', (now, CONFIRMATION_MAX_ATTEMPTS))
+    due, oldest_due = cursor.fetchone()
+    cursor.execute('''
+        SELECT COUNT(*) FROM opt_out_queue WHERE sent = FALSE AND scheduled_time > ?
+    ''', (now,))
+    scheduled = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT COUNT(*) FROM opt_out_queue WHERE sent = FALSE AND attempts >= ?
+    ''', (CONFIRMATION_MAX_ATTEMPTS,))
+    gave_up = cursor.fetchone()[0]
+    
+    cursor.execute('''
+        SELECT (julianday(sent_at) - julianday(scheduled_time)) * 86400.0 AS latency
+        FROM opt_out_queue
+        WHERE sent = TRUE AND sent_at >= ?
+        ORDER BY latency
+    ''', ((datetime.now() - timedelta(hours=window_hours)).isoformat(),))
+    latencies = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    
+    def percentile(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))], 3) if latencies else None
+    
+    return {
+        'backlog_due': due,
+        'backlog_scheduled': scheduled,
+        'backlog_gave_up': gave_up,
+        'oldest_due_seconds': round((datetime.now() - datetime.fromisoformat(oldest_due)).total_seconds(), 3)
+                              if oldest_due else None,
+        'latency_window_hours': window_hours,
+        'latency_count': len(latencies),
+        'latency_p50_seconds': percentile(0.5),
+        'latency_p95_seconds': percentile(0.95),
+        'latency_max_seconds': round(latencies[-1], 3) if latencies else None,
+    }
+
+
+def get_opt_out_analytics(exact: bool = False) -> Dict:
+    """Get analytics about opt-outs (per-campaign opt-outs estimated from sketches unless exact)"""
+    conn = connect()
     cursor = conn.cursor()
     
     # Total opt-outs
@@ -117,26 +296,20 @@ def get_opt_out_analytics() -> Dict:
     cursor.execute('SELECT COUNT(*) FROM opt_out_queue WHERE sent = FALSE')
     pending_confirmations = cursor.fetchone()[0]
     
-    # Opt-out rate per campaign
-    cursor.execute('''
-        SELECT c.name, COUNT(DISTINCT r.phone_number) as opt_outs,
-               c.total_contacts,
-               ROUND(COUNT(DISTINCT r.phone_number) * 100.0 / c.total_contacts, 2) as opt_out_rate
-        FROM campaigns c
-        LEFT JOIN replies r ON c.id = r.campaign_id AND r.is_opt_out = TRUE
-        WHERE c.total_contacts > 0
-        GROUP BY c.id, c.name, c.total_contacts
-        ORDER BY opt_out_rate DESC
-    ''')
+    # Opt-out rate per campaign: distinct opted-out responders merged from the daily sketches
+    opt_outs_by_campaign = count_responders_by_campaign(cursor, kind='opt_out', exact=exact)
+    cursor.execute('SELECT id, name, total_contacts FROM campaigns WHERE total_contacts > 0')
     
     campaign_rates = []
-    for row in cursor.fetchall():
+    for campaign_id, name, total_contacts in cursor.fetchall():
+        opt_outs = opt_outs_by_campaign.get(campaign_id, 0)
         campaign_rates.append({
-            'campaign': row[0],
-            'opt_outs': row[1],
-            'total_contacts': row[2],
-            'opt_out_rate': row[3]
+            'campaign': name,
+            'opt_outs': opt_outs,
+            'total_contacts': total_contacts,
+            'opt_out_rate': round(opt_outs * 100.0 / total_contacts, 2)
         })
+    campaign_rates.sort(key=lambda rate: rate['opt_out_rate'], reverse=True)
     
     conn.close()
     
@@ -150,50 +323,39 @@ def get_opt_out_analytics() -> Dict:
 
 def is_phone_opted_out(phone_number: str) -> bool:
     """Check if a phone number has opted out"""
-    from reply_handler import get_phone_number_variations
-    
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn = connect()
     cursor = conn.cursor()
     
-    # Check all variations of the phone number
-    variations = get_phone_number_variations(phone_number)
-    
-    for variation in variations:
-        cursor.execute('SELECT id FROM opt_out_list WHERE phone_number = ?', (variation,))
-        if cursor.fetchone():
-            conn.close()
-            return True
+    # Every stored format shares one canonical number
+    cursor.execute('SELECT 1 FROM opt_out_list WHERE phone_canonical = ? LIMIT 1',
+                   (canonical_phone_number(phone_number),))
+    opted_out = cursor.fetchone() is not None
     
     conn.close()
-    return False
+    return opted_out
 
 
 def remove_opted_out_contacts_from_campaign(campaign_id: int) -> int:
     """Remove opted-out contacts from a campaign and return count removed"""
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn = connect()
     cursor = conn.cursor()
     
-    # Get all opt-out phone numbers
-    cursor.execute('SELECT phone_number FROM opt_out_list')
-    opted_out_numbers = [row[0] for row in cursor.fetchall()]
-    
-    removed_count = 0
-    
-    # Remove messages for opted-out numbers from the campaign
-    for phone_number in opted_out_numbers:
-        from reply_handler import get_phone_number_variations
-        variations = get_phone_number_variations(phone_number)
-        
-        for variation in variations:
-            cursor.execute('''
-                DELETE FROM messages 
-                WHERE campaign_id = ? AND phone_number = ?
-            ''', (campaign_id, variation))
-            removed_count += cursor.rowcount
+    # Remove messages for opted-out numbers from the campaign in one statement
+    cursor.execute('''
+        DELETE FROM messages 
+        WHERE campaign_id = ? AND contact_id IN (
+            SELECT c.id FROM contacts c
+            JOIN opt_out_list o ON o.phone_canonical = c.phone_canonical
+        )
+    ''', (campaign_id,))
+    removed_count = cursor.rowcount
     
     conn.commit()
     conn.close()
     
+    if removed_count:
+        MESSAGES.labels(campaign_id, 'suppressed', 'opt_out').inc(removed_count)
+    
     return removed_count
 
 
@@ -215,7 +377,7 @@ def schedule_opt_out_confirmation_message(phone_number: str, sender_name: str =
         else:
             scheduled_time = datetime.now()  # Default to now
         
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -226,17 +388,17 @@ def schedule_opt_out_confirmation_message(phone_number: str, sender_name: str =
         conn.commit()
         conn.close()
         
-        print(f"📅 Opt-out confirmation scheduled for {phone_number} at {scheduled_time}")
+        log_event(logger, 'opt_out_confirmation_scheduled', scheduled_time=scheduled_time)
         return True
         
     except Exception as e:
-        print(f"❌ Error scheduling opt-out confirmation: {e}")
+        log_event(logger, 'opt_out_confirmation_failed', logging.ERROR, exc_info=e)
         return False
 
 
 def get_opt_out_queue_status() -> List[Dict]:
     """Get status of all items in opt-out queue"""
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn = connect()
     cursor = conn.cursor()
     
     cursor.execute('''
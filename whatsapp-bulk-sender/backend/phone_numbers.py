@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Phone Number Canonicalisation
+One canonical E.164 form ("+254712345678") for storage, indexing and lookups
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+MIGRATION_BATCH_SIZE = 50000
+DEFAULT_COUNTRY = os.getenv('DEFAULT_PHONE_COUNTRY', 'KE')
+PHONE_CACHE_SIZE = int(os.getenv('PHONE_CACHE_SIZE', '65536'))
+
+# Country -> (dial code, national significant number length)
+COUNTRY_RULES = {
+    'KE': ('254', 9),
+    'UG': ('256', 9),
+    'TZ': ('255', 9),
+    'RW': ('250', 9),
+    'BI': ('257', 8),
+    'ET': ('251', 9),
+    'SS': ('211', 9),
+    'SO': ('252', 8),
+    'ZA': ('27', 9),
+    'NG': ('234', 10),
+    'GB': ('44', 10),
+    'US': ('1', 10),
+}
+
+# Precomputed: dial code -> full international length (dial code + national number)
+INTERNATIONAL_LENGTHS = {code: len(code) + length for code, length in COUNTRY_RULES.values()}
+DIAL_CODE_COUNTRIES = {code: country for country, (code, _) in COUNTRY_RULES.items()}
+DIAL_CODE_SIZES = sorted({len(code) for code in INTERNATIONAL_LENGTHS}, reverse=True)
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+def _digits(phone_number) -> str:
+    """Digits of a raw number ('whatsapp:+254 712-345-678', 712345678.0) with everything else dropped"""
+    if isinstance(phone_number, float) and phone_number.is_integer():
+        # Excel hands numeric phone cells over as floats
+        phone_number = int(phone_number)
+    phone_number = str(phone_number)
+    return phone_number if phone_number.isdigit() else _NON_DIGITS.sub('', phone_number)
+
+
+def _parse_digits(digits: str, country: str) -> Optional[str]:
+    dial_code, national_length = COUNTRY_RULES[country]
+
+    # National formats for the default country: 0712345678 / 712345678
+    if len(digits) == national_length + 1 and digits[0] == '0':
+        return '+' + dial_code + digits[1:]
+    if len(digits) == national_length and digits[0] != '0':
+        return '+' + dial_code + digits
+
+    # International format for a known country must have that country's length
+    for size in DIAL_CODE_SIZES:
+        expected_length = INTERNATIONAL_LENGTHS.get(digits[:size])
+        if expected_length is not None:
+            return '+' + digits if len(digits) == expected_length else None
+
+    # Any other country: accept E.164-sized numbers as given
+    return '+' + digits if 10 <= len(digits) <= 15 else None
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def _parse_cached(phone_number: str, country: str) -> Optional[str]:
+    return _parse_digits(_digits(phone_number), country)
+
+
+def parse_phone_number(phone_number, country: str = DEFAULT_COUNTRY) -> Optional[str]:
+    """Canonical E.164 form ("+254712345678"), or None if this isn't a valid number"""
+    if not isinstance(phone_number, str):
+        phone_number = _digits(phone_number)
+    return _parse_cached(phone_number, country)
+
+
+def canonical_phone_number(phone_number) -> str:
+    """
+    Canonical E.164 form of a phone number (0712345678 = 254712345678 = +254712345678).
+    Used as a lookup key, so numbers that don't validate still get a stable '+digits' form.
+    """
+    return parse_phone_number(phone_number) or '+' + _digits(phone_number)
+
+
+def country_for_phone(phone_number) -> Optional[str]:
+    """Country of a number from its dial code, or None for countries without rules"""
+    digits = _digits(canonical_phone_number(phone_number))
+    for size in DIAL_CODE_SIZES:
+        country = DIAL_CODE_COUNTRIES.get(digits[:size])
+        if country is not None:
+            return country
+    return None
+
+
+def validate_phone_number(phone, country: str = DEFAULT_COUNTRY) -> Optional[str]:
+    """Validate and format a contact's phone number for storage ("254712345678", no '+'), or None"""
+    canonical = parse_phone_number(phone, country)
+    return canonical[1:] if canonical else None
+
+
+def validate_phone_series(phones: pd.Series, country: str = DEFAULT_COUNTRY) -> pd.Series:
+    """
+    Column-at-a-time validate_phone_number for ingestion: each distinct value is parsed once
+    and mapped back, so repeated numbers in a contact sheet cost nothing extra.
+    Returns the storage form ("254712345678") per row, None where the number is invalid.
+    """
+    if pd.api.types.is_float_dtype(phones):
+        phones = phones.astype('Int64')
+    codes, uniques = pd.factorize(phones.astype(str))
+
+    parsed = np.empty(len(uniques), dtype=object)
+    for i, phone in enumerate(uniques):
+        canonical = _parse_digits(_digits(phone), country)
+        parsed[i] = canonical[1:] if canonical else None
+    return pd.Series(parsed[codes], index=phones.index)
+
+
+def ensure_phone_canonical_column(cursor, table: str) -> int:
+    """
+    Add the phone_canonical column to an existing table and backfill it.
+    Only runs the backfill when the column is first added, so calling this on
+    every startup is cheap. Returns the number of rows backfilled.
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'phone_canonical' in columns:
+        return 0
+
+    print(f"⚙️ Adding phone_canonical column to {table}...")
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN phone_canonical TEXT")
+
+    backfilled = 0
+    last_id = 0
+    while True:
+        cursor.execute(f'''
+            SELECT id, phone_number FROM {table}
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, MIGRATION_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        cursor.executemany(
+            f"UPDATE {table} SET phone_canonical = ? WHERE id = ?",
+            [(canonical_phone_number(phone) if phone else None, row_id) for row_id, phone in rows]
+        )
+        backfilled += len(rows)
+        last_id = rows[-1][0]
+
+    print(f"✅ Backfilled phone_canonical for {backfilled} {table} rows")
+    return backfilled
+
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Profiling
+Profiles of single API requests and Celery task runs, switched on where they are needed:
+
+  requests  PROFILE_REQUESTS=true profiles every request; with PROFILE_TOKEN set, a request
+            sending "X-Profile: <token>" is profiled (and "X-Profile-Mode: sample" picks the mode)
+  tasks     PROFILE_TASKS=process_campaign_task,... (or 'all') profiles every run of those tasks;
+            task.apply_async(..., headers={'profile': 'sample'}) profiles one run
+
+Each profile writes to PROFILE_DIR:
+  <id>.prof  cProfile stats (python -m pstats, snakeviz), in the default 'cprofile' mode
+  <id>.txt   collapsed stacks sampled every PROFILE_SAMPLE_INTERVAL seconds, in 'sample' mode;
+             the format of `py-spy record --format raw`, for flamegraph.pl or speedscope. Sampling
+             costs far less than cProfile on long tasks such as a campaign run
+  <id>.json  duration, the slowest functions, and every SQL statement run with its call count,
+             time and rows. Statements run PROFILE_REPEAT_THRESHOLD or more times are listed
+             under 'repeated': a query per item in a loop (N+1) shows up there
+
+SQL comes from the connections db.connect() opens, with the call sites that ran each statement.
+Responses to profiled requests carry the profile's id in an X-Profile-Id header.
+"""
+
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from functools import wraps
+from typing import Dict, List, Optional
+
+from db import Query, QueryRecorder, normalize_statement
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# 'cprofile' (every call, .prof) or 'sample' (stack samples, py-spy raw format)
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'cprofile')
+# Profile every API request
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', 'false').lower() == 'true'
+# Task names profiled on every run, comma-separated, or 'all'
+PROFILE_TASKS = os.getenv('PROFILE_TASKS', '')
+# Secret a request sends in X-Profile to be profiled; unset ignores the header
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+# Calls of one statement within a profile that mark it as a likely N+1 pattern
+PROFILE_REPEAT_THRESHOLD = int(os.getenv('PROFILE_REPEAT_THRESHOLD', '10'))
+
+MODES = ('cprofile', 'sample')
+
+
+class StatementStats:
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'rows', 'sites')
+
+    def __init__(self):
+        self.calls, self.seconds, self.max_seconds, self.rows = 0, 0.0, 0.0, 0
+        self.sites = set()
+
+    def add(self, seconds: float, rows: int, call_seconds: Optional[float] = None):
+        """A new call, or with call_seconds, rows fetched for the call in progress"""
+        self.seconds += seconds
+        self.rows += rows
+        if call_seconds is None:
+            self.calls += 1
+            call_seconds = seconds
+        if call_seconds > self.max_seconds:
+            self.max_seconds = call_seconds
+
+
+class Sampler(threading.Thread):
+    """Samples one thread's stack every interval into collapsed stacks"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Dict[str, int] = defaultdict(int)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Profile(QueryRecorder):
+    """Profiles the code run inside `with Profile(...)` on this thread and writes it out at the end"""
+
+    def __init__(self, kind: str, name: str, mode: Optional[str] = None):
+        self.kind = kind
+        self.name = name
+        self.mode = mode if mode in MODES else PROFILE_MODE
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', name).strip('-')[:60]
+        self.started_at = datetime.now()
+        self.id = f"{self.started_at:%Y%m%d-%H%M%S}-{kind}-{slug}-{uuid.uuid4().hex[:6]}"
+        self.statements: Dict[str, StatementStats] = {}
+        self.profiler: Optional[cProfile.Profile] = None
+        self.sampler: Optional[Sampler] = None
+        self.path: Optional[str] = None
+
+    def statement(self, sql: str) -> StatementStats:
+        stats = self.statements.get(sql)
+        if stats is None:
+            stats = self.statements[sql] = StatementStats()
+        return stats
+
+    def record(self, query: Query):
+        stats = self.statement(query.sql)
+        stats.add(query.seconds, query.rows)
+        stats.sites.add(query.site)
+
+    def fetched(self, query: Query, seconds: float, rows: int):
+        self.statement(query.sql).add(seconds, rows, query.seconds)
+
+    def __enter__(self):
+        super().__enter__()
+        if self.mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler is running in this process; sample instead
+                self.profiler, self.mode = None, 'sample'
+        if self.mode == 'sample':
+            self.sampler = Sampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+            self.sampler.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        super().__exit__(*exc_info)
+        try:
+            self.path = self.write()
+            log_event(logger, 'profile_written', kind=self.kind, name=self.name, path=self.path,
+                      duration_ms=round(self.duration * 1000, 1))
+        except OSError as e:
+            log_event(logger, 'profile_write_failed', logging.WARNING, name=self.name, error=str(e))
+
+    def query_summary(self) -> Dict:
+        merged: Dict[str, StatementStats] = {}
+        for sql, stats in self.statements.items():
+            total = merged.setdefault(normalize_statement(sql), StatementStats())
+            total.calls += stats.calls
+            total.seconds += stats.seconds
+            total.rows += stats.rows
+            total.max_seconds = max(total.max_seconds, stats.max_seconds)
+            total.sites |= stats.sites
+        statements = [{'sql': sql, 'calls': stats.calls, 'total_ms': round(stats.seconds * 1000, 3),
+                       'max_ms': round(stats.max_seconds * 1000, 3), 'rows': stats.rows,
+                       'sites': sorted(stats.sites)}
+                      for sql, stats in sorted(merged.items(), key=lambda item: -item[1].seconds)]
+        return {'count': sum(statement['calls'] for statement in statements),
+                'total_ms': round(sum(stats.seconds for stats in merged.values()) * 1000, 3),
+                'statements': statements,
+                'repeated': [statement for statement in statements if statement['calls'] >= PROFILE_REPEAT_THRESHOLD]}
+
+    def top_functions(self, limit: int = 25) -> List[Dict]:
+        if self.profiler is not None:
+            stats = pstats.Stats(self.profiler).stats
+            rows = sorted(stats.items(), key=lambda item: -item[1][3])[:limit]
+            return [{'function': f'{name} ({os.path.basename(filename)}:{line})', 'calls': calls,
+                     'own_ms': round(own * 1000, 3), 'cumulative_ms': round(cumulative * 1000, 3)}
+                    for (filename, line, name), (_, calls, own, cumulative, _) in rows]
+        # Samples: the frames most often on top of the stack
+        leaves: Dict[str, int] = defaultdict(int)
+        for stack, count in self.sampler.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return [{'function': function, 'samples': count}
+                for function, count in sorted(leaves.items(), key=lambda item: -item[1])[:limit]]
+
+    def write(self) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.id)
+        if self.profiler is not None:
+            self.profiler.dump_stats(base + '.prof')
+            output = base + '.prof'
+        else:
+            with open(base + '.txt', 'w') as f:
+                for stack, count in self.sampler.stacks.items():
+                    f.write(f'{stack} {count}\n')
+            output = base + '.txt'
+        summary = {
+            'id': self.id, 'kind': self.kind, 'name': self.name, 'mode': self.mode,
+            'started_at': self.started_at.isoformat(timespec='milliseconds'),
+            'duration_ms': round(self.duration * 1000, 3), 'profile': os.path.basename(output),
+            'queries': self.query_summary(), 'top_functions': self.top_functions(),
+        }
+        with open(base + '.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+        return base + '.json'
+
+
+class ProfilingMiddleware:
+    """WSGI middleware profiling the requests PROFILE_REQUESTS or the X-Profile header switch on"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        header = environ.get('HTTP_X_PROFILE')
+        if not (PROFILE_REQUESTS or (PROFILE_TOKEN and header and hmac.compare_digest(header, PROFILE_TOKEN))):
+            return self.app(environ, start_response)
+
+        profile = Profile('request', f"{environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')}",
+                          environ.get('HTTP_X_PROFILE_MODE'))
+
+        def start_profiled_response(status, headers, exc_info=None):
+            return start_response(status, headers + [('X-Profile-Id', profile.id)], exc_info)
+
+        # The body is built inside the profile; a streamed body is produced after it, unprofiled
+        with profile:
+            return self.app(environ, start_profiled_response)
+
+
+def _task_profile_mode(name: str) -> Optional[str]:
+    from celery import current_task
+    request = current_task.request if current_task else None
+    if request is not None:
+        header = (request.headers or {}).get('profile') or getattr(request, 'profile', None)
+        if header:
+            return str(header)
+    if PROFILE_TASKS == 'all' or name in PROFILE_TASKS.split(','):
+        return PROFILE_MODE
+    return None
+
+
+def profile_task(function):
+    """Celery task decorator (below @celery_app.task): profiles the runs PROFILE_TASKS or a 'profile' header switch on"""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        mode = _task_profile_mode(function.__name__)
+        if mode is None:
+            return function(*args, **kwargs)
+        with Profile('task', function.__name__, mode):
+            return function(*args, **kwargs)
+    return wrapper
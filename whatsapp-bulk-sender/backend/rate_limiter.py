@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Provider Rate Limiter
+One outbound budget shared by every sender in the process (campaigns, retries, opt-out
+confirmations), so traffic from one path can't push another over the provider's limit.
+"""
+
+import os
+import threading
+import time
+
+# Outbound messages per second across all senders in this worker; 0 leaves sends unthrottled
+PROVIDER_RATE_LIMIT = float(os.getenv('PROVIDER_RATE_LIMIT', '0'))
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def tokens(self) -> float:
+        """Sends allowed right now (at most 1); negative by the number of senders queued behind it"""
+        if not self.interval:
+            return 1.0
+        return min(1.0, (time.monotonic() - self.next_at) / self.interval)
+
+
+provider_limiter = RateLimiter(PROVIDER_RATE_LIMIT)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Reply Export
+Streams filtered replies out as CSV or XLSX without holding the result set in memory. Rows are
+read with fetchmany and written as they arrive: CSV as a chunked generator response, XLSX
+through openpyxl's write-only workbook with column widths estimated from the first rows. Exports
+larger than EXPORT_ASYNC_THRESHOLD run as a background job that writes to EXPORT_DIR and is
+fetched from a download link once it completes.
+"""
+
+import csv
+import io
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from db import connect
+
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+# Matching rows above which the export runs as a background job
+EXPORT_ASYNC_THRESHOLD = int(os.getenv('EXPORT_ASYNC_THRESHOLD', '50000'))
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', '2000'))
+# Rows sampled to size XLSX columns
+EXPORT_WIDTH_SAMPLE = int(os.getenv('EXPORT_WIDTH_SAMPLE', '1000'))
+EXPORT_MAX_WIDTH = 50
+# Hours a finished export file is kept for download
+EXPORT_RETENTION_HOURS = float(os.getenv('EXPORT_RETENTION_HOURS', '24'))
+
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+}
+SHEET_NAME = 'WhatsApp Replies'
+COLUMNS = ['Contact Name', 'Phone Number', 'Reply Message', 'Reply Date & Time',
+           'Campaign Name', 'Sentiment', 'Reply Type', 'Opted Out']
+FILTERS = ('campaign_id', 'sentiment', 'start_date', 'end_date')
+
+
+def setup_export_jobs(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            id TEXT PRIMARY KEY,
+            format TEXT NOT NULL,
+            filters TEXT,
+            filename TEXT,
+            status TEXT DEFAULT 'queued',
+            row_count INTEGER,
+            file_path TEXT,
+            error TEXT,
+            created_at TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+    ''')
+
+
+def export_filters(args) -> Dict[str, str]:
+    """The supported filters present in a request's query arguments"""
+    return {name: args.get(name) for name in FILTERS if args.get(name)}
+
+
+def _where(filters: Dict[str, str]) -> Tuple[str, list]:
+    conditions, params = [], []
+    if filters.get('campaign_id'):
+        conditions.append("r.campaign_id = ?")
+        params.append(filters['campaign_id'])
+    if filters.get('sentiment'):
+        conditions.append("r.sentiment = ?")
+        params.append(filters['sentiment'])
+    if filters.get('start_date'):
+        conditions.append("r.received_at >= ?")
+        params.append(filters['start_date'])
+    if filters.get('end_date'):
+        conditions.append("r.received_at <= ?")
+        params.append(filters['end_date'] + ' 23:59:59')  # Include end of day
+    return ("WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def count_export_rows(conn, filters: Dict[str, str], limit: int = None) -> int:
+    """Matching replies, counting no further than limit so deciding sync vs background stays cheap"""
+    where_clause, params = _where(filters)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT COUNT(*) FROM (SELECT 1 FROM replies r {where_clause} LIMIT ?)
+    ''', params + [limit if limit is not None else -1])
+    return cursor.fetchone()[0]
+
+
+def format_timestamp(value) -> Optional[str]:
+    if not value:
+        return value
+    try:
+        return datetime.fromisoformat(str(value)).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return value
+
+
+def iter_export_rows(conn, filters: Dict[str, str]) -> Iterator[tuple]:
+    """Export rows in COLUMNS order, newest first, read EXPORT_FETCH_SIZE at a time"""
+    where_clause, params = _where(filters)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT r.sender_name, r.phone_number, r.message_content, r.received_at,
+               c.name, r.sentiment, r.reply_type,
+               CASE WHEN r.is_opt_out = 1 THEN 'Yes' ELSE 'No' END
+        FROM replies r
+        LEFT JOIN campaigns c ON r.campaign_id = c.id
+        {where_clause}
+        ORDER BY r.received_at DESC
+    ''', params)
+    while True:
+        rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            return
+        for row in rows:
+            yield row[:3] + (format_timestamp(row[3]),) + row[4:]
+
+
+def export_filename(conn, filters: Dict[str, str], fmt: str, now: datetime = None) -> str:
+    """whatsapp_replies_<timestamp>[_campaign_<name>][_sentiment_<sentiment>].<fmt>"""
+    parts = ['whatsapp_replies', (now or datetime.now()).strftime('%Y%m%d_%H%M%S')]
+    if filters.get('campaign_id'):
+        row = conn.execute("SELECT name FROM campaigns WHERE id = ?", (filters['campaign_id'],)).fetchone()
+        if row:
+            parts.append('campaign_' + row[0].replace(' ', '_').replace('/', '_'))
+    if filters.get('sentiment'):
+        parts.append(f"sentiment_{filters['sentiment']}")
+    return '_'.join(parts) + '.' + fmt
+
+
+def iter_csv_chunks(rows: Iterable[tuple]) -> Iterator[str]:
+    """CSV text (header first, BOM so Excel reads it as UTF-8) in chunks of EXPORT_FETCH_SIZE rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(COLUMNS)
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, EXPORT_FETCH_SIZE))
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        if not chunk:
+            return
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def stream_csv(filters: Dict[str, str]) -> Iterator[str]:
+    """Generator for a streamed response; holds its own connection for as long as the client reads"""
+    conn = connect()
+    try:
+        yield from iter_csv_chunks(iter_export_rows(conn, filters))
+    finally:
+        conn.close()
+
+
+def column_widths(sample: Iterable[tuple]) -> list:
+    """Longest value per column across the header and sample, plus padding, capped at EXPORT_MAX_WIDTH"""
+    widths = [len(name) for name in COLUMNS]
+    for row in sample:
+        for i, value in enumerate(row):
+            if value is not None:
+                widths[i] = max(widths[i], len(str(value)))
+    return [min(width + 2, EXPORT_MAX_WIDTH) for width in widths]
+
+
+def write_xlsx(rows: Iterable[tuple], target) -> int:
+    """
+    Write rows to target (a path or binary file) with a write-only workbook, which streams each
+    row to disk instead of building cell objects. Returns the number of rows written.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(SHEET_NAME)
+
+    # Widths have to be set before the first row goes out, so size them from a sample
+    rows = iter(rows)
+    sample = list(islice(rows, EXPORT_WIDTH_SAMPLE))
+    for i, width in enumerate(column_widths(sample), start=1):
+        worksheet.column_dimensions[get_column_letter(i)].width = width
+
+    header = []
+    for name in COLUMNS:
+        cell = WriteOnlyCell(worksheet, value=name)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    worksheet.append(header)
+
+    written = 0
+    for row in chain(sample, rows):
+        worksheet.append(row)
+        written += 1
+    workbook.save(target)
+    return written
+
+
+def write_csv(rows: Iterable[tuple], path: str) -> int:
+    written = 0
+
+    def counted():
+        nonlocal written
+        for row in rows:
+            written += 1
+            yield row
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in iter_csv_chunks(counted()):
+            f.write(chunk)
+    return written
+
+
+def create_export_job(conn, filters: Dict[str, str], fmt: str, filename: str) -> str:
+    job_id = str(uuid.uuid4())
+    conn.execute('''
+        INSERT INTO export_jobs (id, format, filters, filename, status, created_at)
+        VALUES (?, ?, ?, ?, 'queued', ?)
+    ''', (job_id, fmt, json.dumps(filters), filename, datetime.now()))
+    conn.commit()
+    return job_id
+
+
+def get_export_job(job_id: str) -> Optional[Dict]:
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM export_jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def purge_expired_exports(conn, now: datetime = None) -> int:
+    """Delete finished export files (and their jobs) older than EXPORT_RETENTION_HOURS"""
+    cutoff = (now or datetime.now()) - timedelta(hours=EXPORT_RETENTION_HOURS)
+    expired = conn.execute('''
+        SELECT id, file_path FROM export_jobs
+        WHERE status IN ('completed', 'failed') AND completed_at < ?
+    ''', (cutoff,)).fetchall()
+    for _, file_path in expired:
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+    conn.executemany("DELETE FROM export_jobs WHERE id = ?", [(job_id,) for job_id, _ in expired])
+    conn.commit()
+    return len(expired)
+
+
+def run_export_job(job_id: str) -> Dict:
+    """Write a queued export to EXPORT_DIR; the file only appears under its final name once complete"""
+    conn = connect()
+    try:
+        purge_expired_exports(conn)
+        job = conn.execute("SELECT format, filters FROM export_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not job:
+            return {'job_id': job_id, 'status': 'missing'}
+        fmt, filters = job[0], json.loads(job[1] or '{}')
+        conn.execute("UPDATE export_jobs SET status = 'running' WHERE id = ?", (job_id,))
+        conn.commit()
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        file_path = os.path.join(EXPORT_DIR, f'{job_id}.{fmt}')
+        partial_path = file_path + '.part'
+        try:
+            rows = iter_export_rows(conn, filters)
+            row_count = write_xlsx(rows, partial_path) if fmt == 'xlsx' else write_csv(rows, partial_path)
+            os.replace(partial_path, file_path)
+        except Exception as e:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            conn.execute('''
+                UPDATE export_jobs SET status = 'failed', error = ?, completed_at = ? WHERE id = ?
+            ''', (str(e), datetime.now(), job_id))
+            conn.commit()
+            print(f"❌ Reply export {job_id} failed: {str(e)}")
+            raise
+
+        conn.execute('''
+            UPDATE export_jobs SET status = 'completed', row_count = ?, file_path = ?, completed_at = ?
+            WHERE id = ?
+        ''', (row_count, file_path, datetime.now(), job_id))
+        conn.commit()
+        print(f"📦 Reply export {job_id}: {row_count} rows written to {file_path}")
+        return {'job_id': job_id, 'status': 'completed', 'row_count': row_count}
+    finally:
+        conn.close()
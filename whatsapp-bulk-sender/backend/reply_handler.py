@@ -6,19 +6,39 @@ Handles incoming WhatsApp messages (replies) via Twilio webhook
 
 from flask import request
 from twilio.twiml.messaging_response import MessagingResponse
-import sqlite3
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 import json
+import logging
 import time
 
+from phone_numbers import canonical_phone_number, ensure_phone_canonical_column
+from contacts import find_latest_message_for_phone
+from reply_rollups import setup_reply_rollups
+from responder_sketches import setup_responder_sketches, record_reply
+from keyword_matcher import find_keyword_hits, contains_opt_out_keyword
+from sentiment_model import classify_reply_local
+from metrics import CLASSIFICATION_LATENCY
+from structured_logging import log_event, log_message_event
+from db import connect
+from response_catalogue import (
+    detect_language, render_catalogue_response,
+    get_cached_llm_response, cache_llm_response
+)
+
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini AI
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+logger = logging.getLogger(__name__)
+
+# Configure Gemini AI; GEMINI_API_ENDPOINT swaps in another server over REST (fake_provider.py in load tests)
+if os.getenv('GEMINI_API_ENDPOINT'):
+    genai.configure(api_key=os.getenv('GEMINI_API_KEY'), transport='rest',
+                    client_options={'api_endpoint': os.getenv('GEMINI_API_ENDPOINT')})
+else:
+    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
 # Rate limiting and retry configuration
 GEMINI_MAX_RETRIES = 3
@@ -26,9 +46,12 @@ GEMINI_RETRY_DELAY = 60  # seconds
 gemini_last_error_time = 0
 gemini_consecutive_failures = 0
 
+# Local model predictions below this confidence are escalated to Gemini
+LOCAL_SENTIMENT_THRESHOLD = float(os.getenv('LOCAL_SENTIMENT_THRESHOLD', '0.8'))
+
 def setup_replies_database():
     """Create database table for storing WhatsApp replies"""
-    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn = connect()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -47,10 +70,13 @@ def setup_replies_database():
             confidence_score REAL,
             is_opt_out BOOLEAN DEFAULT FALSE,
             requires_attention BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            phone_canonical TEXT
         )
     ''')
     
+    ensure_phone_canonical_column(cursor, 'replies')
+    
     # Create index for faster queries
     cursor.execute('''
         CREATE INDEX IF NOT EXISTS idx_replies_phone 
@@ -67,83 +93,99 @@ def setup_replies_database():
         ON replies(requires_attention)
     ''')
     
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_replies_phone_canonical 
+        ON replies(phone_canonical)
+    ''')
+    
+    # Exports and the replies list read newest first
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_replies_received
+        ON replies(received_at)
+    ''')
+    
+    # Hourly analytics rollups, maintained by triggers on replies
+    setup_reply_rollups(cursor)
+    
+    # Distinct responder sketches per campaign and day
+    setup_responder_sketches(cursor)
+    
     conn.commit()
     conn.close()
 
 def find_related_campaign(phone_number):
     """Find the most recent campaign this phone number was part of"""
     try:
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
-        # Find the most recent message sent to this phone number
-        cursor.execute('''
-            SELECT campaign_id, id FROM messages 
-            WHERE phone_number = ? 
-            ORDER BY sent_at DESC 
-            LIMIT 1
-        ''', (phone_number,))
-        
-        result = cursor.fetchone()
+        # Single indexed lookup on the canonical number (covers every stored format)
+        campaign_id, message_id, _ = find_latest_message_for_phone(cursor, phone_number)
         conn.close()
         
-        if result:
-            return result[0], result[1]  # campaign_id, message_id
-        return None, None
+        return campaign_id, message_id
         
     except Exception as e:
-        print(f"Error finding related campaign: {str(e)}")
+        log_event(logger, 'related_campaign_lookup_failed', logging.ERROR, exc_info=e)
         return None, None
 
+def request_intelligent_response_gemini(message_content, sentiment_category):
+    """
+    Generate an intelligent auto-response with Gemini AI based on message content and sentiment.
+    Raises on any API error so callers can decide how to fall back.
+    """
+    model = genai.GenerativeModel('gemini-1.5-flash')
+    
+    prompt = f"""
+    You are a professional customer service representative for Mwihaki Intimates, a premium intimate wear and lingerie business in Kenya.
+    
+    Customer Message: "{message_content}"
+    Detected Category: {sentiment_category}
+    
+    Generate a helpful, professional, and culturally appropriate response in the same language the customer used. 
+    
+    Guidelines:
+    - Be warm, friendly, and professional
+    - Use appropriate language for intimate wear business (tasteful and respectful)
+    - If they asked about products, mention we have various sizes, colors, and styles
+    - For pricing questions, mention we have affordable options starting from KES 500
+    - For availability, mention we deliver countrywide
+    - Keep responses under 160 characters when possible
+    - Include a call to action (visit our shop, call us, etc.)
+    - Match the customer's language (English, Swahili, Dholuo, Gikuyu)
+    
+    Response Categories:
+    - INTERESTED: Welcome them warmly, offer to help with selection
+    - QUESTION: IMPORTANT - Acknowledge it's a question and say we'll respond with details soon. Examples:
+      * "Thank you for your question! Our team will respond with details within 2 hours."
+      * "Great question! We'll get back to you shortly with all the information."
+      * "Asante kwa swali! Tutajibu kwa undani hivi karibuni." (Swahili)
+    - POSITIVE_FEEDBACK: Thank them warmly, invite them to recommend to friends
+    - COMPLAINT: Apologize sincerely, offer to resolve the issue
+    - NEUTRAL: Engage politely, offer assistance
+    
+    Business Info:
+    - Location: Nairobi, Kenya
+    - Products: Bras, panties, lingerie sets, nightwear, shapewear
+    - Contact: Available via WhatsApp for orders
+    - Delivery: Countrywide delivery available
+    
+    Generate ONLY the response message, no additional text or formatting.
+    """
+    
+    response = model.generate_content(prompt)
+    return response.text.strip()
+
 def generate_intelligent_response_gemini(message_content, sentiment_category, phone_number=None):
     """
     Generate intelligent auto-responses using Gemini AI based on message content and sentiment
     """
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        prompt = f"""
-        You are a professional customer service representative for Mwihaki Intimates, a premium intimate wear and lingerie business in Kenya.
-        
-        Customer Message: "{message_content}"
-        Detected Category: {sentiment_category}
-        
-        Generate a helpful, professional, and culturally appropriate response in the same language the customer used. 
-        
-        Guidelines:
-        - Be warm, friendly, and professional
-        - Use appropriate language for intimate wear business (tasteful and respectful)
-        - If they asked about products, mention we have various sizes, colors, and styles
-        - For pricing questions, mention we have affordable options starting from KES 500
-        - For availability, mention we deliver countrywide
-        - Keep responses under 160 characters when possible
-        - Include a call to action (visit our shop, call us, etc.)
-        - Match the customer's language (English, Swahili, Dholuo, Gikuyu)
-        
-        Response Categories:
-        - INTERESTED: Welcome them warmly, offer to help with selection
-        - QUESTION: IMPORTANT - Acknowledge it's a question and say we'll respond with details soon. Examples:
-          * "Thank you for your question! Our team will respond with details within 2 hours."
-          * "Great question! We'll get back to you shortly with all the information."
-          * "Asante kwa swali! Tutajibu kwa undani hivi karibuni." (Swahili)
-        - POSITIVE_FEEDBACK: Thank them warmly, invite them to recommend to friends
-        - COMPLAINT: Apologize sincerely, offer to resolve the issue
-        - NEUTRAL: Engage politely, offer assistance
-        
-        Business Info:
-        - Location: Nairobi, Kenya
-        - Products: Bras, panties, lingerie sets, nightwear, shapewear
-        - Contact: Available via WhatsApp for orders
-        - Delivery: Countrywide delivery available
-        
-        Generate ONLY the response message, no additional text or formatting.
-        """
-        
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return request_intelligent_response_gemini(message_content, sentiment_category)
         
     except Exception as e:
-        print(f"Error generating intelligent response: {str(e)}")
+        log_message_event(logger, 'gemini_response_fallback', logging.WARNING, key=phone_number,
+                          category=sentiment_category, error=str(e))
         # Fallback to simple responses
         fallback_responses = {
             'interested': "Thank you for your interest! We have beautiful intimate wear in various sizes. How can we help you today?",
@@ -167,7 +209,7 @@ def detect_reply_sentiment_gemini(message_content, phone_number=None, retry_coun
         if gemini_consecutive_failures >= GEMINI_MAX_RETRIES:
             current_time = time.time()
             if current_time - gemini_last_error_time < GEMINI_RETRY_DELAY:
-                print(f"⏳ Rate limited, using fallback detection")
+                log_message_event(logger, 'gemini_backoff_fallback', key=phone_number)
                 return detect_reply_sentiment_basic(message_content)
             else:
                 # Reset failure count after waiting period
@@ -232,8 +274,6 @@ def detect_reply_sentiment_gemini(message_content, phone_number=None, retry_coun
         elif '```' in response_text:
             response_text = response_text.split('```')[1].strip()
         
-        print(f"🔍 Gemini raw response: {response_text[:100]}...")
-        
         try:
             result = json.loads(response_text)
         except json.JSONDecodeError:
@@ -263,7 +303,8 @@ def detect_reply_sentiment_gemini(message_content, phone_number=None, retry_coun
         # Reset failure count on success
         gemini_consecutive_failures = 0
         
-        print(f"🤖 Gemini Analysis: {message_content[:50]}... → {result['category']} ({sentiment}) - Confidence: {confidence}")
+        log_message_event(logger, 'gemini_classified', logging.DEBUG, key=phone_number,
+                          category=result['category'], confidence=confidence)
         
         return {
             'sentiment': sentiment,
@@ -274,28 +315,27 @@ def detect_reply_sentiment_gemini(message_content, phone_number=None, retry_coun
         }
         
     except json.JSONDecodeError as e:
-        print(f"❌ Gemini JSON parsing error: {str(e)}")
-        print(f"📄 Raw response: {response_text if 'response_text' in locals() else 'No response'}")
+        log_message_event(logger, 'gemini_unparseable_response', logging.WARNING, key=phone_number,
+                          error=str(e), attempt=retry_count + 1)
         gemini_consecutive_failures += 1
         gemini_last_error_time = time.time()
         
         # Retry logic for malformed responses
         if retry_count < GEMINI_MAX_RETRIES:
-            print(f"🔄 Retrying Gemini analysis (attempt {retry_count + 1})")
             time.sleep(5)  # Short delay for JSON parsing errors
             return detect_reply_sentiment_gemini(message_content, phone_number, retry_count + 1)
         
         return detect_reply_sentiment_basic(message_content)
         
     except Exception as e:
-        print(f"❌ Gemini API error: {str(e)}")
+        log_message_event(logger, 'gemini_error', logging.WARNING, key=phone_number,
+                          error=str(e), attempt=retry_count + 1)
         gemini_consecutive_failures += 1
         gemini_last_error_time = time.time()
         
         # Check if this is a rate limit error and we can retry
         if any(keyword in str(e).lower() for keyword in ['quota', 'rate', 'limit', 'exceeded']):
             if retry_count < GEMINI_MAX_RETRIES:
-                print(f"⏳ Rate limited, retrying in {GEMINI_RETRY_DELAY} seconds...")
                 time.sleep(GEMINI_RETRY_DELAY)
                 return detect_reply_sentiment_gemini(message_content, phone_number, retry_count + 1)
         
@@ -304,21 +344,11 @@ def detect_reply_sentiment_gemini(message_content, phone_number=None, retry_coun
 
 def detect_reply_sentiment_basic(message_content):
     """Enhanced fallback basic sentiment detection with comprehensive opt-out detection"""
-    message_lower = message_content.lower()
-    
-    # Enhanced opt-out keywords (high priority) - multiple languages
-    opt_out_keywords = [
-        # English
-        'stop', 'unsubscribe', 'remove', 'opt out', 'optout', 'quit', 'delete',
-        'dont message', "don't message", 'not interested', 'no more', 'enough',
-        'block', 'remove me', 'delete me', 'take me off', 'annoying',
-        # Swahili
-        'hatutaki', 'sitaki', 'acha', 'wacha', 'hapana', 'usinitumie',
-        'sijadhani', 'sitaki ujumbe', 'ondoa', 'sikitaki'
-    ]
+    # One pass over the message finds every keyword category (see keyword_matcher.py)
+    hits = find_keyword_hits(message_content)
     
     # Check for opt-out (most critical)
-    if any(word in message_lower for word in opt_out_keywords):
+    if hits['opt_out']:
         return {
             'sentiment': 'desired_opt_out',
             'confidence': 0.9,
@@ -327,27 +357,10 @@ def detect_reply_sentiment_basic(message_content):
             'reasoning': 'Contains opt-out keywords'
         }
     
-    # Positive keywords (interest/satisfaction)
-    positive_words = ['yes', 'interested', 'buy', 'purchase', 'want', 'like', 'love', 
-                     'thank', 'good', 'great', 'excellent', 'amazing', 'perfect',
-                     'asante', 'nataka', 'poa', 'sawa', 'vizuri']
-    
-    # Negative/complaint keywords
-    negative_words = ['no', 'hate', 'bad', 'terrible', 'angry', 'complain', 'problem', 
-                     'issue', 'wrong', 'awful', 'horrible', 'disappointed', 'refund',
-                     'mbaya', 'haina', 'tatizo']
-    
-    # Question indicators
-    question_words = ['?', 'how', 'what', 'when', 'where', 'why', 'which', 'price', 
-                     'cost', 'available', 'je', 'vipi', 'bei', 'rahisi']
-    
-    # Urgent keywords
-    urgent_words = ['urgent', 'emergency', 'immediately', 'asap', 'help', 'haraka']
-    
-    positive_count = sum(1 for word in positive_words if word in message_lower)
-    negative_count = sum(1 for word in negative_words if word in message_lower)
-    question_count = sum(1 for word in question_words if word in message_lower)
-    urgent_count = sum(1 for word in urgent_words if word in message_lower)
+    positive_count = len(hits['positive'])
+    negative_count = len(hits['negative'])
+    question_count = len(hits['question'])
+    urgent_count = len(hits['urgent'])
     
     # Determine sentiment with priority
     if urgent_count > 0:
@@ -375,54 +388,34 @@ def detect_reply_sentiment_basic(message_content):
     }
 
 def detect_reply_sentiment(message_content, phone_number=None):
-    """Main sentiment detection function with Gemini AI and fallback"""
-    # Try Gemini first, fallback to basic if it fails
+    """Main sentiment detection function: local model, then Gemini AI, then keyword fallback"""
+    # Fast tier: offline n-gram model, trusted only when it is confident
+    with CLASSIFICATION_LATENCY.labels('local').time():
+        local_result = classify_reply_local(message_content)
+    if local_result and local_result['confidence'] >= LOCAL_SENTIMENT_THRESHOLD:
+        return local_result
+    
+    # Escalate low-confidence replies to Gemini, fallback to basic if it fails
     if os.getenv('GEMINI_API_KEY'):
-        return detect_reply_sentiment_gemini(message_content, phone_number)
+        with CLASSIFICATION_LATENCY.labels('gemini').time():
+            return detect_reply_sentiment_gemini(message_content, phone_number)
     else:
-        print("⚠️ No Gemini API key found, using basic detection")
-        return detect_reply_sentiment_basic(message_content)
+        log_message_event(logger, 'gemini_not_configured', logging.DEBUG, key=phone_number)
+        with CLASSIFICATION_LATENCY.labels('basic').time():
+            return detect_reply_sentiment_basic(message_content)
 
 def is_opt_out_message(message_content):
     """Enhanced check if message is an opt-out request with multiple languages"""
-    opt_out_keywords = [
-        # English
-        'stop', 'unsubscribe', 'remove', 'opt out', 'optout', 'quit', 'delete',
-        'dont message', "don't message", 'not interested', 'no more', 'enough',
-        'block', 'remove me', 'delete me', 'take me off', 'annoying',
-        # Swahili
-        'hatutaki', 'sitaki', 'acha', 'wacha', 'hapana', 'usinitumie',
-        'sijadhani', 'sitaki ujumbe', 'ondoa', 'sikitaki'
-    ]
-    return any(keyword in message_content.lower() for keyword in opt_out_keywords)
+    return contains_opt_out_keyword(message_content)
 
 def normalize_phone_number(phone_number):
     """Normalize phone numbers to find variations (0712345678 = +254712345678 = 254712345678)"""
-    # Remove all non-digit characters
-    digits_only = ''.join(filter(str.isdigit, phone_number))
-    
-    # Handle common Kenyan number formats
-    if digits_only.startswith('254'):
-        # Already in international format
-        normalized = '+' + digits_only
-    elif digits_only.startswith('0') and len(digits_only) == 10:
-        # Local format (0712345678) -> +254712345678
-        normalized = '+254' + digits_only[1:]
-    elif len(digits_only) == 9:
-        # Missing leading zero (712345678) -> +254712345678  
-        normalized = '+254' + digits_only
-    else:
-        # Default: add + if not present
-        normalized = '+' + digits_only if not phone_number.startswith('+') else phone_number
-    
-    return normalized
+    return canonical_phone_number(phone_number)
 
 def get_phone_number_variations(phone_number):
     """Get all possible variations of a phone number"""
-    normalized = normalize_phone_number(phone_number)
-    
-    # Extract digits for variations
-    digits_only = ''.join(filter(str.isdigit, normalized))
+    normalized = canonical_phone_number(phone_number)
+    digits_only = normalized[1:]
     
     variations = [
         normalized,  # +254712345678
@@ -434,8 +427,26 @@ def get_phone_number_variations(phone_number):
     
     return list(set(variations))  # Remove duplicates
 
-def store_reply(phone_number, message_content, media_url=None, media_type=None):
-    """Store incoming WhatsApp reply in database with enhanced opt-out handling"""
+def find_sender_name(phone_number, cursor=None):
+    """Find the contact name last used for this phone number"""
+    own_connection = cursor is None
+    if own_connection:
+        conn = connect()
+        cursor = conn.cursor()
+    
+    try:
+        _, _, name = find_latest_message_for_phone(cursor, phone_number)
+    finally:
+        if own_connection:
+            conn.close()
+    
+    return name or 'Unknown'
+
+def store_reply(phone_number, message_content, media_url=None, media_type=None, sentiment_result=None):
+    """
+    Store incoming WhatsApp reply in database with enhanced opt-out handling.
+    Pass sentiment_result when the caller has already classified the message.
+    """
     try:
         # Setup database if needed
         setup_replies_database()
@@ -443,17 +454,9 @@ def store_reply(phone_number, message_content, media_url=None, media_type=None):
         # Normalize phone number
         normalized_phone = normalize_phone_number(phone_number)
         
-        # Find related campaign using phone number variations
-        campaign_id, message_id = find_related_campaign(normalized_phone)
-        if not campaign_id:
-            # Try with variations
-            for variation in get_phone_number_variations(phone_number):
-                campaign_id, message_id = find_related_campaign(variation)
-                if campaign_id:
-                    break
-        
-        # Detect sentiment using Gemini AI
-        sentiment_result = detect_reply_sentiment(message_content, normalized_phone)
+        # Detect sentiment (local model, escalating to Gemini AI)
+        if sentiment_result is None:
+            sentiment_result = detect_reply_sentiment(message_content, normalized_phone)
         sentiment = sentiment_result['sentiment']
         confidence = sentiment_result['confidence']
         requires_attention = sentiment_result['requires_attention']
@@ -465,24 +468,12 @@ def store_reply(phone_number, message_content, media_url=None, media_type=None):
             sentiment == 'desired_opt_out'
         )
         
-        # Get sender name if we have it in our contacts
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
-        # Try to find name using phone number variations
-        sender_name = 'Unknown'
-        for variation in get_phone_number_variations(phone_number):
-            cursor.execute('''
-                SELECT name FROM messages 
-                WHERE phone_number = ? 
-                ORDER BY sent_at DESC 
-                LIMIT 1
-            ''', (variation,))
-            
-            name_result = cursor.fetchone()
-            if name_result:
-                sender_name = name_result[0]
-                break
+        # Related campaign and sender name in one indexed lookup on the canonical number
+        campaign_id, message_id, sender_name = find_latest_message_for_phone(cursor, normalized_phone)
+        sender_name = sender_name or 'Unknown'
         
         # Store the reply with enhanced data
         cursor.execute('''
@@ -490,48 +481,47 @@ def store_reply(phone_number, message_content, media_url=None, media_type=None):
                 phone_number, sender_name, message_content, 
                 campaign_id, original_message_id, reply_type,
                 media_url, media_type, sentiment, confidence_score,
-                is_opt_out, requires_attention
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                is_opt_out, requires_attention, phone_canonical
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             normalized_phone, sender_name, message_content,
             campaign_id, message_id, 'media' if media_url else 'text',
             media_url, media_type, sentiment, confidence,
-            is_opt_out_detected, requires_attention
+            is_opt_out_detected, requires_attention, normalized_phone
         ))
         
         reply_id = cursor.lastrowid
+        record_reply(cursor, reply_id)
+        
+        # Commit before the opt-out helpers open their own connections, otherwise
+        # they block on this write lock until SQLite's 5 second timeout
+        conn.commit()
+        conn.close()
         
         # If this is an opt-out, schedule opt-out confirmation and remove from future campaigns
         if is_opt_out_detected:
             schedule_opt_out_confirmation(normalized_phone, sender_name)
             mark_phone_as_opted_out(normalized_phone)
         
-        conn.commit()
-        conn.close()
-        
-        # Enhanced logging
-        attention_flag = "🚨" if requires_attention else ""
-        confidence_indicator = "🎯" if confidence > 0.8 else "📊"
-        opt_out_flag = "🚫" if is_opt_out_detected else ""
-        
-        print(f"✅ Reply stored: ID {reply_id}, From: {normalized_phone}")
-        print(f"   {confidence_indicator} Sentiment: {sentiment} (confidence: {confidence:.2f})")
-        print(f"   {attention_flag} Category: {sentiment_result['detailed_category']}")
-        if requires_attention:
-            print(f"   ⚠️ Requires human attention: {sentiment_result['reasoning']}")
+        # Sampled per reply; opt-outs are compliance records, so each one is logged
+        fields = dict(reply_id=reply_id, campaign_id=campaign_id, sentiment=sentiment,
+                      category=sentiment_result['detailed_category'], confidence=confidence,
+                      requires_attention=bool(requires_attention))
         if is_opt_out_detected:
-            print(f"   {opt_out_flag} OPT-OUT DETECTED - Customer will be unsubscribed")
+            log_event(logger, 'reply_opt_out', **fields)
+        else:
+            log_message_event(logger, 'reply_stored', key=reply_id, **fields)
         
         return reply_id
         
     except Exception as e:
-        print(f"❌ Error storing reply: {str(e)}")
+        log_event(logger, 'reply_store_failed', logging.ERROR, exc_info=e)
         return None
 
 def schedule_opt_out_confirmation(phone_number, sender_name, schedule_option="now"):
     """Schedule opt-out confirmation message to be sent"""
     try:
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         # Create opt_out_queue table if it doesn't exist
@@ -564,15 +554,15 @@ def schedule_opt_out_confirmation(phone_number, sender_name, schedule_option="no
         conn.commit()
         conn.close()
         
-        print(f"📋 Opt-out confirmation scheduled for {phone_number} at {scheduled_time}")
+        log_event(logger, 'opt_out_confirmation_scheduled', scheduled_time=scheduled_time)
         
     except Exception as e:
-        print(f"❌ Error scheduling opt-out confirmation: {str(e)}")
+        log_event(logger, 'opt_out_confirmation_failed', logging.ERROR, exc_info=e)
 
 def mark_phone_as_opted_out(phone_number):
-    """Mark phone number and all its variations as opted out"""
+    """Mark phone number as opted out (covers every format through its canonical number)"""
     try:
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         # Create opt_out_list table if it doesn't exist
@@ -580,29 +570,30 @@ def mark_phone_as_opted_out(phone_number):
             CREATE TABLE IF NOT EXISTS opt_out_list (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 phone_number TEXT UNIQUE,
-                opted_out_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                opted_out_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                phone_canonical TEXT
             )
         ''')
+        ensure_phone_canonical_column(cursor, 'opt_out_list')
         
-        # Add all phone number variations to opt-out list
-        variations = get_phone_number_variations(phone_number)
-        for variation in variations:
-            cursor.execute('''
-                INSERT OR IGNORE INTO opt_out_list (phone_number)
-                VALUES (?)
-            ''', (variation,))
+        canonical = canonical_phone_number(phone_number)
+        cursor.execute('''
+            INSERT OR IGNORE INTO opt_out_list (phone_number, phone_canonical)
+            VALUES (?, ?)
+        ''', (canonical, canonical))
         
         conn.commit()
         conn.close()
         
-        print(f"🚫 Phone number {phone_number} and variations marked as opted out")
+        log_event(logger, 'phone_opted_out')
         
     except Exception as e:
-        print(f"❌ Error marking phone as opted out: {str(e)}")
+        log_event(logger, 'opt_out_mark_failed', logging.ERROR, exc_info=e)
 
-def generate_auto_response(message_content, sentiment_result, is_opt_out):
+def generate_auto_response(message_content, sentiment_result, is_opt_out, sender_name=''):
     """
-    Generate automatic response using Gemini AI for intelligent, contextual replies.
+    Generate automatic response: pre-written catalogue first (by category and language),
+    then Gemini AI for anything the catalogue doesn't cover, cached per (category, text).
     All responses are fully compliant with WhatsApp Business requirements.
     """
     
@@ -613,20 +604,33 @@ def generate_auto_response(message_content, sentiment_result, is_opt_out):
     if is_opt_out or detailed_category == 'DESIRED_OPT_OUT' or sentiment == 'desired_opt_out':
         return "Thank you for your message. You have been unsubscribed and will not receive further marketing messages from Mwihaki Intimates. We respect your decision. Have a wonderful day! 🙏\n\nMwihaki Intimates"
     
-    # Use Gemini AI to generate intelligent, contextual responses
-    try:
-        intelligent_response = generate_intelligent_response_gemini(message_content, sentiment)
-        
-        # Ensure compliance footer is added if not already present
-        if "Reply STOP to opt out" not in intelligent_response and "Mwihaki Intimates" not in intelligent_response:
-            intelligent_response += "\n\nReply STOP to opt out | Mwihaki Intimates"
-        
-        print(f"🤖 Generated intelligent response: {intelligent_response[:100]}...")
-        return intelligent_response
-        
-    except Exception as e:
-        print(f"⚠️ Gemini response generation failed, using fallback: {str(e)}")
-        # Fallback to previous business-focused responses
+    # Fast path: catalogue response in the customer's language, no network call
+    catalogue_response = render_catalogue_response(sentiment, detect_language(message_content), sender_name)
+    if catalogue_response:
+        return catalogue_response
+    
+    cached_response = get_cached_llm_response(sentiment, message_content)
+    if cached_response:
+        return cached_response
+    
+    # Long tail: use Gemini AI to generate an intelligent, contextual response
+    if os.getenv('GEMINI_API_KEY'):
+        try:
+            intelligent_response = request_intelligent_response_gemini(message_content, sentiment)
+            
+            # Ensure compliance footer is added if not already present
+            if "Reply STOP to opt out" not in intelligent_response and "Mwihaki Intimates" not in intelligent_response:
+                intelligent_response += "\n\nReply STOP to opt out | Mwihaki Intimates"
+            
+            cache_llm_response(sentiment, message_content, intelligent_response)
+            log_message_event(logger, 'gemini_response_generated', category=sentiment,
+                              length=len(intelligent_response))
+            return intelligent_response
+            
+        except Exception as e:
+            log_message_event(logger, 'gemini_response_fallback', logging.WARNING, category=sentiment,
+                              error=str(e))
+            # Fallback to previous business-focused responses
         
     # Business-focused fallback responses with mandatory compliance elements
     if detailed_category == 'INTERESTED' or sentiment == 'interested':
@@ -719,7 +723,7 @@ def get_replies():
         
         offset = (page - 1) * per_page
         
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         # Build query with filters
@@ -802,7 +806,7 @@ def get_reply_analytics():
     try:
         campaign_id = request.args.get('campaign_id')
         
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         where_clause = "WHERE campaign_id = ?" if campaign_id else ""
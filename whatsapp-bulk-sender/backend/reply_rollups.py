@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Reply Rollups
+Hourly reply counts per campaign x sentiment x opt-out, kept in step with the replies table by
+triggers, so the dashboard's analytics read a few hundred rollup rows instead of scanning every
+reply. Triggers (rather than code in store_reply) also cover the sentiment backfill, manual
+fixes and anything else that writes replies, inside the same transaction as the write.
+verify_reply_rollups recomputes the counts from raw replies and repairs any drift.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from db import connect
+
+# Rollup keys never hold NULL: SQLite treats NULLs as distinct in a primary key, which would
+# break the upsert, so a missing campaign or sentiment is stored as ''
+ROLLUP_KEY = '''
+    COALESCE({row}.campaign_id, ''),
+    COALESCE(strftime('%Y-%m-%d %H:00:00', {row}.received_at), ''),
+    COALESCE({row}.sentiment, ''),
+    CASE WHEN {row}.is_opt_out THEN 1 ELSE 0 END
+'''
+ROLLUP_MATCH = '''
+    campaign_id = COALESCE({row}.campaign_id, '')
+    AND bucket = COALESCE(strftime('%Y-%m-%d %H:00:00', {row}.received_at), '')
+    AND sentiment = COALESCE({row}.sentiment, '')
+    AND is_opt_out = CASE WHEN {row}.is_opt_out THEN 1 ELSE 0 END
+'''
+
+
+def _add(row: str) -> str:
+    return f'''
+        INSERT INTO reply_rollups (campaign_id, bucket, sentiment, is_opt_out, reply_count)
+        VALUES ({ROLLUP_KEY.format(row=row)}, 1)
+        ON CONFLICT (campaign_id, bucket, sentiment, is_opt_out) DO UPDATE SET reply_count = reply_count + 1;
+    '''
+
+
+def _remove(row: str) -> str:
+    return f'''
+        UPDATE reply_rollups SET reply_count = reply_count - 1 WHERE {ROLLUP_MATCH.format(row=row)};
+        DELETE FROM reply_rollups WHERE reply_count <= 0 AND {ROLLUP_MATCH.format(row=row)};
+    '''
+
+
+def setup_reply_rollups(cursor):
+    """Rollup table and the triggers that maintain it; built from existing replies the first time"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reply_rollups'")
+    exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reply_rollups (
+            campaign_id TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            sentiment TEXT NOT NULL,
+            is_opt_out INTEGER NOT NULL,
+            reply_count INTEGER NOT NULL,
+            PRIMARY KEY (campaign_id, bucket, sentiment, is_opt_out)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reply_rollups_bucket
+        ON reply_rollups(bucket)
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reply_rollups_insert AFTER INSERT ON replies
+        BEGIN {_add('NEW')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reply_rollups_update
+        AFTER UPDATE OF campaign_id, received_at, sentiment, is_opt_out ON replies
+        BEGIN {_remove('OLD')} {_add('NEW')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reply_rollups_delete AFTER DELETE ON replies
+        BEGIN {_remove('OLD')} END
+    ''')
+
+    if not exists:
+        rebuild_reply_rollups(cursor)
+
+
+def rebuild_reply_rollups(cursor):
+    """Replace every rollup row with counts recomputed from the replies table"""
+    cursor.execute("DELETE FROM reply_rollups")
+    cursor.execute(f'''
+        INSERT INTO reply_rollups (campaign_id, bucket, sentiment, is_opt_out, reply_count)
+        SELECT {ROLLUP_KEY.format(row='r')}, COUNT(*) FROM replies r
+        GROUP BY 1, 2, 3, 4
+    ''')
+
+
+def verify_reply_rollups(conn, repair: bool = True) -> Dict:
+    """
+    Recompute the rollups from raw replies and compare. Returns the number of rollup keys that
+    disagree (missing, extra or wrong count); with repair, rebuilds them when any do.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {ROLLUP_KEY.format(row='r')}, COUNT(*) FROM replies r
+        GROUP BY 1, 2, 3, 4
+    ''')
+    expected = {row[:4]: row[4] for row in cursor.fetchall()}
+    cursor.execute("SELECT campaign_id, bucket, sentiment, is_opt_out, reply_count FROM reply_rollups")
+    actual = {row[:4]: row[4] for row in cursor.fetchall()}
+
+    mismatched = sum(1 for key in expected.keys() | actual.keys() if expected.get(key) != actual.get(key))
+    if mismatched and repair:
+        rebuild_reply_rollups(cursor)
+        conn.commit()
+        print(f"⚠️ Reply rollups had drifted on {mismatched} key(s); rebuilt from raw replies")
+    return {'keys': len(expected), 'mismatched': mismatched, 'repaired': bool(mismatched and repair)}
+
+
+def rollup_where(campaign_id: Optional[str] = None) -> tuple:
+    if campaign_id:
+        return "WHERE campaign_id = ?", [campaign_id]
+    return "", []
+
+
+def replies_since(cursor, since: datetime, campaign_id: Optional[str] = None) -> int:
+    """
+    Replies received at or after since (UTC, like received_at): whole hours from the rollups,
+    plus an indexed count of the raw replies in the partial hour at the start of the window.
+    """
+    first_full_hour = since.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    campaign_filter = "AND campaign_id = ?" if campaign_id else ""
+    params = [campaign_id] if campaign_id else []
+
+    cursor.execute(f'''
+        SELECT COALESCE(SUM(reply_count), 0) FROM reply_rollups
+        WHERE bucket >= ? {campaign_filter}
+    ''', [first_full_hour.strftime('%Y-%m-%d %H:00:00')] + params)
+    whole_hours = cursor.fetchone()[0]
+
+    cursor.execute(f'''
+        SELECT COUNT(*) FROM replies
+        WHERE received_at >= ? AND received_at < ? {campaign_filter}
+    ''', [since.strftime('%Y-%m-%d %H:%M:%S'), first_full_hour.strftime('%Y-%m-%d %H:%M:%S')] + params)
+    return whole_hours + cursor.fetchone()[0]
+
+
+def run_rollup_verification() -> Dict:
+    conn = connect()
+    try:
+        return verify_reply_rollups(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Responder Sketches
+HyperLogLog sketches of distinct responders per campaign and UTC day, stored as blobs next to
+the replies they summarise. One sketch holds 2**HLL_PRECISION one-byte registers (4 KiB), is
+updated in the same transaction as the reply insert, and merges with any other sketch by taking
+the register-wise maximum, so unique responders over any set of campaigns and days cost one
+read of the matching sketches instead of a COUNT(DISTINCT) over every reply.
+
+Error bounds (precision 12, m = 4096 registers): the standard error of an estimate is
+1.04 / sqrt(m) ~= 1.6%, so about 95% of estimates fall within +-3.3% of the true count and
+99.7% within +-4.9%. Merging doesn't add error; a merged sketch is the sketch of the union.
+Below ~2.5 * m distinct numbers the estimate switches to linear counting, which is close to
+exact for the small counts most campaigns have. Pass exact=True where a precise figure matters
+(compliance reports, billing); that path still runs COUNT(DISTINCT) over the replies table.
+"""
+
+import hashlib
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+from db import connect
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_STANDARD_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+# Bias correction for m >= 128 (Flajolet et al.)
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+
+# Every reply counts towards 'reply'; opt-out replies also towards 'opt_out'
+SKETCH_KINDS = ('reply', 'opt_out')
+# Each reply is also folded into a per-day sketch across all campaigns, so totals merge one
+# sketch per day rather than one per campaign per day
+ALL_CAMPAIGNS = '*'
+
+
+def setup_responder_sketches(cursor):
+    """Sketch table, built from existing replies the first time"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'responder_sketches'")
+    exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS responder_sketches (
+            campaign_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            registers BLOB NOT NULL,
+            PRIMARY KEY (campaign_id, day, kind)
+        )
+    ''')
+
+    if not exists:
+        rebuild_responder_sketches(cursor)
+
+
+def _register(phone: str):
+    """(register index, rank) for a phone number: the first HLL_PRECISION hash bits pick the
+    register, the rank is the position of the first 1 bit in the remaining bits"""
+    value = int.from_bytes(hashlib.blake2b(phone.encode('utf-8'), digest_size=8).digest(), 'big')
+    index = value >> (64 - HLL_PRECISION)
+    rest = value & ((1 << (64 - HLL_PRECISION)) - 1)
+    return index, (64 - HLL_PRECISION) - rest.bit_length() + 1
+
+
+def estimate(registers: np.ndarray) -> float:
+    zeros = int(np.count_nonzero(registers == 0))
+    raw = HLL_ALPHA * HLL_REGISTERS ** 2 / float(np.sum(np.exp2(-registers.astype(np.float64))))
+    if raw <= 2.5 * HLL_REGISTERS and zeros:
+        return HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+    return raw
+
+
+def add_responder(cursor, campaign_id: Optional[str], day: str, phone: str, kind: str = 'reply'):
+    """Fold one responder into the (campaign, day, kind) sketch; a no-op write when already counted"""
+    index, rank = _register(phone)
+    key = (campaign_id or '', day, kind)
+    cursor.execute('''
+        SELECT registers FROM responder_sketches WHERE campaign_id = ? AND day = ? AND kind = ?
+    ''', key)
+    row = cursor.fetchone()
+    registers = bytearray(row[0]) if row else bytearray(HLL_REGISTERS)
+    if registers[index] >= rank:
+        return
+    registers[index] = rank
+    cursor.execute('''
+        INSERT INTO responder_sketches (campaign_id, day, kind, registers) VALUES (?, ?, ?, ?)
+        ON CONFLICT (campaign_id, day, kind) DO UPDATE SET registers = excluded.registers
+    ''', key + (bytes(registers),))
+
+
+def record_reply(cursor, reply_id: int):
+    """Add a just-inserted reply to its campaign's sketches for the day it was received"""
+    cursor.execute('''
+        SELECT campaign_id, date(received_at), phone_number, is_opt_out FROM replies WHERE id = ?
+    ''', (reply_id,))
+    campaign_id, day, phone, is_opt_out = cursor.fetchone()
+    for kind in (('reply', 'opt_out') if is_opt_out else ('reply',)):
+        add_responder(cursor, campaign_id, day or '', phone, kind)
+        add_responder(cursor, ALL_CAMPAIGNS, day or '', phone, kind)
+
+
+def rebuild_responder_sketches(cursor) -> int:
+    """Replace every sketch with one built from the replies table; returns the sketch count"""
+    sketches: Dict[tuple, np.ndarray] = {}
+    cursor.execute('''
+        SELECT COALESCE(campaign_id, ''), COALESCE(date(received_at), ''), phone_number, is_opt_out
+        FROM replies
+    ''')
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        for campaign_id, day, phone, is_opt_out in rows:
+            index, rank = _register(phone)
+            for kind in (('reply', 'opt_out') if is_opt_out else ('reply',)):
+                for key in ((campaign_id, day, kind), (ALL_CAMPAIGNS, day, kind)):
+                    registers = sketches.get(key)
+                    if registers is None:
+                        registers = sketches[key] = np.zeros(HLL_REGISTERS, np.uint8)
+                    if registers[index] < rank:
+                        registers[index] = rank
+
+    cursor.execute("DELETE FROM responder_sketches")
+    cursor.executemany('''
+        INSERT INTO responder_sketches (campaign_id, day, kind, registers) VALUES (?, ?, ?, ?)
+    ''', [key + (registers.tobytes(),) for key, registers in sketches.items()])
+    return len(sketches)
+
+
+def run_sketch_rebuild() -> Dict:
+    conn = connect()
+    try:
+        sketches = rebuild_responder_sketches(conn.cursor())
+        conn.commit()
+        return {'sketches': sketches}
+    finally:
+        conn.close()
+
+
+def _filters(campaign_id: Optional[str], start_date: Optional[str], end_date: Optional[str],
+             day_column: str) -> tuple:
+    conditions, params = [], []
+    if campaign_id:
+        conditions.append("campaign_id = ?")
+        params.append(campaign_id)
+    if start_date:
+        conditions.append(f"{day_column} >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append(f"{day_column} <= ?")
+        params.append(end_date)
+    return conditions, params
+
+
+def count_responders(cursor, campaign_id: Optional[str] = None, start_date: Optional[str] = None,
+                     end_date: Optional[str] = None, kind: str = 'reply', exact: bool = False) -> int:
+    """
+    Distinct responders (of kind 'reply' or 'opt_out') for a campaign, or all campaigns, between
+    two UTC days inclusive. Estimated from the sketches unless exact=True.
+    """
+    if exact:
+        conditions, params = _filters(campaign_id, start_date, end_date, 'date(received_at)')
+        if kind == 'opt_out':
+            conditions.append("is_opt_out = 1")
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        cursor.execute(f"SELECT COUNT(DISTINCT phone_number) FROM replies {where}", params)
+        return cursor.fetchone()[0]
+
+    conditions, params = _filters(campaign_id or ALL_CAMPAIGNS, start_date, end_date, 'day')
+    conditions.append("kind = ?")
+    cursor.execute(f'''
+        SELECT registers FROM responder_sketches WHERE {" AND ".join(conditions)}
+    ''', params + [kind])
+    sketches = [np.frombuffer(row[0], np.uint8) for row in cursor.fetchall()]
+    if not sketches:
+        return 0
+    return round(estimate(np.maximum.reduce(sketches)))
+
+
+def count_responders_by_campaign(cursor, kind: str = 'reply', exact: bool = False) -> Dict[str, int]:
+    """Distinct responders per campaign id, all days"""
+    if exact:
+        cursor.execute(f'''
+            SELECT campaign_id, COUNT(DISTINCT phone_number) FROM replies
+            WHERE campaign_id IS NOT NULL {"AND is_opt_out = 1" if kind == 'opt_out' else ""}
+            GROUP BY campaign_id
+        ''')
+        return dict(cursor.fetchall())
+
+    cursor.execute('''
+        SELECT campaign_id, registers FROM responder_sketches WHERE kind = ? AND campaign_id NOT IN ('', '*')
+        ORDER BY campaign_id
+    ''', (kind,))
+    merged: Dict[str, np.ndarray] = {}
+    for campaign_id, blob in cursor.fetchall():
+        registers = np.frombuffer(blob, np.uint8)
+        merged[campaign_id] = np.maximum(merged[campaign_id], registers) if campaign_id in merged else registers
+    return {campaign_id: round(estimate(registers)) for campaign_id, registers in merged.items()}
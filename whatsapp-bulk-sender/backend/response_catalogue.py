@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Auto-response Catalogue for WhatsApp replies
+Pre-written responses keyed by category and language, loaded once and rendered with the sender name.
+Gemini is only needed for the long tail, and its responses are cached.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+CATALOGUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'response_catalogue.json')
+DEFAULT_LANGUAGE = 'en'
+LLM_CACHE_SIZE = int(os.getenv('AUTO_RESPONSE_CACHE_SIZE', '5000'))
+
+# Marker words per language; Gikuyu is also recognised by its ĩ/ũ letters
+LANGUAGE_MARKERS = {
+    'sw': {
+        'asante', 'sana', 'nataka', 'bei', 'gani', 'tafadhali', 'habari', 'naweza',
+        'kupata', 'kuna', 'je', 'vipi', 'hapana', 'sitaki', 'ndiyo', 'nini', 'lini',
+        'wapi', 'hii', 'hiyo', 'nzuri', 'mbaya', 'samahani', 'karibu', 'nipe', 'kununua',
+        'tatizo', 'haraka', 'usinitumie', 'ujumbe', 'tena', 'poa', 'sawa', 'vizuri',
+    },
+    'luo': {
+        'erokamano', 'adwaro', 'ahinya', 'nitie', 'anyalo', 'yudo', 'nengo', 'nengone',
+        'amor', 'ote', 'mano', 'ango', 'adi', 'ber', 'maber', 'adwar', 'ochopo', 'kony',
+    },
+    'ki': {
+        'nĩ', 'wega', 'mũno', 'nĩndĩrenda', 'ndirenda', 'kũrĩ', 'ũhoro', 'njega', 'tiga',
+        'nĩngĩheo', 'ngathe', 'ndeithia', 'ti',
+    },
+}
+
+_WORD_PATTERN = re.compile(r'\w+')
+_PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+_llm_cache = OrderedDict()
+_llm_cache_lock = threading.Lock()
+
+
+def detect_language(message_content: str) -> str:
+    """Best-effort language code ('en', 'sw', 'luo', 'ki') from marker words"""
+    text = message_content.lower()
+    words = _WORD_PATTERN.findall(text)
+
+    scores = {language: sum(1 for word in words if word in markers)
+              for language, markers in LANGUAGE_MARKERS.items()}
+    if 'ĩ' in text or 'ũ' in text:
+        scores['ki'] += 2
+
+    language, score = max(scores.items(), key=lambda item: item[1])
+    return language if score > 0 else DEFAULT_LANGUAGE
+
+
+def load_response_catalogue(path: str = CATALOGUE_PATH) -> Dict[str, Dict[str, str]]:
+    """Load the catalogue once per process"""
+    global _catalogue
+
+    if _catalogue is None:
+        with _catalogue_lock:
+            if _catalogue is None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    _catalogue = json.load(f)
+    return _catalogue
+
+
+def render_catalogue_response(category: str, language: str, sender_name: str = '') -> Optional[str]:
+    """Catalogue response for (category, language) with the sender name, or None if there is no entry"""
+    template = load_response_catalogue().get(category, {}).get(language)
+    if template is None:
+        return None
+
+    name_part = f", {sender_name}" if sender_name and sender_name != 'Unknown' else ''
+    return template.replace('{name}', name_part)
+
+
+def normalize_message_text(message_content: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace so near-identical replies share a cache key"""
+    return ' '.join(_PUNCTUATION_PATTERN.sub(' ', message_content.lower()).split())
+
+
+def get_cached_llm_response(category: str, message_content: str) -> Optional[str]:
+    key = (category, normalize_message_text(message_content))
+    with _llm_cache_lock:
+        response = _llm_cache.get(key)
+        if response is not None:
+            _llm_cache.move_to_end(key)
+        return response
+
+
+def cache_llm_response(category: str, message_content: str, response: str):
+    key = (category, normalize_message_text(message_content))
+    with _llm_cache_lock:
+        _llm_cache[key] = response
+        _llm_cache.move_to_end(key)
+        while len(_llm_cache) > LLM_CACHE_SIZE:
+            _llm_cache.popitem(last=False)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Retry Scheduler
+Recovers transient send failures in bulk. Failed messages are classified from their provider
+error code as retryable or permanent; retryable ones get a jittered exponential backoff and go
+into a Redis sorted set scored by due time. The due time kept on the row is the source of
+truth: the database stands in when Redis is down, and rows overdue by RETRY_ORPHAN_GRACE are
+picked up even when Redis is up, since their queue entry may never have been written or may
+have been removed by a worker that died before releasing them. A periodic worker task pops
+whatever is due and sends it in one pass, so a large campaign never turns into one Celery task
+per failed message.
+"""
+
+import logging
+import os
+import random
+import re
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from campaign_control import get_redis
+from send_ledger import load_send_rows
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+RETRY_QUEUE_KEY = 'messages:retry_due'
+# Sends per message, first attempt included
+MAX_SEND_ATTEMPTS = int(os.getenv('MAX_SEND_ATTEMPTS', '4'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '60'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '3600'))
+RETRY_BATCH_SIZE = int(os.getenv('RETRY_BATCH_SIZE', '500'))
+# Seconds past due after which a retry is taken from the database, whatever Redis says
+RETRY_ORPHAN_GRACE = float(os.getenv('RETRY_ORPHAN_GRACE', '300'))
+
+# Twilio error codes (and HTTP statuses when Twilio gave no code) worth another attempt
+RETRYABLE_CODES = {
+    '429', '500', '502', '503', '504',
+    '20429',  # Too many requests
+    '20500',  # Internal server error
+    '20503',  # Service unavailable
+    '30001',  # Queue overflow
+    '30008',  # Unknown error from the carrier
+    '63018',  # Rate limit exceeded for the WhatsApp sender
+}
+# Codes that will fail the same way however often they are retried
+PERMANENT_CODES = {
+    '21211',  # Invalid 'To' number
+    '21408',  # Region not enabled
+    '21610',  # Recipient replied STOP
+    '21614',  # Not a mobile number
+    '30005',  # Unknown destination handset
+    '30006',  # Landline or unreachable carrier
+    '30007',  # Filtered by the carrier
+    '63003',  # Not a WhatsApp user
+    '63016',  # Outside the 24h window; needs an approved template
+    '63024',  # Invalid message recipient
+}
+# Errors without a code that read as transient (timeouts, dropped connections, throttling, and
+# the worker failing to record a send outcome)
+RETRYABLE_TEXT = re.compile(r'rate limit|too many requests|timeout|timed out|connection|temporar|unavailable'
+                            r'|dispatch error', re.IGNORECASE)
+_ERROR_CODE = re.compile(r'Twilio error:? (?:HTTP )?(\d{3,5})')
+
+
+def parse_error_code(error_message: Optional[str]) -> Optional[str]:
+    match = _ERROR_CODE.search(error_message or '')
+    return match.group(1) if match else None
+
+
+def classify_error(error_message: Optional[str]) -> Tuple[Optional[str], str]:
+    """(error code, 'retryable' | 'permanent') for a stored error message"""
+    code = parse_error_code(error_message)
+    if code in RETRYABLE_CODES:
+        return code, 'retryable'
+    if code in PERMANENT_CODES or code is not None:
+        return code, 'permanent'
+    return None, 'retryable' if RETRYABLE_TEXT.search(error_message or '') else 'permanent'
+
+
+def backoff_delay(attempt: int, rng=random) -> float:
+    """Seconds before retry number attempt: exponential, capped, half of it jittered"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+def setup_retry_columns(cursor):
+    """Error code, retry class and due time on messages, with partial indexes for both scans"""
+    cursor.execute("PRAGMA table_info(messages)")
+    existing = [column[1] for column in cursor.fetchall()]
+    for name, definition in (('error_code', 'TEXT'), ('retry_class', 'TEXT'), ('next_retry_at', 'TIMESTAMP')):
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE messages ADD COLUMN {name} {definition}")
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_unclassified_failures
+        ON messages(id) WHERE status = 'failed' AND retry_class IS NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_retry_due
+        ON messages(next_retry_at) WHERE status = 'retry_scheduled'
+    ''')
+
+
+def _push_due(entries: Dict[str, float]):
+    try:
+        get_redis().zadd(RETRY_QUEUE_KEY, entries)
+    except redis.RedisError as e:
+        log_event(logger, 'retry_queue_redis_unavailable', logging.WARNING, retries=len(entries),
+                  error=str(e))
+
+
+def schedule_failed_messages(conn, now: float = None, rng=random) -> Dict[str, int]:
+    """
+    Classify failures nobody has looked at yet, a page at a time. Retryable ones under the
+    attempt cap become 'retry_scheduled' with a due time; the rest keep 'failed' with their class.
+    """
+    now = now or time.time()
+    cursor = conn.cursor()
+    counts = {'retryable': 0, 'permanent': 0, 'exhausted': 0}
+    last_id = 0
+
+    while True:
+        cursor.execute('''
+            SELECT id, error_message, retry_count FROM messages
+            WHERE status = 'failed' AND retry_class IS NULL AND id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, RETRY_BATCH_SIZE))
+        page = cursor.fetchall()
+        if not page:
+            return counts
+        last_id = page[-1][0]
+
+        scheduled, settled, due = [], [], {}
+        for message_id, error_message, retry_count in page:
+            code, retry_class = classify_error(error_message)
+            retries = retry_count or 0
+            if retry_class == 'retryable' and retries + 1 >= MAX_SEND_ATTEMPTS:
+                retry_class = 'exhausted'
+            counts[retry_class] += 1
+
+            if retry_class == 'retryable':
+                due_at = now + backoff_delay(retries + 1, rng)
+                scheduled.append((code, datetime.fromtimestamp(due_at), message_id))
+                due[str(message_id)] = due_at
+            else:
+                settled.append((retry_class, code, message_id))
+
+        cursor.executemany('''
+            UPDATE messages
+            SET status = 'retry_scheduled', retry_class = 'retryable', error_code = ?,
+                next_retry_at = ?, retry_count = COALESCE(retry_count, 0) + 1
+            WHERE id = ?
+        ''', scheduled)
+        cursor.executemany('''
+            UPDATE messages SET retry_class = ?, error_code = ? WHERE id = ?
+        ''', settled)
+        conn.commit()
+        if due:
+            _push_due(due)
+
+
+def _due_in_database(conn, due_by: float, limit: int) -> List[int]:
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id FROM messages
+        WHERE status = 'retry_scheduled' AND next_retry_at <= ?
+        ORDER BY next_retry_at
+        LIMIT ?
+    ''', (datetime.fromtimestamp(due_by), limit))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def pop_due_retries(conn, now: float = None, limit: int = None) -> List[int]:
+    """
+    Take up to limit due message IDs off the schedule, plus any the schedule lost (overdue by
+    RETRY_ORPHAN_GRACE in the database); the database answers alone if Redis can't
+    """
+    now = now or time.time()
+    limit = limit or RETRY_BATCH_SIZE
+    try:
+        client = get_redis()
+        due = []
+        members = client.zrangebyscore(RETRY_QUEUE_KEY, '-inf', now, start=0, num=limit)
+        if members:
+            # Only members this worker actually removed are its to send
+            pipe = client.pipeline()
+            for member in members:
+                pipe.zrem(RETRY_QUEUE_KEY, member)
+            due = [int(member) for member, removed in zip(members, pipe.execute()) if removed]
+    except redis.RedisError:
+        return _due_in_database(conn, now, limit)
+
+    popped = set(due)
+    orphans = [message_id for message_id in _due_in_database(conn, now - RETRY_ORPHAN_GRACE, limit)
+               if message_id not in popped]
+    if orphans:
+        log_event(logger, 'retry_orphans_recovered', logging.WARNING, retries=len(orphans))
+    return due + orphans
+
+
+def release_due_retries(conn, message_ids: List[int], now: float = None) -> List[tuple]:
+    """
+    Put due messages back to 'pending' and return what's needed to send them:
+    (id, campaign_id, phone, variables, message_content, name, template, rate_limit).
+    Cancelled campaigns drop their retries; paused ones push them back by a base delay.
+    """
+    if not message_ids:
+        return []
+    now = now or time.time()
+    cursor = conn.cursor()
+    placeholders = ','.join('?' * len(message_ids))
+
+    cursor.execute(f'''
+        SELECT m.id, cp.status FROM messages m
+        JOIN campaigns cp ON cp.id = m.campaign_id
+        WHERE m.id IN ({placeholders}) AND m.status = 'retry_scheduled'
+    ''', message_ids)
+    ready, cancelled, deferred = [], [], {}
+    for message_id, campaign_status in cursor.fetchall():
+        if campaign_status == 'cancelled':
+            cancelled.append((message_id,))
+        elif campaign_status == 'paused':
+            deferred[str(message_id)] = now + RETRY_BASE_DELAY
+        else:
+            ready.append((message_id,))
+
+    cursor.executemany('''
+        UPDATE messages SET status = 'pending', next_retry_at = NULL, retry_class = NULL
+        WHERE id = ?
+    ''', ready)
+    cursor.executemany("UPDATE messages SET status = 'cancelled' WHERE id = ?", cancelled)
+    cursor.executemany('''
+        UPDATE messages SET next_retry_at = ? WHERE id = ?
+    ''', [(datetime.fromtimestamp(due_at), int(message_id)) for message_id, due_at in deferred.items()])
+    conn.commit()
+    if deferred:
+        _push_due(deferred)
+    return load_send_rows(cursor, [row[0] for row in ready])
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Campaign Scheduler
+Time-based dispatch driven by one celery beat tick: campaigns with a future scheduled_at, messages
+held back by the recipient's quiet hours, and due opt-out confirmations (claimed and sent by
+opt_out_manager.dispatch_opt_out_confirmations). Each kind of work sits
+behind a partial index on its due time, so a tick costs one indexed range query per queue
+however large the backlog behind it is.
+"""
+
+import os
+import random
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from phone_numbers import DEFAULT_COUNTRY, country_for_phone
+from send_ledger import load_send_rows
+
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', '500'))
+# Recipient-local hours with no campaign sends; equal values switch quiet hours off
+QUIET_HOURS_START = int(os.getenv('QUIET_HOURS_START', '0'))
+QUIET_HOURS_END = int(os.getenv('QUIET_HOURS_END', '0'))
+# Seconds over which messages held by quiet hours are released once the window opens
+QUIET_HOURS_SPREAD = float(os.getenv('QUIET_HOURS_SPREAD', '3600'))
+
+COUNTRY_TIMEZONES = {
+    'KE': 'Africa/Nairobi',
+    'UG': 'Africa/Kampala',
+    'TZ': 'Africa/Dar_es_Salaam',
+    'RW': 'Africa/Kigali',
+    'BI': 'Africa/Bujumbura',
+    'ET': 'Africa/Addis_Ababa',
+    'SS': 'Africa/Juba',
+    'SO': 'Africa/Mogadishu',
+    'ZA': 'Africa/Johannesburg',
+    'NG': 'Africa/Lagos',
+    'GB': 'Europe/London',
+    'US': 'America/New_York',  # dial code 1 spans several zones; Eastern is the conservative pick
+}
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', COUNTRY_TIMEZONES.get(DEFAULT_COUNTRY, 'UTC'))
+
+
+def setup_scheduler(cursor):
+    """Due-time columns and their partial indexes for scheduled campaigns and deferred messages"""
+    for table, column in (('campaigns', 'scheduled_at'), ('messages', 'send_after')):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} TIMESTAMP")
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_campaigns_scheduled
+        ON campaigns(scheduled_at) WHERE status = 'scheduled'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_deferred
+        ON messages(send_after) WHERE status = 'deferred'
+    ''')
+
+
+@lru_cache(maxsize=None)
+def _zone(country: Optional[str]) -> ZoneInfo:
+    return ZoneInfo(COUNTRY_TIMEZONES.get(country, DEFAULT_TIMEZONE))
+
+
+def recipient_timezone(phone) -> ZoneInfo:
+    return _zone(country_for_phone(phone))
+
+
+def quiet_hours_end(phone, now: datetime = None) -> Optional[datetime]:
+    """
+    If it is quiet hours where the recipient is, the server-local time they end (plus a random
+    offset inside QUIET_HOURS_SPREAD so the morning isn't one burst); otherwise None.
+    """
+    if QUIET_HOURS_START == QUIET_HOURS_END:
+        return None
+
+    zone = recipient_timezone(phone)
+    local = now.astimezone(zone) if now else datetime.now(zone)
+    if QUIET_HOURS_START > QUIET_HOURS_END:
+        quiet = local.hour >= QUIET_HOURS_START or local.hour < QUIET_HOURS_END
+    else:
+        quiet = QUIET_HOURS_START <= local.hour < QUIET_HOURS_END
+    if not quiet:
+        return None
+
+    end = local.replace(hour=QUIET_HOURS_END, minute=0, second=0, microsecond=0)
+    if end <= local:
+        end += timedelta(days=1)
+    end += timedelta(seconds=random.uniform(0, QUIET_HOURS_SPREAD))
+    return end.astimezone().replace(tzinfo=None)
+
+
+def defer_message(cursor, message_id: int, send_after: datetime):
+    """Hold a pending message until send_after; the scheduler tick hands it back"""
+    cursor.execute('''
+        UPDATE messages SET status = 'deferred', send_after = ?
+        WHERE id = ? AND status = 'pending'
+    ''', (send_after, message_id))
+
+
+def parse_schedule_time(value: Optional[str]) -> Optional[datetime]:
+    """An ISO 8601 time from the API as server-local naive time, like every other timestamp"""
+    if not value:
+        return None
+    scheduled = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if scheduled.tzinfo is not None:
+        scheduled = scheduled.astimezone().replace(tzinfo=None)
+    return scheduled
+
+
+def start_due_campaigns(conn, now: datetime = None) -> List[Tuple[str, int]]:
+    """Move scheduled campaigns whose time has come to 'pending'; returns (id, rate_limit) to dispatch"""
+    now = now or datetime.now()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, rate_limit FROM campaigns
+        WHERE status = 'scheduled' AND scheduled_at <= ?
+        ORDER BY scheduled_at
+        LIMIT ?
+    ''', (now, SCHEDULER_BATCH_SIZE))
+    due = cursor.fetchall()
+
+    started = []
+    for campaign_id, rate_limit in due:
+        # Guarded, so two ticks never start the same campaign
+        cursor.execute('''
+            UPDATE campaigns SET status = 'pending' WHERE id = ? AND status = 'scheduled'
+        ''', (campaign_id,))
+        if cursor.rowcount == 1:
+            started.append((campaign_id, rate_limit))
+    conn.commit()
+    return started
+
+
+def release_deferred_messages(conn, now: datetime = None) -> List[tuple]:
+    """
+    Hand messages whose quiet hours are over back to 'pending' and return their send rows
+    (see load_send_rows). Messages of paused campaigns wait for the campaign to resume.
+    """
+    now = now or datetime.now()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT m.id FROM messages m
+        JOIN campaigns cp ON cp.id = m.campaign_id
+        WHERE m.status = 'deferred' AND m.send_after <= ? AND cp.status != 'paused'
+        ORDER BY m.send_after
+        LIMIT ?
+    ''', (now, SCHEDULER_BATCH_SIZE))
+    ids = [row[0] for row in cursor.fetchall()]
+
+    cursor.executemany('''
+        UPDATE messages SET status = 'pending', send_after = NULL
+        WHERE id = ? AND status = 'deferred'
+    ''', [(message_id,) for message_id in ids])
+    conn.commit()
+    return load_send_rows(cursor, ids)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Send Ledger
+Makes every message go to the provider at most once, even when a worker dies mid-campaign or a
+task is redelivered. Before the provider call a message is claimed: moved from 'pending' to
+'sending' with a fresh claim token, and committed. Only the holder of the token can record the
+outcome. Rows a dead worker left in 'sending' are reconciled before anything is sent again:
+
+  - a provider SID on the row (a status callback tagged with the message's idempotency key
+    recorded it) means sent
+  - otherwise the provider is asked for messages to the number with the same text since the
+    claim. Ones whose SID another message holds are not this one. None left means pending;
+    exactly one, with no other stuck message it could belong to, means sent with that SID
+  - anything else is ambiguous: the row stays claimed with a review_reason, for a person to settle
+  - no answer from the provider leaves the row alone until the next reconciliation
+"""
+
+import logging
+import os
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlencode
+
+from message_templates import compile_template, render_message
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a 'sending' claim is treated as abandoned by its worker
+SEND_CLAIM_TIMEOUT = int(os.getenv('SEND_CLAIM_TIMEOUT', '300'))
+
+
+def setup_send_ledger(cursor):
+    """Claim columns on messages, plus a partial index over the (normally tiny) in-flight set"""
+    cursor.execute("PRAGMA table_info(messages)")
+    existing = [column[1] for column in cursor.fetchall()]
+    for name, definition in (('claim_token', 'TEXT'), ('claimed_at', 'TIMESTAMP'), ('review_reason', 'TEXT')):
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE messages ADD COLUMN {name} {definition}")
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_sending
+        ON messages(claimed_at) WHERE status = 'sending'
+    ''')
+
+
+def idempotency_key(campaign_id: str, message_id: int) -> str:
+    """Deterministic per message, so a re-send after a crash carries the same key"""
+    return f"{campaign_id}:{message_id}"
+
+
+def message_id_from_key(key: Optional[str]) -> Optional[int]:
+    """The message id in an idempotency key, or None if it isn't one"""
+    _, _, message_id = (key or '').rpartition(':')
+    return int(message_id) if message_id.isdigit() else None
+
+
+def tag_status_callback(url: str, key: str) -> str:
+    """The status callback URL for one message, carrying its idempotency key back to the webhook"""
+    return f"{url}{'&' if '?' in url else '?'}{urlencode({'key': key})}"
+
+
+def claim_message(conn, message_id: int) -> Optional[str]:
+    """Claim a pending message for sending; returns the claim token, or None if it isn't pending"""
+    token = uuid.uuid4().hex
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE messages
+        SET status = 'sending', claim_token = ?, claimed_at = ?
+        WHERE id = ? AND status = 'pending'
+    ''', (token, datetime.now(), message_id))
+    conn.commit()
+    return token if cursor.rowcount == 1 else None
+
+
+def record_send_result(cursor, message_id: int, token: Optional[str], success: bool,
+                       error_msg: Optional[str] = None, message_content: Optional[str] = None,
+                       provider_sid: Optional[str] = None) -> bool:
+    """
+    Store the provider's answer for a claimed message; False if the claim was lost. Without a
+    token, a failure is recorded only on a message that is still pending (it never got claimed).
+    """
+    if success:
+        cursor.execute('''
+            UPDATE messages
+            SET status = 'sent', sent_at = ?, message_content = ?, provider_sid = ?, claim_token = NULL
+            WHERE id = ? AND claim_token IS ?
+        ''', (datetime.now(), message_content, provider_sid, message_id, token))
+    else:
+        cursor.execute('''
+            UPDATE messages
+            SET status = 'failed', failed_at = ?, error_message = ?, claim_token = NULL
+            WHERE id = ? AND claim_token IS ? AND status IN ('pending', 'sending')
+        ''', (datetime.now(), error_msg, message_id, token))
+    return cursor.rowcount == 1
+
+
+def release_message(cursor, message_id: int, token: str):
+    """Hand a claimed message back to the queue without it having reached the provider"""
+    cursor.execute('''
+        UPDATE messages
+        SET status = 'pending', claim_token = NULL, claimed_at = NULL
+        WHERE id = ? AND claim_token = ?
+    ''', (message_id, token))
+
+
+def reconcile_stuck_messages(conn, lookup: Callable, campaign_id: Optional[str] = None,
+                             older_than: Optional[int] = None) -> Dict[str, int]:
+    """
+    Resolve messages left in 'sending'. lookup(phone, content, claimed_at) returns the provider
+    SIDs of messages to phone with that text since the claim; an exception means it can't tell,
+    and the row stays claimed so it is never sent blind. Either pass campaign_id (the one task
+    that owns that campaign) or older_than seconds (startup, when other workers may hold live
+    claims). Rows waiting for review are skipped.
+    """
+    cursor = conn.cursor()
+    query = '''
+        SELECT m.id, m.campaign_id, c.phone_canonical, m.message_content, m.variables,
+               cp.message_template, m.claim_token, m.claimed_at, m.provider_sid
+        FROM messages m
+        JOIN contacts c ON c.id = m.contact_id
+        JOIN campaigns cp ON cp.id = m.campaign_id
+        WHERE m.status = 'sending' AND m.review_reason IS NULL
+    '''
+    params = []
+    if campaign_id is not None:
+        query += ' AND m.campaign_id = ?'
+        params.append(campaign_id)
+    if older_than is not None:
+        query += ' AND m.claimed_at < ?'
+        params.append(datetime.now() - timedelta(seconds=older_than))
+    cursor.execute(query, params)
+    stuck = cursor.fetchall()
+
+    counts = {'sent': 0, 'pending': 0, 'review': 0, 'unresolved': 0}
+    if not stuck:
+        return counts
+
+    # Every claimed message without a SID could own a provider message with its number and text
+    cursor.execute('''
+        SELECT c.phone_canonical, m.message_content, m.variables, cp.message_template
+        FROM messages m
+        JOIN contacts c ON c.id = m.contact_id
+        JOIN campaigns cp ON cp.id = m.campaign_id
+        WHERE m.status = 'sending' AND m.provider_sid IS NULL
+    ''')
+    contenders = Counter(
+        (phone, rendered if rendered is not None else render_message(compile_template(template), variables))
+        for phone, rendered, variables, template in cursor.fetchall()
+    )
+
+    for message_id, campaign, phone, rendered, variables, template, token, claimed_at, sid in stuck:
+        if sid is None:
+            content = rendered if rendered is not None else render_message(compile_template(template), variables)
+            try:
+                candidates = set(lookup(phone, content, claimed_at))
+            except Exception as e:
+                log_event(logger, 'reconcile_unresolved', logging.WARNING, campaign_id=campaign,
+                          message_id=message_id, error=str(e))
+                counts['unresolved'] += 1
+                continue
+
+            if candidates:
+                cursor.execute(f'''
+                    SELECT provider_sid FROM messages WHERE provider_sid IN ({','.join('?' * len(candidates))})
+                ''', list(candidates))
+                candidates -= {row[0] for row in cursor.fetchall()}
+
+            if not candidates:
+                release_message(cursor, message_id, token)
+                counts['pending'] += 1
+                continue
+            if len(candidates) > 1 or contenders[(phone, content)] > 1:
+                reason = (f"{len(candidates)} unattributed provider messages and "
+                          f"{contenders[(phone, content)]} claimed messages share this number and text")
+                cursor.execute('''
+                    UPDATE messages SET review_reason = ? WHERE id = ? AND claim_token = ?
+                ''', (reason, message_id, token))
+                log_event(logger, 'reconcile_needs_review', logging.WARNING, campaign_id=campaign,
+                          message_id=message_id, reason=reason)
+                counts['review'] += 1
+                continue
+            sid = candidates.pop()
+
+        cursor.execute('''
+            UPDATE messages
+            SET status = 'sent', sent_at = COALESCE(sent_at, claimed_at), provider_sid = ?, claim_token = NULL
+            WHERE id = ? AND claim_token = ?
+        ''', (sid, message_id, token))
+        counts['sent'] += 1
+
+    conn.commit()
+    log_event(logger, 'messages_reconciled', campaign_id=campaign_id, stuck=len(stuck), **counts)
+    return counts
+
+
+def load_send_rows(cursor, message_ids: List[int]) -> List[tuple]:
+    """
+    What the sender needs for messages released back to 'pending' outside a campaign run:
+    (id, campaign_id, phone, variables, message_content, name, template, rate_limit)
+    """
+    if not message_ids:
+        return []
+    cursor.execute(f'''
+        SELECT m.id, m.campaign_id, c.phone_canonical, m.variables, m.message_content, c.name,
+               cp.message_template, cp.rate_limit
+        FROM messages m
+        JOIN contacts c ON c.id = m.contact_id
+        JOIN campaigns cp ON cp.id = m.campaign_id
+        WHERE m.id IN ({','.join('?' * len(message_ids))})
+        ORDER BY m.id
+    ''', message_ids)
+    return cursor.fetchall()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Local Sentiment Model for WhatsApp replies
+Hashed n-gram features with a linear (softmax) classifier, trained from the labelled replies table.
+Runs offline on CPU with NumPy in front of Gemini, which only sees the low-confidence replies.
+
+Usage:
+    python sentiment_model.py train [--db whatsapp_campaigns.db] [--output sentiment_model.npz]
+    python sentiment_model.py eval [--db whatsapp_campaigns.db] [--model sentiment_model.npz]
+    python sentiment_model.py predict "Bei gani ya bra?"
+"""
+
+import argparse
+import os
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from db import connect
+
+SENTIMENT_LABELS = [
+    'interested', 'question', 'positive_feedback', 'complaint',
+    'neutral', 'urgent', 'desired_opt_out'
+]
+
+# Older rows were labelled with the pre-Gemini categories
+LEGACY_LABELS = {
+    'positive': 'positive_feedback',
+    'negative': 'complaint',
+}
+
+ATTENTION_LABELS = {'complaint', 'urgent', 'desired_opt_out'}
+
+N_FEATURES = 2 ** 14
+BUCKET_MASK = N_FEATURES - 1
+DEFAULT_MODEL_PATH = os.getenv('SENTIMENT_MODEL_PATH', 'sentiment_model.npz')
+
+# Small multilingual seed set (English, Swahili, Dholuo, Gikuyu) so the model
+# covers the basics even before many replies have been labelled by Gemini
+SEED_EXAMPLES = [
+    # Interested
+    ("I'm interested, please send me the catalogue", 'interested'),
+    ("I want to buy the lace set", 'interested'),
+    ("Nataka kununua hii", 'interested'),
+    ("Nataka bra mbili", 'interested'),
+    ("Nipe hiyo set ya lace", 'interested'),
+    ("Adwaro ngiewo", 'interested'),
+    ("Adwaro mano", 'interested'),
+    ("Nĩndĩrenda kũgũra", 'interested'),
+    ("Nĩndĩrenda ĩyo", 'interested'),
+    ("Yes I'd like to order", 'interested'),
+    # Question
+    ("How much is the black bra?", 'question'),
+    ("What sizes do you have", 'question'),
+    ("Do you deliver to Kisumu", 'question'),
+    ("Bei gani ya nightwear", 'question'),
+    ("Naweza kupata size 36", 'question'),
+    ("Kuna rangi nyekundu", 'question'),
+    ("Mnapatikana wapi", 'question'),
+    ("Anyalo yudo size matin", 'question'),
+    ("Nitie rangi makwar", 'question'),
+    ("Nengone adi", 'question'),
+    ("Nĩngĩheo size nene", 'question'),
+    ("Nĩ kũrĩ rangi ĩngĩ", 'question'),
+    ("I need to know the prices", 'question'),
+    # Positive feedback
+    ("Thank you so much, I love it", 'positive_feedback'),
+    ("The quality is amazing", 'positive_feedback'),
+    ("Asante sana, nimefurahi", 'positive_feedback'),
+    ("Nzuri sana, asante", 'positive_feedback'),
+    ("Erokamano ahinya", 'positive_feedback'),
+    ("Amor ahinya", 'positive_feedback'),
+    ("Nĩ wega mũno", 'positive_feedback'),
+    ("Nĩ njega mũno", 'positive_feedback'),
+    ("Great service, fast delivery", 'positive_feedback'),
+    # Complaint
+    ("The size you sent is wrong", 'complaint'),
+    ("I received a damaged item", 'complaint'),
+    ("My order never arrived", 'complaint'),
+    ("Nimekasirika, mzigo haujafika", 'complaint'),
+    ("Bidhaa ni mbaya", 'complaint'),
+    ("Gik mane ok ber", 'complaint'),
+    ("Ok ochopo", 'complaint'),
+    ("Ti njega", 'complaint'),
+    ("I want a refund", 'complaint'),
+    # Neutral
+    ("Ok", 'neutral'),
+    ("Sawa", 'neutral'),
+    ("Noted", 'neutral'),
+    ("Hello", 'neutral'),
+    ("Habari", 'neutral'),
+    ("Ber", 'neutral'),
+    ("Nĩ ũhoro", 'neutral'),
+    ("Received", 'neutral'),
+    # Urgent
+    ("This is urgent, call me now", 'urgent'),
+    ("Emergency, I need help immediately", 'urgent'),
+    ("Haraka tafadhali, nisaidie", 'urgent'),
+    ("I will report you to the police", 'urgent'),
+    ("Kony piyo", 'urgent'),
+    ("Ndeithia narua", 'urgent'),
+    # Opt-out
+    ("Stop sending me messages", 'desired_opt_out'),
+    ("Unsubscribe me", 'desired_opt_out'),
+    ("Remove my number from your list", 'desired_opt_out'),
+    ("Sitaki ujumbe huu tena", 'desired_opt_out'),
+    ("Usinitumie tena", 'desired_opt_out'),
+    ("Ok adwar ote", 'desired_opt_out'),
+    ("Weya oro ote", 'desired_opt_out'),
+    ("Ndirenda marũa maya", 'desired_opt_out'),
+    ("Tiga gũtũma", 'desired_opt_out'),
+]
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def _hash(gram: str) -> int:
+    # crc32 rather than hash(): str hashes are salted per process, so buckets must be stable
+    return zlib.crc32(gram.encode('utf-8'))
+
+
+@lru_cache(maxsize=100000)
+def _token_features(token: str) -> Tuple[int, Tuple[int, ...]]:
+    """
+    Full hash of a word plus the buckets for its unigram and character trigrams,
+    memoised per distinct word so repeated vocabulary costs a dict lookup
+    """
+    word_hash = _hash('w:' + token)
+    padded = '<' + token + '>'
+    buckets = [word_hash & BUCKET_MASK]
+    buckets.extend(_hash('c:' + padded[i:i + 3]) & BUCKET_MASK for i in range(len(padded) - 2))
+    return word_hash, tuple(buckets)
+
+
+QUESTION_MARK_BUCKET = _hash('q:?') & BUCKET_MASK
+EMPTY_BUCKET = _hash('empty') & BUCKET_MASK
+
+
+def extract_features(message_content: str) -> Tuple[np.ndarray, float]:
+    """
+    Hash word unigrams, word bigrams and character trigrams into N_FEATURES buckets.
+    Returns the bucket indices (repeats count twice) and the L2-normalising value for each.
+    Character trigrams help with Swahili/Gikuyu/Dholuo word forms ("sitaki", "ndirenda").
+    """
+    text = message_content.lower()
+
+    buckets = []
+    previous_hash = None
+    for token in _TOKEN_PATTERN.findall(text):
+        word_hash, token_buckets = _token_features(token)
+        buckets.extend(token_buckets)
+        if previous_hash is not None:
+            # Bigram bucket derived from the two word hashes, no extra string hashing
+            buckets.append(((previous_hash * 1000003) ^ word_hash) & BUCKET_MASK)
+        previous_hash = word_hash
+
+    if '?' in text:
+        buckets.append(QUESTION_MARK_BUCKET)
+    if not buckets:
+        buckets.append(EMPTY_BUCKET)
+
+    return np.array(buckets, dtype=np.intp), 1.0 / np.sqrt(len(buckets))
+
+
+class LocalSentimentModel:
+    """Multinomial logistic regression over hashed n-gram features"""
+
+    def __init__(self, weights: Optional[np.ndarray] = None, bias: Optional[np.ndarray] = None,
+                 labels: Optional[List[str]] = None):
+        self.labels = list(labels or SENTIMENT_LABELS)
+        self.weights = weights if weights is not None else np.zeros((N_FEATURES, len(self.labels)), dtype=np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(self.labels), dtype=np.float32)
+
+    def predict_proba(self, message_content: str) -> np.ndarray:
+        indices, value = extract_features(message_content)
+        logits = self.weights.take(indices, axis=0).sum(axis=0) * value + self.bias
+        logits = np.exp(logits - logits.max())
+        return logits / logits.sum()
+
+    def predict(self, message_content: str) -> Tuple[str, float]:
+        """Return (label, confidence) for a single message"""
+        probabilities = self.predict_proba(message_content)
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+    def fit(self, messages: List[str], labels: List[str], sample_weights: Optional[List[float]] = None,
+            epochs: int = 300, learning_rate: float = 0.5, l2: float = 1e-4) -> 'LocalSentimentModel':
+        """Full-batch gradient descent on the sparse feature matrix"""
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        n_samples = len(messages)
+
+        # Sparse (COO) representation: one entry per active feature per sample
+        rows, columns, values = [], [], []
+        for row, message in enumerate(messages):
+            indices, value = extract_features(message)
+            rows.append(np.full(len(indices), row))
+            columns.append(indices)
+            values.append(np.full(len(indices), value, dtype=np.float32))
+        rows = np.concatenate(rows)
+        columns = np.concatenate(columns)
+        values = np.concatenate(values)
+
+        targets = np.zeros((n_samples, len(self.labels)), dtype=np.float32)
+        targets[np.arange(n_samples), [label_index[label] for label in labels]] = 1.0
+
+        weights = np.asarray(sample_weights if sample_weights is not None else np.ones(n_samples), dtype=np.float32)
+        weights = weights / weights.sum()
+
+        for _ in range(epochs):
+            logits = np.zeros((n_samples, len(self.labels)), dtype=np.float32)
+            np.add.at(logits, rows, self.weights[columns] * values[:, None])
+            logits += self.bias
+            logits -= logits.max(axis=1, keepdims=True)
+            probabilities = np.exp(logits)
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+            error = (probabilities - targets) * weights[:, None]
+            gradient = np.zeros_like(self.weights)
+            np.add.at(gradient, columns, error[rows] * values[:, None])
+
+            self.weights -= learning_rate * (gradient * n_samples + l2 * self.weights)
+            self.bias -= learning_rate * error.sum(axis=0) * n_samples
+
+        return self
+
+    def save(self, path: str = DEFAULT_MODEL_PATH):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels))
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> 'LocalSentimentModel':
+        data = np.load(path)
+        return cls(data['weights'], data['bias'], [str(label) for label in data['labels']])
+
+
+_loaded_model = None
+_loaded_model_path = None
+
+
+def get_local_model(path: str = DEFAULT_MODEL_PATH) -> Optional[LocalSentimentModel]:
+    """Load the trained model once per process; None if it hasn't been trained yet"""
+    global _loaded_model, _loaded_model_path
+
+    if _loaded_model_path != path:
+        _loaded_model_path = path
+        _loaded_model = LocalSentimentModel.load(path) if os.path.exists(path) else None
+        if _loaded_model is None:
+            print(f"⚠️ No local sentiment model at {path} - run: python sentiment_model.py train")
+
+    return _loaded_model
+
+
+def classify_reply_local(message_content: str, model: Optional[LocalSentimentModel] = None) -> Optional[Dict]:
+    """Classify with the local model, in the same result format as the other detectors"""
+    model = model or get_local_model()
+    if model is None:
+        return None
+
+    sentiment, confidence = model.predict(message_content)
+    return {
+        'sentiment': sentiment,
+        'confidence': confidence,
+        'requires_attention': sentiment in ATTENTION_LABELS,
+        'detailed_category': sentiment.upper(),
+        'reasoning': 'Local n-gram model'
+    }
+
+
+def load_training_data(db_path: str = 'whatsapp_campaigns.db', include_seed: bool = True):
+    """Labelled replies (weighted by confidence_score) plus the built-in seed set"""
+    messages, labels, weights = [], [], []
+
+    if include_seed:
+        for message, label in SEED_EXAMPLES:
+            messages.append(message)
+            labels.append(label)
+            weights.append(1.0)
+
+    if os.path.exists(db_path):
+        conn = connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT message_content, sentiment, confidence_score
+            FROM replies
+            WHERE sentiment IS NOT NULL AND message_content IS NOT NULL
+        ''')
+        for message, sentiment, confidence in cursor.fetchall():
+            sentiment = LEGACY_LABELS.get(sentiment, sentiment)
+            if sentiment in SENTIMENT_LABELS:
+                messages.append(message)
+                labels.append(sentiment)
+                weights.append(confidence if confidence else 0.5)
+        conn.close()
+
+    return messages, labels, weights
+
+
+def split_holdout(messages, labels, weights, holdout_every: int = 5):
+    """Deterministic split: every Nth example is held out for evaluation"""
+    train, test = ([], [], []), ([], [], [])
+    for i, example in enumerate(zip(messages, labels, weights)):
+        target = test if i % holdout_every == holdout_every - 1 else train
+        for column, value in zip(target, example):
+            column.append(value)
+    return train, test
+
+
+def evaluate(model: LocalSentimentModel, messages, labels, threshold: float) -> Dict:
+    """Accuracy, per-label precision/recall and how often the model would escalate to the LLM"""
+    predictions = [model.predict(message) for message in messages]
+    confident = [(label, predicted) for label, (predicted, confidence) in zip(labels, predictions)
+                 if confidence >= threshold]
+
+    per_label = {}
+    for name in model.labels:
+        true_positive = sum(1 for label, (predicted, _) in zip(labels, predictions) if label == name == predicted)
+        predicted_count = sum(1 for predicted, _ in predictions if predicted == name)
+        actual_count = sum(1 for label in labels if label == name)
+        per_label[name] = {
+            'precision': true_positive / predicted_count if predicted_count else 0.0,
+            'recall': true_positive / actual_count if actual_count else 0.0,
+            'support': actual_count,
+        }
+
+    total = len(messages) or 1
+    return {
+        'accuracy': sum(1 for label, (predicted, _) in zip(labels, predictions) if label == predicted) / total,
+        'confident_accuracy': (sum(1 for label, predicted in confident if label == predicted) / len(confident)
+                               if confident else 0.0),
+        'escalation_rate': 1 - len(confident) / total,
+        'per_label': per_label,
+    }
+
+
+def print_evaluation(results: Dict, threshold: float):
+    print(f"📊 Accuracy: {results['accuracy']:.1%}")
+    print(f"🎯 Accuracy at confidence >= {threshold}: {results['confident_accuracy']:.1%}")
+    print(f"🤖 Escalated to LLM: {results['escalation_rate']:.1%}")
+    for label, stats in results['per_label'].items():
+        print(f"   {label:18s} precision {stats['precision']:.2f}  recall {stats['recall']:.2f}  (n={stats['support']})")
+
+
+def main():
+    threshold_default = float(os.getenv('LOCAL_SENTIMENT_THRESHOLD', '0.8'))
+
+    parser = argparse.ArgumentParser(description='Train and evaluate the local reply sentiment model')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help='Train on labelled replies and save the model')
+    train_parser.add_argument('--db', default='whatsapp_campaigns.db')
+    train_parser.add_argument('--output', default=DEFAULT_MODEL_PATH)
+    train_parser.add_argument('--epochs', type=int, default=300)
+    train_parser.add_argument('--no-seed', action='store_true', help='Skip the built-in seed examples')
+
+    eval_parser = subparsers.add_parser('eval', help='Train on 80%% of the data and evaluate on the rest')
+    eval_parser.add_argument('--db', default='whatsapp_campaigns.db')
+    eval_parser.add_argument('--threshold', type=float, default=threshold_default)
+    eval_parser.add_argument('--epochs', type=int, default=300)
+    eval_parser.add_argument('--no-seed', action='store_true')
+
+    predict_parser = subparsers.add_parser('predict', help='Classify a single message')
+    predict_parser.add_argument('message')
+    predict_parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        messages, labels, weights = load_training_data(args.db, include_seed=not args.no_seed)
+        print(f"🧠 Training on {len(messages)} labelled messages...")
+        model = LocalSentimentModel().fit(messages, labels, weights, epochs=args.epochs)
+        model.save(args.output)
+        print(f"✅ Model saved to {args.output}")
+
+    elif args.command == 'eval':
+        messages, labels, weights = load_training_data(args.db, include_seed=not args.no_seed)
+        (train_messages, train_labels, train_weights), (test_messages, test_labels, _) = split_holdout(
+            messages, labels, weights
+        )
+        print(f"🧠 Training on {len(train_messages)}, evaluating on {len(test_messages)} held-out messages...")
+        model = LocalSentimentModel().fit(train_messages, train_labels, train_weights, epochs=args.epochs)
+        print_evaluation(evaluate(model, test_messages, test_labels, args.threshold), args.threshold)
+
+    elif args.command == 'predict':
+        model = LocalSentimentModel.load(args.model)
+        label, confidence = model.predict(args.message)
+        print(f"{label} ({confidence:.2f})")
+
+
+if __name__ == "__main__":
+    main()
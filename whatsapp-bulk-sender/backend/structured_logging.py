@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Structured Logging
+One JSON object per log line, written by a background thread. Callers put the record on a
+bounded queue and carry on, so a slow stdout never holds up sending (the solo worker pool sends
+from the thread that logs); when the queue is full records are dropped and counted in
+whatsapp_log_records_dropped_total rather than waited on.
+
+Per-message events (a message sent, a reply stored) go through log_message_event and are sampled
+by message: a sampled message logs every event of its lifecycle and the rest log none, so a
+million-message campaign logs about LOG_MESSAGE_SAMPLE_RATE of them. Sampling applies below
+ERROR; the messages table and the metrics still count every send and failure. campaign_id,
+message_id and reply_id bound with log_context() are added to each line logged inside it.
+
+LOG_LEVEL sets the default level and LOG_LEVELS overrides it per module, e.g.
+"celery_worker=WARNING,reply_handler=DEBUG". LOG_FORMAT=text writes plain lines for local runs.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from metrics import Counter
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Per-module levels, "module=LEVEL,module=LEVEL"
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+# 'json' for log collectors, 'text' for reading in a terminal
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Fraction of messages (and replies) whose per-message events are logged
+LOG_MESSAGE_SAMPLE_RATE = float(os.getenv('LOG_MESSAGE_SAMPLE_RATE', '0.01'))
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Libraries that log every HTTP request at INFO; LOG_LEVELS can still turn them up
+DEFAULT_LEVELS = {'twilio.http_client': 'WARNING'}
+
+DROPPED = Counter('whatsapp_log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+_context: contextvars.ContextVar = contextvars.ContextVar('log_context', default={})
+_handler: Optional['NonBlockingQueueHandler'] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class log_context:
+    """Add correlation ids (campaign_id, message_id, reply_id...) to every line logged inside"""
+    __slots__ = ('ids', 'token')
+
+    def __init__(self, **ids):
+        self.ids = ids
+
+    def __enter__(self):
+        context = _context.get()
+        self.token = _context.set({**context, **self.ids} if context else self.ids)
+        return self
+
+    def __exit__(self, *exc_info):
+        _context.reset(self.token)
+
+
+def is_sampled(key=None) -> bool:
+    """
+    Whether per-message events for key are logged. The same key always gets the same answer,
+    in every process; without a key the current context's message_id or reply_id is used.
+    """
+    if LOG_MESSAGE_SAMPLE_RATE >= 1:
+        return True
+    if LOG_MESSAGE_SAMPLE_RATE <= 0:
+        return False
+    if key is None:
+        context = _context.get()
+        key = context.get('message_id', context.get('reply_id'))
+        if key is None:
+            return random.random() < LOG_MESSAGE_SAMPLE_RATE
+    return zlib.crc32(str(key).encode('utf-8')) < LOG_MESSAGE_SAMPLE_RATE * 0x100000000
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, exc_info=None, **fields):
+    """Log event (a short snake_case name) with fields as JSON keys"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+
+def log_message_event(logger: logging.Logger, event: str, level: int = logging.INFO, key=None, **fields):
+    """A per-message event: logged for sampled messages only, unless it is an error"""
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.ERROR and not is_sampled(key):
+        return
+    logger.log(level, event, extra={'fields': fields})
+
+
+class ContextFilter(logging.Filter):
+    """Copies the correlation ids onto the record in the logging thread, before it is queued"""
+
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', {}))
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = {**getattr(record, 'context', {}), **getattr(record, 'fields', {})}
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the writer thread and drops them, counted, when the queue is full"""
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread; only %-args are resolved here, while they
+        # still hold the values they had when logged
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+class _Writer(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Stopping waits for room, since it means writing out everything queued
+        self.queue.put(self._sentinel)
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """{'celery_worker': 'WARNING', ...} from "celery_worker=WARNING,..." (malformed parts ignored)"""
+    levels = {}
+    for part in spec.split(','):
+        name, _, level = part.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _start_listener(stream):
+    global _listener
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    _listener = _Writer(_handler.queue, output)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # A forked pool process inherits the handler but not the writer thread
+    if _handler is not None:
+        _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        _start_listener(_listener.handlers[0].stream)
+
+
+def setup_logging(stream=None):
+    """Route the root logger through the queue to stream (stdout); safe to call more than once"""
+    global _handler
+    if _handler is not None:
+        return
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in {**DEFAULT_LEVELS, **parse_levels(LOG_LEVELS)}.items():
+        logging.getLogger(name).setLevel(level)
+
+    _start_listener(stream or sys.stdout)
+    atexit.register(stop_logging)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def flush_logging():
+    """Write out everything queued so far and keep logging (tests, before a report)"""
+    if _listener is not None:
+        stream = _listener.handlers[0].stream
+        stop_logging()
+        _start_listener(stream)
+
+
+def stop_logging():
+    """Write out everything queued and stop the writer thread (at exit)"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
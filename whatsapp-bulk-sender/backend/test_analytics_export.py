@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Analytics Export Test Script
+Checks the partitioned Parquet layout, incremental runs past each dataset's watermark (including
+message statuses applied after a run but dated before it), batching
+into row groups, and that a failed run neither publishes files nor moves the watermark
+"""
+
+import sys
+import os
+import sqlite3
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import analytics_export
+from analytics_export import run_analytics_export, export_dataset, get_watermark, setup_export_watermarks
+from app import init_db, create_campaign_records
+from opt_out_manager import setup_opt_out_tables
+from reply_handler import setup_replies_database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    setup_replies_database()
+    setup_opt_out_tables()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(3)])
+    conn.execute("UPDATE messages SET status = 'sent', sent_at = ? WHERE id <= 2", (datetime(2026, 1, 5, 9, 0),))
+    conn.executemany('''
+        INSERT INTO replies (phone_number, sender_name, message_content, received_at, campaign_id, sentiment)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [('0700000000', 'Customer 0', 'Yes please', '2026-01-05 10:00:00', 'c1', 'positive'),
+          ('0799999999', 'Stranger', 'Who is this?', '2026-01-06 08:00:00', None, 'question')])
+    conn.execute('''
+        INSERT INTO opt_out_list (phone_number, sender_name, opted_out_at, reason)
+        VALUES ('0700000001', 'Customer 1', '2026-01-05 11:00:00', 'STOP')
+    ''')
+    conn.commit()
+    return conn
+
+
+def read(root, dataset):
+    return ds.dataset(os.path.join(root, dataset), format='parquet', partitioning='hive').to_table()
+
+
+def test_full_export_layout(db, tmp_path):
+    results = {r['dataset']: r for r in run_analytics_export(output_dir=str(tmp_path / 'out'))}
+    assert {name: r['rows'] for name, r in results.items()} == {
+        'messages': 2, 'replies': 2, 'opt_outs': 1, 'campaigns': 1}
+
+    assert os.path.isdir(tmp_path / 'out' / 'messages' / 'campaign_id=c1' / 'date=2026-01-05')
+    assert os.path.isdir(tmp_path / 'out' / 'replies' / 'campaign_id=__HIVE_DEFAULT_PARTITION__' / 'date=2026-01-06')
+
+    messages = read(tmp_path / 'out', 'messages').sort_by('id')
+    assert messages['id'].to_pylist() == [1, 2]
+    assert messages['phone_number'].to_pylist() == ['+254700000000', '+254700000001']
+    assert messages['sent_at'].to_pylist()[0] == datetime(2026, 1, 5, 9, 0)
+
+    campaigns = read(tmp_path / 'out', 'campaigns').to_pylist()[0]
+    assert (campaigns['id'], campaigns['sent'], campaigns['pending'], campaigns['replies']) == ('c1', 2, 1, 1)
+    assert read(tmp_path / 'out', 'opt_outs')['reason'].to_pylist() == ['STOP']
+
+
+def test_incremental_runs_only_export_changes(db, tmp_path):
+    out = str(tmp_path / 'out')
+    run_analytics_export(['messages', 'replies'], output_dir=out)
+    assert [r['rows'] for r in run_analytics_export(['messages', 'replies'], output_dir=out)] == [0, 0]
+
+    db.execute("UPDATE messages SET status = 'delivered', delivered_at = ? WHERE id = 1", (datetime(2026, 1, 5, 9, 1),))
+    db.execute('''
+        INSERT INTO replies (phone_number, message_content, received_at, campaign_id)
+        VALUES ('0700000002', 'Later', '2026-01-07 12:00:00', 'c1')
+    ''')
+    db.commit()
+    assert [r['rows'] for r in run_analytics_export(['messages', 'replies'], output_dir=out)] == [1, 1]
+
+    # Message 1 is in the dataset twice; the newest export carries its current status
+    messages = read(out, 'messages').sort_by([('exported_at', 'descending')]).to_pylist()
+    assert [m['id'] for m in messages].count(1) == 2
+    assert next(m for m in messages if m['id'] == 1)['status'] == 'delivered'
+    assert read(out, 'replies').num_rows == 3
+
+    assert run_analytics_export(['replies'], output_dir=out, full=True)[0]['rows'] == 3
+
+
+def test_late_applied_status_is_exported(db, tmp_path):
+    out = str(tmp_path / 'out')
+    db.execute("UPDATE messages SET sent_at = ? WHERE id = 2", (datetime(2026, 1, 5, 9, 5),))
+    db.commit()
+    run_analytics_export(['messages'], output_dir=out)
+
+    # A delivery callback that arrived at 09:02 is applied after the export, dated before its watermark
+    db.execute("UPDATE messages SET status = 'delivered', delivered_at = ? WHERE id = 1", (datetime(2026, 1, 5, 9, 2),))
+    db.commit()
+    assert run_analytics_export(['messages'], output_dir=out)[0]['rows'] == 1
+    messages = read(out, 'messages').sort_by([('exported_at', 'descending')]).to_pylist()
+    assert (messages[0]['id'], messages[0]['status']) == (1, 'delivered')
+
+
+def test_batches_become_row_groups(db, tmp_path):
+    setup_export_watermarks(db.cursor())
+    db.execute("UPDATE messages SET status = 'sent', sent_at = ?", (datetime(2026, 1, 5, 9, 0),))
+    db.commit()
+
+    assert export_dataset(db, 'messages', str(tmp_path), batch_size=2)['rows'] == 3
+    [path] = list((tmp_path / 'messages' / 'campaign_id=c1' / 'date=2026-01-05').glob('*.parquet'))
+    assert pq.ParquetFile(path).metadata.num_row_groups == 2
+
+
+def test_failed_run_publishes_nothing(db, tmp_path, monkeypatch):
+    setup_export_watermarks(db.cursor())
+
+    def broken(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(analytics_export, 'to_record_batch', broken)
+    with pytest.raises(OSError):
+        export_dataset(db, 'replies', str(tmp_path / 'out'))
+
+    assert get_watermark(db, 'replies') == 0
+    assert [name for _, _, names in os.walk(tmp_path / 'out') for name in names] == []
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_analytics_export.py")
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Campaign Dispatch Test Script
+Checks that the campaign worker streams pending messages in pages, resumes after a crash,
+and obeys pause / resume / cancel from the control endpoints, including while it only defers
+messages and after it has dispatched everything it can
+"""
+
+import sys
+import os
+import sqlite3
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import campaign_control
+import celery_worker
+from app import app, init_db, create_campaign_records
+
+
+class WorkerKilled(BaseException):
+    """Stands in for the worker process dying mid-campaign"""
+
+
+def make_campaign(tmp_path, monkeypatch, size):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(size)])
+    conn.commit()
+    conn.close()
+
+
+def fake_sender(sent, die_after=None):
+    def send(phone, content, api_key, idempotency_key=None):
+        if die_after is not None and len(sent) == die_after:
+            raise WorkerKilled()
+        sent.append(content)
+        return True, None
+    return send
+
+
+def test_pages_skip_sent_messages(tmp_path, monkeypatch):
+    make_campaign(tmp_path, monkeypatch, 7)
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn.execute("UPDATE messages SET status = 'sent' WHERE id IN (2, 5)")
+
+    assert [row[0] for row in celery_worker.iter_pending_messages(conn, 'c1', page_size=2)] == [1, 3, 4, 6, 7]
+
+    plan = conn.execute('''
+        EXPLAIN QUERY PLAN SELECT id FROM messages
+        WHERE campaign_id = ? AND status = 'pending' AND id > ? ORDER BY id LIMIT 2
+    ''', ('c1', 0)).fetchall()
+    assert any('idx_messages_campaign_status' in row[-1] for row in plan)
+    conn.close()
+
+
+def test_crashed_campaign_resumes_where_it_stopped(tmp_path, monkeypatch):
+    make_campaign(tmp_path, monkeypatch, 25)
+    monkeypatch.setattr(celery_worker, 'CAMPAIGN_PAGE_SIZE', 4)
+
+    sent = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', fake_sender(sent, die_after=10))
+    with pytest.raises(WorkerKilled):
+        celery_worker.process_campaign_task('c1', 'key', 0)
+    assert len(sent) == 10
+
+    # The 11th message was claimed but never reached the provider, so it goes out on resume
+    monkeypatch.setattr(celery_worker, 'find_sent_message', lambda phone, content, since: ['SM1'] if content in sent else [])
+    resumed = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', fake_sender(resumed))
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    assert resumed == [f'Hi Customer {i}' for i in range(10, 25)]
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert conn.execute("SELECT status FROM campaigns WHERE id = 'c1'").fetchone()[0] == 'completed'
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE status = 'sent'").fetchone()[0] == 25
+    conn.close()
+
+
+def test_pause_then_resume_from_checkpoint(tmp_path, monkeypatch):
+    make_campaign(tmp_path, monkeypatch, 25)
+    monkeypatch.setattr(celery_worker, 'CAMPAIGN_CONTROL_BATCH', 5)
+    monkeypatch.setattr(celery_worker.process_campaign_task, 'delay',
+                        lambda *args: celery_worker.process_campaign_task(*args))
+    client = app.test_client()
+
+    sent = []
+
+    def send(phone, content, api_key, idempotency_key=None):
+        sent.append(content)
+        if len(sent) == 7:
+            assert client.post('/api/campaigns/c1/pause').get_json()['applied'] is False
+        return True, None
+
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', send)
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    # Stops at the end of the batch the pause arrived in
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert conn.execute("SELECT status, last_message_id FROM campaigns WHERE id = 'c1'").fetchone() == ('paused', 10)
+    conn.close()
+    assert len(sent) == 10
+    assert client.post('/api/campaigns/c1/pause').status_code == 409
+
+    response = client.post('/api/campaigns/c1/resume', json={'api_key': 'key', 'rate_limit': 0})
+    assert response.get_json()['success']
+    assert sent == [f'Hi Customer {i}' for i in range(25)]
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert conn.execute("SELECT status, control FROM campaigns WHERE id = 'c1'").fetchone() == ('completed', None)
+    conn.close()
+
+
+def test_cancel_before_dispatch(tmp_path, monkeypatch):
+    make_campaign(tmp_path, monkeypatch, 5)
+    response = app.test_client().post('/api/campaigns/c1/cancel')
+    assert response.get_json()['applied'] is True
+
+    sent = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', fake_sender(sent))
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    assert sent == []
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'cancelled'
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE status = 'cancelled'").fetchone()[0] == 5
+    conn.close()
+
+
+def test_cancel_reaches_a_campaign_that_only_defers(tmp_path, monkeypatch):
+    make_campaign(tmp_path, monkeypatch, 12)
+    monkeypatch.setattr(celery_worker, 'CAMPAIGN_CONTROL_BATCH', 5)
+    client = app.test_client()
+    checked = []
+
+    def quiet(phone):
+        checked.append(phone)
+        if len(checked) == 3:
+            assert client.post('/api/campaigns/c1/cancel').get_json()['applied'] is False
+        return datetime.now() + timedelta(hours=8)
+
+    monkeypatch.setattr(celery_worker, 'quiet_hours_end', quiet)
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', fake_sender([]))
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    assert len(checked) == 5
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'cancelled'
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE status = 'cancelled'").fetchone()[0] == 12
+    conn.close()
+
+
+def test_campaign_waiting_on_quiet_hours_stays_controllable(tmp_path, monkeypatch):
+    make_campaign(tmp_path, monkeypatch, 4)
+    sent = []
+    monkeypatch.setattr(celery_worker, 'quiet_hours_end',
+                        lambda phone: datetime.now() + timedelta(hours=8) if phone.endswith('3') else None)
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', fake_sender(sent))
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    assert len(sent) == 3
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'running'
+    conn.close()
+
+    # Nothing is dispatching, so the pause takes effect at once
+    assert app.test_client().post('/api/campaigns/c1/pause').get_json()['applied'] is True
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'paused'
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE status = 'deferred'").fetchone()[0] == 1
+    conn.close()
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def test_control_flag_read_from_redis(tmp_path, monkeypatch):
+    make_campaign(tmp_path, monkeypatch, 1)
+    fake = FakeRedis()
+    monkeypatch.setattr(campaign_control, '_redis_client', fake)
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    campaign_control.set_campaign_control(conn.cursor(), 'c1', 'pause')
+    assert fake.values == {'campaign:c1:control': 'pause'}
+
+    # The dispatcher's per-batch check only touches Redis
+    conn.execute("UPDATE campaigns SET control = NULL")
+    assert campaign_control.get_campaign_control(conn.cursor(), 'c1') == 'pause'
+    conn.close()
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_campaign_dispatch.py")
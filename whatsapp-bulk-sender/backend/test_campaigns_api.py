@@ -20,9 +20,9 @@ def test_campaigns_api():
         cursor.execute('''
             SELECT c.id, c.name, c.message_template, c.total_contacts, c.rate_limit, c.status, c.created_at,
                    COUNT(m.id) as total_messages,
-                   SUM(CASE WHEN m.status = 'sent' THEN 1 ELSE 0 END) as sent_messages,
-                   SUM(CASE WHEN m.status = 'delivered' THEN 1 ELSE 0 END) as delivered_messages,
-                   SUM(CASE WHEN m.status = 'failed' THEN 1 ELSE 0 END) as failed_messages
+                   SUM(CASE WHEN m.status IN ('sent', 'delivered', 'read') THEN 1 ELSE 0 END) as sent_messages,
+                   SUM(CASE WHEN m.status IN ('delivered', 'read') THEN 1 ELSE 0 END) as delivered_messages,
+                   SUM(CASE WHEN m.status IN ('failed', 'undelivered') THEN 1 ELSE 0 END) as failed_messages
             FROM campaigns c
             LEFT JOIN messages m ON c.id = m.campaign_id
             GROUP BY c.id, c.name, c.message_template, c.total_contacts, c.rate_limit, c.status, c.created_at
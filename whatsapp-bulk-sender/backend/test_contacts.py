@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Contact Store Test Script
+Checks cross-campaign deduplication, attribute merging and migrating older message rows
+"""
+
+import sys
+import os
+import json
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import init_db, create_campaign_records
+from contacts import setup_contacts_table, upsert_contacts, migrate_messages_to_contacts
+
+
+def test_upsert_merges_repeat_customers():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    setup_contacts_table(cursor)
+
+    first = upsert_contacts(cursor, [{'phone': '0712345678', 'name': 'Jane', 'city': 'Nairobi', 'size': ''}])
+    second = upsert_contacts(cursor, [{'phone': '+254 712 345 678', 'name': 'Jane W', 'size': '34B'}])
+
+    assert first == second == [1]
+    name, attributes = cursor.execute("SELECT name, attributes FROM contacts").fetchone()
+    assert name == 'Jane W'
+    assert json.loads(attributes) == {'city': 'Nairobi', 'size': '34B'}
+    conn.close()
+
+
+def test_campaigns_share_contacts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+
+    sheet = [{'phone': '0712345678', 'name': 'Jane'}, {'phone': '0722000000', 'name': 'Amina'},
+             {'phone': '254712345678', 'name': 'Jane'}]
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 2, sheet) == 2
+    assert create_campaign_records(conn.cursor(), 'c2', 'Restock', 'Hello {name}', 2, sheet[:1]) == 1
+    conn.commit()
+
+    assert conn.execute("SELECT COUNT(*) FROM contacts").fetchone()[0] == 2
+    assert conn.execute("SELECT total_contacts FROM campaigns WHERE id = 'c1'").fetchone()[0] == 2
+    assert conn.execute('''
+        SELECT c.phone_canonical, m.variables FROM messages m JOIN contacts c ON c.id = m.contact_id
+        WHERE m.campaign_id = 'c2'
+    ''').fetchall() == [('+254712345678', '{"name":"Jane"}')]
+    conn.close()
+
+
+def test_migrate_legacy_messages():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, campaign_id TEXT,
+                               phone_number TEXT, name TEXT, message_content TEXT)
+    ''')
+    cursor.executemany("INSERT INTO messages (campaign_id, phone_number, name, message_content) VALUES (?, ?, ?, ?)",
+                       [('c1', '254712345678', 'Jane', 'a'), ('c1', '254722000000', 'Amina', 'b'),
+                        ('c2', '254712345678', 'Jane W', 'c')])
+    setup_contacts_table(cursor)
+
+    assert migrate_messages_to_contacts(cursor) == 3
+    assert migrate_messages_to_contacts(cursor) == 0
+    assert cursor.execute("SELECT phone_canonical, name FROM contacts ORDER BY id").fetchall() == \
+        [('+254712345678', 'Jane W'), ('+254722000000', 'Amina')]
+    assert [row[0] for row in cursor.execute("SELECT contact_id FROM messages ORDER BY id")] == [1, 2, 1]
+    conn.close()
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_contacts.py")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Database Layer Test Script
+Checks that statements run through db.connect() are recorded with their time, rows and call
+site, that slow statements are logged with their query plan (and no parameters), and that API
+requests export their statement counts per endpoint
+"""
+
+import sys
+import os
+import logging
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from prometheus_client import REGISTRY
+
+import db
+from app import app, init_db
+from db import QueryCount, QueryLog, connect
+
+
+def test_statements_are_recorded_with_rows_and_call_site(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = connect()
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+
+    with QueryLog() as log, QueryCount() as count:
+        conn.executemany("INSERT INTO items (name) VALUES (?)", [(f'item {i}',) for i in range(30)])
+        line = sys._getframe().f_lineno + 1
+        cursor = conn.execute("SELECT id FROM items WHERE id IN (?, ?, ?)", (1, 2, 3))
+        cursor.fetchone()
+        cursor.fetchall()
+        conn.execute("UPDATE items SET name = 'x' WHERE id <= 4")
+    conn.close()
+
+    assert count.count == log.count == 3
+    insert, select, update = log.queries
+    assert (insert.rows, select.rows, update.rows) == (30, 3, 4)
+    assert select.seconds > 0
+    assert select.site == f'test_db.py:{line} test_statements_are_recorded_with_rows_and_call_site'
+    assert log.statements()['SELECT id FROM items WHERE id IN (?, ...)'] == 1
+    assert log.repeated() == {}
+
+
+def test_slow_statements_are_logged_with_their_plan(tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, 'SLOW_QUERY_MS', 0)
+    conn = connect()
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, phone TEXT)")
+    conn.execute("INSERT INTO items (phone) VALUES ('+254700000001')")
+
+    with caplog.at_level(logging.WARNING, logger='db'):
+        conn.execute("SELECT id FROM items WHERE phone = ?", ('+254700000001',)).fetchall()
+    conn.close()
+
+    [record] = [record for record in caplog.records if record.fields['sql'].startswith('SELECT')]
+    assert record.getMessage() == 'slow_query'
+    assert record.fields['plan'] == ['SCAN items']
+    assert record.fields['rows'] == 1 and record.fields['site'].startswith('test_db.py:')
+    assert '+254700000001' not in str(record.fields)
+    assert REGISTRY.get_sample_value('whatsapp_slow_queries_total', {'site': record.fields['site']}) >= 1
+
+
+def test_requests_export_statements_per_endpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    def endpoint_queries(sample):
+        return REGISTRY.get_sample_value(f'whatsapp_endpoint_queries_{sample}', {'endpoint': 'get_campaigns'}) or 0
+    requests, statements = endpoint_queries('count'), endpoint_queries('sum')
+
+    assert app.test_client().get('/api/campaigns').status_code == 200
+    assert endpoint_queries('count') == requests + 1  # one more request observed
+    assert endpoint_queries('sum') - statements == 2  # and the two statements it ran
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_db.py")
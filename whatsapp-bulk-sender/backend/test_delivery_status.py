@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Delivery Status Test Script
+Checks that sends record the provider SID, that status callbacks are queued and applied in
+batches without moving a message backwards, that a batch the database rejects goes back on the
+queue, that campaign counts keep delivered messages as sent, and the per-campaign latency histogram
+"""
+
+import sys
+import os
+import sqlite3
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import campaign_control
+import celery_worker
+import delivery_status
+from app import app, init_db, create_campaign_records
+from delivery_status import apply_status_batch, drain_status_queue
+
+SENT_AT = datetime(2026, 1, 5, 9, 0, 0)
+
+
+class FakeRedisList:
+    """Just enough of a Redis list for the status queue"""
+
+    def __init__(self):
+        self.items = []
+
+    def rpush(self, key, *values):
+        self.items.extend(values)
+
+    def llen(self, key):
+        return len(self.items)
+
+    def pipeline(self):
+        return self
+
+    def lrange(self, key, start, end):
+        self.batch = self.items[start:end + 1]
+
+    def ltrim(self, key, start, end):
+        self.items = self.items[start:]
+
+    def execute(self):
+        return self.batch, True
+
+
+def make_sent_campaign(tmp_path, monkeypatch, size=3):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(size)])
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message',
+                        lambda phone, content, api_key, idempotency_key=None: (True, 'SM' + idempotency_key))
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn.execute("UPDATE messages SET sent_at = ?", (SENT_AT,))
+    conn.commit()
+    return conn
+
+
+def callback(sid, status, seconds_after_send, error_code=None):
+    return {'sid': sid, 'status': status, 'error_code': error_code,
+            'received_at': SENT_AT.timestamp() + seconds_after_send}
+
+
+def message_states(conn):
+    return conn.execute("SELECT provider_sid, status, error_message FROM messages ORDER BY id").fetchall()
+
+
+def test_send_records_provider_sid(tmp_path, monkeypatch):
+    conn = make_sent_campaign(tmp_path, monkeypatch)
+    assert [row[0] for row in message_states(conn)] == ['SMc1:1', 'SMc1:2', 'SMc1:3']
+    conn.close()
+
+
+def test_batch_applies_callbacks_without_going_backwards(tmp_path, monkeypatch):
+    conn = make_sent_campaign(tmp_path, monkeypatch)
+
+    applied, unmatched = apply_status_batch(conn, [
+        callback('SMc1:1', 'read', 4),
+        callback('SMc1:1', 'delivered', 2),  # late, must not undo the read
+        callback('SMc1:2', 'delivered', 3),
+        callback('SMc1:3', 'undelivered', 1, error_code='63016'),
+        callback('SMc1:3', 'sent', 0),  # not a delivery state, ignored
+        callback('SM-unknown', 'delivered', 1),
+    ])
+
+    assert applied == 4
+    assert [event['sid'] for event in unmatched] == ['SM-unknown']
+    assert message_states(conn) == [
+        ('SMc1:1', 'read', None),
+        ('SMc1:2', 'delivered', None),
+        ('SMc1:3', 'undelivered', 'Twilio error 63016'),
+    ]
+    conn.close()
+
+
+def test_campaign_counts_keep_delivered_messages_as_sent(tmp_path, monkeypatch):
+    conn = make_sent_campaign(tmp_path, monkeypatch, size=4)
+    apply_status_batch(conn, [callback('SMc1:1', 'read', 4), callback('SMc1:2', 'delivered', 3),
+                              callback('SMc1:3', 'undelivered', 1, error_code='63016')])
+    conn.close()
+
+    [campaign] = app.test_client().get('/api/campaigns').get_json()['campaigns']
+    assert {key: campaign[key] for key in ('total_messages', 'sent_messages', 'delivered_messages',
+                                           'failed_messages')} == \
+        {'total_messages': 4, 'sent_messages': 3, 'delivered_messages': 2, 'failed_messages': 1}
+
+
+def test_webhook_queues_and_worker_drains(tmp_path, monkeypatch):
+    conn = make_sent_campaign(tmp_path, monkeypatch)
+    queue = FakeRedisList()
+    monkeypatch.setattr(campaign_control, '_redis_client', queue)
+
+    client = app.test_client()
+    for sid in ('SMc1:1', 'SMc1:2', 'SM-not-yet-recorded'):
+        assert client.post('/webhook/status', data={'MessageSid': sid, 'MessageStatus': 'delivered'}).status_code == 204
+    assert len(queue.items) == 3
+    assert message_states(conn)[0][1] == 'sent'
+
+    assert drain_status_queue(conn, batch_size=2) == 2
+    assert [row[1] for row in message_states(conn)] == ['delivered', 'delivered', 'sent']
+    # The callback that beat its send stays queued for the next drain
+    assert len(queue.items) == 1
+    conn.close()
+
+
+def test_failed_batch_goes_back_on_the_queue(tmp_path, monkeypatch):
+    conn = make_sent_campaign(tmp_path, monkeypatch)
+    queue = FakeRedisList()
+    monkeypatch.setattr(campaign_control, '_redis_client', queue)
+    client = app.test_client()
+    for sid in ('SMc1:1', 'SMc1:2'):
+        client.post('/webhook/status', data={'MessageSid': sid, 'MessageStatus': 'delivered'})
+
+    def locked(conn, events):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(delivery_status, 'apply_status_batch', locked)
+    with pytest.raises(sqlite3.OperationalError):
+        drain_status_queue(conn)
+    assert len(queue.items) == 2
+
+    monkeypatch.setattr(delivery_status, 'apply_status_batch', apply_status_batch)
+    assert drain_status_queue(conn) == 2
+    assert [row[1] for row in message_states(conn)] == ['delivered', 'delivered', 'sent']
+    conn.close()
+
+
+def test_webhook_applies_directly_without_redis(tmp_path, monkeypatch):
+    conn = make_sent_campaign(tmp_path, monkeypatch)
+    monkeypatch.setattr('app.enqueue_status_events', lambda events: False)
+
+    response = app.test_client().post('/webhook/status', data={'MessageSid': 'SMc1:2', 'MessageStatus': 'read'})
+    assert response.status_code == 204
+    assert message_states(conn)[1][1] == 'read'
+    conn.close()
+
+
+def test_delivery_latency_histogram(tmp_path, monkeypatch):
+    conn = make_sent_campaign(tmp_path, monkeypatch)
+    apply_status_batch(conn, [callback('SMc1:1', 'delivered', 0.5),
+                              callback('SMc1:2', 'delivered', 45),
+                              callback('SMc1:3', 'read', 7200)])
+    conn.close()
+
+    histogram = app.test_client().get('/api/campaigns/c1/delivery-latency').get_json()
+    counts = {bucket['bucket']: bucket['count'] for bucket in histogram['buckets']}
+    assert histogram['delivered'] == 3
+    assert counts['<=1s'] == 1 and counts['<=60s'] == 1 and counts['>3600s'] == 1
+    assert sum(counts.values()) == 3
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_delivery_status.py")
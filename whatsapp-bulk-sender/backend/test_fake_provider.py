@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Fake Provider Test Script
+Checks that the worker's Twilio client and the Gemini classifier can be pointed at
+fake_provider.py, and that the fake accepts, fails and throttles messages the way Twilio does,
+posting status callbacks for the ones it accepts
+"""
+
+import sys
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import google.generativeai as genai
+import pytest
+
+import celery_worker
+import reply_handler
+from fake_provider import FakeProvider, ProviderConfig
+from retry_scheduler import classify_error
+
+
+def start_provider(monkeypatch, **config):
+    provider = FakeProvider(ProviderConfig(latency_ms=0, jitter_ms=0, callback_delay_ms=0, seed=1, **config))
+    url = provider.start()
+    monkeypatch.setenv('TWILIO_ACCOUNT_SID', 'AC' + '0' * 32)
+    monkeypatch.setenv('TWILIO_AUTH_TOKEN', 'token')
+    monkeypatch.setenv('TWILIO_API_BASE_URL', url)
+    monkeypatch.delenv('TWILIO_STATUS_CALLBACK_URL', raising=False)
+    return provider, url
+
+
+@pytest.fixture
+def callbacks():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+            received.append((form['MessageSid'][0], form['MessageStatus'][0]))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/webhook/status', received
+    server.shutdown()
+
+
+def test_sends_reach_the_fake_and_get_status_callbacks(monkeypatch, callbacks):
+    callback_url, received = callbacks
+    provider, _ = start_provider(monkeypatch, read_rate=1)
+    monkeypatch.setenv('TWILIO_STATUS_CALLBACK_URL', callback_url)
+    try:
+        ok, sid = celery_worker.send_whatsapp_message('254700000001', 'Hi Ann', 'key', idempotency_key='m1')
+        assert ok and sid.startswith('SM')
+        deadline = time.time() + 5
+        while len(received) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert received == [(sid, 'delivered'), (sid, 'read')]
+        assert celery_worker.find_sent_message('254700000001', 'Hi Ann', '2026-01-01T00:00:00') == [sid]
+        assert celery_worker.find_sent_message('254700000001', 'Hi Bob', '2026-01-01T00:00:00') == []
+    finally:
+        provider.stop()
+
+
+def test_failures_and_throttling_look_like_twilio(monkeypatch):
+    provider, _ = start_provider(monkeypatch, invalid_rate=1)
+    try:
+        ok, error = celery_worker.send_whatsapp_message('254700000001', 'Hi', 'key')
+        assert not ok and classify_error(error) == ('21211', 'permanent')
+    finally:
+        provider.stop()
+
+    provider, _ = start_provider(monkeypatch, throttle_rps=1)
+    try:
+        results = [celery_worker.send_whatsapp_message('254700000001', 'Hi', 'key') for _ in range(3)]
+        assert results[0][0] and not results[1][0]
+        assert classify_error(results[1][1]) == ('20429', 'retryable')
+        assert provider.stats()['counts']['messages_throttled'] == 2
+    finally:
+        provider.stop()
+
+
+def test_gemini_classification_comes_from_the_fake(monkeypatch):
+    provider = FakeProvider(ProviderConfig(gemini_latency_ms=0, jitter_ms=0))
+    url = provider.start()
+    monkeypatch.setattr(reply_handler, 'gemini_consecutive_failures', 0)
+    genai.configure(api_key='key', transport='rest', client_options={'api_endpoint': url})
+    try:
+        result = reply_handler.detect_reply_sentiment_gemini('Bei gani ya red set', '254700000001')
+        assert result['sentiment'] == 'question'
+        assert provider.stats()['counts']['gemini_requests'] == 1
+    finally:
+        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+        provider.stop()
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_fake_provider.py")
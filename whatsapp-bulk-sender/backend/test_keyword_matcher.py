@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Keyword Matcher Precision Test Script
+Checks the compiled matcher against labelled replies, including the substring false positives it replaced
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from keyword_matcher import find_keyword_hits, contains_opt_out_keyword
+
+# (message, categories that must be hit, categories that must NOT be hit)
+PRECISION_TEST_SET = [
+    # Opt-out in English and Swahili
+    ("STOP", {'opt_out'}, set()),
+    ("Please unsubscribe me from these messages", {'opt_out'}, set()),
+    ("dont message me again", {'opt_out'}, set()),
+    ("Don’t message me", {'opt_out'}, set()),
+    ("I want to opt-out", {'opt_out'}, set()),
+    ("no more messages please", {'opt_out'}, {'negative'}),
+    ("Hatutaki hii ujumbe tena", {'opt_out'}, set()),
+    ("acha kunitumia", {'opt_out'}, set()),
+    # Former substring false positives
+    ("I know the shop", set(), {'negative', 'opt_out'}),
+    ("Nachagua rangi nyekundu", set(), {'opt_out'}),
+    ("Nothing to add", set(), {'negative'}),
+    ("Stopover in Nakuru next week", set(), {'opt_out'}),
+    ("Tell me about the blocks of colour", set(), {'opt_out'}),
+    ("Sawa, nitakuja kesho", {'positive'}, {'opt_out'}),
+    ("Je, mnasafirisha Kisumu", {'question'}, set()),
+    ("Heyo, showhow", set(), {'question'}),
+    # Stems still match their inflections
+    ("Thanks so much!", {'positive'}, set()),
+    ("I want a refund for this", {'negative', 'positive'}, set()),
+    ("What are the prices?", {'question'}, set()),
+    ("Please help, it's urgent", {'urgent'}, set()),
+    ("I complained yesterday", {'negative'}, set()),
+]
+
+
+def test_precision_test_set():
+    """Every labelled message hits exactly the expected categories"""
+    failures = []
+
+    for message, expected, forbidden in PRECISION_TEST_SET:
+        hits = find_keyword_hits(message)
+        matched = {category for category, words in hits.items() if words}
+
+        if not expected <= matched or matched & forbidden:
+            failures.append((message, matched))
+
+    assert not failures, f"Misclassified messages: {failures}"
+
+
+def test_single_pass_returns_all_categories():
+    """A single scan reports hits for several categories at once"""
+    hits = find_keyword_hits("Help! What is the price? I love it but the size is wrong")
+
+    assert hits['urgent'] == ['help']
+    assert hits['question'] == ['what', 'price']
+    assert hits['positive'] == ['love']
+    assert hits['negative'] == ['wrong']
+    assert hits['opt_out'] == []
+
+
+def test_opt_out_check_matches_full_scan():
+    """The early-exit opt-out check agrees with the full scan"""
+    for message, _, _ in PRECISION_TEST_SET:
+        assert contains_opt_out_keyword(message) == bool(find_keyword_hits(message)['opt_out'])
+
+
+def main():
+    """Main test function"""
+
+    print("🔍 Keyword Matcher Precision Test")
+    print("=" * 60)
+
+    correct = 0
+    for message, expected, forbidden in PRECISION_TEST_SET:
+        hits = find_keyword_hits(message)
+        matched = {category for category, words in hits.items() if words}
+        ok = expected <= matched and not matched & forbidden
+        correct += ok
+
+        print(f"{'✅' if ok else '❌'} \"{message}\" → {sorted(matched) or ['none']}")
+
+    print(f"\n📊 Precision set: {correct}/{len(PRECISION_TEST_SET)} correct")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Message Template Test Script
+Checks template compilation, lazy rendering in the campaign worker and the audit copy of sent text
+"""
+
+import sys
+import os
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import celery_worker
+from app import init_db, create_campaign_records, personalize_message
+from message_templates import compile_template, encode_variables, render_message
+
+TEMPLATE = "Hi {name}, your {size} is back in {city}. {unknown} stays as written."
+
+
+def test_compiled_template_only_keeps_used_fields():
+    compiled = compile_template(TEMPLATE)
+    assert compiled.fields == ('name', 'size', 'city', 'unknown')
+
+    contact = {'phone': '254712345678', 'name': 'Jane', 'size': '34B', 'city': 'Nairobi', 'notes': 'VIP'}
+    variables = compiled.variables_for(contact)
+    assert variables == {'name': 'Jane', 'size': '34B', 'city': 'Nairobi'}
+    assert render_message(compiled, encode_variables(variables)) == \
+        "Hi Jane, your 34B is back in Nairobi. {unknown} stays as written."
+    assert personalize_message(TEMPLATE, contact) == render_message(compiled, encode_variables(variables))
+    assert render_message(compile_template("No fields"), None) == "No fields"
+
+
+def run_campaign(tmp_path, monkeypatch, persist):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Restock', TEMPLATE, 0,
+                            [{'phone': '0712345678', 'name': 'Jane', 'size': '34B', 'city': 'Nairobi'},
+                             {'phone': '0722000000', 'name': 'Amina', 'size': '36C', 'city': 'Kisumu'}])
+    conn.commit()
+    conn.close()
+
+    sent = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message',
+                        lambda phone, content, api_key, idempotency_key=None: sent.append((phone, content)) or (True, None))
+    monkeypatch.setattr(celery_worker, 'PERSIST_RENDERED_MESSAGES', persist)
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    stored = [row[0] for row in conn.execute("SELECT message_content FROM messages ORDER BY id")]
+    conn.close()
+    return sent, stored
+
+
+def test_worker_renders_at_send_time(tmp_path, monkeypatch):
+    sent, stored = run_campaign(tmp_path, monkeypatch, persist=False)
+    assert sent == [('+254712345678', "Hi Jane, your 34B is back in Nairobi. {unknown} stays as written."),
+                    ('+254722000000', "Hi Amina, your 36C is back in Kisumu. {unknown} stays as written.")]
+    assert stored == [None, None]
+
+
+def test_rendered_text_kept_for_audit(tmp_path, monkeypatch):
+    sent, stored = run_campaign(tmp_path, monkeypatch, persist=True)
+    assert stored == [content for _, content in sent]
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_message_templates.py")
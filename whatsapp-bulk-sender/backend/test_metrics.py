@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Metrics Test Script
+Checks the counters and histograms recorded by a campaign run and the provider call, the app's
+/metrics endpoint with the gauges read at scrape time, and the worker exporter adding up what
+prefork pool processes record
+"""
+
+import sys
+import os
+import sqlite3
+import subprocess
+import urllib.request
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from prometheus_client import REGISTRY
+
+import celery_worker
+import metrics
+from app import app, init_db, create_campaign_records
+from metrics import clear_process_files, start_http_server
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_campaign_run_counts_outcomes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'metrics-c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(6)])
+    conn.commit()
+    conn.close()
+
+    results = iter([(True, 'SM1'), (False, 'Twilio error 21211: invalid number'), (True, 'SM2'),
+                    (False, 'Twilio error 20429: too many requests'), (True, 'SM3'), (True, 'SM4')])
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message',
+                        lambda phone, content, api_key, idempotency_key=None: next(results))
+    celery_worker.process_campaign_task('metrics-c1', 'key', 0)
+
+    outcomes = {(outcome, error_class): sample('whatsapp_messages_total', campaign_id='metrics-c1',
+                                               outcome=outcome, error_class=error_class)
+                for outcome, error_class in (('sent', ''), ('failed', 'permanent'), ('failed', 'retryable'))}
+    assert outcomes == {('sent', ''): 4, ('failed', 'permanent'): 1, ('failed', 'retryable'): 1}
+
+
+def test_provider_call_is_timed(monkeypatch):
+    client = SimpleNamespace(messages=SimpleNamespace(create=lambda **kwargs: SimpleNamespace(sid='SM1')))
+    monkeypatch.setattr(celery_worker, 'Client', lambda account_sid, auth_token: client)
+    monkeypatch.setenv('TWILIO_ACCOUNT_SID', 'AC1')
+    monkeypatch.setenv('TWILIO_AUTH_TOKEN', 'token')
+    before = sample('whatsapp_provider_request_seconds_count', outcome='ok')
+
+    assert celery_worker.send_whatsapp_message('254700000001', 'Hi', 'key') == (True, 'SM1')
+    assert sample('whatsapp_provider_request_seconds_count', outcome='ok') == before + 1
+
+
+def test_metrics_endpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'metrics-c2', 'Launch', 'Hi', 0, [{'phone': '0700000001', 'name': 'A'}])
+    conn.execute("UPDATE messages SET status = 'deferred'")
+    conn.commit()
+    conn.close()
+    client = app.test_client()
+    client.post('/webhook/status', data={'MessageSid': 'SM404', 'MessageStatus': 'delivered'})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    assert 'whatsapp_queue_depth{queue="deferred"} 1.0' in body
+    assert 'whatsapp_rate_limiter_tokens 1.0' in body
+    assert 'whatsapp_webhook_seconds_count{webhook="status"}' in body
+
+
+def test_worker_exporter_adds_up_pool_processes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    directory = tmp_path / 'prometheus'
+    # Two pool processes recording the same series, as prefork children do
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', "from metrics import MESSAGES; "
+                        "MESSAGES.labels('c1', 'sent', '').inc(3)"],
+                       cwd=BACKEND, env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(directory)), check=True)
+
+    monkeypatch.setattr(metrics, 'MULTIPROC_DIR', str(directory))
+    server, thread = start_http_server(0, '127.0.0.1')
+    try:
+        body = urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics').read().decode()
+    finally:
+        server.shutdown()
+    assert 'whatsapp_messages_total{campaign_id="c1",error_class="",outcome="sent"} 6.0' in body
+    assert 'whatsapp_queue_depth' in body
+
+
+def test_worker_start_clears_previous_run(tmp_path):
+    for name in ('counter_101.db', 'histogram_102.db', f'counter_{os.getpid()}.db'):
+        (tmp_path / name).write_bytes(b'')
+    clear_process_files(str(tmp_path))
+    assert [path.name for path in tmp_path.iterdir()] == [f'counter_{os.getpid()}.db']
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_metrics.py")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Opt-out Confirmation Dispatcher Test Script
+Checks that due confirmations are claimed in batches, only marked sent after the provider
+accepts them, retried up to a cap, reported in the backlog/latency metrics, paced by the
+shared rate limiter, and sent by the beat-driven scheduler tick
+"""
+
+import sys
+import os
+import sqlite3
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import celery_worker
+import opt_out_manager
+from app import app, init_db
+from opt_out_manager import (setup_opt_out_tables, schedule_opt_out_confirmation_message, claim_due_confirmations,
+                             dispatch_opt_out_confirmations, get_opt_out_confirmation_metrics)
+from rate_limiter import RateLimiter
+
+
+class WorkerKilled(BaseException):
+    """Stands in for the worker process dying"""
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_opt_out_tables()
+    for phone, name in (('254700000001', 'Jane'), ('254700000002', 'Amina'), ('254700000003', 'Wanjiru')):
+        schedule_opt_out_confirmation_message(phone, name)
+    schedule_opt_out_confirmation_message('254700000004', 'Later', 'after_hours', hours_delay=2)
+
+
+def queue_rows():
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    rows = conn.execute("SELECT phone_number, sent, attempts, last_error FROM opt_out_queue ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+
+def provider(sent, failing=()):
+    def send(phone, message, api_key, idempotency_key=None):
+        if phone in failing:
+            return False, 'Twilio error 20429: Too Many Requests'
+        sent.append(phone)
+        return True, 'SM' + phone
+    return send
+
+
+def test_endpoint_sends_due_batch_and_reports(queue, monkeypatch):
+    sent = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', provider(sent, failing={'254700000002'}))
+
+    data = app.test_client().post('/api/opt-out/send-pending').get_json()
+
+    assert data['sent_count'] == 2 and data['total_confirmations'] == 3
+    assert data['errors'] == ['Failed to send to 254700000002: Twilio error 20429: Too Many Requests']
+    assert sent == ['254700000001', '254700000003']
+    assert queue_rows() == [
+        ('254700000001', 1, 1, None),
+        ('254700000002', 0, 1, 'Twilio error 20429: Too Many Requests'),
+        ('254700000003', 1, 1, None),
+        ('254700000004', 0, 0, None),
+    ]
+
+
+def test_scheduler_tick_sends_due_confirmations(queue, monkeypatch):
+    # What celery beat runs every SCHEDULER_TICK_INTERVAL (the scheduler-tick entry)
+    assert celery_worker.celery_app.conf.beat_schedule['scheduler-tick']['task'] == celery_worker.scheduler_tick_task.name
+    init_db()
+    sent = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', provider(sent))
+
+    celery_worker.scheduler_tick_task()
+
+    assert sent == ['254700000001', '254700000002', '254700000003']
+    assert [row[1] for row in queue_rows()] == [1, 1, 1, 0]
+
+
+def test_nothing_marked_sent_before_provider_answers(queue, monkeypatch):
+    def dies_on_second(phone, message, api_key):
+        if phone == '254700000002':
+            raise WorkerKilled()
+        return True, 'SM'
+
+    with pytest.raises(WorkerKilled):
+        dispatch_opt_out_confirmations(dies_on_second)
+    assert [row[1] for row in queue_rows()] == [0, 0, 0, 0]
+
+    # The dead dispatcher's claim blocks others until it times out
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert claim_due_confirmations(conn)[1] == []
+    monkeypatch.setattr(opt_out_manager, 'CONFIRMATION_CLAIM_TIMEOUT', -1)
+    assert len(claim_due_confirmations(conn)[1]) == 3
+    conn.close()
+
+
+def test_failures_stop_at_attempt_cap(queue, monkeypatch):
+    monkeypatch.setattr(opt_out_manager, 'CONFIRMATION_MAX_ATTEMPTS', 2)
+    always_throttled = provider([], failing={'254700000001', '254700000002', '254700000003'})
+
+    assert dispatch_opt_out_confirmations(always_throttled)['failed'] == 3
+    # Failed rows wait out the claim timeout before the next attempt
+    assert dispatch_opt_out_confirmations(always_throttled)['claimed'] == 0
+    monkeypatch.setattr(opt_out_manager, 'CONFIRMATION_CLAIM_TIMEOUT', -1)
+    assert dispatch_opt_out_confirmations(always_throttled, max_batches=1)['failed'] == 3
+    assert dispatch_opt_out_confirmations(always_throttled)['claimed'] == 0
+
+    metrics = get_opt_out_confirmation_metrics()
+    assert metrics['backlog_due'] == 0 and metrics['backlog_gave_up'] == 3
+
+
+def test_metrics_report_backlog_and_latency(queue):
+    metrics = get_opt_out_confirmation_metrics()
+    assert metrics['backlog_due'] == 3 and metrics['backlog_scheduled'] == 1
+    assert metrics['oldest_due_seconds'] >= 0 and metrics['latency_count'] == 0
+
+    dispatch_opt_out_confirmations(provider([]))
+    metrics = app.test_client().get('/api/opt-out/metrics').get_json()
+    assert metrics['backlog_due'] == 0 and metrics['latency_count'] == 3
+    assert 0 <= metrics['latency_p50_seconds'] <= metrics['latency_max_seconds']
+
+
+def test_rate_limiter_spaces_sends():
+    limiter = RateLimiter(100)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.045
+
+    unlimited = RateLimiter(0)
+    start = time.monotonic()
+    for _ in range(1000):
+        unlimited.wait()
+    assert time.monotonic() - start < 0.05
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_opt_out_dispatcher.py")
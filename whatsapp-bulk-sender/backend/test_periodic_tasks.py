@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Periodic Task Deployment Test Script
+Checks that every feature driven by celery beat is on the beat schedule, routed to the periodic
+queue and listed in the README, and that docker-compose.yml runs a beat process plus workers for
+both the periodic and the default queue. Calling the tasks directly, as the feature tests do,
+would pass even if nothing ever sent them. The analytics export is only scheduled when
+ANALYTICS_EXPORT_INTERVAL is set, so it is checked in a worker started with one. Reply exports and
+sentiment backfills must go to the jobs queue, which compose also serves.
+"""
+
+import sys
+import os
+import re
+import subprocess
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from celery_worker import JOBS_QUEUE, PERIODIC_QUEUE, celery_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Beat entry: the task it sends
+PERIODIC_TASKS = {
+    'drain-delivery-status': 'celery_worker.drain_delivery_status_task',
+    'retry-failed-messages': 'celery_worker.retry_failed_messages_task',
+    'scheduler-tick': 'celery_worker.scheduler_tick_task',
+    'verify-reply-rollups': 'celery_worker.verify_reply_rollups_task',
+}
+
+
+def compose_commands():
+    """{service: command} from docker-compose.yml"""
+    commands, service = {}, None
+    with open(os.path.join(ROOT, 'docker-compose.yml')) as f:
+        for line in f:
+            match = re.match(r'^  ([\w-]+):\s*$', line)
+            if match:
+                service = match.group(1)
+            elif service and line.startswith('    command:'):
+                commands[service] = line.split(':', 1)[1].strip()
+    return commands
+
+
+def test_compose_runs_beat_and_both_queues():
+    commands = list(compose_commands().values())
+    assert [command for command in commands if ' beat' in command] == [
+        'celery -A celery_worker beat --loglevel=info --schedule /tmp/celerybeat-schedule']
+    assert any(f'worker -Q {PERIODIC_QUEUE} ' in command for command in commands)
+    assert any(f"worker -Q {celery_app.conf.task_default_queue} " in command for command in commands)
+
+
+@pytest.mark.parametrize('entry, task', list(PERIODIC_TASKS.items()))
+def test_feature_is_scheduled_routed_and_documented(entry, task):
+    assert celery_app.conf.beat_schedule[entry]['task'] == task
+    assert task in celery_app.tasks
+    assert celery_app.amqp.router.route({}, task)['queue'].name == PERIODIC_QUEUE
+    with open(os.path.join(ROOT, 'README.md'), encoding='utf-8') as f:
+        assert f'| `{entry}` |' in f.read()
+
+
+@pytest.mark.parametrize('task', ['celery_worker.export_replies_task', 'celery_worker.backfill_sentiment_task'])
+def test_background_jobs_have_their_own_queue(task):
+    assert task in celery_app.tasks
+    assert celery_app.amqp.router.route({}, task)['queue'].name == JOBS_QUEUE
+    assert any(f'worker -Q {JOBS_QUEUE} ' in command for command in compose_commands().values())
+    with open(os.path.join(ROOT, 'README.md'), encoding='utf-8') as f:
+        assert f"(`{task.split('.')[1]}`)" in f.read()
+
+
+def test_analytics_export_is_scheduled_when_enabled():
+    script = ("from celery_worker import celery_app; "
+              "print(celery_app.conf.beat_schedule['analytics-export']['task']); "
+              "print(celery_app.amqp.router.route({}, 'celery_worker.analytics_export_task')['queue'].name)")
+    env = {**os.environ, 'ANALYTICS_EXPORT_INTERVAL': '3600'}
+    output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.split()
+    assert output == ['celery_worker.analytics_export_task', PERIODIC_QUEUE]
+    with open(os.path.join(ROOT, 'README.md'), encoding='utf-8') as f:
+        assert '| `analytics-export` |' in f.read()
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_periodic_tasks.py")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Phone Number Canonicalisation Test Script
+Checks the canonical E.164 form, country rules, the vectorised validator, the phone_canonical
+backfill, indexed reply attribution (down to the campaign name the replies API shows) and opt-out
+lookups
+"""
+
+import sys
+import os
+import random
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from phone_numbers import (
+    canonical_phone_number, ensure_phone_canonical_column, parse_phone_number,
+    validate_phone_number, validate_phone_series
+)
+from reply_handler import setup_replies_database, store_reply, find_sender_name, mark_phone_as_opted_out
+from app import app, init_db, create_campaign_records
+from opt_out_manager import setup_opt_out_tables, is_phone_opted_out, remove_opted_out_contacts_from_campaign
+
+
+def test_canonical_forms_agree():
+    variants = ["0712345678", "712345678", "254712345678", "+254712345678",
+                "whatsapp:+254712345678", "+254 712-345-678"]
+    assert {canonical_phone_number(variant) for variant in variants} == {"+254712345678"}
+    assert canonical_phone_number("+1 415 555 0100") == "+14155550100"
+
+
+def test_country_rules():
+    assert parse_phone_number("+256 772 123456") == "+256772123456"
+    assert parse_phone_number("255754123456") == "+255754123456"
+    assert parse_phone_number("0772123456", country='UG') == "+256772123456"
+    assert parse_phone_number(712345678.0) == "+254712345678"
+
+    # Known dial code with the wrong length, or too short for any country
+    assert parse_phone_number("2547123456") is None
+    assert parse_phone_number("12345") is None
+    assert validate_phone_number("0712345678") == "254712345678"
+
+
+def test_series_matches_scalar():
+    rng = random.Random(3)
+    raw = ["0712345678", "+256 772 123456", "2547123", "", "+44 20 7946 0958", "whatsapp:+254700000001"]
+    raw += [rng.choice(["0", "", "+254", "256", "+1", "44"]) + str(rng.randint(10 ** 6, 10 ** 10))
+            for _ in range(500)]
+
+    vectorised = validate_phone_series(pd.Series(raw))
+    assert [phone if pd.notna(phone) else None for phone in vectorised] == \
+        [validate_phone_number(phone) for phone in raw]
+
+    excel_floats = pd.Series([712345678.0, 254712345678.0, float('nan')])
+    assert validate_phone_series(excel_floats).tolist()[:2] == ["254712345678", "254712345678"]
+
+
+def test_backfill_existing_table():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, phone_number TEXT)")
+    cursor.executemany("INSERT INTO messages (phone_number) VALUES (?)",
+                       [("254712345678",), ("0722000000",), (None,)])
+
+    assert ensure_phone_canonical_column(cursor, 'messages') == 3
+    assert [row[0] for row in cursor.execute("SELECT phone_canonical FROM messages ORDER BY id")] == \
+        ["+254712345678", "+254722000000", None]
+
+    # Already migrated: nothing to do on the next startup
+    assert ensure_phone_canonical_column(cursor, 'messages') == 0
+    conn.close()
+
+
+def test_reply_attributed_to_latest_campaign(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    setup_replies_database()
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'January', 'hi', 2, [{'phone': '254712345678', 'name': 'Old Name'}])
+    create_campaign_records(conn.cursor(), 'c2', 'February', 'hi', 2, [{'phone': '254712345678', 'name': 'Jane'}])
+    conn.execute("UPDATE messages SET sent_at = CASE campaign_id WHEN 'c1' THEN '2024-01-01' ELSE '2024-02-01' END")
+    conn.commit()
+
+    plan = conn.execute('''
+        EXPLAIN QUERY PLAN SELECT m.campaign_id, m.id, c.name FROM contacts c
+        JOIN messages m ON m.contact_id = c.id
+        WHERE c.phone_canonical = ? ORDER BY m.sent_at DESC LIMIT 1
+    ''', ("+254712345678",)).fetchall()
+    assert any('idx_messages_contact' in row[-1] for row in plan)
+    conn.close()
+
+    neutral = {'sentiment': 'neutral', 'confidence': 0.9, 'requires_attention': False,
+               'detailed_category': 'NEUTRAL', 'reasoning': 'test'}
+    reply_id = store_reply("whatsapp:0712345678", "Thanks", sentiment_result=neutral)
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    row = conn.execute("SELECT campaign_id, original_message_id, sender_name, phone_canonical FROM replies WHERE id = ?",
+                       (reply_id,)).fetchone()
+    conn.close()
+    assert row == ("c2", "2", "Jane", "+254712345678")
+    assert find_sender_name("712345678") == "Jane"
+
+    replies = app.test_client().get('/api/replies').get_json()['replies']
+    assert [(reply['campaign_id'], reply['campaign_name'], reply['phone_number']) for reply in replies] == \
+        [("c2", "February", "+254712345678")]
+
+
+def test_opt_out_covers_every_format(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    setup_opt_out_tables()
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'hi', 2,
+                            [{'phone': '254712345678', 'name': 'Jane'}, {'phone': '254722000000', 'name': 'Amina'}])
+    conn.commit()
+    conn.close()
+
+    mark_phone_as_opted_out("whatsapp:+254712345678")
+    assert is_phone_opted_out("0712345678")
+    assert not is_phone_opted_out("0722000000")
+    assert remove_opted_out_contacts_from_campaign('c1') == 1
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_phone_numbers.py")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Profiling Test Script
+Checks that requests are profiled only when the X-Profile header carries the token, that task
+runs are profiled by header or by PROFILE_TASKS, that SQL statements are counted and timed with
+per-item queries reported as repeated, and the sampling profiler's collapsed-stack output
+"""
+
+import sys
+import os
+import glob
+import json
+import pstats
+import re
+import sqlite3
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import celery_worker
+import profiling
+from db import connect
+from app import app, init_db, create_campaign_records
+from profiling import Profile, profile_task
+from reply_handler import setup_replies_database, get_phone_number_variations
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    init_db()
+    setup_replies_database()
+
+    def written(kind='*'):
+        return [json.load(open(path)) for path in sorted(glob.glob(str(tmp_path / 'profiles' / f'*-{kind}-*.json')))]
+    return written
+
+
+def test_header_switches_on_a_request_profile(profiles, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', 'secret')
+    client = app.test_client()
+    assert 'X-Profile-Id' not in client.get('/api/replies').headers
+    assert 'X-Profile-Id' not in client.get('/api/replies', headers={'X-Profile': 'guess'}).headers
+    assert profiles() == []
+
+    response = client.get('/api/replies?per_page=10', headers={'X-Profile': 'secret'})
+    assert response.status_code == 200
+    [summary] = profiles('request')
+    assert response.headers['X-Profile-Id'] == summary['id']
+    assert summary['name'] == 'GET /api/replies' and summary['mode'] == 'cprofile'
+    assert summary['queries']['count'] == 2
+    assert all('FROM replies r' in statement['sql'] for statement in summary['queries']['statements'])
+    assert pstats.Stats(os.path.join(profiling.PROFILE_DIR, summary['profile'])).total_calls > 0
+
+
+@profile_task
+def attribute_replies(phones):
+    conn = connect()
+    cursor = conn.cursor()
+    for phone in phones:
+        # One lookup per variation, as store_reply once did
+        for variation in get_phone_number_variations(phone):
+            cursor.execute("SELECT id FROM contacts WHERE phone_canonical = ?", (variation,))
+            cursor.fetchone()
+        cursor.execute("SELECT id FROM contacts WHERE phone_canonical IN (?, ?)", (phone, phone[1:]))
+        cursor.fetchall()
+    conn.close()
+
+
+def test_repeated_statements_are_reported(profiles, monkeypatch):
+    attribute_replies(['+254700000001'])
+    assert profiles() == []
+
+    monkeypatch.setattr(profiling, 'PROFILE_TASKS', 'attribute_replies')
+    attribute_replies([f'+2547000000{i:02d}' for i in range(4)])
+    [summary] = profiles('task')
+    queries = summary['queries']
+    assert queries['count'] == 4 * 5 + 4
+    assert [(statement['sql'], statement['calls'], statement['sites']) for statement in queries['repeated']] == [
+        ('SELECT id FROM contacts WHERE phone_canonical = ?', 20, ['test_profiling.py:65 attribute_replies'])]
+    assert 'SELECT id FROM contacts WHERE phone_canonical IN (?, ...)' in [statement['sql'] for statement in queries['statements']]
+
+
+def test_task_header_profiles_one_run(profiles, monkeypatch):
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(5)])
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message',
+                        lambda phone, content, api_key, idempotency_key=None: (True, f'SM{idempotency_key}'))
+
+    celery_worker.process_campaign_task.apply(('c1', 'key', 0), headers={'profile': 'sample'})
+    [summary] = profiles('task')
+    assert summary['name'] == 'process_campaign_task' and summary['mode'] == 'sample'
+    assert summary['queries']['count'] > 5
+
+
+def test_sampling_writes_collapsed_stacks(profiles, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_INTERVAL', 0.001)
+
+    def spin(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    with Profile('task', 'spin', 'sample') as profile:
+        spin(0.2)
+    lines = open(profile.path[:-len('.json')] + '.txt').read().splitlines()
+    assert lines and all(re.fullmatch(r'.+ \(.+:\d+\)(;.+ \(.+:\d+\))* \d+', line) for line in lines)
+    assert any('spin (test_profiling.py:' in line for line in lines)
+    assert profiles('task')[0]['top_functions'][0]['function'].startswith('spin (test_profiling.py:')
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_profiling.py")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Query Budget Test Script
+Holds each API endpoint to a number of SQL statements per request, on a small and a larger
+database: more statements than the budget fails, and so does a count that grows with the data,
+which is what a query per row (N+1) looks like. Lower a budget when an endpoint gets cheaper;
+raise one only with a reason in the commit.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from app import app, init_db, create_campaign_records
+from db import QueryLog, connect
+from opt_out_manager import setup_opt_out_tables
+from reply_handler import setup_replies_database, store_reply
+
+# (method, url, form data): statements allowed per request
+QUERY_BUDGETS = {
+    ('GET', '/api/campaigns', None): 2,
+    ('GET', '/api/campaign-status/c1', None): 2,
+    ('GET', '/api/replies', None): 2,
+    ('GET', '/api/replies?sentiment=question&campaign_id=c1', None): 2,
+    ('GET', '/api/replies/analytics', None): 6,
+    ('GET', '/api/replies/unique-responders', None): 1,
+    ('GET', '/api/replies/download?format=csv', None): 2,
+    ('GET', '/api/opt-out/analytics', None): 5,
+    ('GET', '/api/opt-out/queue', None): 1,
+    ('GET', '/api/opt-out/metrics', None): 4,
+    ('GET', '/api/opt-out/check/0700000001', None): 1,
+    ('GET', '/api/campaigns/c1/delivery-latency', None): 1,
+    ('POST', '/api/campaigns/c2/clean-opt-outs', None): 1,
+    # Applied directly without Redis; queued (no statements) with it
+    ('POST', '/webhook/status', (('MessageSid', 'SM3'), ('MessageStatus', 'delivered'))): 2,
+    # Most of these are setup_replies_database's CREATE ... IF NOT EXISTS, run for every reply
+    ('POST', '/webhook/whatsapp', (('From', 'whatsapp:+254700000003'), ('Body', 'Thanks, love it'),
+                                   ('NumMedia', '0'))): 21,
+}
+
+
+@pytest.fixture(scope='module')
+def databases(tmp_path_factory):
+    """A campaigns database with 5 contacts per campaign, and one with 40"""
+    directories = {}
+    cwd = os.getcwd()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.delenv('GEMINI_API_KEY', raising=False)
+        for size in (5, 40):
+            directories[size] = tmp_path_factory.mktemp(f'contacts-{size}')
+            os.chdir(directories[size])
+            try:
+                init_db()
+                setup_replies_database()
+                setup_opt_out_tables()
+                conn = connect()
+                for campaign_id in ('c1', 'c2'):
+                    create_campaign_records(conn.cursor(), campaign_id, f'Launch {campaign_id}', 'Hi {name}', 0,
+                                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(size)])
+                conn.execute("UPDATE messages SET status = 'sent', provider_sid = 'SM' || id, sent_at = datetime('now')")
+                conn.commit()
+                conn.close()
+                for i in range(size):
+                    store_reply(f'+2547{i:08d}', 'STOP' if i % 5 == 0 else 'How much is it?')
+            finally:
+                os.chdir(cwd)
+        yield directories
+
+
+@pytest.mark.parametrize('method, url, data', list(QUERY_BUDGETS), ids=[' '.join(key[:2]) for key in QUERY_BUDGETS])
+def test_endpoint_stays_within_its_query_budget(databases, monkeypatch, method, url, data):
+    monkeypatch.delenv('GEMINI_API_KEY', raising=False)
+    client = app.test_client()
+    logs = {}
+    for size, directory in databases.items():
+        monkeypatch.chdir(directory)
+        with QueryLog() as log:
+            response = client.open(url, method=method, data=dict(data or ()))
+            response.get_data()
+        assert response.status_code < 400, response.get_data(as_text=True)
+        logs[size] = log
+
+    budget = QUERY_BUDGETS[(method, url, data)]
+    assert logs[5].count <= budget, f"{logs[5].count} statements, budget {budget}:\n{logs[5].report()}"
+    assert logs[40].count == logs[5].count, (
+        f"statements grow with the data ({logs[5].count} -> {logs[40].count}): {logs[40].repeated()}")
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_query_budgets.py")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Reply Export Test Script
+Checks the streamed CSV and write-only XLSX downloads, column sizing from a sample, and that
+exports over the threshold run as a background job with a download link
+"""
+
+import sys
+import os
+import csv
+import io
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from openpyxl import load_workbook
+
+import celery_worker
+import reply_export
+from app import app, init_db
+from reply_export import COLUMNS, run_export_job, write_xlsx
+from reply_handler import setup_replies_database
+
+
+@pytest.fixture
+def replies(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    setup_replies_database()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn.execute("INSERT INTO campaigns (id, name, message_template) VALUES ('c1', 'Launch Day', 'Hi {name}')")
+    conn.executemany('''
+        INSERT INTO replies (phone_number, sender_name, message_content, received_at, campaign_id,
+                             sentiment, reply_type, is_opt_out)
+        VALUES (?, ?, ?, ?, 'c1', ?, 'text', ?)
+    ''', [
+        ('254700000001', 'Jane', 'Thanks, see you there', '2026-01-05 09:00:00', 'positive', 0),
+        ('254700000002', 'Amina', 'STOP', '2026-01-05 10:30:00.123456', 'negative', 1),
+        ('254700000003', 'Wanjiru', 'Where is it?\nAnd when, exactly?', '2026-01-05 11:15:00', 'question', 0),
+    ])
+    conn.commit()
+    conn.close()
+    return app.test_client()
+
+
+def test_xlsx_download_matches_previous_layout(replies):
+    response = replies.get('/api/replies/download?campaign_id=c1')
+
+    assert response.status_code == 200
+    assert 'whatsapp_replies_' in response.headers['Content-Disposition']
+    assert 'campaign_Launch_Day' in response.headers['Content-Disposition']
+    sheet = load_workbook(io.BytesIO(response.data))['WhatsApp Replies']
+    rows = list(sheet.values)
+    assert list(rows[0]) == COLUMNS and sheet['A1'].font.bold
+    assert rows[1] == ('Wanjiru', '254700000003', 'Where is it?\nAnd when, exactly?', '2026-01-05 11:15:00',
+                       'Launch Day', 'question', 'text', 'No')
+    assert rows[2][3] == '2026-01-05 10:30:00' and rows[2][7] == 'Yes'
+    assert sheet.column_dimensions['C'].width == len('Where is it?\nAnd when, exactly?') + 2
+
+
+def test_csv_download_streams_rows(replies):
+    response = replies.get('/api/replies/download?format=csv&sentiment=negative')
+
+    assert response.status_code == 200 and response.is_streamed
+    assert response.mimetype == 'text/csv'
+    text = response.get_data(as_text=True)
+    assert text.startswith('\ufeff')
+    assert list(csv.reader(io.StringIO(text[1:]))) == [
+        COLUMNS,
+        ['Amina', '254700000002', 'STOP', '2026-01-05 10:30:00', 'Launch Day', 'negative', 'text', 'Yes'],
+    ]
+
+
+def test_csv_keeps_multiline_messages_in_one_row(replies, monkeypatch):
+    monkeypatch.setattr(reply_export, 'EXPORT_FETCH_SIZE', 1)
+    text = replies.get('/api/replies/download?format=csv').get_data(as_text=True)
+    rows = list(csv.reader(io.StringIO(text[1:])))
+    assert len(rows) == 4 and rows[1][2] == 'Where is it?\nAnd when, exactly?'
+
+
+def test_download_errors(replies):
+    assert replies.get('/api/replies/download?sentiment=neutral').status_code == 404
+    assert replies.get('/api/replies/download?format=pdf').status_code == 400
+
+
+def test_column_widths_come_from_sample(tmp_path, monkeypatch):
+    monkeypatch.setattr(reply_export, 'EXPORT_WIDTH_SAMPLE', 2)
+    rows = [('A', '1', 'short', None, None, None, None, 'No')] * 2 + [('B', '2', 'x' * 200, None, None, None, None, 'No')]
+    path = str(tmp_path / 'sample.xlsx')
+
+    assert write_xlsx(rows, path) == 3
+    sheet = load_workbook(path)['WhatsApp Replies']
+    assert sheet.column_dimensions['C'].width == len('Reply Message') + 2
+    assert sheet.max_row == 4
+
+
+def test_large_export_runs_as_background_job(replies, monkeypatch):
+    monkeypatch.setattr('app.EXPORT_ASYNC_THRESHOLD', 2)
+    queued = []
+    monkeypatch.setattr(celery_worker.export_replies_task, 'delay', queued.append)
+
+    response = replies.get('/api/replies/download?format=csv')
+    assert response.status_code == 202
+    job = response.get_json()
+    assert queued == [job['job_id']]
+    assert replies.get(job['status_url']).get_json()['status'] == 'queued'
+    assert replies.get(job['download_url']).status_code == 404
+
+    assert run_export_job(job['job_id'])['row_count'] == 3
+    status = replies.get(job['status_url']).get_json()
+    assert status['status'] == 'completed' and status['download_url'] == job['download_url']
+    download = replies.get(job['download_url'])
+    assert download.status_code == 200 and download.data.decode('utf-8').count('Launch Day') == 3
+    download.close()
+
+
+def test_expired_exports_are_purged(replies, monkeypatch):
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    job_id = reply_export.create_export_job(conn, {}, 'xlsx', 'replies.xlsx')
+    run_export_job(job_id)
+    file_path = reply_export.get_export_job(job_id)['file_path']
+    assert os.path.exists(file_path)
+
+    monkeypatch.setattr(reply_export, 'EXPORT_RETENTION_HOURS', -1)
+    assert reply_export.purge_expired_exports(conn) == 1
+    assert not os.path.exists(file_path) and reply_export.get_export_job(job_id) is None
+    conn.close()
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_reply_export.py")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Reply Rollups Test Script
+Checks that the triggers keep hourly campaign x sentiment x opt-out counts in step with inserts,
+updates and deletes, that the analytics endpoint answers from them (including an exact 24 hour
+window), and that verification finds and repairs drift
+"""
+
+import sys
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from app import app, init_db
+from reply_handler import setup_replies_database
+from reply_rollups import verify_reply_rollups
+
+NOW = datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    setup_replies_database()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn.execute("INSERT INTO campaigns (id, name, message_template, total_contacts) VALUES ('c1', 'Launch', 'Hi', 4)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def add_reply(conn, phone, sentiment, received_at, campaign_id='c1', is_opt_out=False):
+    conn.execute('''
+        INSERT INTO replies (phone_number, message_content, received_at, campaign_id, sentiment, is_opt_out)
+        VALUES (?, 'text', ?, ?, ?, ?)
+    ''', (phone, received_at.strftime('%Y-%m-%d %H:%M:%S'), campaign_id, sentiment, is_opt_out))
+    conn.commit()
+
+
+def rollups(conn):
+    return conn.execute('''
+        SELECT campaign_id, bucket, sentiment, is_opt_out, reply_count FROM reply_rollups ORDER BY 1, 2, 3, 4
+    ''').fetchall()
+
+
+def test_triggers_follow_inserts_updates_and_deletes(conn):
+    add_reply(conn, '0700000001', 'positive', datetime(2026, 1, 5, 9, 10))
+    add_reply(conn, '0700000002', 'positive', datetime(2026, 1, 5, 9, 50))
+    add_reply(conn, '0700000003', None, datetime(2026, 1, 5, 10, 5), campaign_id=None, is_opt_out=True)
+    assert rollups(conn) == [
+        ('', '2026-01-05 10:00:00', '', 1, 1),
+        ('c1', '2026-01-05 09:00:00', 'positive', 0, 2),
+    ]
+
+    conn.execute("UPDATE replies SET sentiment = 'negative' WHERE phone_number = '0700000002'")
+    conn.execute("DELETE FROM replies WHERE phone_number = '0700000003'")
+    conn.commit()
+    assert rollups(conn) == [
+        ('c1', '2026-01-05 09:00:00', 'negative', 0, 1),
+        ('c1', '2026-01-05 09:00:00', 'positive', 0, 1),
+    ]
+    assert verify_reply_rollups(conn)['mismatched'] == 0
+
+
+def test_existing_replies_are_rolled_up_on_setup(conn):
+    add_reply(conn, '0700000001', 'neutral', datetime(2026, 1, 5, 9, 10))
+    conn.execute("DROP TABLE reply_rollups")
+    conn.commit()
+
+    setup_replies_database()
+    assert rollups(conn) == [('c1', '2026-01-05 09:00:00', 'neutral', 0, 1)]
+
+
+def test_verification_repairs_drift(conn):
+    add_reply(conn, '0700000001', 'neutral', datetime(2026, 1, 5, 9, 10))
+    add_reply(conn, '0700000002', 'question', datetime(2026, 1, 5, 9, 20))
+    conn.execute("UPDATE reply_rollups SET reply_count = 7 WHERE sentiment = 'neutral'")
+    conn.execute("INSERT INTO reply_rollups VALUES ('c9', '2026-01-01 00:00:00', 'positive', 0, 3)")
+    conn.commit()
+
+    assert verify_reply_rollups(conn) == {'keys': 2, 'mismatched': 2, 'repaired': True}
+    assert verify_reply_rollups(conn)['mismatched'] == 0
+    assert [row[-1] for row in rollups(conn)] == [1, 1]
+
+
+def test_analytics_endpoint_reads_rollups(conn):
+    add_reply(conn, '0700000001', 'positive', NOW - timedelta(hours=1))
+    add_reply(conn, '0700000001', 'positive_feedback', NOW - timedelta(hours=3))
+    add_reply(conn, '0700000002', 'negative', NOW - timedelta(hours=23, minutes=59), is_opt_out=True)
+    add_reply(conn, '0700000003', 'neutral', NOW - timedelta(hours=24, minutes=1))
+    add_reply(conn, '0799999999', 'neutral', NOW - timedelta(hours=30), campaign_id=None)
+
+    data = app.test_client().get('/api/replies/analytics?campaign_id=c1&exact=true').get_json()
+    assert data['sentiment_breakdown'] == {'positive': 2, 'positive_feedback': 1, 'negative': 1, 'neutral': 1}
+    assert data['total_opt_outs'] == 1
+    assert data['recent_replies_24h'] == 3
+    assert data['reply_rate'] == 75.0
+
+    overall = app.test_client().get('/api/replies/analytics').get_json()
+    assert overall['sentiment_breakdown']['neutral'] == 2 and overall['recent_replies_24h'] == 3
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_reply_rollups.py")
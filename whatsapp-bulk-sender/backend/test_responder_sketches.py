@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Responder Sketches Test Script
+Checks HyperLogLog estimates of unique responders against exact counts, merging across
+campaigns and days, the update made when a reply is stored, and the analytics endpoints'
+approximate and exact paths
+"""
+
+import sys
+import os
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from app import app, init_db, create_campaign_records
+from opt_out_manager import setup_opt_out_tables, get_opt_out_analytics
+from reply_handler import setup_replies_database, store_reply
+from responder_sketches import HLL_STANDARD_ERROR, count_responders, rebuild_responder_sketches
+
+OPT_OUT = {'sentiment': 'desired_opt_out', 'confidence': 0.9, 'requires_attention': False,
+           'detailed_category': 'DESIRED_OPT_OUT', 'reasoning': 'test'}
+NEUTRAL = {'sentiment': 'neutral', 'confidence': 0.9, 'requires_attention': False,
+           'detailed_category': 'NEUTRAL', 'reasoning': 'test'}
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    setup_replies_database()
+    setup_opt_out_tables()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    yield conn
+    conn.close()
+
+
+def add_replies(conn, rows):
+    """rows of (phone, campaign_id, day, is_opt_out), then sketches rebuilt from them"""
+    conn.executemany('''
+        INSERT INTO replies (phone_number, message_content, campaign_id, received_at, is_opt_out)
+        VALUES (?, 'text', ?, ? || ' 12:00:00', ?)
+    ''', rows)
+    rebuild_responder_sketches(conn.cursor())
+    conn.commit()
+
+
+def test_estimates_within_error_bounds(conn):
+    add_replies(conn, [(f'2547{i:08d}', 'big', '2026-01-05', False) for i in range(30000)] +
+                      [(f'2547{i:08d}', 'small', '2026-01-05', False) for i in range(40)])
+    cursor = conn.cursor()
+
+    big = count_responders(cursor, 'big')
+    assert abs(big - 30000) / 30000 < 3 * HLL_STANDARD_ERROR
+    assert count_responders(cursor, 'small') == 40
+    assert count_responders(cursor, 'small', exact=True) == 40
+
+
+def test_sketches_merge_across_campaigns_and_days(conn):
+    rows = []
+    for i in range(3000):
+        phone = f'2547{i:08d}'
+        rows.append((phone, 'c1', '2026-01-05', False))
+        if i % 2:
+            rows.append((phone, 'c2', '2026-01-06', False))  # responds to both, counted once overall
+        if i < 500:
+            rows.append((phone, 'c1', '2026-01-07', i < 100))
+    add_replies(conn, rows)
+    cursor = conn.cursor()
+
+    for kwargs in ({}, {'campaign_id': 'c1'}, {'start_date': '2026-01-06'}, {'end_date': '2026-01-05'},
+                   {'campaign_id': 'c1', 'start_date': '2026-01-07'}, {'kind': 'opt_out'}):
+        exact = count_responders(cursor, exact=True, **kwargs)
+        assert abs(count_responders(cursor, **kwargs) - exact) <= max(2, 3 * HLL_STANDARD_ERROR * exact), kwargs
+
+
+def test_store_reply_updates_sketches(conn):
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi', 0,
+                            [{'phone': '254700000001', 'name': 'Jane'}, {'phone': '254700000002', 'name': 'Amina'}])
+    conn.execute("UPDATE campaigns SET total_contacts = 2")
+    conn.commit()
+
+    store_reply('254700000001', 'Thanks', sentiment_result=NEUTRAL)
+    store_reply('254700000001', 'Thanks again', sentiment_result=NEUTRAL)
+    store_reply('254700000002', 'STOP', sentiment_result=OPT_OUT)
+
+    cursor = conn.cursor()
+    assert count_responders(cursor, 'c1') == 2
+    assert count_responders(cursor, 'c1', kind='opt_out') == 1
+    assert get_opt_out_analytics()['campaign_opt_out_rates'] == [
+        {'campaign': 'Launch', 'opt_outs': 1, 'total_contacts': 2, 'opt_out_rate': 50.0}]
+
+    data = app.test_client().get('/api/replies/analytics?campaign_id=c1').get_json()
+    assert data['unique_responders'] == 2 and data['reply_rate'] == 100.0
+    assert data['unique_responders_approximate'] is True
+
+
+def test_unique_responders_endpoint(conn):
+    add_replies(conn, [('254700000001', 'c1', '2026-01-05', False), ('254700000002', 'c1', '2026-01-06', True)])
+    client = app.test_client()
+
+    assert client.get('/api/replies/unique-responders?start_date=2026-01-06').get_json() == {
+        'unique_responders': 1, 'approximate': True, 'standard_error': round(HLL_STANDARD_ERROR, 4)}
+    exact = client.get('/api/replies/unique-responders?campaign_id=c1&exact=true').get_json()
+    assert exact['unique_responders'] == 2 and exact['approximate'] is False
+    assert client.get('/api/replies/unique-responders?kind=opt_out').get_json()['unique_responders'] == 1
+    assert client.get('/api/replies/unique-responders?kind=everyone').status_code == 400
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_responder_sketches.py")
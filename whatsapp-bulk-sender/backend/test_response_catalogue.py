@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Auto-response Catalogue Test Script
+Checks language detection, catalogue rendering and that Gemini is only used (once) for the long tail
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import reply_handler
+from response_catalogue import (
+    detect_language, render_catalogue_response, load_response_catalogue,
+    normalize_message_text
+)
+
+
+def sentiment(category, confidence=0.9):
+    return {'sentiment': category, 'confidence': confidence, 'requires_attention': False,
+            'detailed_category': category.upper(), 'reasoning': 'test'}
+
+
+def test_detect_language():
+    assert detect_language("How much is the lace set?") == 'en'
+    assert detect_language("Bei gani ya bra hii?") == 'sw'
+    assert detect_language("Erokamano ahinya") == 'luo'
+    assert detect_language("Nĩ wega mũno") == 'ki'
+
+
+def test_every_catalogue_entry_is_compliant():
+    """All pre-written responses carry the opt-out instruction and the business name"""
+    for category, languages in load_response_catalogue().items():
+        for language, template in languages.items():
+            assert 'STOP' in template and 'Mwihaki Intimates' in template, (category, language)
+            assert '{name}' in template, (category, language)
+
+
+def test_render_with_sender_name():
+    assert ', Jane' in render_catalogue_response('question', 'en', 'Jane')
+    assert '{name}' not in render_catalogue_response('question', 'sw', 'Unknown')
+    assert render_catalogue_response('question', 'luo') is None
+
+
+def test_catalogue_hit_skips_llm(monkeypatch):
+    def fail(*args):
+        raise AssertionError("Gemini should not be called for catalogue categories")
+
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(reply_handler, 'request_intelligent_response_gemini', fail)
+
+    response = reply_handler.generate_auto_response("What sizes do you have?", sentiment('question'), False, 'Amina')
+    assert response.startswith("Thank you for your question, Amina!")
+
+    response = reply_handler.generate_auto_response("Bei gani?", sentiment('question'), False)
+    assert response.startswith("Asante kwa swali lako!")
+
+
+def test_long_tail_uses_llm_once_then_cache(monkeypatch):
+    calls = []
+
+    def fake_gemini(message_content, sentiment_category):
+        calls.append(message_content)
+        return "Erokamano! Wan gi size duto."
+
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(reply_handler, 'request_intelligent_response_gemini', fake_gemini)
+
+    first = reply_handler.generate_auto_response("Nitie size maduong?", sentiment('question'), False)
+    second = reply_handler.generate_auto_response("nitie size maduong", sentiment('question'), False)
+
+    assert first == second
+    assert first.endswith("Reply STOP to opt out | Mwihaki Intimates")
+    assert calls == ["Nitie size maduong?"]
+    assert normalize_message_text("Nitie  size, maduong?") == "nitie size maduong"
+
+
+if __name__ == "__main__":
+    print("📚 Auto-response Catalogue Test")
+    print("=" * 60)
+
+    for message, category in [("What sizes do you have?", 'question'), ("Asante sana!", 'positive_feedback'),
+                              ("Erokamano ahinya", 'positive_feedback')]:
+        language = detect_language(message)
+        response = render_catalogue_response(category, language, 'Jane')
+        print(f"\"{message}\" [{category}/{language}] → {response.splitlines()[0] if response else 'LLM (long tail)'}")
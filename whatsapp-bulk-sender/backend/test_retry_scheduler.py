@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Retry Scheduler Test Script
+Checks error classification, the jittered backoff, the attempt cap, and that transient
+failures are rescheduled through the delayed queue and handed back to the campaign's dispatcher,
+even when their queue entry was lost
+"""
+
+import sys
+import os
+import random
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+import redis
+
+import campaign_control
+import celery_worker
+import retry_scheduler
+from app import init_db, create_campaign_records
+from retry_scheduler import (classify_error, backoff_delay, schedule_failed_messages,
+                             pop_due_retries, release_due_retries)
+
+NOW = 1_800_000_000.0
+
+
+class FakeZset:
+    """Just enough of a Redis sorted set for the retry queue"""
+
+    def __init__(self):
+        self.scores = {}
+        self.removing = []
+
+    def zadd(self, key, mapping):
+        self.scores.update(mapping)
+
+    def zrangebyscore(self, key, low, high, start=0, num=None):
+        due = sorted((score, member) for member, score in self.scores.items() if score <= high)
+        return [member for _, member in due][start:start + num]
+
+    def pipeline(self):
+        self.removing = []
+        return self
+
+    def zrem(self, key, member):
+        self.removing.append(member)
+
+    def execute(self):
+        return [self.scores.pop(member, None) is not None for member in self.removing]
+
+
+@pytest.mark.parametrize('error_message, expected', [
+    ('Twilio error 20429: Too Many Requests', ('20429', 'retryable')),
+    ('Twilio error: HTTP 503 error: Service Unavailable', ('503', 'retryable')),
+    ('Twilio error 63016', ('63016', 'permanent')),
+    ('Twilio error 21211: Invalid To number', ('21211', 'permanent')),
+    ('Twilio error 99999: Something new', ('99999', 'permanent')),
+    ('Request timeout', (None, 'retryable')),
+    ('Twilio credentials not configured in .env file', (None, 'permanent')),
+    (None, (None, 'permanent')),
+])
+def test_classify_error(error_message, expected):
+    assert classify_error(error_message) == expected
+
+
+def test_backoff_is_jittered_exponential_and_capped(monkeypatch):
+    monkeypatch.setattr(retry_scheduler, 'RETRY_BASE_DELAY', 60)
+    monkeypatch.setattr(retry_scheduler, 'RETRY_MAX_DELAY', 300)
+    rng = random.Random(1)
+    for attempt, full in ((1, 60), (2, 120), (3, 240), (4, 300), (9, 300)):
+        delays = [backoff_delay(attempt, rng) for _ in range(200)]
+        assert full / 2 <= min(delays) and max(delays) <= full
+        assert max(delays) - min(delays) > full / 4
+
+
+def make_failed_campaign(tmp_path, monkeypatch, errors):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(len(errors))])
+    conn.executemany("UPDATE messages SET status = 'failed', error_message = ?, retry_count = ? WHERE id = ?",
+                     [(error, retries, index + 1) for index, (error, retries) in enumerate(errors)])
+    conn.commit()
+    return conn
+
+
+def states(conn):
+    return conn.execute("SELECT status, retry_class, error_code, retry_count FROM messages ORDER BY id").fetchall()
+
+
+def test_schedule_classifies_and_caps_attempts(tmp_path, monkeypatch):
+    queue = FakeZset()
+    monkeypatch.setattr(campaign_control, '_redis_client', queue)
+    conn = make_failed_campaign(tmp_path, monkeypatch, [
+        ('Twilio error 20429: Too Many Requests', 0),
+        ('Twilio error 21211: Invalid To number', 0),
+        ('Twilio error 63018: Rate limit exceeded', retry_scheduler.MAX_SEND_ATTEMPTS - 1),
+    ])
+
+    assert schedule_failed_messages(conn, now=NOW) == {'retryable': 1, 'permanent': 1, 'exhausted': 1}
+    assert states(conn) == [
+        ('retry_scheduled', 'retryable', '20429', 1),
+        ('failed', 'permanent', '21211', 0),
+        ('failed', 'exhausted', '63018', retry_scheduler.MAX_SEND_ATTEMPTS - 1),
+    ]
+    assert list(queue.scores) == ['1']
+
+    # Classified rows are not looked at again
+    assert schedule_failed_messages(conn, now=NOW) == {'retryable': 0, 'permanent': 0, 'exhausted': 0}
+    conn.close()
+
+
+def test_due_retries_popped_once(tmp_path, monkeypatch):
+    queue = FakeZset()
+    monkeypatch.setattr(campaign_control, '_redis_client', queue)
+    conn = make_failed_campaign(tmp_path, monkeypatch, [('Request timeout', 0)] * 3)
+    schedule_failed_messages(conn, now=NOW)
+
+    assert pop_due_retries(conn, now=NOW) == []
+    later = NOW + retry_scheduler.RETRY_BASE_DELAY
+    assert sorted(pop_due_retries(conn, now=later)) == [1, 2, 3]
+    assert pop_due_retries(conn, now=later) == []
+    conn.close()
+
+
+def test_due_retries_from_database_without_redis(tmp_path, monkeypatch):
+    conn = make_failed_campaign(tmp_path, monkeypatch, [('Request timeout', 0)] * 2)
+    schedule_failed_messages(conn, now=NOW)
+
+    assert pop_due_retries(conn, now=NOW) == []
+    assert sorted(pop_due_retries(conn, now=NOW + retry_scheduler.RETRY_BASE_DELAY)) == [1, 2]
+    conn.close()
+
+
+def test_retry_lost_from_queue_is_still_released(tmp_path, monkeypatch):
+    queue = FakeZset()
+    monkeypatch.setattr(campaign_control, '_redis_client', queue)
+    conn = make_failed_campaign(tmp_path, monkeypatch, [('Request timeout', 0)] * 2)
+
+    # Redis drops out for the ZADD only; both rows are already committed as retry_scheduled
+    def lost(key, mapping):
+        raise redis.ConnectionError('Connection reset by peer')
+    monkeypatch.setattr(queue, 'zadd', lost)
+    schedule_failed_messages(conn, now=NOW)
+    monkeypatch.delattr(queue, 'zadd')
+
+    due = NOW + retry_scheduler.RETRY_BASE_DELAY
+    assert pop_due_retries(conn, now=due) == []
+    later = due + retry_scheduler.RETRY_ORPHAN_GRACE
+    assert [row[0] for row in release_due_retries(conn, pop_due_retries(conn, now=later), now=later)] == [1, 2]
+    assert [row[0] for row in states(conn)] == ['pending', 'pending']
+    assert pop_due_retries(conn, now=later) == []
+    conn.close()
+
+
+def test_cancelled_campaign_drops_its_retries(tmp_path, monkeypatch):
+    conn = make_failed_campaign(tmp_path, monkeypatch, [('Request timeout', 0)])
+    schedule_failed_messages(conn, now=NOW)
+    conn.execute("UPDATE campaigns SET status = 'cancelled'")
+    conn.commit()
+
+    assert release_due_retries(conn, [1], now=NOW) == []
+    assert states(conn)[0][0] == 'cancelled'
+    conn.close()
+
+
+def test_transient_failures_recovered_in_bulk(tmp_path, monkeypatch):
+    queue = FakeZset()
+    monkeypatch.setattr(campaign_control, '_redis_client', queue)
+    monkeypatch.setattr(retry_scheduler, 'RETRY_BASE_DELAY', 0)
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(6)])
+    conn.commit()
+
+    # Every other recipient is throttled on the first pass, and one number is invalid
+    calls = []
+
+    def send(phone, content, api_key, idempotency_key=None):
+        calls.append(content)
+        if content == 'Hi Customer 5':
+            return False, 'Twilio error 21211: Invalid To number'
+        if calls.count(content) == 1 and content in ('Hi Customer 1', 'Hi Customer 3'):
+            return False, 'Twilio error 20429: Too Many Requests'
+        return True, f'SM{idempotency_key}'
+
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', send)
+    monkeypatch.setattr(celery_worker.process_campaign_task, 'delay',
+                        lambda *args: celery_worker.process_campaign_task(*args))
+    celery_worker.process_campaign_task('c1', 'key', 0)
+    assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'running'
+    assert celery_worker.retry_failed_messages_task() == 2
+    assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'completed'
+
+    assert [row[:2] for row in states(conn)] == [('sent', None)] * 5 + [('failed', 'permanent')]
+    assert calls.count('Hi Customer 1') == 2 and calls.count('Hi Customer 5') == 1
+    conn.close()
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_retry_scheduler.py")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Scheduler Test Script
+Checks quiet hours by recipient timezone, scheduled campaign start, the release of deferred
+messages back to the campaign's dispatcher (not sent from the tick), due opt-out confirmations,
+and that each due query is an indexed range scan
+"""
+
+import sys
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import celery_worker
+import scheduler
+from app import init_db, create_campaign_records
+from opt_out_manager import setup_opt_out_tables, schedule_opt_out_confirmation_message
+from scheduler import quiet_hours_end, parse_schedule_time, start_due_campaigns, release_deferred_messages
+
+# 22:00 in Nairobi, 19:00 in London
+NIGHT_IN_NAIROBI = datetime(2026, 1, 5, 19, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def quiet_hours(monkeypatch):
+    monkeypatch.setattr(scheduler, 'QUIET_HOURS_START', 21)
+    monkeypatch.setattr(scheduler, 'QUIET_HOURS_END', 8)
+    monkeypatch.setattr(scheduler, 'QUIET_HOURS_SPREAD', 0)
+
+
+def make_campaign(tmp_path, monkeypatch, size=3):
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    setup_opt_out_tables()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(size)])
+    conn.commit()
+    return conn
+
+
+def test_quiet_hours_follow_recipient_timezone(quiet_hours):
+    morning_in_nairobi = datetime(2026, 1, 6, 5, 0, tzinfo=timezone.utc)
+    assert quiet_hours_end('0712345678', NIGHT_IN_NAIROBI) == morning_in_nairobi.astimezone().replace(tzinfo=None)
+    assert quiet_hours_end('+447911123456', NIGHT_IN_NAIROBI) is None
+    assert quiet_hours_end('0712345678', datetime(2026, 1, 5, 9, 0, tzinfo=timezone.utc)) is None
+
+
+def test_quiet_hours_off_by_default():
+    assert quiet_hours_end('0712345678', NIGHT_IN_NAIROBI) is None
+
+
+def test_parse_schedule_time():
+    utc = parse_schedule_time('2026-03-01T06:00:00Z')
+    assert utc == datetime(2026, 3, 1, 6, 0, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert parse_schedule_time('2026-03-01T09:00:00') == datetime(2026, 3, 1, 9, 0)
+    assert parse_schedule_time('') is None
+
+
+def test_scheduled_campaign_starts_once(tmp_path, monkeypatch):
+    conn = make_campaign(tmp_path, monkeypatch)
+    start = datetime(2026, 3, 1, 9, 0)
+    conn.execute("UPDATE campaigns SET status = 'scheduled', scheduled_at = ?", (start,))
+    conn.commit()
+
+    assert start_due_campaigns(conn, now=start - timedelta(minutes=1)) == []
+    assert start_due_campaigns(conn, now=start) == [('c1', 0)]
+    assert start_due_campaigns(conn, now=start) == []
+    assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'pending'
+    conn.close()
+
+
+def test_quiet_hours_defer_then_release(tmp_path, monkeypatch, quiet_hours):
+    conn = make_campaign(tmp_path, monkeypatch)
+    sent = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message',
+                        lambda phone, content, api_key, idempotency_key=None:
+                        sent.append(content) or (True, 'SM' + idempotency_key))
+    monkeypatch.setattr(celery_worker, 'quiet_hours_end', lambda phone: quiet_hours_end(phone, NIGHT_IN_NAIROBI))
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    assert sent == []
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE status = 'deferred'").fetchone()[0] == 3
+    morning = datetime(2026, 1, 6, 5, 0, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert release_deferred_messages(conn, now=morning - timedelta(seconds=1)) == []
+
+    monkeypatch.setattr(celery_worker, 'quiet_hours_end', lambda phone: None)
+    queued = []
+    monkeypatch.setattr(celery_worker.process_campaign_task, 'delay',
+                        lambda *args: queued.append(args) or celery_worker.process_campaign_task(*args))
+    released = release_deferred_messages(conn, now=morning)
+    assert celery_worker.hand_back_to_dispatchers(conn, released) == ['c1']
+    assert [args[0] for args in queued] == ['c1']
+    assert sent == ['Hi Customer 0', 'Hi Customer 1', 'Hi Customer 2']
+    assert conn.execute("SELECT status FROM campaigns").fetchone()[0] == 'completed'
+    conn.close()
+
+
+def test_released_messages_join_a_running_dispatcher(tmp_path, monkeypatch):
+    conn = make_campaign(tmp_path, monkeypatch, size=4)
+    conn.execute("UPDATE messages SET status = 'deferred', send_after = ? WHERE id IN (1, 2)",
+                 (datetime.now() - timedelta(minutes=1),))
+    conn.commit()
+    queued = []
+    monkeypatch.setattr(celery_worker.process_campaign_task, 'delay', lambda *args: queued.append(args))
+
+    # Messages 3 and 4 are still pending, so the campaign's own dispatcher takes the released ones too
+    assert celery_worker.hand_back_to_dispatchers(conn, release_deferred_messages(conn)) == []
+    assert queued == []
+
+    sent = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message',
+                        lambda phone, content, api_key, idempotency_key=None:
+                        sent.append(content) or (True, 'SM' + idempotency_key))
+    conn.execute("UPDATE campaigns SET last_message_id = 2")
+    conn.commit()
+    celery_worker.process_campaign_task('c1', 'key', 0)
+    assert sent == ['Hi Customer 2', 'Hi Customer 3', 'Hi Customer 0', 'Hi Customer 1']
+    conn.close()
+
+
+def test_tick_sends_due_opt_out_confirmations(tmp_path, monkeypatch):
+    conn = make_campaign(tmp_path, monkeypatch, size=0)
+    schedule_opt_out_confirmation_message('254700000001', 'Jane')
+    schedule_opt_out_confirmation_message('254700000002', 'Amina', 'after_hours', hours_delay=2)
+
+    sent = []
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message',
+                        lambda phone, content, api_key, idempotency_key=None: sent.append(phone) or (True, 'SM'))
+    celery_worker.scheduler_tick_task()
+
+    assert sent == ['254700000001']
+    assert conn.execute("SELECT phone_number FROM opt_out_queue WHERE sent = FALSE").fetchall() == [('254700000002',)]
+    conn.close()
+
+
+@pytest.mark.parametrize('query, index', [
+    ("SELECT id FROM campaigns WHERE status = 'scheduled' AND scheduled_at <= ? ORDER BY scheduled_at",
+     'idx_campaigns_scheduled'),
+    ("SELECT id FROM messages WHERE status = 'deferred' AND send_after <= ? ORDER BY send_after",
+     'idx_messages_deferred'),
+    ("SELECT id FROM opt_out_queue WHERE sent = FALSE AND scheduled_time <= ? AND attempts < 5 "
+     "AND (claim_token IS NULL OR claimed_at < '') ORDER BY scheduled_time",
+     'idx_optout_queue_due'),
+])
+def test_due_queries_use_partial_indexes(tmp_path, monkeypatch, query, index):
+    conn = make_campaign(tmp_path, monkeypatch, size=0)
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + query, (datetime.now(),)).fetchall()
+    assert any(index in row[-1] for row in plan)
+    conn.close()
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_scheduler.py")
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Send Ledger Test Script
+Kills the campaign worker at every point around the provider call and checks that, after
+startup reconciliation and task redelivery, each recipient got the message exactly once
+"""
+
+import sys
+import os
+import sqlite3
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import celery_worker
+from app import init_db, create_campaign_records
+from delivery_status import apply_status_batch, parse_status_callback
+from send_ledger import claim_message, idempotency_key, reconcile_stuck_messages, tag_status_callback
+
+SIZE = 10
+
+
+class WorkerKilled(BaseException):
+    """Stands in for the worker process dying"""
+
+
+class FakeProvider:
+    """Local stand-in for Twilio that remembers what it accepted, by SID"""
+
+    def __init__(self, crash_at=None, crash_when=None):
+        self.accepted = {}
+        self.deliveries = Counter()
+        self.calls = 0
+        self.crash_at = crash_at
+        self.crash_when = crash_when
+        self.reachable = True
+
+    def send(self, phone, content, api_key, idempotency_key=None):
+        self.calls += 1
+        if self.calls == self.crash_at and self.crash_when == 'before_send':
+            raise WorkerKilled()
+        sid = f'SM{self.calls}'
+        self.accepted[sid] = (phone, content)
+        self.deliveries[phone] += 1
+        if self.calls == self.crash_at and self.crash_when == 'after_send':
+            # The provider took it, the worker died before recording it
+            raise WorkerKilled()
+        return True, sid
+
+    def lookup(self, phone, content, since):
+        if not self.reachable:
+            raise ConnectionError("provider unreachable")
+        return [sid for sid, accepted in self.accepted.items() if accepted == (phone, content)]
+
+
+def make_campaign(tmp_path, monkeypatch, provider):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', provider.send)
+    monkeypatch.setattr(celery_worker, 'find_sent_message', provider.lookup)
+    monkeypatch.setattr(celery_worker, 'SEND_CLAIM_TIMEOUT', 0)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(SIZE)])
+    conn.commit()
+    conn.close()
+
+
+def statuses():
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    rows = Counter(row[0] for row in conn.execute("SELECT status FROM messages"))
+    conn.close()
+    return rows
+
+
+@pytest.mark.parametrize('crash_when', ['before_send', 'after_send'])
+@pytest.mark.parametrize('crash_at', [1, 5, SIZE])
+def test_crash_then_redelivery_sends_each_message_once(tmp_path, monkeypatch, crash_at, crash_when):
+    provider = FakeProvider(crash_at, crash_when)
+    make_campaign(tmp_path, monkeypatch, provider)
+
+    with pytest.raises(WorkerKilled):
+        celery_worker.process_campaign_task('c1', 'key', 0)
+    assert statuses()['sending'] == 1
+
+    # A fresh worker starts, then the unacknowledged task is redelivered
+    celery_worker.reconcile_on_startup()
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    assert len(provider.deliveries) == SIZE
+    assert set(provider.deliveries.values()) == {1}
+    assert statuses() == {'sent': SIZE}
+
+
+def test_unreachable_provider_leaves_message_claimed(tmp_path, monkeypatch):
+    provider = FakeProvider(3, 'after_send')
+    make_campaign(tmp_path, monkeypatch, provider)
+    with pytest.raises(WorkerKilled):
+        celery_worker.process_campaign_task('c1', 'key', 0)
+
+    # Unknown outcome: never re-sent blind
+    provider.reachable = False
+    celery_worker.process_campaign_task('c1', 'key', 0)
+    assert statuses() == {'sent': SIZE - 1, 'sending': 1}
+    assert max(provider.deliveries.values()) == 1
+
+    provider.reachable = True
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert reconcile_stuck_messages(conn, provider.lookup, campaign_id='c1') == {'sent': 1, 'pending': 0, 'review': 0, 'unresolved': 0}
+    conn.close()
+    assert statuses() == {'sent': SIZE}
+
+
+def crash_after_send(tmp_path, monkeypatch, provider, template='Hi {name}'):
+    """A worker dies right after the provider accepted the first message"""
+    provider.crash_at, provider.crash_when = 1, 'after_send'
+    make_campaign(tmp_path, monkeypatch, provider)
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn.execute("UPDATE campaigns SET message_template = ?", (template,))
+    conn.commit()
+    conn.close()
+    with pytest.raises(WorkerKilled):
+        celery_worker.process_campaign_task('c1', 'key', 0)
+
+
+def test_same_text_sent_by_another_message_is_not_taken_for_this_one(tmp_path, monkeypatch):
+    provider = FakeProvider()
+    provider.crash_at, provider.crash_when = 1, 'before_send'
+    make_campaign(tmp_path, monkeypatch, provider)
+    # The same text already went to the first contact from another campaign, under its own SID
+    provider.accepted['SM-earlier'] = ('+254700000000', 'Hi Customer 0')
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c0', 'Earlier', 'Hi {name}', 0,
+                            [{'phone': '0700000000', 'name': 'Customer 0'}])
+    conn.execute("UPDATE messages SET status = 'sent', provider_sid = 'SM-earlier' WHERE campaign_id = 'c0'")
+    conn.commit()
+    conn.close()
+    with pytest.raises(WorkerKilled):
+        celery_worker.process_campaign_task('c1', 'key', 0)
+
+    assert provider.lookup('+254700000000', 'Hi Customer 0', None) == ['SM-earlier']
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert reconcile_stuck_messages(conn, provider.lookup, campaign_id='c1')['pending'] == 1
+    conn.close()
+    celery_worker.process_campaign_task('c1', 'key', 0)
+    assert provider.deliveries['+254700000000'] == 1
+    assert statuses() == {'sent': SIZE + 1}
+
+
+def test_ambiguous_send_is_left_for_review(tmp_path, monkeypatch):
+    provider = FakeProvider()
+    # Every contact gets the same text, and the provider holds two unattributed copies of it
+    provider.accepted['SM-unknown'] = ('+254700000000', 'Hello')
+    crash_after_send(tmp_path, monkeypatch, provider, template='Hello')
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert reconcile_stuck_messages(conn, provider.lookup, campaign_id='c1')['review'] == 1
+    reason = conn.execute("SELECT review_reason FROM messages WHERE status = 'sending'").fetchone()[0]
+    conn.close()
+    assert reason.startswith('2 unattributed provider messages')
+
+    # Never re-sent, and left alone by later reconciliations
+    celery_worker.process_campaign_task('c1', 'key', 0)
+    assert provider.deliveries['+254700000000'] == 1
+    assert statuses() == {'sent': SIZE - 1, 'sending': 1}
+
+
+def test_tagged_status_callback_records_the_sid(tmp_path, monkeypatch):
+    provider = FakeProvider()
+    crash_after_send(tmp_path, monkeypatch, provider)
+    provider.reachable = False
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    key = idempotency_key('c1', 1)
+    url = tag_status_callback('https://example.com/webhook/status', key)
+    assert parse_qs(urlsplit(url).query) == {'key': [key]}
+    event = parse_status_callback({'MessageSid': 'SM1', 'MessageStatus': 'sent', 'key': key})
+    assert apply_status_batch(conn, [event]) == (0, [])
+    # Settled from the recorded SID, without asking the (unreachable) provider
+    assert reconcile_stuck_messages(conn, provider.lookup, campaign_id='c1')['sent'] == 1
+    assert conn.execute("SELECT status, provider_sid FROM messages WHERE id = 1").fetchone() == ('sent', 'SM1')
+    conn.close()
+
+
+def test_error_after_claim_does_not_strand_the_message(tmp_path, monkeypatch):
+    provider = FakeProvider()
+    make_campaign(tmp_path, monkeypatch, provider)
+    results = iter([(True, 'SM-a'), (False, 'Twilio error 20503: Service unavailable')]
+                   + [(True, f'SM{i}') for i in range(3, SIZE + 1)])
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message', lambda *args, **kwargs: next(results))
+    record = celery_worker.record_send_result
+    failures = {1, 2}
+
+    def flaky_record(cursor, message_id, token, *args, **kwargs):
+        # The first attempt to record each of the first two outcomes raises after the update
+        record(cursor, message_id, token, *args, **kwargs)
+        if message_id in failures:
+            failures.discard(message_id)
+            raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(celery_worker, 'record_send_result', flaky_record)
+
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    rows = conn.execute("SELECT id, status, provider_sid, error_message, claim_token FROM messages WHERE id <= 2").fetchall()
+    conn.close()
+    assert rows == [(1, 'sent', 'SM-a', None, None),
+                    (2, 'failed', None, 'Twilio error 20503: Service unavailable', None)]
+    assert statuses() == {'sent': SIZE - 1, 'failed': 1}
+
+
+def test_message_can_only_be_claimed_once(tmp_path, monkeypatch):
+    make_campaign(tmp_path, monkeypatch, FakeProvider())
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert claim_message(conn, 1) is not None
+    assert claim_message(conn, 1) is None
+    conn.close()
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_send_ledger.py")
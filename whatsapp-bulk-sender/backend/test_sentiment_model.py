@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Local Sentiment Model Test Script
+Trains on the built-in seed set and checks predictions, persistence and LLM escalation
+"""
+
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import reply_handler
+from sentiment_model import LocalSentimentModel, SEED_EXAMPLES, classify_reply_local
+
+
+def train_seed_model():
+    messages = [message for message, _ in SEED_EXAMPLES]
+    labels = [label for _, label in SEED_EXAMPLES]
+    return LocalSentimentModel().fit(messages, labels)
+
+
+def test_seed_examples_are_learned():
+    """Each language's seed phrases are classified correctly after training"""
+    model = train_seed_model()
+    wrong = [(message, label) for message, label in SEED_EXAMPLES if model.predict(message)[0] != label]
+
+    assert len(wrong) <= len(SEED_EXAMPLES) // 10, f"Misclassified seed examples: {wrong}"
+
+
+def test_save_and_load_round_trip():
+    """A saved model gives identical predictions after loading"""
+    model = train_seed_model()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.npz')
+        model.save(path)
+        loaded = LocalSentimentModel.load(path)
+
+    for message in ["Bei gani?", "Erokamano ahinya", "Nĩndĩrenda kũgũra"]:
+        assert loaded.predict(message) == model.predict(message)
+
+
+def test_result_format_matches_other_detectors():
+    """Local results carry the same keys as the Gemini and keyword detectors"""
+    result = classify_reply_local("Stop sending me messages", model=train_seed_model())
+
+    assert set(result) == {'sentiment', 'confidence', 'requires_attention', 'detailed_category', 'reasoning'}
+    assert result['detailed_category'] == result['sentiment'].upper()
+    assert result['requires_attention'] == (result['sentiment'] in ('complaint', 'urgent', 'desired_opt_out'))
+
+
+def test_low_confidence_escalates_to_llm(monkeypatch):
+    """Confident local predictions are used directly, uncertain ones go to Gemini"""
+    gemini_calls = []
+    gemini_result = {'sentiment': 'question', 'confidence': 0.95, 'requires_attention': False,
+                     'detailed_category': 'QUESTION', 'reasoning': 'Gemini'}
+
+    def fake_gemini(message_content, phone_number=None):
+        gemini_calls.append(message_content)
+        return gemini_result
+
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(reply_handler, 'detect_reply_sentiment_gemini', fake_gemini)
+
+    confident = {'sentiment': 'interested', 'confidence': 0.97, 'requires_attention': False,
+                 'detailed_category': 'INTERESTED', 'reasoning': 'Local n-gram model'}
+    monkeypatch.setattr(reply_handler, 'classify_reply_local', lambda message: confident)
+    assert reply_handler.detect_reply_sentiment("Nataka kununua") is confident
+    assert gemini_calls == []
+
+    uncertain = dict(confident, confidence=reply_handler.LOCAL_SENTIMENT_THRESHOLD - 0.1)
+    monkeypatch.setattr(reply_handler, 'classify_reply_local', lambda message: uncertain)
+    assert reply_handler.detect_reply_sentiment("Something ambiguous") is gemini_result
+    assert gemini_calls == ["Something ambiguous"]
+
+
+if __name__ == "__main__":
+    print("🧠 Local Sentiment Model Test")
+    print("=" * 60)
+
+    model = train_seed_model()
+    for message in ["Bei gani ya bra?", "Anyalo yudo size matin", "Nĩ wega mũno", "Please stop", "ok"]:
+        label, confidence = model.predict(message)
+        print(f"\"{message}\" → {label} ({confidence:.2f})")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Structured Logging Test Script
+Checks the JSON line format and correlation ids, that per-message events are sampled by
+message (and errors never are), that a full log queue drops records instead of blocking,
+per-module levels, that a campaign run logs a sample rather than a line per message, and that
+a generated auto-response is logged without its text
+"""
+
+import sys
+import os
+import io
+import json
+import logging
+import queue
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from prometheus_client import REGISTRY
+
+import celery_worker
+import reply_handler
+import structured_logging
+from app import init_db, create_campaign_records
+from structured_logging import (ContextFilter, JsonFormatter, NonBlockingQueueHandler, is_sampled,
+                                log_context, log_event, log_message_event, parse_levels)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.addFilter(ContextFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def captured():
+    handler = ListHandler()
+    root = logging.getLogger()
+    level = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    yield handler.records
+    root.removeHandler(handler)
+    root.setLevel(level)
+
+
+def test_json_lines_carry_context_and_fields(captured):
+    logger = logging.getLogger('test.json')
+    with log_context(campaign_id='c1', message_id=42):
+        log_event(logger, 'message_sent', provider_sid='SM1')
+    log_event(logger, 'campaign_completed', campaign_id='c1', processed=3)
+
+    lines = [json.loads(JsonFormatter().format(record)) for record in captured]
+    assert {key: lines[0][key] for key in ('level', 'logger', 'event', 'campaign_id', 'message_id', 'provider_sid')} == {
+        'level': 'info', 'logger': 'test.json', 'event': 'message_sent',
+        'campaign_id': 'c1', 'message_id': 42, 'provider_sid': 'SM1'}
+    assert 'message_id' not in lines[1] and lines[1]['processed'] == 3
+    assert lines[0]['ts'].endswith('+00:00')
+
+
+def test_sampling_is_per_message(monkeypatch, captured):
+    monkeypatch.setattr(structured_logging, 'LOG_MESSAGE_SAMPLE_RATE', 0.01)
+    sampled = [message_id for message_id in range(100000) if is_sampled(message_id)]
+    assert 700 < len(sampled) < 1300
+    assert all(is_sampled(message_id) for message_id in sampled)
+
+    # A sampled message logs every event; others only their errors
+    logger = logging.getLogger('test.sampling')
+    unsampled = next(message_id for message_id in range(100000) if message_id not in sampled)
+    for message_id in (sampled[0], unsampled):
+        with log_context(message_id=message_id):
+            log_message_event(logger, 'message_sent')
+            log_message_event(logger, 'message_failed', logging.WARNING)
+            log_message_event(logger, 'message_crashed', logging.ERROR)
+    assert [(record.context['message_id'] == sampled[0], record.getMessage()) for record in captured] == [
+        (True, 'message_sent'), (True, 'message_failed'), (True, 'message_crashed'), (False, 'message_crashed')]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(2))
+    logger = logging.getLogger('test.queue')
+    logger.propagate = False
+    logger.addHandler(handler)
+    before = REGISTRY.get_sample_value('whatsapp_log_records_dropped_total')
+    try:
+        for i in range(5):
+            logger.warning('event %d', i)
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+    assert REGISTRY.get_sample_value('whatsapp_log_records_dropped_total') - before == 3
+    assert [handler.queue.get().msg for _ in range(2)] == ['event 0', 'event 1']
+
+
+def test_setup_writes_json_from_a_background_thread(monkeypatch):
+    monkeypatch.setattr(structured_logging, '_handler', None)
+    monkeypatch.setattr(structured_logging, 'LOG_LEVELS', 'test.quiet=ERROR')
+    root = logging.getLogger()
+    level = root.level
+    stream = io.StringIO()
+    structured_logging.setup_logging(stream)
+    try:
+        log_event(logging.getLogger('test.setup'), 'hello', answer=42)
+        log_event(logging.getLogger('test.quiet'), 'suppressed')
+        structured_logging.flush_logging()
+    finally:
+        root.removeHandler(structured_logging._handler)
+        root.setLevel(level)
+        structured_logging.stop_logging()
+        logging.getLogger('test.quiet').setLevel(logging.NOTSET)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(line['event'], line.get('answer')) for line in lines] == [('hello', 42)]
+    assert parse_levels('celery_worker=warning, reply_handler=DEBUG,bad') == {
+        'celery_worker': 'WARNING', 'reply_handler': 'DEBUG'}
+
+
+def test_campaign_run_logs_a_sample(tmp_path, monkeypatch, captured):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(structured_logging, 'LOG_MESSAGE_SAMPLE_RATE', 0.05)
+    init_db()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    create_campaign_records(conn.cursor(), 'c1', 'Launch', 'Hi {name}', 0,
+                            [{'phone': f'07{i:08d}', 'name': f'Customer {i}'} for i in range(400)])
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(celery_worker, 'send_whatsapp_message',
+                        lambda phone, content, api_key, idempotency_key=None: (True, f'SM{idempotency_key}'))
+
+    celery_worker.process_campaign_task('c1', 'key', 0)
+
+    sent = [record for record in captured if record.getMessage() == 'message_sent']
+    assert 5 <= len(sent) <= 40
+    assert all(is_sampled(record.context['message_id']) and record.context['campaign_id'] == 'c1' for record in sent)
+    assert [record.getMessage() for record in captured if record.name == 'celery_worker'
+            and record.getMessage().startswith('campaign_')] == ['campaign_started', 'campaign_completed']
+
+
+def test_generated_reply_text_is_not_logged(tmp_path, monkeypatch, captured):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(structured_logging, 'LOG_MESSAGE_SAMPLE_RATE', 1.0)
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(reply_handler, 'request_intelligent_response_gemini',
+                        lambda message_content, sentiment_category: "Wan gi size duto, Akinyi.")
+    sentiment = {'sentiment': 'question', 'confidence': 0.9, 'requires_attention': False,
+                 'detailed_category': 'QUESTION', 'reasoning': 'test'}
+
+    reply_handler.generate_auto_response("Nitie rangi machielo?", sentiment, False)
+
+    generated = [record for record in captured if record.getMessage() == 'gemini_response_generated']
+    assert len(generated) == 1 and generated[0].fields['category'] == 'question'
+    lines = [JsonFormatter().format(record) for record in captured]
+    assert not any('Akinyi' in line or 'machielo' in line for line in lines)
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_structured_logging.py")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Sentiment Backfill Test Script
+Checks paging, the per-text result cache and resuming from a checkpoint after a crash
+"""
+
+import sys
+import os
+import sqlite3
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import update_sentiment
+from reply_handler import setup_replies_database
+
+
+def make_replies(directory, monkeypatch, messages):
+    monkeypatch.chdir(directory)
+    setup_replies_database()
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    conn.executemany("INSERT INTO replies (phone_number, message_content) VALUES (?, ?)",
+                     [('+254700000000', message) for message in messages])
+    conn.commit()
+    conn.close()
+
+
+def fake_classifier(calls, fail_on=None):
+    lock = threading.Lock()
+
+    def classify(message_content):
+        with lock:
+            calls.append(message_content)
+            if fail_on is not None and len(calls) == fail_on:
+                raise RuntimeError("simulated crash")
+        return {'sentiment': 'question' if '?' in message_content else 'neutral', 'confidence': 0.9,
+                'requires_attention': False, 'detailed_category': 'NEUTRAL', 'reasoning': 'test'}
+
+    return classify
+
+
+def test_duplicate_texts_are_classified_once(tmp_path, monkeypatch):
+    make_replies(tmp_path, monkeypatch, ["ok", "OK", "price?", " ok "] * 10)
+    calls = []
+    monkeypatch.setattr(update_sentiment, 'detect_reply_sentiment', fake_classifier(calls))
+
+    result = update_sentiment.update_all_sentiments(batch_size=7, workers=3)
+
+    assert result['updated'] == 40
+    assert sorted(call.strip().lower() for call in calls) == ["ok", "price?"]
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    assert dict(conn.execute("SELECT sentiment, COUNT(*) FROM replies GROUP BY sentiment").fetchall()) == \
+        {'neutral': 30, 'question': 10}
+    conn.close()
+
+
+def test_resume_after_crash(tmp_path, monkeypatch):
+    make_replies(tmp_path, monkeypatch, [f"message {i}" for i in range(50)])
+
+    calls = []
+    monkeypatch.setattr(update_sentiment, 'detect_reply_sentiment', fake_classifier(calls, fail_on=25))
+    with pytest.raises(RuntimeError):
+        update_sentiment.update_all_sentiments(batch_size=10, workers=1)
+
+    conn = sqlite3.connect('whatsapp_campaigns.db')
+    last_id, processed = conn.execute("SELECT last_id, processed FROM backfill_checkpoints").fetchone()
+    conn.close()
+    assert (last_id, processed) == (20, 20)
+
+    # Second run picks up after the checkpoint and never re-reads finished pages
+    calls.clear()
+    monkeypatch.setattr(update_sentiment, 'detect_reply_sentiment', fake_classifier(calls))
+    result = update_sentiment.update_all_sentiments(batch_size=10, workers=2)
+
+    assert result['updated'] == 30
+    assert sorted(calls) == sorted(f"message {i}" for i in range(20, 50))
+
+    # Nothing left to do; --restart re-runs everything from the cache
+    assert update_sentiment.update_all_sentiments()['updated'] == 0
+    calls.clear()
+    assert update_sentiment.update_all_sentiments(restart=True)['cache_hits'] == 50
+    assert calls == []
+
+
+def test_classifier_change_invalidates_the_cache(tmp_path, monkeypatch):
+    make_replies(tmp_path, monkeypatch, ["ok", "price?"] * 5)
+    calls = []
+    monkeypatch.setattr(update_sentiment, 'detect_reply_sentiment', fake_classifier(calls))
+    update_sentiment.update_all_sentiments()
+    assert update_sentiment.update_all_sentiments(restart=True)['cache_hits'] == 10
+    assert len(calls) == 2
+
+    # Retraining the local model is a new classifier version: every text is classified again
+    (tmp_path / 'sentiment_model.npz').write_bytes(b'retrained')
+    monkeypatch.setattr(update_sentiment, 'DEFAULT_MODEL_PATH', str(tmp_path / 'sentiment_model.npz'))
+    assert update_sentiment.update_all_sentiments(restart=True)['cache_hits'] == 0
+    assert len(calls) == 4
+
+    monkeypatch.setattr(update_sentiment, 'CLASSIFIER_REVISION', update_sentiment.CLASSIFIER_REVISION + 1)
+    assert update_sentiment.update_all_sentiments(restart=True)['cache_hits'] == 0
+    assert len(calls) == 6
+
+
+if __name__ == "__main__":
+    print("Run with: python -m pytest test_update_sentiment.py")
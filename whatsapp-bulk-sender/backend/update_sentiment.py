@@ -1,22 +1,102 @@
 #!/usr/bin/env python3
 """
-Utility script to update sentiment analysis for existing replies using Gemini AI
-Run this after implementing the new Gemini-powered sentiment detection
+Utility script to update sentiment analysis for existing replies
+Resumable backfill: pages by reply ID, classifies in parallel and checkpoints every page.
+Also available as the Celery task celery_worker.backfill_sentiment_task.
+
+Results are cached per distinct message text and classifier version (classifier_version():
+CLASSIFIER_REVISION, the local model file, LOCAL_SENTIMENT_THRESHOLD and whether Gemini is
+configured), so retraining the model or changing the rules re-classifies every text instead of
+serving the old labels. Bump CLASSIFIER_REVISION when detect_reply_sentiment's rules or prompt change.
 """
 
-import sqlite3
+import argparse
+import hashlib
 import sys
 import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 # Add the backend directory to the path to import reply_handler
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from reply_handler import detect_reply_sentiment
+from reply_handler import LOCAL_SENTIMENT_THRESHOLD, detect_reply_sentiment
+from sentiment_model import DEFAULT_MODEL_PATH
+from db import connect
+
+BACKFILL_JOB_NAME = 'sentiment_backfill'
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_WORKERS = 4
+# Part of every cached result's version: bump when the classification rules or prompt change
+CLASSIFIER_REVISION = 1
+
+
+def setup_backfill_tables(cursor):
+    """Checkpoint and result-cache tables used by the backfill"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            job_name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # One classification per distinct message text ("ok", "stop", ...), valid only for the
+    # classifier_version it was made with; a newer version replaces the row
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sentiment_cache (
+            text_hash TEXT PRIMARY KEY,
+            sentiment TEXT,
+            confidence_score REAL,
+            requires_attention BOOLEAN,
+            detailed_category TEXT,
+            classifier_version TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("PRAGMA table_info(sentiment_cache)")
+    if 'classifier_version' not in [column[1] for column in cursor.fetchall()]:
+        # Rows cached before versioning match no version and are re-classified
+        cursor.execute("ALTER TABLE sentiment_cache ADD COLUMN classifier_version TEXT")
+
+
+def message_text_hash(message_content):
+    """Stable hash of the message text, ignoring case and surrounding whitespace"""
+    return hashlib.sha1(' '.join(message_content.lower().split()).encode('utf-8')).hexdigest()
+
+
+def classifier_version(model_path=None):
+    """Identifies what detect_reply_sentiment would answer with: rules, local model and threshold, Gemini"""
+    model_path = model_path or DEFAULT_MODEL_PATH
+    if os.path.exists(model_path):
+        with open(model_path, 'rb') as f:
+            model = hashlib.sha1(f.read()).hexdigest()[:12]
+    else:
+        model = 'none'
+    gemini = 'gemini' if os.getenv('GEMINI_API_KEY') else 'basic'
+    return f"r{CLASSIFIER_REVISION}-model:{model}-threshold:{LOCAL_SENTIMENT_THRESHOLD}-{gemini}"
+
+
+def classify_batch(messages_by_hash, workers):
+    """Classify distinct message texts with bounded concurrency"""
+    hashes = list(messages_by_hash)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(detect_reply_sentiment, (messages_by_hash[h] for h in hashes))
+        return dict(zip(hashes, results))
+
 
-def update_all_sentiments():
-    """Update sentiment for all existing replies using the new Gemini AI algorithm"""
+def update_all_sentiments(batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS,
+                          restart=False, job_name=BACKFILL_JOB_NAME, db_path='whatsapp_campaigns.db'):
+    """
+    Re-classify all existing replies, resumably.
+    Pages through replies by ID, classifies each distinct text once (using the sentiment_cache
+    table across runs while the classifier_version is unchanged), and commits a checkpoint after
+    every page so a crash or restart resumes from the last processed ID.
+    """
     try:
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect(db_path)
         cursor = conn.cursor()
         
         # First, check if new columns exist, if not add them
@@ -31,77 +111,129 @@ def update_all_sentiments():
             print("Adding requires_attention column...")
             cursor.execute("ALTER TABLE replies ADD COLUMN requires_attention BOOLEAN DEFAULT FALSE")
         
-        # Get all replies
-        cursor.execute("SELECT id, message_content, sentiment FROM replies")
-        replies = cursor.fetchall()
+        setup_backfill_tables(cursor)
+        version = classifier_version()
         
-        if not replies:
-            print("No replies found in database.")
-            return
+        if restart:
+            cursor.execute("DELETE FROM backfill_checkpoints WHERE job_name = ?", (job_name,))
+        cursor.execute("INSERT OR IGNORE INTO backfill_checkpoints (job_name) VALUES (?)", (job_name,))
+        conn.commit()
+        
+        cursor.execute("SELECT last_id, processed FROM backfill_checkpoints WHERE job_name = ?", (job_name,))
+        last_id, processed_before = cursor.fetchone()
+        
+        cursor.execute("SELECT COUNT(*) FROM replies WHERE id > ?", (last_id,))
+        remaining = cursor.fetchone()[0]
         
-        print(f"Found {len(replies)} replies to analyze with Gemini AI...")
+        if not remaining:
+            print("No replies left to analyze.")
+            conn.close()
+            return {'updated': 0, 'cache_hits': 0, 'last_id': last_id}
+        
+        if last_id:
+            print(f"⏩ Resuming from reply ID {last_id} ({processed_before} already processed)")
+        print(f"Found {remaining} replies to analyze ({workers} workers, batches of {batch_size})...")
         
         updated_count = 0
-        sentiment_changes = {
-            'positive': 0,
-            'negative': 0,
-            'question': 0,
-            'neutral': 0
-        }
+        cache_hits = 0
         attention_count = 0
+        sentiment_changes = Counter()
+        started = time.time()
         
-        for reply_id, message_content, old_sentiment in replies:
-            # Detect new sentiment using Gemini AI
-            sentiment_result = detect_reply_sentiment(message_content)
-            new_sentiment = sentiment_result['sentiment']
-            confidence = sentiment_result['confidence']
-            requires_attention = sentiment_result['requires_attention']
-            detailed_category = sentiment_result.get('detailed_category', 'UNKNOWN')
+        while True:
+            # Keyset pagination: never re-reads finished rows, no OFFSET scans
+            cursor.execute('''
+                SELECT id, message_content FROM replies
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, batch_size))
+            page = cursor.fetchall()
+            if not page:
+                break
+            
+            page_hashes = {reply_id: message_text_hash(content or '') for reply_id, content in page}
+            distinct = {text_hash: content or '' for (_, content), text_hash in zip(page, page_hashes.values())}
+            
+            placeholders = ','.join('?' * len(distinct))
+            cursor.execute(f'''
+                SELECT text_hash, sentiment, confidence_score, requires_attention, detailed_category
+                FROM sentiment_cache WHERE text_hash IN ({placeholders}) AND classifier_version = ?
+            ''', list(distinct) + [version])
+            results = {
+                row[0]: {'sentiment': row[1], 'confidence': row[2], 'requires_attention': bool(row[3]),
+                         'detailed_category': row[4]}
+                for row in cursor.fetchall()
+            }
+            cache_hits += sum(1 for text_hash in page_hashes.values() if text_hash in results)
             
-            if requires_attention:
-                attention_count += 1
+            to_classify = {text_hash: content for text_hash, content in distinct.items() if text_hash not in results}
+            if to_classify:
+                new_results = classify_batch(to_classify, workers)
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO sentiment_cache
+                        (text_hash, sentiment, confidence_score, requires_attention, detailed_category,
+                         classifier_version)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [
+                    (text_hash, result['sentiment'], result['confidence'], result['requires_attention'],
+                     result.get('detailed_category', 'UNKNOWN'), version)
+                    for text_hash, result in new_results.items()
+                ])
+                results.update(new_results)
+            
+            updates = []
+            for reply_id, text_hash in page_hashes.items():
+                result = results[text_hash]
+                updates.append((result['sentiment'], result['confidence'], result['requires_attention'], reply_id))
+                sentiment_changes[result['sentiment']] += 1
+                if result['requires_attention']:
+                    attention_count += 1
             
             # Update the sentiment and new fields in database
-            cursor.execute(
+            cursor.executemany(
                 """UPDATE replies 
                    SET sentiment = ?, confidence_score = ?, requires_attention = ? 
                    WHERE id = ?""",
-                (new_sentiment, confidence, requires_attention, reply_id)
+                updates
             )
-            updated_count += 1
-            sentiment_changes[new_sentiment] += 1
             
-            status_icon = "🚨" if requires_attention else "✅"
-            confidence_icon = "🎯" if confidence > 0.8 else "📊"
+            last_id = page[-1][0]
+            updated_count += len(page)
+            cursor.execute('''
+                UPDATE backfill_checkpoints
+                SET last_id = ?, processed = processed + ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_name = ?
+            ''', (last_id, len(page), job_name))
+            
+            # Checkpoint: page results and the new position are committed together
+            conn.commit()
             
-            print(f"{status_icon} Reply ID {reply_id}: '{message_content[:40]}...'")
-            print(f"   {confidence_icon} {old_sentiment} → {new_sentiment} ({detailed_category}) - Confidence: {confidence:.2f}")
-            if requires_attention:
-                print(f"   ⚠️ Flagged for human attention")
-            print()
+            elapsed = time.time() - started
+            rate = updated_count / elapsed if elapsed > 0 else 0
+            eta = (remaining - updated_count) / rate if rate > 0 else 0
+            print(f"📈 {updated_count}/{remaining} replies | {rate:.1f} replies/s | "
+                  f"cache hits {cache_hits} | ETA {eta:.0f}s | checkpoint ID {last_id}")
         
-        # Commit changes
-        conn.commit()
         conn.close()
         
-        print(f"\n🎉 Gemini AI Analysis Complete!")
-        print(f"📊 Updated {updated_count} out of {len(replies)} replies")
+        print(f"\n🎉 Sentiment Backfill Complete!")
+        print(f"📊 Updated {updated_count} out of {remaining} replies ({cache_hits} from cache)")
         print(f"🚨 {attention_count} replies flagged for human attention")
         print(f"📈 New sentiment distribution:")
-        print(f"   😊 Positive: {sentiment_changes['positive']}")
-        print(f"   😞 Negative: {sentiment_changes['negative']}")
-        print(f"   ❓ Questions: {sentiment_changes['question']}")
-        print(f"   😐 Neutral: {sentiment_changes['neutral']}")
+        for sentiment, count in sentiment_changes.most_common():
+            print(f"   {sentiment}: {count}")
+        
+        return {'updated': updated_count, 'cache_hits': cache_hits, 'last_id': last_id}
         
     except Exception as e:
-        print(f"❌ Error updating sentiments: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        print(f"❌ Error updating sentiments (progress is kept up to the last checkpoint): {str(e)}")
+        raise
 
 def show_current_sentiment_stats():
     """Show current sentiment statistics"""
     try:
-        conn = sqlite3.connect('whatsapp_campaigns.db')
+        conn = connect()
         cursor = conn.cursor()
         
         # Check if new columns exist
@@ -141,13 +273,20 @@ def show_current_sentiment_stats():
         print(f"❌ Error getting stats: {str(e)}")
 
 if __name__ == "__main__":
-    print("🤖 WhatsApp Reply Sentiment Updater (Gemini AI)\n")
+    parser = argparse.ArgumentParser(description='Resumable sentiment backfill for existing replies')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Replies per page/checkpoint')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent classifications')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the first reply '
+                        '(cached results of the current classifier version are reused)')
+    args = parser.parse_args()
+    
+    print("🤖 WhatsApp Reply Sentiment Updater\n")
     
     print("Current sentiment statistics:")
     show_current_sentiment_stats()
     
-    print("\nUpdating sentiments with Gemini AI...")
-    update_all_sentiments()
+    print("\nUpdating sentiments...")
+    update_all_sentiments(batch_size=args.batch_size, workers=args.workers, restart=args.restart)
     
     print("\nUpdated sentiment statistics:")
     show_current_sentiment_stats()
@@ -108,7 +108,7 @@ const RepliesTab = () => {
       if (startDate) params.append('start_date', startDate);
       if (endDate) params.append('end_date', endDate);
       
-      const response = await fetch(`/api/replies/download?${params}`);
+      let response = await fetch(`/api/replies/download?${params}`);
       
       if (!response.ok) {
         const error = await response.json();
@@ -116,6 +116,21 @@ const RepliesTab = () => {
         return;
       }
       
+      // Large exports run in the background; poll until the file is ready
+      if (response.status === 202) {
+        const job = await response.json();
+        let status = job;
+        while (status.status === 'queued' || status.status === 'running') {
+          await new Promise((resolve) => setTimeout(resolve, 2000));
+          status = await (await fetch(job.status_url)).json();
+        }
+        if (status.status !== 'completed') {
+          alert(`Error: ${status.error || 'Export failed'}`);
+          return;
+        }
+        response = await fetch(job.download_url);
+      }
+      
       // Create blob and download
       const blob = await response.blob();
       const url = window.URL.createObjectURL(blob);